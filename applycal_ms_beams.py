@@ -5,10 +5,11 @@ import os
 import shutil
 import sys
 import re
-from casatools import table
-from casatasks import applycal, split
-import casaconfig
-casaconfig.logfile = "/dev/null"
+
+from casa_worker import casa_available, casa_tasks
+from shard import add_shard_arguments, read_file_list, shard_items
+from task_pool import io_slot, run_tasks
+from telemetry import step
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run CASA applycal on MS files for specified beams (SBID-aware).")
@@ -18,33 +19,42 @@ def parse_args():
     parser.add_argument("--cal-dir", required=True, help="Directory containing calibration tables under data-root/SBID (expects *beamXX*.B0)")
     parser.add_argument("--beam", type=int, help="Single beam index to process (0..36)")
     parser.add_argument("--beams", default="all", help='Comma-separated list (e.g., "0,5,12") or "all" for 0..36')
-    parser.add_argument("--extension", default="B0", help='Gain table extension (e.g. "B0", "G5" etc.) to specify which calibrationt table to apply for beams')
+    parser.add_argument("--extension", default="B0", help='Gain table extension (e.g. "B0", "G5" etc.) to specify which calibrationt table to apply for beams. A comma-separated chain (e.g. "G1,G2,G3,G4,G5,G6") is applied in one pass')
     parser.add_argument("--dry-run", action="store_true", help="List planned operations without running applycal")
     parser.add_argument("--delete-previous", action="store_true", help="Delete previous generation ms split to save filesystem errors")
+    parser.add_argument("--engine", choices=["casa", "native"], default="casa", help="casa: applycal+split; native: single-pass python-casacore apply that writes the output MS directly")
+    parser.add_argument("--chunk-rows", type=int, default=20000, help="Rows per streamed block for --engine native")
+    parser.add_argument("--workers", type=int, default=1, help="Process beams/scans concurrently on this many worker processes")
+    parser.add_argument("--io-workers", type=int, default=None, help="Maximum workers reading/writing measurement sets at once (default: --workers)")
+    parser.add_argument("--share-parent", action="store_true", help="With --engine native, hardlink unchanged subtables and columns from the input MS instead of copying them (copy-on-write generation)")
+    parser.add_argument("--layout", default="", help="Storage layout of the calibrated MS, e.g. time or rows:cc16 (see ms_layout.py; needs python-casacore). Default: as written by the engine")
+    parser.add_argument("--stage-cache", action="store_true", help="Skip MSs whose output was already produced from the same input and caltables (see stage_cache.py)")
+    parser.add_argument("--resume", action="store_true", help="With --engine native, journal each written block and resume an interrupted output instead of rewriting it (see ms_journal.py)")
+    add_shard_arguments(parser)
     return parser.parse_args()
 
 def ensure_casa_applycal() -> bool:
     try:
-        from casatasks import applycal  # noqa: F401
+        casa_available("applycal")
         return True
     except Exception as e:
         print(f"ERROR: casatasks.applycal not available: {e}", file=sys.stderr)
         return False
 
+def ensure_native_applycal() -> bool:
+    try:
+        import native_applycal  # noqa: F401
+        return True
+    except Exception as e:
+        print(f"ERROR: native applycal engine not available (needs python-casacore): {e}", file=sys.stderr)
+        return False
+
 
 def _ms_nrows(ms_path: str) -> int:
-    """Return the number of rows in the main table of a Measurement Set."""
-    tb = table()
-    try:
-        tb.open(ms_path)
-        n = tb.nrows()
-    finally:
-        try:
-            tb.close()
-        except Exception:
-            pass
-    return int(n)
-    
+    """Return the number of rows in the main table of a Measurement Set (from its metadata index when current)."""
+    from ms_index import ms_nrows
+    return ms_nrows(ms_path)
+
 def find_ms_for_beam(data_root: str, sbid: str, pattern: str, beam: int) -> list:
     root = os.path.join(data_root, sbid)
     pat = os.path.join(root, pattern.format(beam=beam))
@@ -62,7 +72,8 @@ def validate_and_clean_ms(msname: str, outputvis: str, delete_previous: bool=Tru
     if not os.path.isdir(outputvis):
         raise RuntimeError(f"Split did not produce output MS: {outputvis}")
 
-    # Validate row counts (must match)
+    # Validate row counts (must match); the output's metadata index is left to the stages that read it,
+    # since flag_calB0 rewrites its FLAG column before any of them runs
     old_rows = _ms_nrows(msname)
     new_rows = _ms_nrows(outputvis)
     print(f"Row count check: old={old_rows} new={new_rows}")
@@ -87,45 +98,146 @@ def validate_and_clean_ms(msname: str, outputvis: str, delete_previous: bool=Tru
     return True
 
 
-def run_applycal(msname: str, caltable: str, extension: str = "B0", delete_previous: bool = False) -> str:
+def cal_output_name(msname: str, extension: str) -> str:
+    """Name of the next generation MS, e.g. X.ms -> X.calB0.ms or X.calG1.ms -> X.calG2.ms.
+    For a chain such as "G1,G2,G3" the last extension labels the output."""
+    extension = extension.split(",")[-1]
+    #replace e.g. .calG1.ms with .calG6
+    if "cal" in msname:
+        outputvis = re.sub(r'\.cal(?:B0|G\d+)\.ms', f".cal{extension}.ms", msname)
+    else:
+        outputvis = msname.replace(".ms", f".cal{extension}.ms")
+    if outputvis == msname:
+        raise ValueError(f"Output measurement set name {outputvis} matches input {msname} ya nong.")
+    return outputvis
+
+def interp_for_extension(extension: str) -> tuple:
+    """(time, freq) interpolation used for a caltable extension: nearest in time for bandpass, linear otherwise."""
+    time_interp = "nearest" if extension == "B0" else "linear"
+    freq_interp = "linear"
+    return time_interp, freq_interp
+
+def run_applycal(msname: str, caltable, extension: str = "B0", delete_previous: bool = False, layout: str = "") -> str:
     """
     Apply a calibration table to 'msname' and split the corrected data to a new MS
     labeled with '.cal{extension}.ms'. If validation succeeds, delete the previous
     generation MS ('msname') to control disk usage.
 
+    'caltable' may be a list matching a comma-separated 'extension' chain; the
+    whole chain is then applied by a single applycal+split.
+
     Returns:
         The path to the newly created output MS.
     """
+    applycal, split = casa_tasks("applycal", "split")
     print(f"Applying cal: {caltable} -> {msname}")
     
-    time_interp = "nearest" if extension == "B0" else "linear"
-    freq_interp = "linear"
-    print(f"applying caltable {caltable} to ms {msname}")    
-    applycal(vis=msname, gaintable=[caltable], interp=[time_interp, freq_interp])
-    #replace e.g. .calG1.ms with .calG6
-    if "cal" in msname:
-        outputvis = re.sub(r'\.cal(?:B0|G\d+)\.ms', f".cal{extension}.ms", msname)
-    else:
-        outputvis = msname.replace(".ms", f".cal{extension}.ms")
-    if outputvis == msname:
-        raise ValueError(f"Output measurement set name {outputvis} matches input {msname} ya nong.")
+    with step("applycal", ms=msname):
+        if isinstance(caltable, (list, tuple)):
+            interps = [interp_for_extension(ext) for ext in extension.split(",")]
+            applycal(vis=msname, gaintable=list(caltable), interp=[f"{t},{f}" for t, f in interps])
+        else:
+            time_interp, freq_interp = interp_for_extension(extension)
+            print(f"applying caltable {caltable} to ms {msname}")    
+            applycal(vis=msname, gaintable=[caltable], interp=[time_interp, freq_interp])
+    outputvis = cal_output_name(msname, extension)
 
     if os.path.isdir(outputvis):
         print(f"found existing copy of {outputvis}. removing prior to split")
         shutil.rmtree(outputvis)
     print(f"splitting corrected data from ms {msname} to {outputvis}")
-    split(vis=msname, outputvis=outputvis, datacolumn="corrected")    
-    success = validate_and_clean_ms(msname, outputvis, delete_previous=delete_previous)
+    with step("split", ms=outputvis):
+        split(vis=msname, outputvis=outputvis, datacolumn="corrected")    
+    if layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, parse_layout(layout))
+    with step("validate", ms=outputvis):
+        success = validate_and_clean_ms(msname, outputvis, delete_previous=delete_previous)
 
     print(f"Completed applycal+split: {outputvis}")
     return outputvis
 
+def load_interpolator(caltable, extension: str = "B0"):
+    """Read a caltable once so its interpolated gains can be reused for every MS of a beam.
+    A list of caltables is composed into one cumulative table first."""
+    from caltable_tools import GainInterpolator
+    if isinstance(caltable, (list, tuple)):
+        from caltable_algebra import compose_caltables
+        interps = [interp_for_extension(ext) for ext in extension.split(",")]
+        composed = compose_caltables(caltable, [t for t, _ in interps], [f for _, f in interps])
+        time_interp = "nearest" if all(t == "nearest" for t, _ in interps) else "linear"
+        return GainInterpolator(composed, time_interp=time_interp, freq_interp="linear")
+    time_interp, freq_interp = interp_for_extension(extension)
+    return GainInterpolator.from_caltable(caltable, time_interp=time_interp, freq_interp=freq_interp)
+
+def run_native_applycal(msname: str, interpolator, extension: str = "B0", delete_previous: bool = False, chunk_rows: int = 20000, share_parent: bool = False, layout: str = "", resume: bool = False) -> str:
+    """
+    Single-pass equivalent of run_applycal: DATA is read, calibrated and written
+    straight into '.cal{extension}.ms' without a CORRECTED_DATA column or split.
+    With share_parent the output only materialises DATA, FLAG and the weights;
+    everything else is hardlinked to 'msname', so deleting it frees little.
+    A layout then only applies to the rewritten columns. With resume a
+    partial output left by an interrupted run is completed, not rewritten.
+
+    Returns:
+        The path to the newly created output MS.
+    """
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_applycal import apply_to_new_ms
+    outputvis = cal_output_name(msname, extension)
+    print(f"native applycal: {msname} -> {outputvis}")
+    now, later = split_deferred(parse_layout(layout))
+    with step("apply", ms=outputvis) as rec:
+        rec["rows"] = apply_to_new_ms(msname, outputvis, [interpolator], chunk_rows=chunk_rows, share_parent=share_parent, layout=now,
+                                       resume=resume)
+    if later is not None:
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, later, chunk_rows=chunk_rows)
+    with step("validate", ms=outputvis):
+        success = validate_and_clean_ms(msname, outputvis, delete_previous=delete_previous)
+
+    print(f"Completed native applycal: {outputvis}")
+    return outputvis
+
 def run_clearcal(msname: str):
-    from casatasks import clearcal
+    clearcal = casa_tasks("clearcal")
     print(f"Applying cal: {caltable} -> {msname}")
     # Interpolation list as per your example; adjust if you have multiple gaintables
     clearcal(vis=msname)
 
+_INTERPOLATORS = {}
+
+def cached_interpolator(caltable, extension: str = "B0"):
+    """load_interpolator, memoised per process so a worker reads each beam's caltables once."""
+    key = (tuple(caltable) if isinstance(caltable, (list, tuple)) else caltable, extension)
+    if key not in _INTERPOLATORS:
+        _INTERPOLATORS[key] = load_interpolator(caltable, extension=extension)
+    return _INTERPOLATORS[key]
+
+def applycal_stage(msname: str, caltable, args):
+    """stage_cache.Stage for calibrating one MS (CASA applycal also writes CORRECTED_DATA into the input)."""
+    from stage_cache import Stage
+    caltables = list(caltable) if isinstance(caltable, (list, tuple)) else [caltable]
+    outputs = [cal_output_name(msname, args.extension)] + ([msname] if args.engine == "casa" else [])
+    return Stage(f"applycal_{args.extension}", [msname] + caltables, outputs, {"extension": args.extension, "engine": args.engine,
+                                                                                     "layout": args.layout})
+
+def process_ms(msname: str, caltable, args) -> str:
+    """Calibrate one MS; the unit of work run by the --workers pool."""
+    stage = applycal_stage(msname, caltable, args) if args.stage_cache else None
+    if stage is not None:
+        stage.begin()
+    if args.engine == "native":
+        interpolator = cached_interpolator(caltable, extension=args.extension)
+        outputvis = run_native_applycal(msname, interpolator, extension=args.extension, delete_previous=args.delete_previous, chunk_rows=args.chunk_rows, share_parent=args.share_parent, layout=args.layout, resume=args.resume)
+    else:
+        with io_slot():
+            outputvis = run_applycal(msname, caltable, extension=args.extension, delete_previous=args.delete_previous, layout=args.layout)
+    if stage is not None:
+        stage.commit()
+    return outputvis
+
 def main():
     args = parse_args()
 
@@ -134,26 +246,45 @@ def main():
     else:
         beams = list(range(0, 36)) if args.beams == "all" else [int(x) for x in args.beams.split(",")]
 
-    if not args.dry_run and not ensure_casa_applycal():
+    ensure_engine = ensure_native_applycal if args.engine == "native" else ensure_casa_applycal
+    if not args.dry_run and not ensure_engine():
         sys.exit(1)
 
     exit_code = 0
+    candidates, tasks = [], []
     for beam in beams:
         try:
             ms_list = find_ms_for_beam(args.data_root, args.sbid, args.pattern, beam)
             if not ms_list:
                 print(f"WARN: No MS found under '{args.data_root}/{args.sbid}' for beam {beam:02d} with pattern '{args.pattern}'")
                 continue
-            caltable = find_caltable(args.data_root, args.sbid, args.cal_dir, beam, extension=args.extension)
+            extensions = args.extension.split(",")
+            caltable = [find_caltable(args.data_root, args.sbid, args.cal_dir, beam, extension=ext) for ext in extensions]
+            if len(caltable) == 1:
+                caltable = caltable[0]
             print(f"Beam {beam:02d}: {len(ms_list)} MS found; using caltable: {caltable}")
-            for msname in ms_list:
-                print(f"running applycal on  MS: {msname}")
-                if not args.dry_run:
-                    run_applycal(msname, caltable, extension=args.extension, delete_previous=args.delete_previous)
+            candidates += [(beam, msname, caltable) for msname in ms_list]
         except Exception as e:
             print(f"ERROR: Beam {beam:02d} failed: {e}", file=sys.stderr)
             exit_code = 2
 
+    file_list = set(os.path.abspath(f) for f in read_file_list(args.file_list)) if args.file_list else None
+    if file_list is not None:
+        candidates = [c for c in candidates if os.path.abspath(c[1]) in file_list]
+    # shard the full (beam, MS) list before skipping finished MSs, so the slices do not depend on progress
+    for beam, msname, caltable in shard_items(candidates, args.shard):
+        if args.stage_cache and applycal_stage(msname, caltable, args).complete():
+            print(f"up to date, skipping: {msname} -> {cal_output_name(msname, args.extension)}")
+            continue
+        print(f"running applycal on  MS: {msname}")
+        tasks.append((f"beam {beam:02d} {msname}", (msname, caltable, args)))
+
+    if not args.dry_run:
+        failures = run_tasks(process_ms, tasks, workers=args.workers, io_workers=args.io_workers)
+        print(f"applycal finished: {len(tasks) - len(failures)}/{len(tasks)} MS succeeded")
+        if failures:
+            exit_code = 2
+
     sys.exit(exit_code)
 
 if __name__ == "__main__":
@@ -4,13 +4,24 @@ import glob
 import os
 import sys
 import re
-import casaconfig
-casaconfig.logfile = "/dev/null"
+from casa_worker import casa_available, casa_tasks
+from shard import add_shard_arguments, select_files
+from task_pool import run_tasks
+from telemetry import step
 
 def parse_args():
     p = argparse.ArgumentParser(description="Phase-only self-calibration loop in CASA.")
-    p.add_argument("--ms", required=True, help="Path to the measurement set.")
+    p.add_argument("--ms", nargs="+", default=[], help="Path to the measurement set(s).")
     p.add_argument("--timebin", default="9.90s", help="average time bin.")
+    p.add_argument("--chanbin", type=int, default=1, help="Number of adjacent channels to average (1 = no channel averaging).")
+    p.add_argument("--engine", choices=["casa", "native"], default="casa", help="casa: mstransform; native: streaming python-casacore averager")
+    p.add_argument("--workers", type=int, default=1, help="Threads averaging baseline groups in parallel (--engine native)")
+    p.add_argument("--stage-cache", action="store_true", help="Skip if the averaged MS was already produced from the same input and settings (see stage_cache.py)")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="Approximate input rows per streamed block (--engine native)")
+    p.add_argument("--layout", default="", help="Storage layout of the averaged MS, e.g. time or rows:cc16 (see ms_layout.py; needs python-casacore). Default: as written by the engine")
+    p.add_argument("--resume", action="store_true", help="Journal each written block and resume an interrupted averaged MS instead of rewriting it (--engine native; see ms_journal.py)")
+    p.add_argument("--ms-workers", type=int, default=1, help="Average this many MSs of the shard concurrently (worker processes)")
+    add_shard_arguments(p)
     return p.parse_args()    
 
 def find_ms_files(data_root: str, sbid: str, beam: int, pattern: str) -> list:
@@ -25,7 +36,7 @@ def find_ms_files(data_root: str, sbid: str, beam: int, pattern: str) -> list:
 
 def ensure_casa_concat():
     try:
-        from casatasks import concat  # noqa: F401
+        casa_available("concat")
         return True
     except Exception as e:
         print(f"ERROR: casatasks.concat not available: {e}", file=sys.stderr)
@@ -58,25 +69,73 @@ def strip_scanid_from_path(ms_path: str, sbid: str, out_root: str) -> str:
 
     
 def do_concat(msnames: list, output_path: str):
-    from casatasks import concat
+    concat = casa_tasks("concat")
     print(f"Concatenating {len(msnames)} MS -> {output_path}")
-    concat(msnames, concatvis=output_path, timesort=True)
+    concat(vis=msnames, concatvis=output_path, timesort=True)
 
-def do_average(msname: str, outputvis: str, timebin: str='9.90s'):
-    from casatasks import mstransform
+def do_average(msname: str, outputvis: str, timebin: str='9.90s', chanbin: int=1, layout: str=""):
+    mstransform = casa_tasks("mstransform")
     print(f"averaging {msname} -> {outputvis}")
-    mstransform(vis=msname, outputvis=outputvis, timeaverage=True, timebin=timebin, datacolumn='all')
+    with step("mstransform", ms=outputvis):
+        if chanbin > 1:
+            mstransform(vis=msname, outputvis=outputvis, timeaverage=True, timebin=timebin, chanaverage=True, chanbin=chanbin, datacolumn='all')
+        else:
+            mstransform(vis=msname, outputvis=outputvis, timeaverage=True, timebin=timebin, datacolumn='all')
+    if layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, parse_layout(layout))
+
+def do_native_average(msname: str, outputvis: str, timebin: str='9.90s', chanbin: int=1, workers: int=1, chunk_rows: int=20000, layout: str="", resume: bool=False):
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_average import average_ms
+    print(f"native averaging {msname} -> {outputvis} (timebin={timebin}, chanbin={chanbin}, workers={workers})")
+    now, later = split_deferred(parse_layout(layout))
+    with step("average", ms=outputvis) as rec:
+        rec["rows"] = nrows = average_ms(msname, outputvis, timebin=timebin, chanbin=chanbin, workers=workers, chunk_rows=chunk_rows,
+                                         layout=now, resume=resume)
+    if later is not None:
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, later, chunk_rows=chunk_rows)
+    print(f"wrote {nrows} averaged rows to {outputvis}")
     
 
-def main():
-    args = parse_args()
-    msname = args.ms
+def average_one(msname, args):
+    """Average one MS to its .avg counterpart; the unit of work of a shard."""
     timebin = args.timebin
     if 'cal' in msname:
         new_msname = msname.replace('.cal', '.avg.cal')
     else:
         new_msname = msname.replace('.ms', '.avg.ms')    
-    do_average(msname, new_msname, timebin=timebin)
+    stage = None
+    if args.stage_cache:
+        from stage_cache import Stage
+        stage = Stage("average", [msname], [new_msname], {"timebin": timebin, "chanbin": args.chanbin, "engine": args.engine,
+                                                       "layout": args.layout})
+        if stage.complete():
+            print(f"{new_msname} is up to date; skipping")
+            return
+        stage.begin()
+    if args.engine == "native":
+        do_native_average(msname, new_msname, timebin=timebin, chanbin=args.chanbin, workers=args.workers, chunk_rows=args.chunk_rows,
+                          layout=args.layout, resume=args.resume)
+    else:
+        do_average(msname, new_msname, timebin=timebin, chanbin=args.chanbin, layout=args.layout)
+    if stage is not None:
+        stage.commit()
+
+def main():
+    args = parse_args()
+    msnames = select_files(args.ms, args.file_list, args.shard)
+    if not msnames:
+        if args.shard is not None:
+            print(f"shard {args.shard.index}/{args.shard.count} is empty; nothing to do")
+            return
+        print("ERROR: no MS to average (give --ms or --file-list)", file=sys.stderr)
+        sys.exit(1)
+    failures = run_tasks(average_one, [(msname, (msname, args)) for msname in msnames], workers=args.ms_workers)
+    if failures:
+        sys.exit(2)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Benchmark the native gain solver against CASA gaincal on a synthetic MS.
+
+The MS is corrupted with known gains, so both solvers are also checked
+for accuracy. gaincal is skipped when casatasks is not importable.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from caltable_tools import read_caltable
+from native_gaincal import parse_solint, solve_gains
+from synthetic_ms import make_synthetic_ms, random_gains
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark native gain solver vs CASA gaincal.")
+    p.add_argument("--workdir", default="bench_gaincal", help="Directory for the synthetic MS and caltables.")
+    p.add_argument("--nant", type=int, default=36, help="Number of antennas.")
+    p.add_argument("--ntime", type=int, default=120, help="Number of integrations.")
+    p.add_argument("--nchan", type=int, default=32, help="Number of channels.")
+    p.add_argument("--tsamp", type=float, default=10.0, help="Integration time in seconds.")
+    p.add_argument("--solint", default="60s", help="Solution interval.")
+    p.add_argument("--calmode", default="ap", choices=["p", "ap"], help="Calibration mode.")
+    p.add_argument("--refant", default="ak01", help="Reference antenna.")
+    p.add_argument("--skip-casa", action="store_true", help="Only time the native solver.")
+    p.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return p.parse_args()
+
+
+def solution_errors(caltable, true_gains, tsamp, solint, refant_idx, calmode):
+    """Max phase (rad) and amplitude error against the true gains sampled at each solution's first integration."""
+    sol = read_caltable(caltable)
+    step = max(1, int(round(parse_solint(solint) / tsamp)))
+    truth = true_gains[::step][: len(sol.times)]
+    truth = truth * np.conj(truth[:, refant_idx:refant_idx + 1]) / np.abs(truth[:, refant_idx:refant_idx + 1])
+    est = sol.gains[:, :, 0, :]
+    ok = ~sol.flags[:, :, 0, :]
+    phase_err = np.abs(np.angle(est / truth))[ok].max()
+    amp_err = np.abs(np.abs(est) - np.abs(truth))[ok].max() if calmode == "ap" else 0.0
+    return float(phase_err), float(amp_err)
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    msname = os.path.join(args.workdir, "synthetic.ms")
+    gains = random_gains(args.ntime, args.nant)
+    make_synthetic_ms(msname, nant=args.nant, ntime=args.ntime, nchan=args.nchan, tsamp=args.tsamp, gains=gains)
+    refant_idx = int(args.refant.lower().lstrip("ak")) - 1
+
+    results = {}
+    caltable = os.path.join(args.workdir, "native.G")
+    t0 = time.perf_counter()
+    solve_gains(msname, caltable, args.solint, calmode=args.calmode, combine="scan", refant=args.refant)
+    results["native"] = {"wall_s": time.perf_counter() - t0}
+    results["native"]["max_phase_err"], results["native"]["max_amp_err"] = solution_errors(
+        caltable, gains, args.tsamp, args.solint, refant_idx, args.calmode)
+
+    if not args.skip_casa:
+        try:
+            from casatasks import gaincal
+        except Exception as e:
+            print(f"WARN: casatasks not available, skipping gaincal: {e}", file=sys.stderr)
+        else:
+            caltable = os.path.join(args.workdir, "casa.G")
+            t0 = time.perf_counter()
+            gaincal(vis=msname, caltable=caltable, solint=args.solint, combine="scan", refant=args.refant,
+                    minsnr=3.0, gaintype="G", calmode=args.calmode)
+            results["casa"] = {"wall_s": time.perf_counter() - t0}
+            results["casa"]["max_phase_err"], results["casa"]["max_amp_err"] = solution_errors(
+                caltable, gains, args.tsamp, args.solint, refant_idx, args.calmode)
+            results["speedup"] = results["casa"]["wall_s"] / results["native"]["wall_s"]
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Benchmark the native UVFITS importer against CASA importuvfits.
+
+A synthetic CRACO-like UVFITS file is imported with both engines and the
+two MSs are compared column by column (main table after sorting rows by
+time and baseline, plus the ANTENNA, SPECTRAL_WINDOW, POLARIZATION and
+FIELD subtables). importuvfits is skipped when casatasks is not
+importable; ``--reference`` compares against an existing MS instead.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from casacore.tables import table
+
+from native_uvfits import import_uvfits
+from synthetic_ms import make_synthetic_uvfits
+
+MAIN_COLUMNS = {
+    "TIME": 1e-3, "INTERVAL": 1e-3, "EXPOSURE": 1e-3, "ANTENNA1": 0, "ANTENNA2": 0,
+    "UVW": 1e-3, "DATA": 1e-6, "FLAG": 0, "FLAG_ROW": 0, "WEIGHT": 1e-4, "SIGMA": 1e-4,
+}
+"""Main-table columns to compare, with the absolute tolerance for each"""
+
+SUBTABLE_COLUMNS = {
+    "ANTENNA": {"NAME": 0, "POSITION": 1e-3},
+    "SPECTRAL_WINDOW": {"CHAN_FREQ": 1e-3, "CHAN_WIDTH": 1e-3, "NUM_CHAN": 0},
+    "POLARIZATION": {"CORR_TYPE": 0, "NUM_CORR": 0},
+    "FIELD": {"PHASE_DIR": 1e-9},
+}
+"""Subtable columns to compare, with the absolute tolerance for each"""
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark native UVFITS import vs CASA importuvfits.")
+    p.add_argument("--workdir", default="bench_import", help="Directory for the synthetic UVFITS file and MSs.")
+    p.add_argument("--nant", type=int, default=36, help="Number of antennas.")
+    p.add_argument("--ntime", type=int, default=60, help="Number of integrations.")
+    p.add_argument("--nchan", type=int, default=288, help="Number of channels.")
+    p.add_argument("--tsamp", type=float, default=10.0, help="Integration time in seconds.")
+    p.add_argument("--flag-fraction", type=float, default=0.01, help="Fraction of samples written with negative weights.")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="Native importer block size.")
+    p.add_argument("--uvfits", default=None, help="Import this UVFITS file instead of a synthetic one.")
+    p.add_argument("--reference", default=None, help="Existing MS to validate against instead of running importuvfits.")
+    p.add_argument("--skip-casa", action="store_true", help="Only time the native importer.")
+    p.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return p.parse_args()
+
+
+def _compare(ref, new, atol):
+    """Max absolute difference between two arrays, or None if their shapes differ."""
+    if ref.shape != new.shape:
+        return None
+    if ref.dtype.kind in "US" or atol == 0:
+        return float(np.count_nonzero(ref != new))
+    return float(np.max(np.abs(ref - new))) if ref.size else 0.0
+
+
+def compare_ms(reference, candidate):
+    """Compare ``candidate`` with ``reference`` column by column.
+
+    Returns:
+        dict: "TABLE/COLUMN" -> {"max_diff": float or None, "ok": bool};
+        ``max_diff`` is the number of differing values for exact columns
+        and None on a shape mismatch
+    """
+    report = {}
+
+    def record(name, ref, new, atol):
+        diff = _compare(np.asarray(ref), np.asarray(new), atol)
+        report[name] = {"max_diff": diff, "ok": diff is not None and diff <= atol}
+
+    with table(reference, ack=False) as rtab, table(candidate, ack=False) as ctab:
+        order = {}
+        for key, tab in (("ref", rtab), ("new", ctab)):
+            order[key] = np.lexsort((tab.getcol("ANTENNA2"), tab.getcol("ANTENNA1"), np.round(tab.getcol("TIME"), 3)))
+        record("MAIN/nrows", rtab.nrows(), ctab.nrows(), 0)
+        if rtab.nrows() == ctab.nrows():
+            for col, atol in MAIN_COLUMNS.items():
+                if col not in rtab.colnames() or col not in ctab.colnames():
+                    report[f"MAIN/{col}"] = {"max_diff": None, "ok": False}
+                    continue
+                record(f"MAIN/{col}", rtab.getcol(col)[order["ref"]], ctab.getcol(col)[order["new"]], atol)
+    for sub, columns in SUBTABLE_COLUMNS.items():
+        with table(os.path.join(reference, sub), ack=False) as rtab, table(os.path.join(candidate, sub), ack=False) as ctab:
+            for col, atol in columns.items():
+                record(f"{sub}/{col}", rtab.getcol(col), ctab.getcol(col), atol)
+    return report
+
+
+def timed_import(func):
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    uvfits = args.uvfits
+    if uvfits is None:
+        uvfits = make_synthetic_uvfits(os.path.join(args.workdir, "synthetic.uvfits"), nant=args.nant, ntime=args.ntime,
+                                       nchan=args.nchan, tsamp=args.tsamp, flag_fraction=args.flag_fraction)
+    size_gb = os.path.getsize(uvfits) / 1e9
+
+    results = {"uvfits_gb": size_gb}
+    native_ms = os.path.join(args.workdir, "native.ms")
+    wall = timed_import(lambda: import_uvfits(uvfits, native_ms, chunk_rows=args.chunk_rows))
+    results["native"] = {"wall_s": wall, "gb_per_s": size_gb / wall}
+
+    reference = args.reference
+    if reference is None and not args.skip_casa:
+        try:
+            from casatasks import importuvfits
+        except Exception as e:
+            print(f"WARN: casatasks not available, skipping importuvfits: {e}", file=sys.stderr)
+        else:
+            reference = os.path.join(args.workdir, "casa.ms")
+            if os.path.isdir(reference):
+                shutil.rmtree(reference)
+            wall = timed_import(lambda: importuvfits(fitsfile=uvfits, vis=reference))
+            results["casa"] = {"wall_s": wall, "gb_per_s": size_gb / wall}
+            results["speedup"] = results["casa"]["wall_s"] / results["native"]["wall_s"]
+
+    if reference is not None:
+        report = compare_ms(reference, native_ms)
+        results["validation"] = report
+        results["valid"] = all(r["ok"] for r in report.values())
+        for name, r in report.items():
+            if not r["ok"]:
+                print(f"MISMATCH {name}: max_diff={r['max_diff']}", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if results.get("valid") is False:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
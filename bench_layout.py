@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Benchmark storage-manager layouts: on-disk size and read throughput per access pattern.
+
+A synthetic ASKAP-like MS is rewritten once per layout (``ms_layout``)
+and each copy is read the way the pipeline stages read it:
+
+* ``rows``: sequential blocks of whole rows (wsclean, crystalball, uvsub)
+* ``timestep``: one integration (all baselines) at a time (gaincal
+  solution intervals, per-integration flagging)
+* ``channel``: DATA and FLAG in 16-channel slabs over all rows (bandpass,
+  per-channel diagnostics)
+
+The size is the allocated size of the main table's storage-manager files.
+DATA is compared with the uncompressed original, so the error of lossy
+layouts is reported alongside the speed. The page cache is not dropped
+between reads unless ``--cold-cmd`` is given (e.g. a command that runs
+``echo 3 > /proc/sys/vm/drop_caches``); warm reads mostly measure the
+storage managers' decoding, cold reads the tile I/O.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+from casacore.tables import table
+
+from ms_layout import CHANNEL_TILE, describe_layout, parse_layout, relayout_ms
+from synthetic_ms import make_synthetic_ms
+
+DEFAULT_LAYOUTS = "default,rows,time,channel,rows:cc16,time:cc16,rows:dysco10"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark MS storage-manager layouts.")
+    p.add_argument("--workdir", default="bench_layout", help="Directory for the synthetic MSs.")
+    p.add_argument("--nant", type=int, default=36, help="Number of antennas.")
+    p.add_argument("--ntime", type=int, default=120, help="Number of integrations.")
+    p.add_argument("--nchan", type=int, default=288, help="Number of channels.")
+    p.add_argument("--layouts", default=DEFAULT_LAYOUTS, help="Comma-separated layouts ('default' = as written by synthetic_ms).")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="Rows per block for the 'rows' pattern.")
+    p.add_argument("--repeat", type=int, default=3, help="Reads per pattern; the fastest is reported.")
+    p.add_argument("--cold-cmd", default=None, help="Shell command run before every read (e.g. to drop the page cache).")
+    p.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return p.parse_args()
+
+
+def main_table_bytes(msname):
+    """Allocated bytes of the main table's files (subtables excluded)."""
+    total = 0
+    for entry in os.listdir(msname):
+        path = os.path.join(msname, entry)
+        if os.path.isfile(path):
+            total += os.stat(path).st_blocks * 512
+    return total
+
+
+def read_rows(tab, chunk_rows):
+    nbytes = 0
+    for start in range(0, tab.nrows(), chunk_rows):
+        n = min(chunk_rows, tab.nrows() - start)
+        nbytes += tab.getcol("DATA", startrow=start, nrow=n).nbytes + tab.getcol("FLAG", startrow=start, nrow=n).nbytes
+    return nbytes
+
+
+def read_timesteps(tab, nbaselines):
+    nbytes = 0
+    for start in range(0, tab.nrows(), nbaselines):
+        n = min(nbaselines, tab.nrows() - start)
+        nbytes += tab.getcol("DATA", startrow=start, nrow=n).nbytes + tab.getcol("FLAG", startrow=start, nrow=n).nbytes
+    return nbytes
+
+
+def read_channels(tab, nchan, ncorr):
+    nbytes = 0
+    for c0 in range(0, nchan, CHANNEL_TILE):
+        blc, trc = [c0, 0], [min(c0 + CHANNEL_TILE, nchan) - 1, ncorr - 1]
+        nbytes += tab.getcolslice("DATA", blc, trc).nbytes + tab.getcolslice("FLAG", blc, trc).nbytes
+    return nbytes
+
+
+def timed(read, msname, repeat, cold_cmd):
+    """Fastest of ``repeat`` reads of a freshly opened table; returns (seconds, bytes)."""
+    best, nbytes = np.inf, 0
+    for _ in range(repeat):
+        if cold_cmd:
+            subprocess.run(cold_cmd, shell=True, check=True)
+        t0 = time.perf_counter()
+        with table(msname, ack=False) as tab:
+            nbytes = read(tab)
+        best = min(best, time.perf_counter() - t0)
+    return best, nbytes
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    source = os.path.join(args.workdir, "source.ms")
+    make_synthetic_ms(source, nant=args.nant, ntime=args.ntime, nchan=args.nchan, with_model=False)
+    with table(source, ack=False) as tab:
+        nrows, (nchan, ncorr) = tab.nrows(), tab.getcell("DATA", 0).shape
+        times = tab.getcol("TIME")
+        reference = tab.getcol("DATA")
+    nbaselines = int(np.count_nonzero(times == times[0]))
+    patterns = {
+        "rows": lambda tab: read_rows(tab, args.chunk_rows),
+        "timestep": lambda tab: read_timesteps(tab, nbaselines),
+        "channel": lambda tab: read_channels(tab, nchan, ncorr),
+    }
+
+    results = {"nrows": nrows, "nchan": nchan, "ncorr": ncorr, "nbaselines": nbaselines, "layouts": {}}
+    for spec in args.layouts.split(","):
+        msname = os.path.join(args.workdir, f"{spec.replace(':', '_')}.ms")
+        if os.path.isdir(msname):
+            shutil.rmtree(msname)
+        shutil.copytree(source, msname)
+        t0 = time.perf_counter()
+        relayout_ms(msname, parse_layout(spec), chunk_rows=args.chunk_rows)
+        entry = {"relayout_s": time.perf_counter() - t0, "bytes": main_table_bytes(msname),
+                 "columns": describe_layout(msname)}
+        with table(msname, ack=False) as tab:
+            data = tab.getcol("DATA")
+        entry["data_max_rel_err"] = float(np.max(np.abs(data - reference)) / np.max(np.abs(reference)))
+        for name, read in patterns.items():
+            wall, nbytes = timed(read, msname, args.repeat, args.cold_cmd)
+            entry[name] = {"wall_s": wall, "mb_per_s": nbytes / wall / 1e6}
+        results["layouts"][spec] = entry
+        print(f"{spec:>16s}: {entry['bytes'] / 1e6:8.1f} MB  err {entry['data_max_rel_err']:.1e}  "
+              + "  ".join(f"{name} {entry[name]['mb_per_s']:8.1f} MB/s" for name in patterns))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
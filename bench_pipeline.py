@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Benchmark every pipeline stage on deterministic synthetic data, with a baseline regression check.
+
+A synthetic ASKAP/CRACO-like observation (36 antennas by default; channels,
+integrations and scans configurable) is generated with python-casacore:
+one UVFITS file, one MS per scan with gain-corrupted DATA, a B0 bandpass
+table and a WSClean source list. The stages then run in pipeline order on
+their native engines, each in a fresh worker process:
+
+    import -> bandpass -> average -> concat -> predict -> gaincal
+           -> applycal -> uvsub -> ms_tools
+
+These are the engines applycal_ms_beams, average_ms_beams,
+concat_ms_beams, uvsub_ms_beams and selfcal_ms_beams run with
+``--engine native``, called directly rather than through the entry
+scripts, so everything runs offline without CASA. Each stage records wall time,
+rows/s, bytes/s (allocated size of the inputs' main tables over the
+wall time) and the peak RSS of its worker process.
+
+``--save-baseline`` stores the results as JSON; ``--baseline`` compares a
+run against a stored one. A stage regresses when its wall time or peak
+RSS exceed the baseline by more than ``--max-slowdown`` /
+``--max-rss-growth`` (and the wall time by more than ``--wall-slack``
+seconds); the script then exits with status 2. Baselines are
+only compared when the synthetic configuration matches.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from casacore.tables import table
+
+STAGES = ("import", "bandpass", "average", "concat", "predict", "gaincal", "applycal", "uvsub", "ms_tools")
+"""Benchmarked stages, in pipeline order"""
+
+CONFIG_KEYS = ("nant", "nchan", "ntime", "nscan", "tsamp", "nsrc", "workers", "chunk_rows")
+"""Arguments that define the synthetic workload; baselines only compare when they match"""
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    p.add_argument("--workdir", default="bench_pipeline", help="Directory for the synthetic data and stage outputs.")
+    p.add_argument("--nant", type=int, default=36, help="Number of antennas.")
+    p.add_argument("--nchan", type=int, default=64, help="Number of channels.")
+    p.add_argument("--ntime", type=int, default=30, help="Integrations per scan.")
+    p.add_argument("--nscan", type=int, default=3, help="Number of scans (one MS each).")
+    p.add_argument("--tsamp", type=float, default=10.0, help="Integration time in seconds.")
+    p.add_argument("--nsrc", type=int, default=200, help="Components in the synthetic source list.")
+    p.add_argument("--workers", type=int, default=1, help="Threads for the averaging and predict stages.")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="Rows per streamed block.")
+    p.add_argument("--stages", default=",".join(STAGES), help="Comma-separated subset of stages to measure; earlier stages still run, unmeasured, to produce their inputs.")
+    p.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest wall time and the largest RSS are kept.")
+    p.add_argument("--baseline", default=None, help="Compare against this stored baseline JSON.")
+    p.add_argument("--save-baseline", default=None, help="Write the results to this file as the new baseline.")
+    p.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed fractional increase of wall time over the baseline.")
+    p.add_argument("--wall-slack", type=float, default=0.5, help="Wall-time increases below this many seconds never count as regressions (timer noise).")
+    p.add_argument("--max-rss-growth", type=float, default=0.25, help="Allowed fractional increase of peak RSS over the baseline.")
+    p.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return p.parse_args()
+
+
+def workspace(workdir, nscan):
+    """Paths of the synthetic inputs and of every stage output."""
+    scans = [os.path.join(workdir, f"scan{k:02d}.ms") for k in range(1, nscan + 1)]
+    return {
+        "uvfits": os.path.join(workdir, "synthetic.uvfits"),
+        "imported": os.path.join(workdir, "imported.ms"),
+        "scans": scans,
+        "bandpass": os.path.join(workdir, "synthetic.B0"),
+        "source_list": os.path.join(workdir, "synthetic-sources.txt"),
+        "calibrated": [s.replace(".ms", ".calB0.ms") for s in scans],
+        "averaged": [s.replace(".ms", ".avg.calB0.ms") for s in scans],
+        "concat": os.path.join(workdir, "beam00.avg.calB0.ms"),
+        "gaintable": os.path.join(workdir, "beam00.G1"),
+        "selfcal": os.path.join(workdir, "beam00.selfcal_1.ms"),
+        "uvsub": os.path.join(workdir, "beam00.uvsub.ms"),
+    }
+
+
+def make_inputs(ws, cfg):
+    """Write the synthetic UVFITS file, per-scan MSs, bandpass table and source list."""
+    from native_predict import phase_centre
+    from synthetic_ms import (make_synthetic_caltable, make_synthetic_ms, make_synthetic_source_list,
+                              make_synthetic_uvfits, random_gains)
+    make_synthetic_uvfits(ws["uvfits"], nant=cfg["nant"], ntime=cfg["ntime"], nchan=cfg["nchan"], tsamp=cfg["tsamp"])
+    full = os.path.join(os.path.dirname(ws["uvfits"]), "synthetic.ms")
+    gains = random_gains(cfg["ntime"] * cfg["nscan"], cfg["nant"])
+    make_synthetic_ms(full, nant=cfg["nant"], ntime=cfg["ntime"], nchan=cfg["nchan"], nscan=cfg["nscan"],
+                      tsamp=cfg["tsamp"], gains=gains)
+    with table(full, ack=False) as tab:
+        for scan, path in enumerate(ws["scans"], start=1):
+            with tab.query(f"SCAN_NUMBER=={scan}") as sel:
+                sel.copy(path, deep=True).close()
+    make_synthetic_caltable(ws["bandpass"], full, bandpass=True)
+    make_synthetic_source_list(ws["source_list"], nsrc=cfg["nsrc"], phase_dir=phase_centre(full, 0))
+
+
+def stage_import(ws, cfg):
+    from native_uvfits import import_uvfits
+    return import_uvfits(ws["uvfits"], ws["imported"], chunk_rows=cfg["chunk_rows"]), [ws["uvfits"]]
+
+
+def stage_bandpass(ws, cfg):
+    from caltable_tools import GainInterpolator
+    from native_applycal import apply_to_new_ms
+    interpolator = GainInterpolator.from_caltable(ws["bandpass"], time_interp="nearest", freq_interp="linear")
+    rows = sum(apply_to_new_ms(src, dst, [interpolator], chunk_rows=cfg["chunk_rows"])
+               for src, dst in zip(ws["scans"], ws["calibrated"]))
+    return rows, ws["scans"]
+
+
+def stage_average(ws, cfg):
+    from native_average import average_ms
+    for src, dst in zip(ws["calibrated"], ws["averaged"]):
+        average_ms(src, dst, timebin=f"{2 * cfg['tsamp']}s", workers=cfg["workers"], chunk_rows=cfg["chunk_rows"])
+    return sum(table_rows(m) for m in ws["calibrated"]), ws["calibrated"]
+
+
+def stage_concat(ws, cfg):
+    from native_concat import concat_ms
+    return concat_ms(ws["averaged"], ws["concat"], chunk_rows=cfg["chunk_rows"]), ws["averaged"]
+
+
+def stage_predict(ws, cfg):
+    from native_predict import predict_ms
+    predict_ms(ws["concat"], ws["source_list"], workers=cfg["workers"], chunk_rows=cfg["chunk_rows"])
+    return table_rows(ws["concat"]), [ws["concat"]]
+
+
+def stage_gaincal(ws, cfg):
+    from native_gaincal import solve_gains
+    solve_gains(ws["concat"], ws["gaintable"], f"{4 * cfg['tsamp']}s", calmode="p", refant="ak01",
+                chunk_rows=cfg["chunk_rows"])
+    return table_rows(ws["concat"]), [ws["concat"]]
+
+
+def stage_applycal(ws, cfg):
+    from caltable_tools import GainInterpolator
+    from native_applycal import apply_to_new_ms
+    interpolator = GainInterpolator.from_caltable(ws["gaintable"], time_interp="linear", freq_interp="nearest")
+    return apply_to_new_ms(ws["concat"], ws["selfcal"], [interpolator], calwt=False,
+                           chunk_rows=cfg["chunk_rows"]), [ws["concat"]]
+
+
+def stage_uvsub(ws, cfg):
+    from native_uvsub import subtract_to_new_ms
+    return subtract_to_new_ms(ws["concat"], ws["uvsub"], chunk_rows=cfg["chunk_rows"]), [ws["concat"]]
+
+
+def stage_ms_tools(ws, cfg):
+    from ms_index import INDEX_NAME
+    from ms_tools import get_fast_imaging_intervals
+    index = os.path.join(ws["concat"], INDEX_NAME)
+    if os.path.exists(index):
+        os.remove(index)
+    get_fast_imaging_intervals(ws["concat"], timestep=cfg["tsamp"])
+    return table_rows(ws["concat"]), [ws["concat"]]
+
+
+def table_rows(msname):
+    with table(msname, ack=False) as tab:
+        return tab.nrows()
+
+
+def input_bytes(paths):
+    """Allocated bytes of the given files and of the main-table files of the given MSs."""
+    total = 0
+    for path in paths:
+        files = [path] if os.path.isfile(path) else [os.path.join(path, f) for f in os.listdir(path)]
+        total += sum(os.stat(f).st_blocks * 512 for f in files if os.path.isfile(f))
+    return total
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB.
+
+    VmHWM belongs to the address space, so unlike ru_maxrss (which Linux
+    carries over fork and exec) it is not inflated by the parent's peak.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stage(name, ws, cfg):
+    """Run one stage in this (fresh) process; returns its metrics."""
+    t0 = time.perf_counter()
+    rows, inputs = globals()[f"stage_{name}"](ws, cfg)
+    wall = time.perf_counter() - t0
+    nbytes = input_bytes(inputs)
+    return {"wall_s": wall, "rows": int(rows), "rows_per_s": rows / wall, "bytes": nbytes,
+            "bytes_per_s": nbytes / wall, "peak_rss_mb": peak_rss_mb()}
+
+
+def measure(name, ws, cfg, repeat):
+    """Best of ``repeat`` runs of a stage, each in a new spawned process so its peak RSS is its own."""
+    best = None
+    for _ in range(max(repeat, 1)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_stage, name, ws, cfg).result()
+        if best is None or result["wall_s"] < best["wall_s"]:
+            peak = max(result["peak_rss_mb"], best["peak_rss_mb"]) if best else result["peak_rss_mb"]
+            best = dict(result, peak_rss_mb=peak)
+        else:
+            best["peak_rss_mb"] = max(best["peak_rss_mb"], result["peak_rss_mb"])
+    return best
+
+
+def compare(results, baseline, max_slowdown, max_rss_growth, wall_slack=0.5):
+    """Per-stage ratios against ``baseline``; returns (report, list of regressions)."""
+    report, regressions = {}, []
+    for name, current in results["stages"].items():
+        ref = baseline["stages"].get(name)
+        if ref is None:
+            continue
+        wall_ratio = current["wall_s"] / ref["wall_s"]
+        rss_ratio = current["peak_rss_mb"] / ref["peak_rss_mb"]
+        report[name] = {"wall_ratio": wall_ratio, "rss_ratio": rss_ratio}
+        if wall_ratio > 1 + max_slowdown and current["wall_s"] - ref["wall_s"] > wall_slack:
+            regressions.append(f"{name}: wall {current['wall_s']:.2f}s vs baseline {ref['wall_s']:.2f}s (x{wall_ratio:.2f})")
+        if rss_ratio > 1 + max_rss_growth:
+            regressions.append(f"{name}: peak RSS {current['peak_rss_mb']:.0f} MB vs baseline "
+                               f"{ref['peak_rss_mb']:.0f} MB (x{rss_ratio:.2f})")
+    return report, regressions
+
+
+def main():
+    args = parse_args()
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        sys.exit(f"Unknown stages {sorted(unknown)}; choose from {', '.join(STAGES)}")
+    cfg = {k: getattr(args, k) for k in CONFIG_KEYS}
+    os.makedirs(args.workdir, exist_ok=True)
+    ws = workspace(args.workdir, args.nscan)
+
+    t0 = time.perf_counter()
+    make_inputs(ws, cfg)
+    results = {"config": cfg, "generate_s": time.perf_counter() - t0, "stages": {}}
+    last = max(STAGES.index(s) for s in stages)
+    for name in STAGES[:last + 1]:
+        if name not in stages:
+            print(f"{name:>9s}: running unmeasured to produce the next stage's inputs")
+            run_stage(name, ws, cfg)
+            continue
+        results["stages"][name] = measure(name, ws, cfg, args.repeat)
+        r = results["stages"][name]
+        print(f"{name:>9s}: {r['wall_s']:7.2f} s  {r['rows_per_s']:10.0f} rows/s  "
+              f"{r['bytes_per_s'] / 1e6:8.1f} MB/s  peak {r['peak_rss_mb']:7.0f} MB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != cfg:
+            print(f"WARN: baseline {args.baseline} was recorded with {baseline.get('config')}; not comparing",
+                  file=sys.stderr)
+        else:
+            results["comparison"], regressions = compare(results, baseline, args.max_slowdown, args.max_rss_growth,
+                                                              args.wall_slack)
+            results["regressions"] = regressions
+            for line in regressions:
+                print(f"REGRESSION {line}", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Benchmark the native sky-model predictor against crystalball.
+
+A synthetic ASKAP-like MS and a WSClean source list (points and
+Gaussians, ordinary and logarithmic spectra) are generated, the list is
+predicted with ``native_predict`` and checked against a direct
+per-source, per-channel DFT on a subset of rows. When the crystalball
+CLI is found (``--crystalball`` or on PATH) the same list is predicted
+into a copy of the MS and the two MODEL_DATA columns are compared;
+otherwise crystalball is skipped with a warning.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+from casacore.tables import table
+
+from native_predict import (C_LIGHT, GAUSS_SCALE, brightest, get_spectral_setup, parse_wsclean_source_list, phase_centre,
+                            predict_ms, radec_to_lmn, spectral_flux)
+from synthetic_ms import make_synthetic_ms, make_synthetic_source_list
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark native_predict vs crystalball.")
+    p.add_argument("--workdir", default="bench_predict", help="Directory for the synthetic MS and source list.")
+    p.add_argument("--nant", type=int, default=36, help="Number of antennas.")
+    p.add_argument("--ntime", type=int, default=60, help="Number of integrations.")
+    p.add_argument("--nchan", type=int, default=288, help="Number of channels.")
+    p.add_argument("--nsrc", type=int, default=500, help="Number of components in the source list.")
+    p.add_argument("--gaussian-fraction", type=float, default=0.2, help="Fraction of Gaussian components.")
+    p.add_argument("--num-sources", type=int, default=0, help="Predict only the N brightest (0 = all).")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="Threads for native_predict and crystalball -j.")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="native_predict block size.")
+    p.add_argument("--check-rows", type=int, default=200, help="Rows validated against the direct DFT.")
+    p.add_argument("--rtol", type=float, default=1e-4, help="Tolerance relative to the peak model amplitude.")
+    p.add_argument("--crystalball", default=shutil.which("crystalball"), help="crystalball executable (default: from PATH).")
+    p.add_argument("--output", default=None, help="Write results as JSON to this file.")
+    return p.parse_args()
+
+
+def direct_dft(msname, source_list, rows, num_sources=0):
+    """Stokes I model of ``rows`` by an explicit loop over sources and channels."""
+    sources = brightest(parse_wsclean_source_list(source_list), num_sources)
+    freqs, _ = get_spectral_setup(msname)
+    with table(msname, ack=False) as tab:
+        uvw = tab.getcol("UVW")[rows]
+    lmn = radec_to_lmn(sources.ra, sources.dec, *phase_centre(msname, 0))
+    flux = spectral_flux(sources, freqs)
+    u, v, w = uvw.T
+    vis = np.zeros((len(rows), len(freqs)), dtype=np.complex128)
+    for s in range(len(sources.flux)):
+        em = sources.major[s] * np.cos(sources.orientation[s])
+        el = sources.major[s] * np.sin(sources.orientation[s])
+        ratio = sources.minor[s] / sources.major[s] if sources.major[s] > 0 else 0.0
+        q = ((u * em - v * el) * ratio) ** 2 + (u * el + v * em) ** 2
+        for c, f in enumerate(freqs):
+            phase = -2j * np.pi * (u * lmn[0, s] + v * lmn[1, s] + w * lmn[2, s]) * f / C_LIGHT
+            vis[:, c] += flux[s, c] * np.exp(phase - GAUSS_SCALE * q * f ** 2)
+    return vis
+
+
+def max_rel_diff(ref, new):
+    return float(np.max(np.abs(ref - new)) / max(np.max(np.abs(ref)), 1e-30))
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    msname = os.path.join(args.workdir, "native.ms")
+    make_synthetic_ms(msname, nant=args.nant, ntime=args.ntime, nchan=args.nchan, with_model=False)
+    source_list = make_synthetic_source_list(os.path.join(args.workdir, "synthetic-sources.txt"), nsrc=args.nsrc,
+                                             gaussian_fraction=args.gaussian_fraction,
+                                             phase_dir=phase_centre(msname, 0))
+    cb_ms = os.path.join(args.workdir, "crystalball.ms")
+    if os.path.isdir(cb_ms):
+        shutil.rmtree(cb_ms)
+    shutil.copytree(msname, cb_ms)
+
+    with table(msname, ack=False) as tab:
+        nrows = tab.nrows()
+    results = {"nrows": nrows, "nchan": args.nchan, "nsrc": args.nsrc}
+    t0 = time.perf_counter()
+    predict_ms(msname, source_list, num_sources=args.num_sources, workers=args.workers, chunk_rows=args.chunk_rows)
+    wall = time.perf_counter() - t0
+    results["native"] = {"wall_s": wall, "vis_per_s": nrows * args.nchan / wall}
+
+    rows = np.linspace(0, nrows - 1, min(args.check_rows, nrows)).astype(int)
+    with table(msname, ack=False) as tab:
+        native = tab.getcol("MODEL_DATA")
+    diff = max_rel_diff(direct_dft(msname, source_list, rows, args.num_sources), native[rows, :, 0])
+    results["validation"] = {"direct_dft_max_rel_diff": diff, "ok": diff <= args.rtol}
+
+    if args.crystalball is None:
+        print("WARN: crystalball not found, skipping it (pass --crystalball)", file=sys.stderr)
+    else:
+        cmd = [args.crystalball, cb_ms, "-sm", source_list, "-o", "MODEL_DATA", "-j", str(args.workers)]
+        if args.num_sources > 0:
+            cmd += ["-ns", str(args.num_sources)]
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True)
+        wall = time.perf_counter() - t0
+        results["crystalball"] = {"wall_s": wall, "vis_per_s": nrows * args.nchan / wall}
+        results["speedup"] = results["crystalball"]["wall_s"] / results["native"]["wall_s"]
+        with table(cb_ms, ack=False) as tab:
+            diff = max_rel_diff(tab.getcol("MODEL_DATA"), native)
+        results["validation"]["crystalball_max_rel_diff"] = diff
+        results["validation"]["ok"] &= diff <= args.rtol
+
+    results["valid"] = results["validation"]["ok"]
+    if not results["valid"]:
+        print(f"MISMATCH: {results['validation']}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not results["valid"]:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
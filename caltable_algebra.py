@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Multiply a chain of B/G caltables into one cumulative Jones table.
+
+Each table is resampled onto a common time/frequency grid with its own
+interpolation rule (nearest in time for B0, linear for G), so a whole
+self-cal chain can be applied in a single pass.
+"""
+import argparse
+
+import numpy as np
+
+from caltable_tools import CalSolutions, GainInterpolator, read_caltable, write_caltable
+
+
+def common_time_grid(solutions, time_interps):
+    """Union of all solution times, plus the switch-over midpoints of nearest-interpolated tables.
+
+    The midpoints keep the steps of a nearest-interpolated table close to
+    where they fall when the composed table is later interpolated linearly.
+    """
+    grid = [sol.times for sol in solutions]
+    for sol, interp in zip(solutions, time_interps):
+        if interp == "nearest" and len(sol.times) > 1:
+            mid = 0.5 * (sol.times[1:] + sol.times[:-1])
+            grid.extend([mid - 1e-3, mid + 1e-3])
+    return np.unique(np.concatenate(grid))
+
+
+def common_freq_grid(solutions):
+    """Frequencies of the most finely channelised table (the bandpass, if any)."""
+    return max((sol.freqs for sol in solutions), key=len)
+
+
+def compose(solutions, time_interps, freq_interps=None, freqs=None):
+    """Multiply solutions g = g_1 * g_2 * ... on a common grid.
+
+    Args:
+        solutions (list): CalSolutions, in application order
+        time_interps (list): 'nearest' or 'linear' per table
+        freq_interps (list): 'nearest' or 'linear' per table (default linear)
+        freqs (np.ndarray): Target channel frequencies; defaults to the finest table's
+
+    Returns:
+        CalSolutions: Cumulative gains; a cell is flagged if any factor is flagged
+    """
+    if not solutions:
+        raise ValueError("Need at least one caltable to compose")
+    freq_interps = freq_interps or ["linear"] * len(solutions)
+    nants = {sol.gains.shape[1] for sol in solutions}
+    if len(nants) > 1:
+        raise ValueError(f"Caltables have different antenna counts: {sorted(nants)}")
+
+    times = common_time_grid(solutions, time_interps)
+    freqs = common_freq_grid(solutions) if freqs is None else np.asarray(freqs)
+    gains = 1.0 + 0j
+    flags = False
+    for sol, t_interp, f_interp in zip(solutions, time_interps, freq_interps):
+        g, f = GainInterpolator(sol, time_interp=t_interp, freq_interp=f_interp).at(times, freqs)
+        gains = gains * g
+        flags = flags | f
+    shape = np.broadcast_shapes(np.shape(gains), (len(times), gains.shape[1], len(freqs), gains.shape[3]))
+    gains = np.broadcast_to(gains, shape).copy()
+    flags = np.broadcast_to(flags, shape).copy()
+    return CalSolutions(times, freqs, gains, flags)
+
+
+def compose_caltables(caltables, time_interps, freq_interps=None, freqs=None):
+    """Read and compose caltables by path; see ``compose``."""
+    return compose([read_caltable(c) for c in caltables], time_interps, freq_interps=freq_interps, freqs=freqs)
+
+
+def write_composed(output, composed, template):
+    """Write a composed solution set, taking subtables from ``template`` (a caltable or MS with matching channels)."""
+    times = composed.times
+    if len(times) > 1:
+        intervals = np.gradient(times)
+    else:
+        intervals = np.zeros(1)
+    vistype = "B Jones" if composed.gains.shape[2] > 1 else "G Jones"
+    return write_caltable(output, template, times, intervals, composed.gains, composed.flags, vistype=vistype)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compose a chain of CASA B/G caltables into one cumulative table.")
+    p.add_argument("--caltables", nargs="+", required=True, help="Caltables in application order (e.g. B0 then G1..G6).")
+    p.add_argument("--time-interp", default=None, help="Comma-separated time interpolation per table (default: nearest for *.B0, linear otherwise).")
+    p.add_argument("--output", required=True, help="Path of the composed caltable.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.time_interp:
+        time_interps = args.time_interp.split(",")
+    else:
+        time_interps = ["nearest" if c.rstrip("/").endswith(".B0") else "linear" for c in args.caltables]
+    if len(time_interps) != len(args.caltables):
+        raise ValueError(f"Got {len(time_interps)} interpolation rules for {len(args.caltables)} caltables")
+    composed = compose_caltables(args.caltables, time_interps)
+    template = max(args.caltables, key=lambda c: read_caltable(c).gains.shape[2])
+    write_composed(args.output, composed, template)
+    print(f"Composed {len(args.caltables)} caltables -> {args.output} "
+          f"({len(composed.times)} times x {composed.gains.shape[2]} channels)")
+
+
+if __name__ == "__main__":
+    main()
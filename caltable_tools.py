@@ -0,0 +1,269 @@
+from casacore.tables import table, makearrcoldesc, makescacoldesc, maketabdesc
+import numpy as np
+import os
+import shutil
+from typing import NamedTuple
+
+
+class CalSolutions(NamedTuple):
+    """Structure to hold the solutions of a CASA B or G calibration table"""
+
+    times: np.ndarray
+    """Unique solution times in seconds (MJD), shape (ntime,)"""
+    freqs: np.ndarray
+    """Solution channel frequencies in Hz, shape (nchan,)"""
+    gains: np.ndarray
+    """Complex gains, shape (ntime, nant, nchan, npol)"""
+    flags: np.ndarray
+    """Solution flags, shape (ntime, nant, nchan, npol); True where missing or flagged"""
+
+
+def read_caltable(caltable):
+    """Read a single-SPW CASA B/G caltable into dense arrays.
+
+    Every (time, antenna) cell without a row in the table is flagged.
+
+    Args:
+        caltable (str): Path to the calibration table
+
+    Returns:
+        CalSolutions: Gains and flags on the (time, antenna, chan, pol) grid
+    """
+    with table(caltable, ack=False) as tab:
+        time = tab.getcol("TIME")
+        ant = tab.getcol("ANTENNA1")
+        spw = tab.getcol("SPECTRAL_WINDOW_ID")
+        cparam = tab.getcol("CPARAM")
+        flag = tab.getcol("FLAG")
+    if len(np.unique(spw)) > 1:
+        raise ValueError(f"{caltable} has solutions for several SPWs; only single-SPW tables are supported")
+    with table(os.path.join(caltable, "SPECTRAL_WINDOW"), ack=False) as sw:
+        freqs = np.asarray(sw.getcell("CHAN_FREQ", int(spw[0])), dtype=np.float64)
+    with table(os.path.join(caltable, "ANTENNA"), ack=False) as at:
+        nant = max(at.nrows(), int(ant.max()) + 1)
+
+    times, tidx = np.unique(time, return_inverse=True)
+    nchan, npol = cparam.shape[1:]
+    gains = np.ones((len(times), nant, nchan, npol), dtype=np.complex128)
+    flags = np.ones(gains.shape, dtype=bool)
+    gains[tidx, ant] = cparam
+    flags[tidx, ant] = flag
+    return CalSolutions(times, freqs[:nchan], gains, flags)
+
+
+def _copy_subtable(msname, caltable, name, norows=False):
+    with table(os.path.join(msname, name), ack=False) as sub:
+        sub.copy(os.path.join(caltable, name), deep=True, valuecopy=True, copynorows=norows)
+
+
+def write_caltable(caltable, msname, times, intervals, gains, flags, snr=None, paramerr=None, weight=None,
+                   scans=None, field_id=0, spw_id=0, refant=-1, vistype="G Jones"):
+    """Write solutions as a CASA NewCalTable that applycal and gaincal(gaintable=...) accept.
+
+    Rows are time-major, antenna-minor, as CASA writes them. ANTENNA,
+    FIELD, OBSERVATION and HISTORY are taken from ``msname``; the
+    SPECTRAL_WINDOW subtable is reduced to the solution channelisation
+    (one channel at the band centre for G tables).
+
+    Args:
+        caltable (str): Output path; replaced if present
+        msname (str): MS the solutions were derived from
+        times (np.ndarray): Solution times in seconds, shape (ntime,)
+        intervals (np.ndarray): Solution interval lengths in seconds, shape (ntime,)
+        gains (np.ndarray): Complex gains, shape (ntime, nant, nchan, npol)
+        flags (np.ndarray): Solution flags, same shape as ``gains``
+        snr (np.ndarray): Optional SNR per solution
+        paramerr (np.ndarray): Optional gain uncertainty per solution
+        weight (np.ndarray): Optional solution weights
+        scans (np.ndarray): Optional scan number per solution time
+        field_id (int): FIELD_ID written on every row
+        spw_id (int): SPECTRAL_WINDOW_ID written on every row
+        refant (int): Reference antenna index (stored in ANTENNA2 as CASA does)
+        vistype (str): CASA Jones type, e.g. "G Jones" or "B Jones"
+
+    Returns:
+        str: ``caltable``
+    """
+    ntime, nant, nchan, npol = gains.shape
+    nrow = ntime * nant
+    if os.path.isdir(caltable):
+        shutil.rmtree(caltable)
+
+    with table(msname, ack=False) as ms:
+        time_kw = ms.getcoldesc("TIME").get("keywords", {})
+        interval_kw = ms.getcoldesc("INTERVAL").get("keywords", {})
+    desc = maketabdesc([
+        makescacoldesc("TIME", 0.0, keywords=time_kw),
+        makescacoldesc("FIELD_ID", 0),
+        makescacoldesc("SPECTRAL_WINDOW_ID", 0),
+        makescacoldesc("ANTENNA1", 0),
+        makescacoldesc("ANTENNA2", 0),
+        makescacoldesc("INTERVAL", 0.0, keywords=interval_kw),
+        makescacoldesc("SCAN_NUMBER", 0),
+        makescacoldesc("OBSERVATION_ID", 0),
+        makearrcoldesc("CPARAM", 0j, ndim=2, valuetype="complex"),
+        makearrcoldesc("PARAMERR", 0.0, ndim=2, valuetype="float"),
+        makearrcoldesc("FLAG", False, ndim=2),
+        makearrcoldesc("SNR", 0.0, ndim=2, valuetype="float"),
+        makearrcoldesc("WEIGHT", 0.0, ndim=2, valuetype="float"),
+    ])
+    shape = (nrow, nchan, npol)
+    with table(caltable, desc, nrow=nrow, ack=False) as tab:
+        tab.putcol("TIME", np.repeat(times, nant))
+        tab.putcol("INTERVAL", np.repeat(intervals, nant))
+        tab.putcol("FIELD_ID", np.full(nrow, field_id, dtype=np.int32))
+        tab.putcol("SPECTRAL_WINDOW_ID", np.full(nrow, spw_id, dtype=np.int32))
+        tab.putcol("ANTENNA1", np.tile(np.arange(nant, dtype=np.int32), ntime))
+        tab.putcol("ANTENNA2", np.full(nrow, refant, dtype=np.int32))
+        tab.putcol("SCAN_NUMBER", np.repeat(np.zeros(ntime, dtype=np.int32) if scans is None else scans, nant))
+        tab.putcol("OBSERVATION_ID", np.zeros(nrow, dtype=np.int32))
+        tab.putcol("CPARAM", gains.reshape(shape).astype(np.complex64))
+        tab.putcol("FLAG", flags.reshape(shape))
+        for col, values in (("PARAMERR", paramerr), ("SNR", snr), ("WEIGHT", weight)):
+            values = np.zeros(shape) if values is None else values.reshape(shape)
+            tab.putcol(col, values.astype(np.float32))
+
+        for name in ("ANTENNA", "FIELD", "OBSERVATION", "SPECTRAL_WINDOW"):
+            _copy_subtable(msname, caltable, name)
+        _copy_subtable(msname, caltable, "HISTORY", norows=True)
+        for name in ("OBSERVATION", "ANTENNA", "FIELD", "SPECTRAL_WINDOW", "HISTORY"):
+            tab.putkeyword(name, "Table: " + os.path.abspath(os.path.join(caltable, name)))
+        tab.putkeyword("ParType", "Complex")
+        tab.putkeyword("MSName", os.path.basename(os.path.normpath(msname)))
+        tab.putkeyword("VisCal", vistype)
+        tab.putkeyword("PolBasis", "unknown")
+        tab.putkeyword("CASA_Version", "native")
+        tab.putinfo({"type": "Calibration", "subType": vistype, "readme": ""})
+
+    with table(os.path.join(caltable, "SPECTRAL_WINDOW"), readonly=False, ack=False) as sw:
+        freqs = sw.getcell("CHAN_FREQ", spw_id)
+        widths = sw.getcell("CHAN_WIDTH", spw_id)
+        if nchan == 1 and len(freqs) > 1:
+            bandwidth = np.abs(widths).sum()
+            sw.putcell("CHAN_FREQ", spw_id, np.array([freqs.mean()]))
+            for col in ("CHAN_WIDTH", "EFFECTIVE_BW", "RESOLUTION"):
+                sw.putcell(col, spw_id, np.array([bandwidth]))
+            sw.putcell("NUM_CHAN", spw_id, 1)
+    return caltable
+
+
+def _interp_weights(x, xp, mode):
+    """Left indices and right-hand weights to interpolate samples at ``xp`` onto ``x``.
+
+    Points outside ``xp`` are clamped to the end samples, as CASA does.
+    """
+    if len(xp) == 1:
+        return np.zeros(len(x), dtype=int), np.zeros(len(x))
+    i0 = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, len(xp) - 2)
+    w = np.clip((x - xp[i0]) / (xp[i0 + 1] - xp[i0]), 0.0, 1.0)
+    if mode == "nearest":
+        w = np.round(w)
+    elif mode != "linear":
+        raise ValueError(f"Unsupported interpolation '{mode}' (use 'nearest' or 'linear')")
+    return i0, w
+
+
+def _interp_axis(gains, flags, i0, w, axis):
+    """Interpolate amplitude and phase of ``gains`` along ``axis``.
+
+    Phase is interpolated through the weighted sum of unit phasors so
+    wraps at +/-pi need no unwrapping. A result is flagged if any sample
+    contributing a non-zero weight is flagged.
+    """
+    shape = [1] * gains.ndim
+    shape[axis] = len(w)
+    w = w.reshape(shape)
+    i1 = np.minimum(i0 + 1, gains.shape[axis] - 1)
+    g0 = np.take(gains, i0, axis=axis)
+    g1 = np.take(gains, i1, axis=axis)
+    amp = (1 - w) * np.abs(g0) + w * np.abs(g1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        u0 = np.where(g0 != 0, g0 / np.abs(g0), 0)
+        u1 = np.where(g1 != 0, g1 / np.abs(g1), 0)
+    phase = np.angle((1 - w) * u0 + w * u1)
+    f0 = np.take(flags, i0, axis=axis)
+    f1 = np.take(flags, i1, axis=axis)
+    out_flags = (f0 & (w < 1)) | (f1 & (w > 0))
+    return amp * np.exp(1j * phase), out_flags
+
+
+def _fill_flagged_times(gains, flags):
+    """Replace flagged solutions along time with values interpolated from unflagged ones.
+
+    CASA interpolates each antenna over its own unflagged solutions;
+    only (antenna, chan, pol) series that are fully flagged stay flagged.
+    """
+    ntime = gains.shape[0]
+    if ntime == 1:
+        return gains, flags
+    gains = gains.copy()
+    flags = flags.copy()
+    nflag = flags.sum(axis=0)
+    partial = np.argwhere((nflag > 0) & (nflag < ntime))
+    t = np.arange(ntime)
+    for a, c, p in partial:
+        good = ~flags[:, a, c, p]
+        series = gains[:, a, c, p]
+        amp = np.interp(t, t[good], np.abs(series[good]))
+        phase = np.interp(t, t[good], np.unwrap(np.angle(series[good])))
+        gains[:, a, c, p] = amp * np.exp(1j * phase)
+        flags[:, a, c, p] = False
+    return gains, flags
+
+
+class GainInterpolator:
+    """Interpolate a caltable onto visibility times and channels.
+
+    Flag filling and frequency resampling are done once and cached per
+    channel grid, so one interpolator per beam can be shared by every
+    scan MS of that beam.
+
+    Args:
+        solutions (CalSolutions): Solutions read with ``read_caltable``
+        time_interp (str): 'nearest' or 'linear'
+        freq_interp (str): 'nearest' or 'linear'
+    """
+
+    def __init__(self, solutions, time_interp="linear", freq_interp="linear"):
+        self.time_interp = time_interp
+        self.freq_interp = freq_interp
+        gains, flags = _fill_flagged_times(solutions.gains, solutions.flags)
+        self.solutions = solutions._replace(gains=gains, flags=flags)
+        self._freq_cache = {}
+
+    @classmethod
+    def from_caltable(cls, caltable, time_interp="linear", freq_interp="linear"):
+        return cls(read_caltable(caltable), time_interp=time_interp, freq_interp=freq_interp)
+
+    @property
+    def time_independent(self):
+        return len(self.solutions.times) == 1
+
+    def on_freqs(self, freqs):
+        """Return (gains, flags) resampled onto ``freqs``; single-channel solutions are left unexpanded."""
+        key = np.asarray(freqs, dtype=np.float64).tobytes()
+        if key not in self._freq_cache:
+            sol = self.solutions
+            if sol.gains.shape[2] == 1:
+                self._freq_cache[key] = (sol.gains, sol.flags)
+            else:
+                i0, w = _interp_weights(np.asarray(freqs), sol.freqs, self.freq_interp)
+                self._freq_cache[key] = _interp_axis(sol.gains, sol.flags, i0, w, axis=2)
+        return self._freq_cache[key]
+
+    def at(self, times, freqs):
+        """Interpolate gains to the visibility grid.
+
+        Args:
+            times (np.ndarray): Sorted unique visibility times in seconds, shape (nt,)
+            freqs (np.ndarray): Visibility channel frequencies in Hz, shape (nchan,)
+
+        Returns:
+            tuple: gains and flags of shape (nt, nant, nchan or 1, npol)
+        """
+        gains, flags = self.on_freqs(freqs)
+        if self.time_independent:
+            shape = (len(times),) + gains.shape[1:]
+            return np.broadcast_to(gains, shape), np.broadcast_to(flags, shape)
+        i0, w = _interp_weights(np.asarray(times), self.solutions.times, self.time_interp)
+        return _interp_axis(gains, flags, i0, w, axis=0)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""Long-lived CASA worker so pipeline steps skip the casatasks start-up.
+
+Importing casatasks (casatools, the measures data, casaconfig) takes many
+seconds, and every *_ms_beams.py invocation used to pay it. ``serve``
+keeps a pool of worker processes with casatasks already imported and
+runs task requests (applycal, split, mstransform, gaincal, uvsub, concat,
+...) sent over a local Unix socket, one JSON line per request::
+
+    {"op": "run", "task": "applycal", "kwargs": {...}, "cwd": "/path"}
+    -> {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+
+Scripts call ``run_casa_task(name, **kwargs)``. It uses the daemon when
+one is listening on the socket (``$CASA_WORKER_SOCKET``, default
+``$TMPDIR/casa_worker_<SLURM_JOB_ID or uid>.sock``) and otherwise
+imports casatasks and runs the task in-process exactly as before. Only a
+daemon that cannot be connected to falls back; a task that fails in the
+daemon, or whose daemon goes away after accepting it, is reported, not
+re-run.
+
+SLURM_JOB_ID is unique per array task, so each daemon lives and dies
+with the task that uses it, on that task's CPUs and memory. The run_*.sh
+wrappers of the CASA steps (with CASA_WORKER set, see casa_worker.sh)
+run, inside the CASA container::
+
+    python3 casa_worker.py run -- applycal_ms_beams.py ...
+
+which starts the daemon, runs the command with CASA_WORKER_SOCKET
+exported and stops the daemon when the command exits (``serve`` /
+``ping`` / ``stop`` are also available on their own). Stopping first
+unlinks the socket, so new requests run in-process, and then waits for
+the running ones.
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+ALLOWED_TASKS = ("applycal", "bandpass", "clearcal", "concat", "flagdata", "gaincal", "importuvfits",
+                 "mstransform", "split", "uvsub")
+"""casatasks the daemon will run"""
+
+CONNECT_TIMEOUT = 5.0
+"""Seconds to wait for the daemon to accept a connection before running in-process"""
+
+
+def default_socket():
+    """Socket path of the daemon for this job (one per array task) or user."""
+    return os.environ.get("CASA_WORKER_SOCKET") or os.path.join(
+        tempfile.gettempdir(), f"casa_worker_{os.environ.get('SLURM_JOB_ID', os.getuid())}.sock")
+
+
+# ---------------------------------------------------------------- client
+
+def _connect(path):
+    """A socket connected to the daemon at ``path`` (OSError if none accepts within CONNECT_TIMEOUT)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _exchange(sock, path, message, timeout=None):
+    """Send one JSON request on a connected ``sock`` and return the daemon's reply."""
+    sock.settimeout(timeout)
+    sock.sendall(json.dumps(message).encode() + b"\n")
+    with sock.makefile("rb") as f:
+        line = f.readline()
+    if not line:
+        raise ConnectionError(f"casa_worker at {path} closed the connection")
+    return json.loads(line)
+
+
+def _request(path, message, timeout=None):
+    """Send one JSON request to the daemon at ``path`` and return its reply."""
+    with _connect(path) as sock:
+        return _exchange(sock, path, message, timeout)
+
+
+def ping(path=None):
+    """Daemon status dict, or None if no daemon is listening."""
+    path = path or default_socket()
+    if not os.path.exists(path):
+        return None
+    try:
+        return _request(path, {"op": "ping"}, timeout=CONNECT_TIMEOUT)
+    except (OSError, ValueError):
+        return None
+
+
+def casa_available(*tasks):
+    """Whether the named casatasks can be run: through a daemon, or imported here."""
+    if ping() is not None:
+        return True
+    import casaconfig
+    casaconfig.logfile = "/dev/null"
+    import casatasks
+    missing = [t for t in tasks if not hasattr(casatasks, t)]
+    if missing:
+        raise ImportError(f"casatasks has no {', '.join(missing)}")
+    return True
+
+
+def run_casa_task(task, **kwargs):
+    """Run casatasks.<task>(**kwargs) on the worker daemon if there is one, else in this process.
+
+    Args:
+        task (str): Task name (one of ALLOWED_TASKS)
+        **kwargs: Task parameters (JSON-serialisable)
+
+    Returns:
+        The task's return value (JSON round-tripped when it ran in the daemon)
+    """
+    path = default_socket()
+    if os.path.exists(path):
+        try:
+            sock = _connect(path)
+        except OSError as e:
+            print(f"WARN: casa_worker at {path} unreachable ({e}); running {task} in-process", file=sys.stderr)
+        else:
+            # once the daemon has the request the task may have started (and written part of its
+            # output), so losing the daemon now is an error rather than a reason to run it again here
+            with sock:
+                try:
+                    reply = _exchange(sock, path, {"op": "run", "task": task, "kwargs": kwargs, "cwd": os.getcwd()})
+                except (OSError, ValueError) as e:
+                    raise RuntimeError(f"casa_worker at {path} was lost while running {task}: {e}") from e
+            if not reply.get("ok"):
+                raise RuntimeError(f"casa_worker {task} failed: {reply.get('error')}")
+            return reply.get("result")
+    import casaconfig
+    casaconfig.logfile = "/dev/null"
+    import casatasks
+    return getattr(casatasks, task)(**kwargs)
+
+
+def casa_tasks(*tasks):
+    """Stand-ins for ``from casatasks import a, b``: keyword-only callables routed through ``run_casa_task``."""
+    proxies = tuple(functools.partial(run_casa_task, task) for task in tasks)
+    return proxies[0] if len(proxies) == 1 else proxies
+
+
+# ---------------------------------------------------------------- server
+
+def _warm_worker():
+    """Pool initializer: pay the casatasks import once per worker process."""
+    import casaconfig
+    casaconfig.logfile = "/dev/null"
+    import casatasks  # noqa: F401
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return value
+    except TypeError:
+        return json.loads(json.dumps(value, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o)))
+
+
+def _run_in_worker(task, kwargs, cwd):
+    import casatasks
+    os.chdir(cwd)
+    t0 = time.perf_counter()
+    result = getattr(casatasks, task)(**kwargs)
+    print(f"{task} done in {time.perf_counter() - t0:.1f}s (pid {os.getpid()})", flush=True)
+    return _jsonable(result)
+
+
+class _Daemon:
+    """Worker pool plus bookkeeping shared by the connection handlers."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = self._new_pool()
+        self.running = 0
+        self.served = 0
+        self.started = time.time()
+
+    def _new_pool(self):
+        # spawn rather than fork: CASA tools do not survive being forked
+        ctx = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_warm_worker)
+
+    def run(self, task, kwargs, cwd):
+        if task not in ALLOWED_TASKS:
+            return {"ok": False, "error": f"task {task!r} is not served (allowed: {', '.join(ALLOWED_TASKS)})"}
+        with self.lock:
+            pool = self.pool
+            self.running += 1
+        try:
+            return {"ok": True, "result": pool.submit(_run_in_worker, task, kwargs, cwd).result()}
+        except BrokenProcessPool as e:
+            # a worker died (e.g. OOM-killed); replace the pool so later requests still run
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = self._new_pool()
+            return {"ok": False, "error": f"worker process died: {e}"}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.served += 1
+
+    def status(self):
+        with self.lock:
+            return {"ok": True, "pid": os.getpid(), "workers": self.workers, "running": self.running,
+                    "served": self.served, "uptime": time.time() - self.started}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "ping":
+                reply = self.server.daemon.status()
+            elif op == "run":
+                reply = self.server.daemon.run(message["task"], message.get("kwargs", {}), message.get("cwd", "/"))
+            elif op == "shutdown":
+                reply = {"ok": True}
+                self.server.stop()
+            else:
+                reply = {"ok": False, "error": f"unknown op {op!r}"}
+        except Exception as e:
+            traceback.print_exc()
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # server_close() joins the handler threads, so requests already accepted finish before the pool goes
+    daemon_threads = False
+    block_on_close = True
+
+    def stop(self):
+        """Stop taking requests: unlink the socket (new clients run in-process) and end serve_forever."""
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+def serve(path, workers=1):
+    """Run the daemon on ``path`` until ``stop`` is requested or SIGTERM/SIGINT arrives.
+
+    Either way it stops taking requests, then lets the running ones finish before exiting.
+    """
+    if ping(path) is not None:
+        raise RuntimeError(f"a casa_worker is already listening on {path}")
+    if os.path.exists(path):
+        os.remove(path)  # stale socket of a daemon that did not shut down cleanly
+    daemon = _Daemon(workers)
+    # warm the pool now rather than on the first request
+    list(daemon.pool.map(_jsonable, range(workers)))
+    server = _Server(path, _Handler)
+    server.daemon = daemon
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: server.stop())
+    print(f"casa_worker listening on {path} with {workers} workers (pid {os.getpid()})", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
+        server.server_close()
+        daemon.pool.shutdown(wait=True)
+        print(f"casa_worker on {path} stopped after {daemon.served} tasks", flush=True)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Persistent CASA task worker on a Unix socket.")
+    sub = p.add_subparsers(dest="command", required=True)
+    for name, text in (("serve", "Run the daemon in the foreground."), ("ping", "Show the daemon's status (exit 1 if none)."),
+                       ("stop", "Ask the daemon to shut down."), ("run", "Start a daemon, run a command against it, then stop it.")):
+        sp = sub.add_parser(name, help=text)
+        sp.add_argument("--socket", default=default_socket(), help="Socket path (default: $CASA_WORKER_SOCKET or $TMPDIR/casa_worker_<job>.sock).")
+        if name in ("serve", "run"):
+            sp.add_argument("--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", 1)),
+                            help="Worker processes (default: $SLURM_CPUS_PER_TASK or 1).")
+        if name == "run":
+            sp.add_argument("cmd", nargs=argparse.REMAINDER, help="Command to run (after --); a leading *.py runs with this python.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "serve":
+        serve(args.socket, workers=args.workers)
+    elif args.command == "ping":
+        status = ping(args.socket)
+        print(json.dumps(status) if status else f"no casa_worker on {args.socket}")
+        sys.exit(0 if status else 1)
+    elif args.command == "stop":
+        if ping(args.socket) is None:
+            print(f"no casa_worker on {args.socket}")
+            return
+        # the daemon exits once its running tasks are done
+        _request(args.socket, {"op": "shutdown"}, timeout=CONNECT_TIMEOUT)
+    else:
+        cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+        if not cmd:
+            sys.exit("casa_worker run: no command given")
+        if cmd[0].endswith(".py"):
+            cmd = [sys.executable] + cmd
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--socket", args.socket,
+                                 "--workers", str(args.workers)])
+        try:
+            while ping(args.socket) is None:
+                if proc.poll() is not None:
+                    sys.exit(f"casa_worker failed to start (exit {proc.returncode})")
+                time.sleep(0.5)
+            rc = subprocess.run(cmd, env={**os.environ, "CASA_WORKER_SOCKET": args.socket}).returncode
+        finally:
+            if proc.poll() is None:
+                try:
+                    _request(args.socket, {"op": "shutdown"}, timeout=CONNECT_TIMEOUT)
+                except (OSError, ValueError):
+                    proc.terminate()  # both paths stop taking requests and wait for the running ones
+                proc.wait()
+        sys.exit(rc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# CASA worker daemon for the run_*.sh wrappers of the CASA steps (see casa_worker.py); sourced, not run.
+# With CASA_WORKER set, a wrapper runs its script as "$PYTHON $(casa_worker_for ENGINE...) SCRIPT ...": inside
+# the CASA container, casa_worker.py then starts a daemon with casatasks imported in this task's allocation,
+# runs SCRIPT against it, and stops the daemon once SCRIPT exits and its running tasks are done. With
+# CASA_WORKER empty every helper is a no-op and SCRIPT imports casatasks itself.
+
+CASA_WORKER=${CASA_WORKER:-""}  # set non-empty to run the casatasks of each array task in its own daemon
+CASA_WORKER_SCRIPT=${CASA_WORKER_SCRIPT:-${SCRIPT_DIR:-$PWD}/casa_worker.py}
+
+# casa_worker_for ENGINE...: the words to put between $PYTHON and the script when any ENGINE is casa
+casa_worker_for() {
+  local engine
+  [[ -z "${CASA_WORKER}" ]] && return 0
+  for engine in "$@"; do
+    if [[ "${engine}" == "casa" ]]; then
+      echo "${CASA_WORKER_SCRIPT} run --"
+      return 0
+    fi
+  done
+}
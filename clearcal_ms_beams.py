@@ -3,8 +3,10 @@ import argparse
 import glob
 import os
 import sys
-import casaconfig
-casaconfig.logfile = "/dev/null"
+
+from casa_worker import casa_available, casa_tasks
+from task_pool import io_slot, run_tasks
+from telemetry import step
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run CASA applycal on MS files for specified beams (SBID-aware).")
@@ -14,11 +16,13 @@ def parse_args():
     parser.add_argument("--beam", type=int, help="Single beam index to process (0..36)")
     parser.add_argument("--beams", default="all", help='Comma-separated list (e.g., "0,5,12") or "all" for 0..36')
     parser.add_argument("--dry-run", action="store_true", help="List planned operations without running applycal")
+    parser.add_argument("--workers", type=int, default=1, help="Process beams/scans concurrently on this many worker processes")
+    parser.add_argument("--io-workers", type=int, default=None, help="Maximum workers clearing measurement sets at once (default: --workers)")
     return parser.parse_args()
 
 def ensure_casa_applycal() -> bool:
     try:
-        from casatasks import applycal  # noqa: F401
+        casa_available("applycal")
         return True
     except Exception as e:
         print(f"ERROR: casatasks.applycal not available: {e}", file=sys.stderr)
@@ -37,16 +41,22 @@ def find_caltable(data_root: str, sbid: str, cal_dir: str, beam: int) -> str:
     return matches[0]
 
 def run_applycal(msname: str, caltable: str):
-    from casatasks import applycal
+    applycal = casa_tasks("applycal")
     print(f"Applying cal: {caltable} -> {msname}")
     # Interpolation list as per your example; adjust if you have multiple gaintables
     applycal(vis=msname, gaintable=[caltable], interp=['nearest', 'linear'])
 
 def run_clearcal(msname: str):
-    from casatasks import clearcal
+    clearcal = casa_tasks("clearcal")
     print(f"Clearing cal -> {msname}")
     # Interpolation list as per your example; adjust if you have multiple gaintables
-    clearcal(vis=msname)
+    with step("clearcal", ms=msname):
+        clearcal(vis=msname)
+
+def process_ms(msname: str):
+    """Clear one MS; the unit of work run by the --workers pool. clearcal is pure I/O."""
+    with io_slot():
+        run_clearcal(msname)
 
 def main():
     args = parse_args()
@@ -60,6 +70,7 @@ def main():
         sys.exit(1)
 
     exit_code = 0
+    tasks = []
     for beam in beams:
         try:
             ms_list = find_ms_for_beam(args.data_root, args.sbid, args.pattern, beam)
@@ -68,12 +79,17 @@ def main():
                 continue
             for msname in ms_list:
                 print(f"  MS: {msname}")
-                if not args.dry_run:
-                    run_clearcal(msname)
+                tasks.append((f"beam {beam:02d} {msname}", (msname,)))
         except Exception as e:
             print(f"ERROR: Beam {beam:02d} failed: {e}", file=sys.stderr)
             exit_code = 2
 
+    if not args.dry_run:
+        failures = run_tasks(process_ms, tasks, workers=args.workers, io_workers=args.io_workers)
+        print(f"clearcal finished: {len(tasks) - len(failures)}/{len(tasks)} MS succeeded")
+        if failures:
+            exit_code = 2
+
     sys.exit(exit_code)
 
 if __name__ == "__main__":
@@ -4,8 +4,8 @@ import glob
 import os
 import sys
 import re
-import casaconfig
-casaconfig.logfile = "/dev/null"
+from casa_worker import casa_available, casa_tasks
+from telemetry import step
 
 def find_ms_files(data_root: str, sbid: str, beam: int, pattern: str) -> list:
     """
@@ -19,7 +19,7 @@ def find_ms_files(data_root: str, sbid: str, beam: int, pattern: str) -> list:
 
 def ensure_casa_concat():
     try:
-        from casatasks import concat  # noqa: F401
+        casa_available("concat")
         return True
     except Exception as e:
         print(f"ERROR: casatasks.concat not available: {e}", file=sys.stderr)
@@ -51,10 +51,33 @@ def strip_scanid_from_path(ms_path: str, sbid: str, out_root: str) -> str:
     return os.path.join(out_dir, fname_clean)
 
     
-def do_concat(msnames: list, output_path: str):
-    from casatasks import concat
+def do_concat(msnames: list, output_path: str, layout: str = ""):
+    concat = casa_tasks("concat")
     print(f"Concatenating {len(msnames)} MS -> {output_path}")
-    concat(msnames, concatvis=output_path, timesort=True)
+    with step("concat", ms=output_path, inputs=len(msnames)):
+        concat(vis=msnames, concatvis=output_path, timesort=True)
+    if layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=output_path):
+            relayout_ms(output_path, parse_layout(layout))
+
+def do_native_concat(msnames: list, output_path: str, chunk_rows: int = 20000, layout: str = ""):
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_concat import concat_ms
+    now, later = split_deferred(parse_layout(layout))
+    with step("concat", ms=output_path, inputs=len(msnames)) as rec:
+        rec["rows"] = nrows = concat_ms(msnames, output_path, chunk_rows=chunk_rows, layout=now)
+    if later is not None:
+        with step("relayout", ms=output_path):
+            relayout_ms(output_path, later, chunk_rows=chunk_rows)
+    print(f"wrote {nrows} rows to {output_path}")
+
+def do_virtual_concat(msnames: list, output_path: str):
+    from native_concat import virtual_concat
+    print(f"Virtually concatenating {len(msnames)} MS -> {output_path} (inputs must be kept)")
+    with step("virtual_concat", ms=output_path, inputs=len(msnames)) as rec:
+        rec["rows"] = nrows = virtual_concat(msnames, output_path)
+    print(f"{output_path} references {nrows} rows")
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Concatenate MS per beam for a given SBID.")
@@ -77,6 +100,17 @@ def parse_args():
         action="store_true",
         help="List planned operations without running concat"
     )
+    parser.add_argument(
+        "--engine",
+        choices=["casa", "native", "virtual"],
+        default="casa",
+        help="casa: concat(timesort=True); native: k-way merge with bulk row copies; "
+             "virtual: zero-copy concatenated reference table for read-only use outside the pipeline (inputs must be kept; "
+             "subtables are only referenced, so tools opening MS/FIELD etc. by path fail on it)"
+    )
+    parser.add_argument("--stage-cache", action="store_true", help="Skip beams whose output was already concatenated from the same inputs (see stage_cache.py)")
+    parser.add_argument("--chunk-rows", type=int, default=20000, help="Rows per bulk copy for the native engine")
+    parser.add_argument("--layout", default="", help="Storage layout of the concatenated MS, e.g. time or rows:cc16 (see ms_layout.py; needs python-casacore; ignored by --engine virtual). Default: as written by the engine")
     return parser.parse_args()
 
 def main():
@@ -91,8 +125,10 @@ def main():
     out_dir = os.path.join(out_root, args.sbid)
     os.makedirs(out_dir, exist_ok=True)
 
-    if not args.dry_run and not ensure_casa_concat():
+    if not args.dry_run and args.engine == "casa" and not ensure_casa_concat():
         sys.exit(1)
+    if args.layout and args.engine == "virtual":
+        print(f"WARN: --layout {args.layout} ignored: a virtual concat keeps the inputs' storage")
 
     any_work = False
     for beam in beams:
@@ -107,9 +143,26 @@ def main():
             print(f"  - {m}")
         print(f"  -> {output_msname}")
 
+        stage = None
+        if args.stage_cache and not args.dry_run:
+            from stage_cache import Stage
+            stage = Stage("concat", msnames, [output_msname], {"engine": args.engine, "layout": args.layout})
+            if stage.complete():
+                print("  up to date; skipping")
+                any_work = True
+                continue
+            stage.begin()
+
         if not args.dry_run:
             any_work = True
-            do_concat(msnames, output_msname)
+            if args.engine == "native":
+                do_native_concat(msnames, output_msname, chunk_rows=args.chunk_rows, layout=args.layout)
+            elif args.engine == "virtual":
+                do_virtual_concat(msnames, output_msname)
+            else:
+                do_concat(msnames, output_msname, layout=args.layout)
+            if stage is not None:
+                stage.commit()
 
     if not any_work and not args.dry_run:
         print("No concatenations performed (no inputs found).", file=sys.stderr)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Flag store: carry flags between MS generations instead of re-flagging.
+
+aoflagger used to run three times on the same observation (raw, .calB0
+and .avg.calB0). After a flagging pass ``save`` writes the MS's FLAG
+cube as a compressed bitmask next to the MS (``<ms>.flags.zip``, so it
+survives ``--delete-previous``), together with the row keys needed to
+map it onto later generations and per-timestep statistics of the data
+it was flagged on.
+
+A later generation then either
+
+* ``inherit``s the flags: ORed in row by row when it has the parent's
+  rows, or propagated through the time/channel averaging with an "any"
+  or "fraction:F" rule when it was averaged from the parent, or
+* ``plan``s an aoflagger re-run: the per-timestep statistics of its data
+  are compared with the parent's (after removing the overall change a
+  bandpass brings) and only the time ranges that changed are printed as
+  aoflagger ``-interval`` start/end pairs.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import zipfile
+from typing import NamedTuple
+
+import numpy as np
+from casacore.tables import table
+
+from ms_generation import unshare_columns
+from ms_stream import DEFAULT_CHUNK_ROWS, iter_row_chunks, prefetch_chunks
+from native_average import assign_time_bins, channel_sum
+from native_gaincal import parse_solint
+
+STORE_SUFFIX = ".flags.zip"
+"""Appended to the MS path to get its flag store"""
+
+STORE_VERSION = 1
+"""Bumped whenever the store layout changes, so old stores are ignored"""
+
+KEY_COLUMNS = ("TIME", "INTERVAL", "SCAN_NUMBER", "FIELD_ID", "DATA_DESC_ID", "ANTENNA1", "ANTENNA2")
+"""Row columns stored alongside the flags, enough to map them onto a derived MS"""
+
+DEFAULT_TOLERANCE = 0.2
+"""Relative change of a timestep's statistic (after normalisation) that marks it for re-flagging"""
+
+DEFAULT_PAD = 10
+"""Timesteps of context added on each side of a changed range (aoflagger needs some for its fits)"""
+
+
+class FlagStore(NamedTuple):
+    """Contents of a flag store (everything but the flag bits, which are streamed)"""
+
+    path: str
+    """The store file"""
+    meta: dict
+    """nrows, nchan, ncorr, chunk_rows and the MS it was written from"""
+    keys: dict
+    """KEY_COLUMNS of every row"""
+    times: np.ndarray
+    """Unique TIME values"""
+    stat: np.ndarray
+    """Per-timestep dispersion (std/mean of unflagged |vis|), NaN where all flagged"""
+
+
+def store_path(msname):
+    return msname.rstrip("/") + STORE_SUFFIX
+
+
+def parse_rule(rule):
+    """'any' or 'fraction:F' to the flagged fraction at or above which an averaged cell is flagged."""
+    if rule == "any":
+        return 0.0
+    if rule.startswith("fraction:"):
+        fraction = float(rule.split(":", 1)[1])
+        if 0 < fraction <= 1:
+            return fraction
+    raise ValueError(f"flag rule must be 'any' or 'fraction:F' with 0 < F <= 1, got {rule!r}")
+
+
+class _TimeStats:
+    """Streaming per-timestep mean and spread of unflagged cross-correlation amplitudes."""
+
+    def __init__(self):
+        self.sums = {}
+
+    def add(self, times, ant1, ant2, vis, flag):
+        cross = ant1 != ant2
+        amp = np.where(flag[cross], 0.0, np.abs(vis[cross])).astype(np.float64)
+        per_row = np.stack([(~flag[cross]).sum(axis=(1, 2)), amp.sum(axis=(1, 2)), (amp ** 2).sum(axis=(1, 2))], axis=1)
+        unique, inverse = np.unique(times[cross], return_inverse=True)
+        sums = np.stack([np.bincount(inverse.ravel(), weights=per_row[:, i], minlength=len(unique)) for i in range(3)], axis=1)
+        for t, acc in zip(unique.tolist(), sums):
+            self.sums[t] = self.sums.get(t, 0.0) + acc
+
+    def result(self):
+        times = np.array(sorted(self.sums))
+        n, s1, s2 = (np.array([self.sums[t][i] for t in times]) for i in range(3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s1 / n
+            stat = np.sqrt(np.maximum(s2 / n - mean ** 2, 0.0)) / mean
+        return times, stat
+
+
+def time_statistics(msname, column="DATA", chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Unique times of ``msname`` and the std/mean of the unflagged cross-correlation amplitudes at each."""
+    stats = _TimeStats()
+    with table(msname, ack=False) as tab:
+        def read_chunk(start, n):
+            return {c: tab.getcol(c, startrow=start, nrow=n) for c in ("TIME", "ANTENNA1", "ANTENNA2", column, "FLAG")}
+
+        for _, block in prefetch_chunks(read_chunk, iter_row_chunks(tab.nrows(), chunk_rows)):
+            stats.add(block["TIME"], block["ANTENNA1"], block["ANTENNA2"], block[column], block["FLAG"])
+    return stats.result()
+
+
+def save_flag_store(msname, column="DATA", chunk_rows=DEFAULT_CHUNK_ROWS, path=None):
+    """Write the FLAG cube, row keys and timestep statistics of ``msname`` to its flag store.
+
+    One streamed pass over the MS; the flag bits are written one packed
+    block at a time, so memory stays at one chunk.
+
+    Returns:
+        str: Path of the store
+    """
+    path = path or store_path(msname)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    stats = _TimeStats()
+    keys = {c: [] for c in KEY_COLUMNS}
+    with table(msname, ack=False) as tab, zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        nrows = tab.nrows()
+        shape = tab.getcell("FLAG", 0).shape if nrows else (0, 0)
+        has_data = column in tab.colnames()
+
+        def read_chunk(start, n):
+            cols = KEY_COLUMNS + ("FLAG",) + ((column,) if has_data else ())
+            return {c: tab.getcol(c, startrow=start, nrow=n) for c in cols}
+
+        with zf.open("flags.bits", "w", force_zip64=True) as bits:
+            for _, block in prefetch_chunks(read_chunk, iter_row_chunks(nrows, chunk_rows)):
+                bits.write(np.packbits(block["FLAG"].ravel()).tobytes())
+                for c in KEY_COLUMNS:
+                    keys[c].append(block[c])
+                if has_data:
+                    stats.add(block["TIME"], block["ANTENNA1"], block["ANTENNA2"], block[column], block["FLAG"])
+        times, stat = stats.result()
+        buf = io.BytesIO()
+        np.savez(buf, times=times, stat=stat, **{c: np.concatenate(v) if v else np.zeros(0) for c, v in keys.items()})
+        zf.writestr("keys.npz", buf.getvalue())
+        zf.writestr("meta.json", json.dumps({"version": STORE_VERSION, "ms": os.path.abspath(msname), "nrows": nrows,
+                                             "nchan": int(shape[0]), "ncorr": int(shape[1]), "chunk_rows": chunk_rows,
+                                             "stat_column": column if has_data else None}))
+    os.replace(tmp, path)
+    return path
+
+
+def open_flag_store(path):
+    """Read the metadata, row keys and statistics of a flag store (not the flags)."""
+    with zipfile.ZipFile(path) as zf:
+        meta = json.loads(zf.read("meta.json"))
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"{path} is a version {meta.get('version')} flag store; expected {STORE_VERSION}")
+        with np.load(io.BytesIO(zf.read("keys.npz"))) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+    return FlagStore(path=path, meta=meta, keys={c: arrays[c] for c in KEY_COLUMNS},
+                     times=arrays["times"], stat=arrays["stat"])
+
+
+def iter_store_flags(store):
+    """Yield (startrow, nrow, flags) blocks of a flag store in row order."""
+    nchan, ncorr = store.meta["nchan"], store.meta["ncorr"]
+    with zipfile.ZipFile(store.path) as zf, zf.open("flags.bits") as bits:
+        for start, n in iter_row_chunks(store.meta["nrows"], store.meta["chunk_rows"]):
+            nbits = n * nchan * ncorr
+            packed = np.frombuffer(bits.read((nbits + 7) // 8), dtype=np.uint8)
+            yield start, n, np.unpackbits(packed, count=nbits).astype(bool).reshape(n, nchan, ncorr)
+
+
+def _same_rows(store, tab):
+    if tab.nrows() != store.meta["nrows"]:
+        return False
+    return all(np.array_equal(tab.getcol(c), store.keys[c]) for c in ("ANTENNA1", "ANTENNA2")) and \
+        np.allclose(tab.getcol("TIME"), store.keys["TIME"], rtol=0, atol=1e-3)
+
+
+def map_averaged_rows(store, tab, timebin):
+    """Row of the averaged MS ``tab`` that every row of the store was averaged into (-1 if none).
+
+    The store's rows are binned like the averager does (``timebin``, never
+    across scans); an averaged row belongs to the bin its TIME falls in.
+    """
+    k = store.keys
+    bins = assign_time_bins(k["TIME"], k["INTERVAL"], k["SCAN_NUMBER"], timebin)
+    nbins = int(bins.max()) + 1 if len(bins) else 0
+    lo = np.full(nbins, np.inf)
+    np.minimum.at(lo, bins, k["TIME"] - k["INTERVAL"] / 2)
+    child_time = tab.getcol("TIME")
+    child_bins = np.clip(np.searchsorted(lo, child_time + 1e-6, side="right") - 1, 0, max(nbins - 1, 0))
+    ids = ("SCAN_NUMBER", "FIELD_ID", "DATA_DESC_ID", "ANTENNA1", "ANTENNA2")
+    parent_keys = np.stack([bins] + [k[c].astype(np.int64) for c in ids], axis=1)
+    child_keys = np.stack([child_bins] + [tab.getcol(c).astype(np.int64) for c in ids], axis=1)
+    _, inverse = np.unique(np.concatenate([parent_keys, child_keys]), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    row_of_key = np.full(inverse.max() + 1 if len(inverse) else 0, -1, dtype=np.int64)
+    row_of_key[inverse[len(parent_keys):]] = np.arange(len(child_keys))
+    return row_of_key[inverse[:len(parent_keys)]]
+
+
+def _write_flags(tab, start, n, new):
+    """OR ``new`` into FLAG of rows [start, start+n) and keep FLAG_ROW consistent; returns newly flagged samples."""
+    flag = tab.getcol("FLAG", startrow=start, nrow=n)
+    added = int(np.count_nonzero(new & ~flag))
+    if added:
+        flag |= new
+        tab.putcol("FLAG", flag, startrow=start, nrow=n)
+        if "FLAG_ROW" in tab.colnames():
+            tab.putcol("FLAG_ROW", tab.getcol("FLAG_ROW", startrow=start, nrow=n) | flag.all(axis=(1, 2)), startrow=start, nrow=n)
+    return added
+
+
+def inherit_flags(msname, store, rule="any", timebin=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """OR the flags of a parent's store into ``msname``.
+
+    Flags are only ever added. When ``msname`` has the store's rows they
+    are ORed in row by row; otherwise ``msname`` must have been averaged
+    from the parent with ``timebin`` (and an integer channel factor), and
+    an averaged cell is flagged when the flagged fraction of the samples
+    averaged into it reaches the ``rule`` threshold.
+
+    Args:
+        msname (str): MS to flag
+        store (FlagStore): Parent's flag store
+        rule (str): "any" or "fraction:F" (averaged MSs only)
+        timebin (str): Averaging interval used to make ``msname`` (e.g. "9.90s"); needed unless the rows match
+        chunk_rows (int): Rows per block written to ``msname``
+
+    Returns:
+        int: Number of samples newly flagged
+    """
+    threshold = parse_rule(rule)
+    unshare_columns(msname, ["FLAG", "FLAG_ROW"])
+    added = 0
+    with table(msname, readonly=False, ack=False) as tab:
+        if _same_rows(store, tab):
+            for start, n, flags in iter_store_flags(store):
+                added += _write_flags(tab, start, n, flags)
+            return added
+        if timebin is None:
+            raise ValueError(f"{msname} does not have the rows of {store.meta['ms']}; give the averaging timebin")
+        nrows = tab.nrows()
+        nchan_out, ncorr = tab.getcell("FLAG", 0).shape
+        nchan = store.meta["nchan"]
+        chanbin = -(-nchan // nchan_out)
+        if ncorr != store.meta["ncorr"] or len(range(0, nchan, chanbin)) != nchan_out:
+            raise ValueError(f"cannot map {nchan} x {store.meta['ncorr']} flags onto {nchan_out} x {ncorr} of {msname}")
+        child = map_averaged_rows(store, tab, parse_solint(timebin))
+        mapped = child >= 0
+        rows_in = np.bincount(child[mapped], minlength=nrows)
+        widths = channel_sum(np.ones((1, nchan), dtype=np.int64), chanbin)[0]
+        dtype = np.uint16 if rows_in.max(initial=0) * chanbin < np.iinfo(np.uint16).max else np.int32
+        flagged = np.zeros((nrows, nchan_out, ncorr), dtype=dtype)
+        for start, n, flags in iter_store_flags(store):
+            rows = child[start:start + n]
+            sel = rows >= 0
+            if not sel.any():
+                continue
+            order = np.argsort(rows[sel], kind="stable")
+            targets, first = np.unique(rows[sel][order], return_index=True)
+            counts = np.add.reduceat(flags[sel][order].astype(dtype), first, axis=0)
+            flagged[targets] += channel_sum(counts, chanbin).astype(dtype)
+        total = rows_in[:, None, None] * widths[None, :, None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = flagged / total
+        new = (fraction > 0) if threshold == 0 else (fraction >= threshold)
+        for start, n in iter_row_chunks(nrows, chunk_rows):
+            added += _write_flags(tab, start, n, new[start:start + n])
+    return added
+
+
+def changed_intervals(times, stat, ref_times, ref_stat, tolerance=DEFAULT_TOLERANCE, pad=DEFAULT_PAD):
+    """Timestep ranges whose statistic changed relative to the parent's.
+
+    The ratio to the parent's statistic is divided by its median, so a
+    change shared by the whole scan (e.g. the bandpass) does not count;
+    timesteps the parent does not have, or that were flagged there but
+    not here, always count.
+
+    Returns:
+        list: (start, end) timestep indices into ``times``, end exclusive,
+        padded by ``pad`` and merged
+    """
+    ref = np.full(len(times), np.nan)
+    if len(ref_times):
+        idx = np.clip(np.searchsorted(ref_times, times), 0, len(ref_times) - 1)
+        ref = np.where(np.abs(ref_times[idx] - times) < 1e-3, ref_stat[idx], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = stat / ref
+    finite = np.isfinite(ratio)
+    scale = np.median(ratio[finite]) if finite.any() else 1.0
+    changed = np.where(finite, np.abs(ratio / scale - 1) > tolerance, np.isfinite(stat))
+    intervals = []
+    for t in np.flatnonzero(changed):
+        start, end = max(t - pad, 0), min(t + pad + 1, len(times))
+        if intervals and start <= intervals[-1][1]:
+            intervals[-1][1] = max(intervals[-1][1], end)
+        else:
+            intervals.append([int(start), int(end)])
+    return [tuple(iv) for iv in intervals]
+
+
+def plan_reflag(msname, store, column="DATA", tolerance=DEFAULT_TOLERANCE, pad=DEFAULT_PAD, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """aoflagger intervals of ``msname`` to re-flag, comparing its statistics with the parent's store.
+
+    Returns:
+        tuple: (intervals, number of timesteps)
+    """
+    times, stat = time_statistics(msname, column=column, chunk_rows=chunk_rows)
+    if store.meta.get("stat_column") is None:
+        return [(0, len(times))], len(times)
+    return changed_intervals(times, stat, store.times, store.stat, tolerance=tolerance, pad=pad), len(times)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Save, inherit and compare MS flags through a compressed flag store.")
+    sub = p.add_subparsers(dest="command", required=True)
+    sp = sub.add_parser("save", help="Write <ms>.flags.zip from the MS's FLAG column.")
+    sp.add_argument("ms")
+    sp.add_argument("--column", default="DATA", help="Column the timestep statistics are computed on.")
+    sp.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    sp = sub.add_parser("inherit", help="OR a parent's stored flags into the MS (same rows, or averaged from it).")
+    sp.add_argument("ms")
+    sp.add_argument("--parent", required=True, help="Parent MS (its store <parent>.flags.zip is read; the MS itself may be gone).")
+    sp.add_argument("--rule", default="any", help="Averaged cells: 'any' or 'fraction:F' of flagged input samples.")
+    sp.add_argument("--timebin", default=None, help="Averaging interval the MS was made with (averaged MSs only).")
+    sp.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    sp = sub.add_parser("plan", help="Print aoflagger -interval ranges whose statistics changed since the parent was flagged.")
+    sp.add_argument("ms")
+    sp.add_argument("--parent", required=True, help="Parent MS whose store holds the reference statistics.")
+    sp.add_argument("--column", default="DATA")
+    sp.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Relative change that marks a timestep.")
+    sp.add_argument("--pad", type=int, default=DEFAULT_PAD, help="Timesteps of context around each changed range.")
+    sp.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "save":
+        path = save_flag_store(args.ms, column=args.column, chunk_rows=args.chunk_rows)
+        print(f"saved flags of {args.ms} to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    elif args.command == "inherit":
+        store = open_flag_store(store_path(args.parent))
+        added = inherit_flags(args.ms, store, rule=args.rule, timebin=args.timebin, chunk_rows=args.chunk_rows)
+        print(f"inherited flags of {args.parent} into {args.ms}: {added} samples newly flagged")
+    else:
+        store = open_flag_store(store_path(args.parent))
+        intervals, ntimes = plan_reflag(args.ms, store, column=args.column, tolerance=args.tolerance, pad=args.pad,
+                                        chunk_rows=args.chunk_rows)
+        # stdout is the plan (one "start end" per line); the summary goes to stderr
+        for start, end in intervals:
+            print(start, end)
+        print(f"{sum(e - s for s, e in intervals)} of {ntimes} timesteps to re-flag in {len(intervals)} intervals",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
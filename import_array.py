@@ -4,11 +4,13 @@ import argparse
 import os
 import sys
 import shutil
-from casatasks import importuvfits
-import casaconfig
-casaconfig.logfile = "/dev/null"
 
-def main():
+from casa_worker import casa_tasks
+from shard import add_shard_arguments, select_files
+from task_pool import run_tasks
+from telemetry import step
+
+def parse_args():
     parser = argparse.ArgumentParser(
         description="Import a selected UVFITS file into a Measurement Set."
     )
@@ -16,14 +18,14 @@ def main():
     parser.add_argument(
         "-i", "--index",
         type=int,
-        required=True,
-        help="Index of the UVFITS file to process."
+        default=None,
+        help="Index of the UVFITS file to process (alternatively use --shard)."
     )
 
     parser.add_argument(
         "-f", "--files",
         nargs="+",
-        required=True,
+        default=[],
         help="List of UVFITS files to process (space-separated)."
     )
     parser.add_argument(
@@ -31,27 +33,91 @@ def main():
         action="store_true",
         help="Do not clobber (overwrite) existing uvfits files"
     )
+    parser.add_argument(
+        "--engine",
+        choices=["casa", "native"],
+        default="casa",
+        help="casa: importuvfits; native: memory-mapped streaming importer (native_uvfits.py)."
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=20000,
+        help="UVFITS groups per streamed block (native engine only)."
+    )
+    parser.add_argument(
+        "--layout",
+        default="",
+        help="Storage layout of the MS, e.g. time or rows:cc16 (see ms_layout.py; needs python-casacore). Default: as written by the engine."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Import this many files of the shard concurrently (worker processes)."
+    )
+    add_shard_arguments(parser)
 
-    args = parser.parse_args()
-    uvfitsfiles = sorted(args.files)
-    print(len(uvfitsfiles))
+    return parser.parse_args()
+
+
+def import_file(uvfile, msfile, engine="casa", chunk_rows=20000, layout=""):
+    """Convert ``uvfile`` to ``msfile`` with CASA importuvfits or the native importer."""
+    if engine == "native":
+        from ms_layout import parse_layout, relayout_ms, split_deferred
+        from native_uvfits import import_uvfits
+        now, later = split_deferred(parse_layout(layout))
+        with step("import", ms=msfile, engine=engine) as rec:
+            rec["rows"] = nrows = import_uvfits(uvfile, msfile, chunk_rows=chunk_rows, layout=now)
+        if later is not None:
+            with step("relayout", ms=msfile):
+                relayout_ms(msfile, later, chunk_rows=chunk_rows)
+        print(f"wrote {nrows} rows to {msfile}")
+        return
+    importuvfits = casa_tasks("importuvfits")
+    with step("import", ms=msfile, engine=engine):
+        importuvfits(fitsfile=uvfile, vis=msfile)
+    if layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=msfile):
+            relayout_ms(msfile, parse_layout(layout))
 
-    try:
-        uvfile = uvfitsfiles[args.index]
-    except IndexError:
-        print(f"Error: index {args.index} is out of range for {len(uvfitsfiles)} files.")
-        sys.exit(1)
 
+def import_one(uvfile, args):
+    """Import one UVFITS file to the .ms next to it; the unit of work of a shard."""
     msfile = uvfile.replace(".uvfits", ".ms")
 
     if os.path.exists(msfile):
         if not args.no_clobber:
             shutil.rmtree(msfile)
-            importuvfits(fitsfile=uvfile, vis=msfile)
+            import_file(uvfile, msfile, engine=args.engine, chunk_rows=args.chunk_rows, layout=args.layout)
         else:
             raise RuntimeError(f"no_clobber is set to {args.no_clobber} but {msfile} already exists")
     else:
-        importuvfits(fitsfile=uvfile, vis=msfile)
+        import_file(uvfile, msfile, engine=args.engine, chunk_rows=args.chunk_rows, layout=args.layout)
+
+
+def main():
+    args = parse_args()
+    uvfitsfiles = select_files(args.files, args.file_list)
+    print(len(uvfitsfiles))
+
+    if args.index is not None:
+        try:
+            selected = [uvfitsfiles[args.index]]
+        except IndexError:
+            print(f"Error: index {args.index} is out of range for {len(uvfitsfiles)} files.")
+            sys.exit(1)
+    elif args.shard is not None:
+        selected = select_files(uvfitsfiles, shard=args.shard)
+        print(f"shard {args.shard.index}/{args.shard.count}: {len(selected)} files")
+    else:
+        print("Error: give --index or --shard.")
+        sys.exit(1)
+
+    failures = run_tasks(import_one, [(uvfile, (uvfile, args)) for uvfile in selected], workers=args.workers)
+    if failures:
+        sys.exit(2)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Fused ingest: CRACO UVFITS -> bandpass-calibrated .calB0.ms in one pass.
+
+Replaces importuvfits + aoflagger + applycal(B0)/split + aoflagger: the
+UVFITS file is memory-mapped and streamed once, every block is calibrated
+with the beam's B0 table on the way through, and the result is written
+straight to X.calB0.ms. The uncalibrated X.ms never lands on disk.
+
+Flagging can run in the same process with ``--flag-strategy`` when the
+aoflagger python bindings are installed: the strategy is run on each
+baseline of the new MS. Otherwise an external ``--aoflagger-cmd`` is
+invoked on it. run_ingest.sh does neither: the CASA container it runs
+this script in has no aoflagger, so the wrapper runs aoflagger from its
+own container once this script is done.
+"""
+import argparse
+import glob
+import os
+import re
+import shlex
+import subprocess
+import sys
+
+import numpy as np
+
+from shard import add_shard_arguments, select_files
+from task_pool import run_tasks
+from telemetry import step
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Import a CRACO UVFITS file straight to a bandpass-calibrated MS.")
+    p.add_argument("-i", "--index", type=int, default=None, help="Index of the UVFITS file to process (alternatively use --shard).")
+    p.add_argument("-f", "--files", nargs="+", default=[], help="List of UVFITS files to process (space-separated).")
+    p.add_argument("--cal-dir", required=True, help="Directory containing the bandpass tables (expects *beamXX*.<extension>).")
+    p.add_argument("--extension", default="B0", help="Bandpass table extension; also labels the output (.cal<extension>.ms).")
+    p.add_argument("--no-calwt", action="store_true", help="Do not scale WEIGHT/SIGMA by the gain amplitudes.")
+    p.add_argument("--flag-strategy", default=None, help="aoflagger strategy (e.g. aoflagger/ASKAP.lua) to run on the calibrated MS.")
+    p.add_argument("--aoflagger-cmd", default=None, help="External aoflagger command to use when the python bindings are unavailable (e.g. 'apptainer exec ... aoflagger').")
+    p.add_argument("--flag-column", default="DATA", help="Column to flag on.")
+    p.add_argument("--save-flag-store", action="store_true", help="After flagging, save <ms>.flags.zip for later generations to inherit (see flag_store.py).")
+    p.add_argument("--chunk-rows", type=int, default=20000, help="UVFITS groups per streamed block.")
+    p.add_argument("--layout", default="", help="Storage layout of the calibrated MS, e.g. time or rows:cc16 (see ms_layout.py).")
+    p.add_argument("--no-clobber", action="store_true", help="Do not overwrite an existing output MS.")
+    p.add_argument("--workers", type=int, default=1, help="Ingest this many files of the shard concurrently (worker processes).")
+    add_shard_arguments(p)
+    return p.parse_args()
+
+
+def beam_from_path(path: str) -> int:
+    match = re.search(r"beam(\d+)", os.path.basename(path))
+    if not match:
+        raise ValueError(f"Cannot determine beam number from {path}")
+    return int(match.group(1))
+
+
+def find_bandpass(cal_dir: str, beam: int, extension: str = "B0") -> str:
+    matches = sorted(glob.glob(os.path.join(cal_dir, f"*beam{beam:02d}*.{extension}")))
+    if not matches:
+        raise FileNotFoundError(f"No cal table found in '{cal_dir}' for beam {beam:02d} matching '*beam{beam:02d}*.{extension}'")
+    return matches[0]
+
+
+def make_calibrator(interpolator, freqs, corr_product, calwt=True):
+    """Return a block transform that applies ``interpolator`` to DATA (and WEIGHT/SIGMA with calwt)."""
+    from native_applycal import baseline_gain_products, calibrate_chunk, scale_weights
+
+    def calibrate(columns):
+        prod, prod_flags = baseline_gain_products([interpolator], columns["TIME"], columns["ANTENNA1"],
+                                                  columns["ANTENNA2"], freqs, corr_product)
+        data, flags = calibrate_chunk(columns["DATA"], columns["FLAG"], prod, prod_flags)
+        columns["DATA"] = data.astype(np.complex64, copy=False)
+        columns["FLAG"] = flags
+        columns["FLAG_ROW"] = flags.all(axis=(1, 2))
+        if calwt:
+            weights = {c: columns[c] for c in ("WEIGHT", "SIGMA")}
+            scale_weights(weights, prod, prod_flags | (prod == 0))
+            columns.update(weights)
+        return columns
+
+    return calibrate
+
+
+def aoflagger_in_process(msname: str, strategy_file: str, column: str = "DATA") -> int:
+    """Run an aoflagger strategy on every cross-correlation baseline of ``msname`` and OR the result into FLAG.
+
+    Rows must be time-major with the same baseline order in every
+    integration (as written by importuvfits and the native importer), so
+    each baseline is read with a strided getcol.
+
+    Returns:
+        int: Number of baselines flagged
+    """
+    import aoflagger
+    from casacore.tables import table
+
+    flagger = aoflagger.AOFlagger()
+    strategy = flagger.load_strategy_file(strategy_file)
+    with table(msname, readonly=False, ack=False) as tab:
+        a1, a2 = tab.getcol("ANTENNA1"), tab.getcol("ANTENNA2")
+        ntimes = len(np.unique(tab.getcol("TIME")))
+        nbl = tab.nrows() // ntimes
+        if nbl * ntimes != tab.nrows() or not (np.all(a1.reshape(ntimes, nbl) == a1[:nbl])
+                                                and np.all(a2.reshape(ntimes, nbl) == a2[:nbl])):
+            raise ValueError(f"{msname} does not have a regular time x baseline row layout; flag it with aoflagger instead")
+        nflagged = 0
+        for b in range(nbl):
+            if a1[b] == a2[b]:
+                continue
+            data = tab.getcol(column, startrow=b, nrow=ntimes, rowincr=nbl)
+            flags = tab.getcol("FLAG", startrow=b, nrow=ntimes, rowincr=nbl)
+            ncorr = data.shape[2]
+            images = flagger.make_image_set(ntimes, data.shape[1], 2 * ncorr)
+            for c in range(ncorr):
+                images.set_image_buffer(2 * c, np.ascontiguousarray(data[:, :, c].real.T, dtype=np.float32))
+                images.set_image_buffer(2 * c + 1, np.ascontiguousarray(data[:, :, c].imag.T, dtype=np.float32))
+            new = np.asarray(strategy.run(images).get_buffer(), dtype=bool).T
+            tab.putcol("FLAG", flags | new[:, :, None], startrow=b, nrow=ntimes, rowincr=nbl)
+            nflagged += 1
+    return nflagged
+
+
+def has_aoflagger_bindings() -> bool:
+    """Whether the aoflagger python bindings can be imported."""
+    try:
+        import aoflagger
+    except ImportError:
+        return False
+    # the strategy directory next to this script also imports as a (namespace) package
+    return hasattr(aoflagger, "AOFlagger")
+
+
+def run_flag_hook(msname: str, strategy_file: str, column: str = "DATA", aoflagger_cmd: str = None) -> None:
+    """Flag ``msname`` in this process via the aoflagger bindings, or with ``aoflagger_cmd`` if they are missing."""
+    if not has_aoflagger_bindings():
+        if not aoflagger_cmd:
+            raise RuntimeError("aoflagger python bindings not available; pass --aoflagger-cmd or flag with run_flag.sh")
+        cmd = shlex.split(aoflagger_cmd) + ["-column", column, "-strategy", strategy_file, msname]
+        print(f"running {' '.join(cmd)}")
+        subprocess.run(cmd, check=True)
+        return
+    nbl = aoflagger_in_process(msname, strategy_file, column=column)
+    print(f"aoflagger ({os.path.basename(strategy_file)}) flagged {nbl} baselines of {msname}")
+
+
+def ingest_one(uvfile, args):
+    """Import, calibrate and (optionally) flag one UVFITS file; the unit of work of a shard."""
+    from caltable_tools import GainInterpolator
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_uvfits import CASA_STOKES_RECEPTORS, import_uvfits, read_uvfits_info
+    from astropy.io import fits
+
+    msfile = uvfile.replace(".uvfits", f".cal{args.extension}.ms")
+    if os.path.exists(msfile) and args.no_clobber:
+        raise RuntimeError(f"no_clobber is set to {args.no_clobber} but {msfile} already exists")
+
+    caltable = find_bandpass(args.cal_dir, beam_from_path(uvfile), args.extension)
+    time_interp = "nearest" if args.extension == "B0" else "linear"
+    interpolator = GainInterpolator.from_caltable(caltable, time_interp=time_interp, freq_interp="linear")
+    with fits.open(uvfile, memmap=True) as hdul:
+        info = read_uvfits_info(hdul)
+    corr_product = np.array([CASA_STOKES_RECEPTORS[t] for t in info.corr_types])
+    calibrate = make_calibrator(interpolator, info.freqs, corr_product, calwt=not args.no_calwt)
+
+    print(f"ingesting {uvfile} -> {msfile} with {caltable}")
+    now, later = split_deferred(parse_layout(args.layout))
+    with step("import_calibrate", ms=msfile) as rec:
+        rec["rows"] = nrows = import_uvfits(uvfile, msfile, chunk_rows=args.chunk_rows, transform=calibrate, layout=now)
+    if later is not None:
+        with step("relayout", ms=msfile):
+            relayout_ms(msfile, later, chunk_rows=args.chunk_rows)
+    print(f"wrote {nrows} calibrated rows to {msfile}")
+
+    if args.flag_strategy:
+        with step("aoflagger", ms=msfile):
+            run_flag_hook(msfile, args.flag_strategy, column=args.flag_column, aoflagger_cmd=args.aoflagger_cmd)
+    if args.save_flag_store:
+        from flag_store import save_flag_store
+        with step("flag_save", ms=msfile):
+            save_flag_store(msfile, column=args.flag_column, chunk_rows=args.chunk_rows)
+
+
+def main():
+    args = parse_args()
+    uvfitsfiles = select_files(args.files, args.file_list)
+    print(len(uvfitsfiles))
+    if args.index is not None:
+        try:
+            selected = [uvfitsfiles[args.index]]
+        except IndexError:
+            print(f"Error: index {args.index} is out of range for {len(uvfitsfiles)} files.")
+            sys.exit(1)
+    elif args.shard is not None:
+        selected = select_files(uvfitsfiles, shard=args.shard)
+        print(f"shard {args.shard.index}/{args.shard.count}: {len(selected)} files")
+    else:
+        print("Error: give --index or --shard.")
+        sys.exit(1)
+
+    if args.flag_strategy and not args.aoflagger_cmd and not has_aoflagger_bindings():
+        # fail before the ingest rather than after it
+        sys.exit("Error: --flag-strategy needs the aoflagger python bindings or --aoflagger-cmd")
+
+    failures = run_tasks(ingest_one, [(uvfile, (uvfile, args)) for uvfile in selected], workers=args.workers)
+    if failures:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Incremental MODEL_DATA updates between self-cal rounds.
+
+Successive ``selfcal_N_img-sources.txt`` lists share most of their clean
+components. Instead of re-predicting the whole list every round, the
+components are matched between the list MODEL_DATA currently holds and
+the new one (same type and position, then shape and spectrum compared)
+and only the difference is predicted: added and changed components with
+their new parameters, removed and changed components with their old
+parameters and negated flux.
+
+What MODEL_DATA holds is recorded in a sidecar (``model_state.json``
+inside the MS) together with the sizes and mtimes of the column's
+storage-manager files, so anything else that writes the column (wsclean,
+crystalball, a CASA task) invalidates the record. The base can be the MS
+itself or its parent generation (the previous self-cal MS has the same
+rows; split drops MODEL_DATA, so the new MS starts without one). A full
+predict is done when no valid base exists, when the base's rows differ,
+or when the delta is larger than ``max_delta_fraction`` of the new list.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+from casacore.tables import table
+
+from ms_generation import storage_manager_files
+from ms_stream import DEFAULT_CHUNK_ROWS
+from native_predict import DEFAULT_TILE_BYTES, SourceList, brightest, parse_wsclean_source_list, predict_sources, select_components
+
+STATE_NAME = "model_state.json"
+"""Sidecar file name, stored inside the MS directory"""
+
+STATE_VERSION = 1
+"""Bumped whenever the sidecar layout changes, so old records are ignored"""
+
+MATCH_TOLERANCE = np.deg2rad(0.05 / 3600.0)
+"""Components closer than this (radians) are candidates for the same component"""
+
+DEFAULT_MAX_DELTA_FRACTION = 0.5
+"""Delta size, relative to the new list, above which a full predict is cheaper"""
+
+
+class SourceDiff(NamedTuple):
+    """Classification of the components of two source lists"""
+
+    added: np.ndarray
+    """Indices into the new list with no counterpart in the old one"""
+    removed: np.ndarray
+    """Indices into the old list with no counterpart in the new one"""
+    changed_old: np.ndarray
+    """Indices into the old list of matched components whose flux, spectrum or shape changed"""
+    changed_new: np.ndarray
+    """Indices into the new list of the same components"""
+    unchanged: int
+    """Number of matched components that are identical"""
+
+    @property
+    def size(self):
+        """Components a delta predict has to evaluate."""
+        return len(self.added) + len(self.removed) + len(self.changed_old) + len(self.changed_new)
+
+
+def _match_keys(sources, tolerance):
+    ra = np.round(sources.ra * np.cos(sources.dec) / tolerance).astype(np.int64)
+    dec = np.round(sources.dec / tolerance).astype(np.int64)
+    groups = defaultdict(list)
+    for i, key in enumerate(zip(ra.tolist(), dec.tolist(), sources.gaussian.tolist())):
+        groups[key].append(i)
+    return groups
+
+
+def _same_component(old, i, new, j, rtol=1e-6):
+    nterms = max(old.spectral.shape[1], new.spectral.shape[1])
+    old_si = np.pad(old.spectral[i], (0, nterms - old.spectral.shape[1]))
+    new_si = np.pad(new.spectral[j], (0, nterms - new.spectral.shape[1]))
+    return (old.log_si[i] == new.log_si[j]
+            and np.allclose([old.flux[i], old.ref_freq[i], old.major[i], old.minor[i], old.orientation[i]],
+                            [new.flux[j], new.ref_freq[j], new.major[j], new.minor[j], new.orientation[j]], rtol=rtol, atol=0.0)
+            and np.allclose(old_si, new_si, rtol=rtol, atol=1e-12))
+
+
+def diff_source_lists(old, new, tolerance=MATCH_TOLERANCE):
+    """Match the components of two source lists and classify them.
+
+    Components match when they have the same type and position (within
+    ``tolerance``). Several components at one position (multi-scale
+    Gaussians on the same pixel) are paired in order of major axis.
+
+    Returns:
+        SourceDiff: Added, removed and changed components
+    """
+    old_groups, new_groups = _match_keys(old, tolerance), _match_keys(new, tolerance)
+    added, removed, changed_old, changed_new = [], [], [], []
+    unchanged = 0
+    for key in old_groups.keys() | new_groups.keys():
+        o = sorted(old_groups.get(key, []), key=lambda i: old.major[i])
+        n = sorted(new_groups.get(key, []), key=lambda j: new.major[j])
+        for i, j in zip(o, n):
+            if _same_component(old, i, new, j):
+                unchanged += 1
+            else:
+                changed_old.append(i)
+                changed_new.append(j)
+        removed += o[len(n):]
+        added += n[len(o):]
+    as_index = lambda x: np.array(sorted(x), dtype=int)
+    return SourceDiff(added=as_index(added), removed=as_index(removed), changed_old=np.array(changed_old, dtype=int),
+                      changed_new=np.array(changed_new, dtype=int), unchanged=unchanged)
+
+
+def negate(sources):
+    """The same components with the sign of their spectra flipped (for subtracting them)."""
+    spectral = np.where(sources.log_si[:, None], sources.spectral, -sources.spectral)
+    return sources._replace(flux=-sources.flux, spectral=spectral)
+
+
+def concat_sources(*lists):
+    """Concatenate source lists (spectral terms zero-padded to the longest)."""
+    nterms = max(s.spectral.shape[1] for s in lists)
+    fields = {name: np.concatenate([getattr(s, name) for s in lists]) for name in SourceList._fields if name != "spectral"}
+    fields["spectral"] = np.concatenate([np.pad(s.spectral, ((0, 0), (0, nterms - s.spectral.shape[1]))) for s in lists])
+    return SourceList(**fields)
+
+
+def delta_sources(old, new, diff):
+    """Components whose prediction turns a model of ``old`` into a model of ``new``."""
+    plus = select_components(new, np.concatenate([diff.added, diff.changed_new]))
+    minus = negate(select_components(old, np.concatenate([diff.removed, diff.changed_old])))
+    return concat_sources(plus, minus)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def column_fingerprint(msname, column):
+    """Sizes and mtimes of the storage-manager files holding ``column`` (None if there is no such column)."""
+    try:
+        with table(msname, ack=False) as tab:
+            if column not in tab.colnames():
+                return None
+            dminfo = tab.getdminfo(column)
+    except RuntimeError:
+        return None
+    entries = []
+    for f in sorted(storage_manager_files(msname, dminfo["SEQNR"])):
+        st = os.stat(os.path.join(msname, f))
+        entries.append([f, st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def read_model_state(msname, column="MODEL_DATA"):
+    """What ``column`` of ``msname`` holds, if the sidecar record is still current, otherwise None.
+
+    Returns:
+        dict: {"source_list", "sha256", "num_sources", "field"} of the last prediction
+    """
+    try:
+        with open(os.path.join(msname, STATE_NAME)) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    record = stored.get("columns", {}).get(column) if stored.get("version") == STATE_VERSION else None
+    if record is None or record.get("fingerprint") != column_fingerprint(msname, column):
+        return None
+    if not os.path.isfile(record["source_list"]) or _file_sha256(record["source_list"]) != record["sha256"]:
+        return None
+    return record
+
+
+def write_model_state(msname, column, source_list, num_sources, field):
+    """Record that ``column`` of ``msname`` now holds the prediction of ``source_list``.
+
+    The file is replaced atomically, which also breaks any hardlink a
+    copy-on-write generation inherited from its parent.
+    """
+    path = os.path.join(msname, STATE_NAME)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        if stored.get("version") != STATE_VERSION:
+            raise ValueError
+    except (OSError, ValueError):
+        stored = {"version": STATE_VERSION, "columns": {}}
+    stored["columns"][column] = {"source_list": os.path.abspath(source_list), "sha256": _file_sha256(source_list),
+                                 "num_sources": num_sources, "field": field,
+                                 "fingerprint": column_fingerprint(msname, column)}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(stored, f, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"WARN: could not write {path}: {e}")
+
+
+def predict_incremental(msname, source_list, column="MODEL_DATA", num_sources=0, field=0, base_ms=None,
+                        max_delta_fraction=DEFAULT_MAX_DELTA_FRACTION, workers=1, chunk_rows=DEFAULT_CHUNK_ROWS,
+                        tile_bytes=DEFAULT_TILE_BYTES, resume=False):
+    """Bring ``column`` of ``msname`` up to date with ``source_list``, predicting only the change where possible.
+
+    Args:
+        msname (str): Measurement set to write
+        source_list (str): WSClean ``*-sources.txt``
+        column (str): Model column
+        num_sources (int): Keep only the N brightest components (0 = all)
+        field (int): FIELD_ID to predict
+        base_ms (str): Parent generation whose ``column`` may serve as the starting model
+        max_delta_fraction (float): Full predict when the delta exceeds this fraction of the new list
+        workers (int): Threads evaluating row tiles
+        chunk_rows (int): Rows per streamed block
+        tile_bytes (int): Memory budget of one (rows x sources) tile
+        resume (bool): Journal the write and resume an interrupted one (not for a delta onto ``msname`` itself)
+
+    Returns:
+        str: "unchanged", "delta" or "full"
+    """
+    new = brightest(parse_wsclean_source_list(source_list), num_sources)
+    mode = "full"
+    for base in [msname] + ([base_ms] if base_ms and os.path.isdir(base_ms) else []):
+        state = read_model_state(base, column)
+        if state is None or state["field"] != field:
+            print(f"{base}:{column} has no current model record")
+            continue
+        old = brightest(parse_wsclean_source_list(state["source_list"]), state["num_sources"])
+        diff = diff_source_lists(old, new)
+        print(f"{base}:{column} holds {state['source_list']}: {len(diff.added)} added, {len(diff.removed)} removed, "
+              f"{len(diff.changed_new)} changed, {diff.unchanged} unchanged")
+        if diff.size == 0 and base == msname:
+            mode = "unchanged"
+            break
+        if diff.size > max_delta_fraction * max(len(new.flux), 1):
+            print(f"delta of {diff.size} components exceeds {max_delta_fraction:g} of {len(new.flux)}; full predict")
+            break
+        try:
+            predict_sources(msname, delta_sources(old, new, diff), column=column, field=field, workers=workers,
+                            chunk_rows=chunk_rows, tile_bytes=tile_bytes, base_ms=base, resume=resume)
+        except ValueError as e:
+            print(f"WARN: cannot use {base} as the base model ({e}); full predict")
+            break
+        mode = "delta"
+        break
+    if mode == "full":
+        predict_sources(msname, new, column=column, field=field, workers=workers, chunk_rows=chunk_rows,
+                        tile_bytes=tile_bytes, resume=resume)
+    if mode != "unchanged":
+        write_model_state(msname, column, source_list, num_sources, field)
+    return mode
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Update MODEL_DATA to a new WSClean source list, predicting only the change.")
+    p.add_argument("ms", help="Measurement set.")
+    p.add_argument("-sm", "--sky-model", required=True, help="WSClean source list (*-sources.txt).")
+    p.add_argument("-o", "--output-column", default="MODEL_DATA", help="Model column.")
+    p.add_argument("-ns", "--num-sources", type=int, default=0, help="Predict only the N brightest components (0 = all).")
+    p.add_argument("-f", "--field", type=int, default=0, help="FIELD_ID to predict.")
+    p.add_argument("--base-ms", default=None, help="Parent MS (same rows) whose model may be reused, e.g. the previous self-cal round.")
+    p.add_argument("--max-delta-fraction", type=float, default=DEFAULT_MAX_DELTA_FRACTION,
+                   help="Re-predict everything when the delta exceeds this fraction of the new list.")
+    p.add_argument("-j", "--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", 1)), help="Threads (default: $SLURM_CPUS_PER_TASK or 1).")
+    p.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per streamed block.")
+    p.add_argument("--resume", action="store_true", help="Journal the write and resume an interrupted one (see ms_journal.py).")
+    p.add_argument("--diff-only", action="store_true", help="Print the diff against the model recorded in the MS and exit.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.diff_only:
+        for base in [args.ms] + ([args.base_ms] if args.base_ms else []):
+            state = read_model_state(base, args.output_column)
+            if state is not None:
+                old = brightest(parse_wsclean_source_list(state["source_list"]), state["num_sources"])
+                new = brightest(parse_wsclean_source_list(args.sky_model), args.num_sources)
+                diff = diff_source_lists(old, new)
+                print(json.dumps({"base": base, "old": state["source_list"], "added": len(diff.added),
+                                  "removed": len(diff.removed), "changed": len(diff.changed_new), "unchanged": diff.unchanged}))
+                return
+        print(f"no current model record for {args.output_column}")
+        return
+    t0 = time.perf_counter()
+    mode = predict_incremental(args.ms, args.sky_model, column=args.output_column, num_sources=args.num_sources,
+                               field=args.field, base_ms=args.base_ms, max_delta_fraction=args.max_delta_fraction,
+                               workers=args.workers, chunk_rows=args.chunk_rows, resume=args.resume)
+    print(f"{args.ms}:{args.output_column} {mode} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Copy-on-write MS generations.
+
+A derived MS (X.calB0.ms, X.selfcal_N.ms, X.uvsub.ms) usually differs from
+its parent only in DATA (and sometimes FLAG/WEIGHT). Instead of a full
+split copy, the derived MS hardlinks every subtable file and every
+storage-manager file of the unchanged columns; only the storage managers
+of the rewritten columns get private files.
+
+Hardlinks keep the data alive when the parent is deleted, so
+``validate_and_clean_ms(..., delete_previous=True)`` keeps working. The
+flip side is that a linked file must never be written in place: anything
+that modifies a column of a derived MS in place should call
+``unshare_columns`` first.
+"""
+import argparse
+import errno
+import os
+import shutil
+
+from casacore.tables import table
+
+from ms_layout import apply_layout, companion_columns
+from ms_stream import copyable_columns, create_empty_like
+
+META_FILES = ("table.dat", "table.info", "table.lock")
+"""Per-table files that casacore rewrites on every write-open, so are never shared"""
+
+PRIVATE_SUBTABLES = ("HISTORY", "FLAG_CMD")
+"""Subtables that CASA tasks append to, so are copied rather than linked"""
+
+DROP_COLUMNS = ("CORRECTED_DATA", "MODEL_DATA")
+"""Columns that split(datacolumn='corrected') leaves out of a derived MS"""
+
+
+def _link(src, dst):
+    """Hardlink ``src`` to ``dst``, copying instead where the filesystem refuses links."""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copy2(src, dst)
+
+
+def _sparse_like(src, dst):
+    """Create ``dst`` as a zero-filled sparse file of the same size as ``src``."""
+    with open(dst, "wb") as f:
+        f.truncate(os.path.getsize(src))
+
+
+def storage_manager_files(tabdir, seqnr):
+    """Files of data manager ``seqnr`` (table.fN, table.fN_TSM0, ...) in a table directory."""
+    prefix = f"table.f{seqnr}"
+    return [f for f in os.listdir(tabdir)
+            if f == prefix or (f.startswith(prefix) and not f[len(prefix)].isdigit())]
+
+
+def _share_table_dir(src, dst):
+    """Recreate a (sub)table directory with private metadata and hardlinked data files."""
+    os.makedirs(dst)
+    for entry in os.listdir(src):
+        s, d = os.path.join(src, entry), os.path.join(dst, entry)
+        if os.path.isdir(s):
+            if entry in PRIVATE_SUBTABLES:
+                shutil.copytree(s, d)
+            else:
+                _share_table_dir(s, d)
+        elif entry in META_FILES:
+            shutil.copy2(s, d)
+        else:
+            _link(s, d)
+
+
+def plan_main_table(msname, rewrite_columns, drop_columns=DROP_COLUMNS):
+    """Decide how each storage-manager file of the main table is carried into a derived MS.
+
+    Args:
+        msname (str): Parent measurement set
+        rewrite_columns (list): Columns the caller will rewrite in every row
+        drop_columns (list): Columns removed from the derived MS
+
+    Returns:
+        dict: file name -> 'link' (shared with the parent), 'copy' (private
+        copy) or 'fresh' (private, zero-filled; only for tiled managers whose
+        columns are all rewritten)
+    """
+    with table(msname, ack=False) as tab:
+        dminfo = tab.getdminfo()
+        # a compressed column is written through the files of its backing columns
+        rewrite = set(rewrite_columns) | set(companion_columns(tab, rewrite_columns))
+        drop = set(drop_columns) | set(companion_columns(tab, drop_columns))
+    plan = {}
+    for dm in dminfo.values():
+        seqnr = dm["SEQNR"]
+        cols = set(dm["COLUMNS"])
+        files = storage_manager_files(msname, seqnr)
+        if cols & rewrite:
+            if cols <= rewrite and dm["TYPE"].startswith("Tiled"):
+                # The header file describes the hypercubes; the _TSM files are raw tiles
+                action = {f: "copy" if f == f"table.f{seqnr}" else "fresh" for f in files}
+            else:
+                action = dict.fromkeys(files, "copy")
+        elif cols & drop and not cols <= drop:
+            # removecols would rewrite a manager that still holds kept columns
+            action = dict.fromkeys(files, "copy")
+        else:
+            action = dict.fromkeys(files, "link")
+        plan.update(action)
+    return plan
+
+
+def create_generation(msname, outputvis, rewrite_columns=("DATA",), drop_columns=DROP_COLUMNS, layout=None):
+    """Create ``outputvis`` as a copy-on-write child of ``msname``.
+
+    The child has every row of the parent. Subtables and the storage
+    managers of untouched columns are hardlinks to the parent's files;
+    the managers of ``rewrite_columns`` are private and must be rewritten
+    in full by the caller (dedicated tiled managers start out zero-filled).
+
+    Args:
+        msname (str): Parent measurement set
+        outputvis (str): Path of the child; replaced if present
+        rewrite_columns (list): Columns the caller will overwrite in every row
+        drop_columns (list): Columns left out of the child
+        layout (ms_layout.Layout): Re-create ``rewrite_columns`` with this layout
+
+    Returns:
+        str: ``outputvis``
+    """
+    if os.path.isdir(outputvis):
+        print(f"found existing copy of {outputvis}. removing prior to write")
+        shutil.rmtree(outputvis)
+    plan = plan_main_table(msname, rewrite_columns, drop_columns)
+    os.makedirs(outputvis)
+    for entry in os.listdir(msname):
+        src, dst = os.path.join(msname, entry), os.path.join(outputvis, entry)
+        if os.path.isdir(src):
+            if entry in PRIVATE_SUBTABLES:
+                shutil.copytree(src, dst)
+            else:
+                _share_table_dir(src, dst)
+        elif entry in META_FILES:
+            shutil.copy2(src, dst)
+        elif plan.get(entry, "link") == "fresh":
+            _sparse_like(src, dst)
+        elif plan.get(entry, "link") == "copy":
+            shutil.copy2(src, dst)
+        else:
+            _link(src, dst)
+    with table(outputvis, readonly=False, ack=False) as out:
+        drop = [c for c in drop_columns if c in out.colnames()]
+        if drop:
+            out.removecols(drop + companion_columns(out, drop))
+        if layout is not None:
+            apply_layout(out, layout, columns=rewrite_columns)
+    return outputvis
+
+
+def create_derived_ms(msname, outputvis, rewrite_columns, share_parent=False, layout=None):
+    """Create the output of a DATA-rewriting stage, either as a full copy or a copy-on-write child.
+
+    Args:
+        msname (str): Input measurement set
+        outputvis (str): Output measurement set; replaced if present
+        rewrite_columns (list): Columns the caller writes itself
+        share_parent (bool): Hardlink unchanged files instead of copying them
+        layout (ms_layout.Layout): Storage layout of the output (of the rewritten
+            columns only for a copy-on-write child)
+
+    Returns:
+        list: Remaining columns the caller still has to copy row by row
+        (empty for a copy-on-write child, whose rows already exist)
+    """
+    if share_parent:
+        create_generation(msname, outputvis, rewrite_columns=rewrite_columns, layout=layout)
+    else:
+        create_empty_like(msname, outputvis, drop_columns=DROP_COLUMNS, layout=layout)
+    return derived_columns(msname, rewrite_columns, share_parent=share_parent)
+
+
+def derived_columns(msname, rewrite_columns, share_parent=False):
+    """Columns the caller copies row by row into an output made by ``create_derived_ms`` (e.g. on resuming it)."""
+    if share_parent:
+        return []
+    with table(msname, ack=False) as src:
+        columns = copyable_columns(src)
+    return [c for c in columns if c not in DROP_COLUMNS and c not in rewrite_columns]
+
+
+def unshare_columns(msname, columns=None):
+    """Give ``msname`` private copies of any hardlinked storage-manager files.
+
+    Call before modifying a column in place (flagging, in-place uvsub), so
+    the change does not leak into the parent or sibling generations.
+
+    Args:
+        msname (str): Measurement set about to be modified
+        columns (list): Only unshare the managers holding these columns (default: all)
+
+    Returns:
+        int: Number of bytes copied
+    """
+    with table(msname, ack=False) as tab:
+        dminfo = tab.getdminfo()
+        if columns is not None:
+            columns = list(columns) + companion_columns(tab, columns)
+    copied = 0
+    for dm in dminfo.values():
+        if columns is not None and not set(dm["COLUMNS"]) & set(columns):
+            continue
+        for f in storage_manager_files(msname, dm["SEQNR"]):
+            path = os.path.join(msname, f)
+            if os.stat(path).st_nlink > 1:
+                tmp = path + ".unshare"
+                shutil.copy2(path, tmp)
+                os.replace(tmp, path)
+                copied += os.path.getsize(path)
+    return copied
+
+
+def shared_bytes(msname):
+    """Total size of the files in ``msname`` that are hardlinked to another MS."""
+    total = 0
+    for root, _, files in os.walk(msname):
+        for f in files:
+            st = os.stat(os.path.join(root, f))
+            if st.st_nlink > 1:
+                total += st.st_size
+    return total
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Inspect or break the file sharing of copy-on-write MS generations.")
+    p.add_argument("ms", nargs="+", help="Measurement sets.")
+    p.add_argument("--unshare", action="store_true", help="Replace hardlinked main-table files with private copies.")
+    p.add_argument("--columns", default=None, help="Comma-separated columns to unshare (default: all).")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    columns = args.columns.split(",") if args.columns else None
+    for ms in args.ms:
+        if args.unshare:
+            copied = unshare_columns(ms, columns)
+            print(f"{ms}: unshared {copied / 1e9:.2f} GB")
+        else:
+            print(f"{ms}: {shared_bytes(ms) / 1e9:.2f} GB shared with other generations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Cached metadata index for measurement sets.
+
+Several stages need the same small facts about an MS (row count, unique
+times, channels, ...) and used to get them by loading whole columns.
+``ms_index`` computes them once with a chunked streaming pass and stores
+them in a JSON sidecar inside the MS directory. The sidecar records the
+size and mtime of the main-table files (and the ANTENNA / SPECTRAL_WINDOW
+descriptors), so any write to the MS invalidates it.
+"""
+import argparse
+import json
+import os
+from typing import List, NamedTuple
+
+import numpy as np
+from casacore.tables import table
+
+from ms_stream import DEFAULT_CHUNK_ROWS, iter_row_chunks, prefetch_chunks
+
+INDEX_NAME = "ms_index.json"
+"""Sidecar file name, stored inside the MS directory"""
+
+INDEX_VERSION = 1
+"""Bumped whenever the sidecar layout changes, so old sidecars are rebuilt"""
+
+FINGERPRINT_SUBTABLES = ("ANTENNA", "SPECTRAL_WINDOW")
+"""Subtables whose table.dat is included in the fingerprint"""
+
+
+class MSIndex(NamedTuple):
+    """Structure to hold the cached metadata of an MS"""
+
+    nrows: int
+    """Number of rows in the main table"""
+    times: np.ndarray
+    """Sorted unique TIME values (MJD seconds)"""
+    tsamp: float
+    """Median spacing of the unique times in seconds (0 for a single time)"""
+    antennas: List[str]
+    """Names from the ANTENNA subtable"""
+    used_antennas: List[int]
+    """Antenna indices that appear in ANTENNA1/ANTENNA2"""
+    chan_freqs: List[List[float]]
+    """Channel frequencies (Hz) of each spectral window"""
+    scans: List[int]
+    """Unique SCAN_NUMBER values"""
+    flag_fraction: float
+    """Fraction of flagged visibility samples"""
+
+
+def table_fingerprint(msname):
+    """Sizes and mtimes of the files that change whenever the MS is written."""
+    entries = []
+    for f in sorted(os.listdir(msname)):
+        path = os.path.join(msname, f)
+        # only casacore's own files: sidecars (this index, stage_cache.json) do not count
+        if not f.startswith("table.") or f == "table.lock" or os.path.isdir(path):
+            continue
+        st = os.stat(path)
+        entries.append([f, st.st_size, st.st_mtime_ns])
+    for sub in FINGERPRINT_SUBTABLES:
+        path = os.path.join(msname, sub, "table.dat")
+        if os.path.exists(path):
+            st = os.stat(path)
+            entries.append([f"{sub}/table.dat", st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def build_ms_index(msname, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Compute the index of ``msname`` with one chunked pass over TIME, SCAN_NUMBER, ANTENNA1/2 and FLAG.
+
+    Returns:
+        MSIndex: Metadata of the MS
+    """
+    times, scans, ants = set(), set(), set()
+    nflagged = nsamples = 0
+    with table(msname, ack=False) as tab:
+        nrows = tab.nrows()
+
+        def read_chunk(start, n):
+            return {c: tab.getcol(c, startrow=start, nrow=n)
+                    for c in ("TIME", "SCAN_NUMBER", "ANTENNA1", "ANTENNA2", "FLAG")}
+
+        for _, block in prefetch_chunks(read_chunk, iter_row_chunks(nrows, chunk_rows)):
+            times.update(np.unique(block["TIME"]).tolist())
+            scans.update(np.unique(block["SCAN_NUMBER"]).tolist())
+            ants.update(np.unique(np.concatenate([block["ANTENNA1"], block["ANTENNA2"]])).tolist())
+            nflagged += int(np.count_nonzero(block["FLAG"]))
+            nsamples += block["FLAG"].size
+    with table(os.path.join(msname, "ANTENNA"), ack=False) as at:
+        antennas = list(at.getcol("NAME")) if at.nrows() else []
+    with table(os.path.join(msname, "SPECTRAL_WINDOW"), ack=False) as spw:
+        chan_freqs = [np.asarray(spw.getcell("CHAN_FREQ", i), dtype=float).tolist() for i in range(spw.nrows())]
+    times = np.array(sorted(times))
+    tsamp = float(np.median(np.diff(times))) if len(times) > 1 else 0.0
+    return MSIndex(nrows=int(nrows), times=times, tsamp=tsamp, antennas=[str(a) for a in antennas],
+                   used_antennas=sorted(int(a) for a in ants), chan_freqs=chan_freqs,
+                   scans=sorted(int(s) for s in scans),
+                   flag_fraction=nflagged / nsamples if nsamples else 0.0)
+
+
+def read_ms_index(msname):
+    """Return the sidecar index of ``msname`` if it is still current, otherwise None."""
+    path = os.path.join(msname, INDEX_NAME)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stored.get("version") != INDEX_VERSION or stored.get("fingerprint") != table_fingerprint(msname):
+        return None
+    fields = stored["index"]
+    fields["times"] = np.asarray(fields["times"], dtype=float)
+    return MSIndex(**fields)
+
+
+def write_ms_index(msname, index):
+    """Store ``index`` as the sidecar of ``msname``.
+
+    The file is replaced atomically, which also breaks any hardlink a
+    copy-on-write generation inherited from its parent.
+    """
+    fields = index._asdict()
+    fields["times"] = index.times.tolist()
+    payload = {"version": INDEX_VERSION, "fingerprint": table_fingerprint(msname), "index": fields}
+    path = os.path.join(msname, INDEX_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        # a read-only MS still gets its index, just not cached
+        print(f"WARN: could not write {path}: {e}")
+
+
+def ms_index(msname, rebuild=False, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Return the metadata index of ``msname``, building and caching it if missing or stale.
+
+    Args:
+        msname (str): Measurement set
+        rebuild (bool): Ignore any cached sidecar
+        chunk_rows (int): Rows per block of the streaming pass
+
+    Returns:
+        MSIndex: Metadata of the MS
+    """
+    index = None if rebuild else read_ms_index(msname)
+    if index is None:
+        index = build_ms_index(msname, chunk_rows=chunk_rows)
+        write_ms_index(msname, index)
+    return index
+
+
+def ms_nrows(msname):
+    """Row count of ``msname`` from a current sidecar, or from the table itself (without building an index)."""
+    index = read_ms_index(msname)
+    if index is not None:
+        return index.nrows
+    with table(msname, ack=False) as tab:
+        return int(tab.nrows())
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Build or show the cached metadata index of measurement sets.")
+    p.add_argument("ms", nargs="+", help="Measurement sets.")
+    p.add_argument("--rebuild", action="store_true", help="Rebuild even if the cached index is current.")
+    p.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per block of the streaming pass.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    for ms in args.ms:
+        index = ms_index(ms, rebuild=args.rebuild, chunk_rows=args.chunk_rows)
+        nchan = sum(len(f) for f in index.chan_freqs)
+        print(f"{ms}: {index.nrows} rows, {len(index.times)} times (tsamp {index.tsamp:.2f}s), "
+              f"{len(index.used_antennas)}/{len(index.antennas)} antennas, {nchan} channels, "
+              f"scans {index.scans}, {100 * index.flag_fraction:.1f}% flagged")
+
+
+if __name__ == "__main__":
+    main()
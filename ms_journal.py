@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Write journals: block-level checkpoints so an interrupted native write resumes.
+
+The native writers (``native_applycal.apply_to_new_ms``,
+``native_uvsub.subtract_to_new_ms``, ``native_predict.predict_sources`` and
+``native_average.average_ms``) stream an MS in fixed blocks of rows.
+Without a journal, a job killed at its time limit or pre-empted leaves a
+partial output that the next attempt deletes and rewrites from row 0.
+With ``resume=True`` each block is flushed and then committed to a journal
+(``write_journal.json`` inside the output MS). The entry records the
+block's input and output row ranges and a digest of its first and last
+output rows as stored.
+
+A later run of the same write keeps the output. The same write means the
+same input state, parameters and block size. The run re-reads the digests
+of the committed blocks, newest first, and carries on after the newest
+block that still matches. Anything else starts from scratch: no journal,
+other parameters, an input written since, or an output that does not open
+with the expected rows. The journal is removed once the last block is
+written, so a finished output is never taken for a partial one.
+
+A block that was written but not yet committed when the job died is
+written again, so only writes that give the same result when repeated
+are journaled. The in-place writers that subtract from or add to a
+column (``native_uvsub.subtract_in_place``, a delta predict into the MS
+itself) are not, and always run from the start.
+
+::
+
+    ms_journal.py MS ...   # progress of interrupted writes
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+from casacore.tables import table
+
+JOURNAL_NAME = "write_journal.json"
+"""Journal file name, stored inside the output MS directory"""
+
+JOURNAL_VERSION = 1
+"""Bumped whenever the journal layout changes, so old journals are ignored"""
+
+
+def journal_path(outputvis):
+    return os.path.join(outputvis, JOURNAL_NAME)
+
+
+def digest(*parts):
+    """Short hash of JSON-serialisable values and NumPy arrays (gains, source lists) that identify a write."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype.hasobject:
+            # object arrays (e.g. component names) would hash their pointers
+            h.update(json.dumps(part.tolist(), default=str).encode())
+        elif isinstance(part, np.ndarray):
+            h.update(f"{part.dtype}{part.shape}".encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+
+def rows_digest(tab, columns, start, nrow):
+    """Digest of the first and last of the ``nrow`` rows from ``start`` of ``columns``, as stored in ``tab``."""
+    if nrow <= 0:
+        return ""
+    h = hashlib.sha256()
+    for col in columns:
+        for row in sorted({start, start + nrow - 1}):
+            h.update(np.ascontiguousarray(tab.getcol(col, startrow=row, nrow=1)).tobytes())
+    return h.hexdigest()[:16]
+
+
+class WriteJournal:
+    """The committed blocks of one chunked write into ``outputvis``.
+
+    Args:
+        outputvis (str): MS being written; the journal lives inside it
+        key (str): Identity of the write, a ``digest`` of its input state, parameters and block size
+        verify_columns (list): Columns whose stored rows are digested at each commit
+    """
+
+    def __init__(self, outputvis, key, verify_columns):
+        self.outputvis = outputvis
+        self.path = journal_path(outputvis)
+        self.key = key
+        self.verify_columns = list(verify_columns)
+        self.nrows = None
+        self.blocks = []
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("version") != JOURNAL_VERSION or state.get("key") != self.key:
+            return None
+        return state
+
+    def _save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": JOURNAL_VERSION, "key": self.key, "nrows": self.nrows,
+                       "verify_columns": self.verify_columns, "blocks": self.blocks}, f)
+        os.replace(tmp, self.path)
+
+    def resumable(self):
+        """Whether ``outputvis`` holds a partial write with this key (and opens with the rows it was given)."""
+        state = self._load()
+        if state is None:
+            return False
+        try:
+            with table(self.outputvis, ack=False) as tab:
+                if tab.nrows() != state["nrows"]:
+                    return False
+        except RuntimeError:
+            return False
+        self.nrows = state["nrows"]
+        self.blocks = state["blocks"]
+        return True
+
+    def start(self, nrows):
+        """Begin an empty journal for an output of ``nrows`` rows; call once the output exists."""
+        self.nrows = nrows
+        self.blocks = []
+        self._save()
+
+    def resume_point(self, tab):
+        """Verify the committed blocks against ``tab`` (the open output), newest first.
+
+        Blocks after the newest one that matches its digest are dropped, to
+        be written again.
+
+        Returns:
+            tuple: (first input row still to write, output rows already written)
+        """
+        while self.blocks:
+            block = self.blocks[-1]
+            try:
+                if rows_digest(tab, self.verify_columns, block["out_start"], block["out_nrow"]) == block["digest"]:
+                    break
+            except RuntimeError:
+                pass
+            print(f"WARN: block at row {block['start']} of {self.outputvis} does not match its journal entry; rewriting it")
+            self.blocks.pop()
+        self._save()
+        if not self.blocks:
+            return 0, 0
+        last = self.blocks[-1]
+        return last["start"] + last["nrow"], sum(b["out_nrow"] for b in self.blocks)
+
+    def commit(self, tab, start, nrow, out_start=None, out_nrow=None):
+        """Flush ``tab`` and record input rows [start, start + nrow) as written.
+
+        They went to output rows [out_start, out_start + out_nrow), by default the same rows.
+        """
+        out_start = start if out_start is None else out_start
+        out_nrow = nrow if out_nrow is None else out_nrow
+        tab.flush()
+        self.blocks.append({"start": start, "nrow": nrow, "out_start": out_start, "out_nrow": out_nrow,
+                            "digest": rows_digest(tab, self.verify_columns, out_start, out_nrow)})
+        self._save()
+
+    def finish(self):
+        """Remove the journal once the write is complete."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Show the progress recorded in the write journals of interrupted native writes.")
+    p.add_argument("ms", nargs="+", help="Measurement sets.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    for ms in args.ms:
+        try:
+            with open(journal_path(ms)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print(f"{ms}: no write journal (never journaled, or complete)")
+            continue
+        blocks = state.get("blocks", [])
+        done = blocks[-1]["start"] + blocks[-1]["nrow"] if blocks else 0
+        print(f"{ms}: {len(blocks)} blocks committed, {sum(b['out_nrow'] for b in blocks)} of {state.get('nrows')} output rows "
+              f"(input rows up to {done})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""Storage-manager layouts for the bulk columns of pipeline MSs.
+
+A layout fixes the tile shape casacore uses for DATA, MODEL_DATA,
+CORRECTED_DATA and FLAG, matched to how the next stage reads them, and
+optionally stores the visibility columns compressed:
+
+* ``rows``: whole spectra, ~1 MiB tiles; sequential row scans (wsclean,
+  crystalball, uvsub, averaging)
+* ``time``: whole spectra, tiles of whole timesteps (all baselines);
+  per-solution-interval reads (gaincal, flagging)
+* ``channel``: 16-channel tiles over many rows; per-channel reads
+  (bandpass, diagnostics)
+* ``<nchan>x<nrow>``: an explicit tile of nchan channels by nrow rows
+
+A ``:cc16`` suffix stores the visibilities through casacore's
+CompressComplex engine (16-bit integers with a per-row scale and offset,
+readable by any casacore build); ``:dysco`` or ``:dysco<bits>`` uses
+DyscoStMan where the casacore build provides it. Both are lossy and meant
+for intermediates. Dysco columns can only be added to a table that already
+has its rows, so writers that start from an empty table take the
+uncompressed layout and the output is re-laid out afterwards
+(``split_deferred``). FLAG needs no option: casacore already stores Bool
+columns one bit per flag.
+"""
+from argparse import ArgumentParser
+import os
+import shutil
+from typing import NamedTuple
+
+import numpy as np
+from casacore.tables import makecoldesc, makescacoldesc, maketabdesc, table
+
+LAYOUT_COLUMNS = ("DATA", "CORRECTED_DATA", "MODEL_DATA", "FLAG")
+"""Main-table columns a layout re-tiles"""
+
+COMPRESSIBLE_COLUMNS = ("DATA", "CORRECTED_DATA", "MODEL_DATA")
+"""Columns a compressed layout stores lossily"""
+
+TILE_BYTES = 1 << 20
+"""Target tile size for the ``rows`` and ``channel`` layouts (complex64 cells)"""
+
+CHANNEL_TILE = 16
+"""Channels per tile for the ``channel`` layout"""
+
+DEFAULT_DYSCO_BITS = 10
+"""Bits per float for ``:dysco`` without an explicit bit count"""
+
+
+class Layout(NamedTuple):
+    """Parsed layout specification"""
+
+    access: str
+    """Access pattern: 'rows', 'time', 'channel' or 'explicit'"""
+    tile_channels: int = 0
+    """Channels per tile for 'explicit' (0 = derived from ``access``)"""
+    tile_rows: int = 0
+    """Rows per tile for 'explicit' (0 = derived from ``access``)"""
+    compression: str = "none"
+    """'none', 'cc16' or 'dysco'"""
+    bits: int = DEFAULT_DYSCO_BITS
+    """Bits per float for 'dysco'"""
+
+    @property
+    def spec(self):
+        """The layout as a string accepted by ``parse_layout``."""
+        base = f"{self.tile_channels}x{self.tile_rows}" if self.access == "explicit" else self.access
+        if self.compression == "dysco":
+            return f"{base}:dysco{self.bits}"
+        return base if self.compression == "none" else f"{base}:{self.compression}"
+
+
+def parse_layout(spec):
+    """Parse a layout string such as ``time``, ``rows:cc16`` or ``32x630:dysco8``.
+
+    Args:
+        spec (str): Layout specification; empty or 'default' keeps the input's layout
+
+    Returns:
+        Layout: Parsed layout, or None for the default
+    """
+    if spec is None or spec.strip() in ("", "default"):
+        return None
+    access, _, compression = spec.strip().partition(":")
+    bits = DEFAULT_DYSCO_BITS
+    if compression in ("", "none"):
+        compression = "none"
+    elif compression.startswith("dysco"):
+        bits = int(compression[len("dysco"):] or DEFAULT_DYSCO_BITS)
+        compression = "dysco"
+    elif compression != "cc16":
+        raise ValueError(f"Unknown compression '{compression}' in layout '{spec}' (use cc16 or dysco[bits])")
+    if access in ("rows", "time", "channel"):
+        return Layout(access, compression=compression, bits=bits)
+    try:
+        tile_channels, tile_rows = (int(v) for v in access.split("x"))
+    except ValueError:
+        raise ValueError(f"Unknown layout '{spec}': expected rows, time, channel or <nchan>x<nrow>") from None
+    if tile_channels <= 0 or tile_rows <= 0:
+        raise ValueError(f"Tile dimensions must be positive in layout '{spec}'")
+    return Layout("explicit", tile_channels, tile_rows, compression, bits)
+
+
+def split_deferred(layout):
+    """Split ``layout`` into the part a writer of an empty MS can apply and the part applied afterwards.
+
+    Args:
+        layout (Layout): Requested layout (or None)
+
+    Returns:
+        tuple: (layout for ``create_empty_like``, layout for ``relayout_ms`` or None)
+    """
+    if layout is not None and layout.compression == "dysco":
+        return layout._replace(compression="none"), layout
+    return layout, None
+
+
+def count_baselines(tab):
+    """Rows per timestep: counted at the first TIME, or nant*(nant+1)/2 for an empty table."""
+    if tab.nrows() > 0:
+        times = tab.getcol("TIME", startrow=0, nrow=min(tab.nrows(), 1 << 16))
+        return max(1, int(np.count_nonzero(times == times[0])))
+    with table(os.path.join(tab.name(), "ANTENNA"), ack=False) as ant:
+        nant = ant.nrows()
+    return max(1, nant * (nant + 1) // 2)
+
+
+def tile_shape(layout, nchan, ncorr, nbaselines):
+    """Tile shape (casacore order: ncorr, nchan, nrow) of a complex column under ``layout``.
+
+    Args:
+        layout (Layout): Parsed layout
+        nchan (int): Channels per row
+        ncorr (int): Correlations per row
+        nbaselines (int): Rows per timestep
+
+    Returns:
+        list: [ncorr, channels per tile, rows per tile]
+    """
+    if layout.access == "explicit":
+        return [ncorr, min(layout.tile_channels, nchan), layout.tile_rows]
+    if layout.access == "channel":
+        chans = min(CHANNEL_TILE, nchan)
+        return [ncorr, chans, max(1, TILE_BYTES // (8 * ncorr * chans))]
+    rows = max(1, TILE_BYTES // (8 * ncorr * nchan))
+    if layout.access == "time":
+        rows = nbaselines * max(1, rows // nbaselines)
+    return [ncorr, nchan, rows]
+
+
+def engine_storage_columns(tab):
+    """Stored columns that back virtual-engine columns (e.g. DATA_COMPRESSED of CompressComplex).
+
+    Args:
+        tab (table): Open casacore table
+
+    Returns:
+        set: Names of the backing columns
+    """
+    storage = set()
+    for dm in tab.getdminfo().values():
+        spec = dm.get("SPEC", {})
+        storage.update(spec[k] for k in ("TARGETNAME", "SCALENAME", "OFFSETNAME") if k in spec)
+    return storage
+
+
+def companion_columns(tab, columns):
+    """Stored columns backing the given virtual columns, which must be removed along with them.
+
+    Args:
+        tab (table): Open casacore table
+        columns (list): Column names
+
+    Returns:
+        list: Backing columns of any of ``columns``
+    """
+    companions = []
+    for dm in tab.getdminfo().values():
+        if set(dm["COLUMNS"]) & set(columns):
+            spec = dm.get("SPEC", {})
+            companions += [spec[k] for k in ("TARGETNAME", "SCALENAME", "OFFSETNAME") if k in spec]
+    return companions
+
+
+def _spectral_setup(msname):
+    # Imported lazily: ms_stream imports this module for create_empty_like
+    from ms_stream import get_spectral_setup
+    return get_spectral_setup(msname)
+
+
+def _fixed_desc(tab, col, shape):
+    desc = dict(tab.getcoldesc(col))
+    for key in ("dataManagerType", "dataManagerGroup", "shape", "ndim"):
+        desc.pop(key, None)
+    desc["shape"] = np.array(shape, dtype=np.int32)
+    desc["ndim"] = len(shape)
+    desc["option"] = 4
+    # engine bookkeeping (e.g. _CompressComplex_Scale) belongs to the old manager
+    desc["keywords"] = {k: v for k, v in desc.get("keywords", {}).items() if not k.startswith("_")}
+    return desc
+
+
+def apply_layout(tab, layout, columns=None):
+    """Re-create the bulk columns of a writable table with ``layout``.
+
+    The old values of the re-created columns are discarded, so call this on
+    an empty table or on columns the caller is about to rewrite in full.
+
+    Args:
+        tab (table): Writable casacore table (a measurement set main table)
+        layout (Layout): Layout to apply
+        columns (list): Limit to these columns (default: every LAYOUT_COLUMNS present)
+
+    Returns:
+        list: Columns that were re-created
+    """
+    if layout.compression == "dysco" and tab.nrows() == 0:
+        raise ValueError("DyscoStMan columns can only be added to a table with rows; see split_deferred")
+    freqs, corr_product = _spectral_setup(tab.name())
+    nchan, ncorr = len(freqs), len(corr_product)
+    tile = np.array(tile_shape(layout, nchan, ncorr, count_baselines(tab)), dtype=np.int32)
+    columns = [c for c in (columns or LAYOUT_COLUMNS) if c in LAYOUT_COLUMNS and c in tab.colnames()]
+    for col in columns:
+        desc = _fixed_desc(tab, col, [nchan, ncorr])
+        tab.removecols([col] + companion_columns(tab, [col]))
+        name = f"Layout{col}"
+        if col not in COMPRESSIBLE_COLUMNS or layout.compression == "none":
+            tab.addcols(maketabdesc([makecoldesc(col, desc)]),
+                        {"TYPE": "TiledShapeStMan", "NAME": name, "SPEC": {"DEFAULTTILESHAPE": tile}})
+        elif layout.compression == "cc16":
+            stored = dict(desc, valueType="int")
+            tab.addcols(maketabdesc([makecoldesc(f"{col}_COMPRESSED", stored)]),
+                        {"TYPE": "TiledShapeStMan", "NAME": name, "SPEC": {"DEFAULTTILESHAPE": tile}})
+            tab.addcols(maketabdesc([makescacoldesc(f"{col}_SCALE", 0.0, valuetype="float"),
+                                     makescacoldesc(f"{col}_OFFSET", 0.0, valuetype="float")]))
+            virtual = dict(desc, dataManagerType="CompressComplex", dataManagerGroup=f"CC{col}")
+            tab.addcols(maketabdesc([makecoldesc(col, virtual)]),
+                        {"TYPE": "CompressComplex", "NAME": f"CC{col}",
+                         "SPEC": {"SOURCENAME": col, "TARGETNAME": f"{col}_COMPRESSED", "SCALENAME": f"{col}_SCALE",
+                                  "OFFSETNAME": f"{col}_OFFSET", "AUTOSCALE": True}})
+        else:
+            desc["option"] = 5
+            tab.addcols(maketabdesc([makecoldesc(col, desc)]),
+                        {"TYPE": "DyscoStMan", "NAME": name,
+                         "SPEC": {"dataBitCount": layout.bits, "weightBitCount": 12,
+                                  "distribution": "TruncatedGaussian", "normalization": "AF",
+                                  "studentTNu": 0.0, "distributionTruncation": 2.5}})
+    return columns
+
+
+def describe_layout(msname):
+    """Storage manager and tile shape of each bulk column, for logs and benchmarks.
+
+    Args:
+        msname (str): Measurement set to inspect
+
+    Returns:
+        dict: column -> {"type": manager type, "tile": tile shape or None}
+    """
+    with table(msname, ack=False) as tab:
+        dminfo = tab.getdminfo()
+    found = {}
+    for dm in dminfo.values():
+        tile = dm.get("SPEC", {}).get("DEFAULTTILESHAPE")
+        for col in dm["COLUMNS"]:
+            found[col] = {"type": dm["TYPE"], "tile": None if tile is None else [int(t) for t in tile]}
+    for dm in dminfo.values():
+        target = dm.get("SPEC", {}).get("TARGETNAME")
+        if target in found:
+            for col in dm["COLUMNS"]:
+                found[col]["tile"] = found[target]["tile"]
+    return {col: found[col] for col in LAYOUT_COLUMNS if col in found}
+
+
+def relayout_ms(msname, layout, chunk_rows=None):
+    """Rewrite ``msname`` in place with ``layout``.
+
+    Used after stages whose output is written by CASA (split, mstransform,
+    concat), which always writes its own default layout. The MS is copied
+    into a sibling directory with the new layout in one streaming pass and
+    then swapped in.
+
+    Args:
+        msname (str): Measurement set to rewrite
+        layout (Layout): Layout to apply (None does nothing)
+        chunk_rows (int): Rows per streamed block (default: ms_stream.DEFAULT_CHUNK_ROWS)
+
+    Returns:
+        str: ``msname``
+    """
+    if layout is None:
+        return msname
+    from ms_stream import DEFAULT_CHUNK_ROWS, copyable_columns, create_empty_like, iter_row_chunks, prefetch_chunks
+    msname = msname.rstrip("/")
+    tmp, old = f"{msname}.relayout", f"{msname}.prelayout"
+    now, later = split_deferred(layout)
+    create_empty_like(msname, tmp, drop_columns=(), layout=now)
+    with table(msname, ack=False) as src, table(tmp, readonly=False, ack=False) as dst:
+        dst.addrows(src.nrows())
+        if later is not None:
+            apply_layout(dst, later, columns=COMPRESSIBLE_COLUMNS)
+        columns = [c for c in copyable_columns(src) if c in dst.colnames()]
+
+        def read_chunk(start, n):
+            return {col: src.getcol(col, startrow=start, nrow=n) for col in columns}
+
+        for (start, n), values in prefetch_chunks(read_chunk, iter_row_chunks(src.nrows(), chunk_rows or DEFAULT_CHUNK_ROWS)):
+            for col, v in values.items():
+                dst.putcol(col, v, startrow=start, nrow=n)
+        dst.flush()
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+    os.rename(msname, old)
+    os.rename(tmp, msname)
+    shutil.rmtree(old)
+    print(f"Rewrote {msname} with layout {layout.spec}")
+    return msname
+
+
+def main():
+    p = ArgumentParser(description="Rewrite a measurement set with a storage-manager layout, or show its layout.")
+    p.add_argument("ms", help="Measurement set")
+    p.add_argument("--layout", default="", help="Layout, e.g. rows, time, channel, 32x630, time:cc16, rows:dysco10")
+    p.add_argument("--chunk-rows", type=int, default=None, help="Rows per streamed block.")
+    args = p.parse_args()
+    relayout_ms(args.ms, parse_layout(args.layout), chunk_rows=args.chunk_rows)
+    for col, info in describe_layout(args.ms).items():
+        print(f"{col}: {info['type']} tile={info['tile']}")
+
+
+if __name__ == "__main__":
+    main()
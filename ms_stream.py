@@ -0,0 +1,164 @@
+from casacore.tables import table
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import shutil
+
+from ms_layout import apply_layout, companion_columns, engine_storage_columns
+
+DEFAULT_CHUNK_ROWS = 20000
+"""Rows per streamed chunk; ~200 MB of DATA for a 288 channel, 4 pol CRACO MS"""
+
+VIS_COLUMNS = ("DATA", "CORRECTED_DATA", "MODEL_DATA")
+"""Visibility columns that derived MSs either rewrite or drop"""
+
+WEIGHT_COLUMNS = ("WEIGHT", "SIGMA", "WEIGHT_SPECTRUM", "SIGMA_SPECTRUM")
+"""Weight columns that calibration may rescale"""
+
+
+def iter_row_chunks(nrows, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield (startrow, nrow) pairs covering a table in fixed-size blocks.
+
+    Args:
+        nrows (int): Total number of rows in the table
+        chunk_rows (int): Maximum number of rows per block
+
+    Yields:
+        tuple: (startrow, nrow) of each block
+    """
+    if chunk_rows <= 0:
+        raise ValueError(f"chunk_rows must be positive, got {chunk_rows}")
+    for start in range(0, nrows, chunk_rows):
+        yield start, min(chunk_rows, nrows - start)
+
+
+def prefetch_chunks(read_chunk, chunks):
+    """Double-buffered iteration: read block k+1 on a background thread while block k is processed.
+
+    At most two blocks are held in memory at a time.
+
+    Args:
+        read_chunk (callable): ``read_chunk(startrow, nrow)`` returning the block's data
+        chunks (iterable): (startrow, nrow) pairs, e.g. from ``iter_row_chunks``
+
+    Yields:
+        tuple: ((startrow, nrow), read_chunk(startrow, nrow))
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(read_chunk, *chunks[0])
+        for i, chunk in enumerate(chunks):
+            result = future.result()
+            if i + 1 < len(chunks):
+                future = pool.submit(read_chunk, *chunks[i + 1])
+            yield chunk, result
+
+
+def copyable_columns(tab):
+    """Return the main-table columns that hold data in every row.
+
+    Columns such as FLAG_CATEGORY are usually declared but never filled;
+    ``getcol`` raises on them, so they are left empty in derived MSs. The
+    stored columns behind a compressing engine (DATA_COMPRESSED, ...) are
+    skipped too: they are written through their virtual column.
+
+    Args:
+        tab (table): Open casacore table
+
+    Returns:
+        list: Names of columns that can be bulk-copied
+    """
+    storage = engine_storage_columns(tab)
+    if tab.nrows() == 0:
+        return [col for col in tab.colnames() if col not in storage]
+    return [col for col in tab.colnames() if col not in storage and tab.iscelldefined(col, 0)]
+
+
+def copy_subtables(msname, outputvis):
+    """Deep-copy every subtable of ``msname`` (with rows) into ``outputvis``.
+
+    ``table.copy(copynorows=True)`` empties the subtables as well as the
+    main table, so they are re-copied here.
+
+    Args:
+        msname (str): Source measurement set
+        outputvis (str): Destination measurement set (must already exist)
+    """
+    with table(msname, ack=False) as src:
+        subtables = src.getsubtables()
+    for sub in subtables:
+        name = os.path.basename(os.path.normpath(sub))
+        dest = os.path.join(outputvis, name)
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        with table(sub, ack=False) as st:
+            st.copy(dest, deep=True, valuecopy=True)
+
+
+def create_empty_like(msname, outputvis, drop_columns=("CORRECTED_DATA", "MODEL_DATA"), layout=None):
+    """Create an MS with the structure and subtables of ``msname`` but no main-table rows.
+
+    The column descriptions and storage managers of ``msname`` are kept, so
+    the output is tiled the same way as its parent unless ``layout`` is given.
+
+    Args:
+        msname (str): Template measurement set
+        outputvis (str): Path of the new measurement set; replaced if present
+        drop_columns (tuple): Main-table columns to remove from the output
+        layout (ms_layout.Layout): Re-tile (and optionally compress) the bulk columns
+
+    Returns:
+        str: ``outputvis``
+    """
+    if os.path.isdir(outputvis):
+        print(f"found existing copy of {outputvis}. removing prior to write")
+        shutil.rmtree(outputvis)
+    with table(msname, ack=False) as src:
+        src.copy(outputvis, deep=True, valuecopy=True, copynorows=True)
+    copy_subtables(msname, outputvis)
+    with table(outputvis, readonly=False, ack=False) as out:
+        drop = [c for c in drop_columns if c in out.colnames()]
+        if drop:
+            out.removecols(drop + companion_columns(out, drop))
+        if layout is not None:
+            apply_layout(out, layout)
+    return outputvis
+
+
+def copy_rows(src, dst, columns, start, nrow, dst_start=None):
+    """Bulk-copy a block of rows for the given columns.
+
+    Args:
+        src (table): Source table
+        dst (table): Destination table (writable, rows already allocated)
+        columns (list): Column names to copy
+        start (int): First source row
+        nrow (int): Number of rows
+        dst_start (int): First destination row (defaults to ``start``)
+    """
+    dst_start = start if dst_start is None else dst_start
+    for col in columns:
+        dst.putcol(col, src.getcol(col, startrow=start, nrow=nrow), startrow=dst_start, nrow=nrow)
+
+
+def get_spectral_setup(msname):
+    """Return channel frequencies and correlation products of a single-SPW MS.
+
+    Args:
+        msname (str): Measurement set to inspect
+
+    Returns:
+        tuple: (chan_freqs (nchan,) in Hz, corr_product (ncorr, 2) receptor indices)
+    """
+    with table(os.path.join(msname, "DATA_DESCRIPTION"), ack=False) as dd:
+        if dd.nrows() != 1:
+            raise ValueError(f"{msname} has {dd.nrows()} data descriptions; only single-SPW MSs are supported")
+        spw_id = int(dd.getcell("SPECTRAL_WINDOW_ID", 0))
+        pol_id = int(dd.getcell("POLARIZATION_ID", 0))
+    with table(os.path.join(msname, "SPECTRAL_WINDOW"), ack=False) as spw:
+        freqs = np.asarray(spw.getcell("CHAN_FREQ", spw_id), dtype=np.float64)
+    with table(os.path.join(msname, "POLARIZATION"), ack=False) as pol:
+        corr_product = np.asarray(pol.getcell("CORR_PRODUCT", pol_id), dtype=int)
+    return freqs, corr_product
@@ -1,4 +1,4 @@
-from casacore.tables import table, taql
+from ms_index import ms_index
 import numpy as np
 from astropy.time import Time
 import astropy.units as u
@@ -20,7 +20,8 @@ def get_unique_times_from_ms(ms):
     """Return the unique observation times from an ASKAP Measurement
     set along with the number of integrations and time sampling.
 
-    Useful for making cubes
+    Useful for making cubes. Read from the cached metadata index
+    (see ms_index.py), which is built on first use.
 
     Args:
         ms (Union[MS, Path]): Measurement set to inspect
@@ -29,17 +30,18 @@ def get_unique_times_from_ms(ms):
         Time: The observation times
     """
     
-    with table(ms, ack=False) as tab:
-        times = Time(np.unique(tab.getcol("TIME")) * u.s, format="mjd")
+    index = ms_index(str(ms))
+    times = Time(index.times * u.s, format="mjd")
 
     nsub = len(times)
-    tsamp = np.median(np.diff(times)).sec.item()
+    tsamp = index.tsamp
     return UniqueTimes(tsamp, nsub, times)
 
 def get_fast_imaging_intervals(ms, timestep=None, verbose=False):
     """
     Get number of time-intervals from a measurement set for a given imaging timestep
-    Convenience function for wsclean -intervals-out
+    Convenience function for wsclean -intervals-out; snapshot_plan.py plans the same intervals with
+    their row ranges and flagging, and images them in parallel
     Args:
         ms (MS): The subject measurement set to rename
         timestep: float (in seconds) for doing short-imaging over
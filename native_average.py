@@ -0,0 +1,328 @@
+from casacore.tables import table, makecoldesc, maketabdesc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+
+from ms_index import table_fingerprint
+from ms_journal import WriteJournal, digest
+from ms_layout import apply_layout, companion_columns
+from ms_stream import DEFAULT_CHUNK_ROWS, VIS_COLUMNS, copyable_columns, create_empty_like, prefetch_chunks
+from native_gaincal import parse_solint
+
+KEY_COLUMNS = ("SCAN_NUMBER", "FIELD_ID", "DATA_DESC_ID", "ANTENNA1", "ANTENNA2")
+"""Rows are only averaged together if all of these match (mstransform's default timespan)"""
+
+SPECTRAL_COLUMNS = ("FLAG", "WEIGHT_SPECTRUM", "SIGMA_SPECTRUM") + VIS_COLUMNS
+"""Main-table columns with a channel axis"""
+
+DERIVED_COLUMNS = ("TIME", "TIME_CENTROID", "INTERVAL", "EXPOSURE", "UVW", "FLAG_ROW",
+                   "WEIGHT", "SIGMA", "WEIGHT_SPECTRUM", "SIGMA_SPECTRUM", "FLAG") + VIS_COLUMNS
+"""Columns computed by the averager; all others are taken from the first row of each bin"""
+
+
+def assign_time_bins(times, intervals, scans, timebin):
+    """Number the averaging bins of every row.
+
+    As in mstransform, bins never span scans. Each scan's first bin starts at
+    the leading edge of its first integration (TIME - INTERVAL/2) and an
+    integration belongs to the bin its centre falls in.
+
+    Returns:
+        np.ndarray: Bin number of each row, increasing with time across scans
+    """
+    bins = np.zeros(len(times), dtype=np.int64)
+    offset = 0
+    for scan in np.unique(scans):
+        sel = scans == scan
+        edge = np.min(times[sel] - intervals[sel] / 2)
+        if np.isinf(timebin):
+            local = np.zeros(sel.sum(), dtype=np.int64)
+        else:
+            local = np.floor((times[sel] - edge) / timebin + 1e-9).astype(np.int64)
+        bins[sel] = local + offset
+        offset += local.max() + 1
+    return bins
+
+
+def plan_output_rows(tab, timebin):
+    """Map every input row to its output row.
+
+    Output rows are ordered by their first input row, so a time-ordered input
+    gives a time-ordered output with the input's baseline order.
+
+    Args:
+        tab (table): Open input main table
+        timebin (float): Averaging interval in seconds
+
+    Returns:
+        tuple: (out_row per input row, number of output rows, time bin per input row)
+    """
+    times = tab.getcol("TIME")
+    intervals = tab.getcol("INTERVAL")
+    keys = [tab.getcol(c).astype(np.int64) for c in KEY_COLUMNS]
+    bins = assign_time_bins(times, intervals, keys[0], timebin)
+    if np.any(np.diff(bins) < 0):
+        raise ValueError("Input MS is not time-ordered; sort it (or use mstransform) before native averaging")
+    _, first, inverse = np.unique(np.stack([bins] + keys, axis=1), axis=0, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+    return rank[inverse.ravel()], len(first), bins
+
+
+def bin_aligned_chunks(bins, chunk_rows):
+    """Split rows into contiguous (startrow, nrow) blocks of about ``chunk_rows`` that never split a time bin."""
+    edges = np.flatnonzero(np.diff(bins)) + 1
+    edges = np.concatenate([[0], edges, [len(bins)]])
+    chunks = []
+    start = 0
+    for edge in edges[1:]:
+        if edge - start >= chunk_rows or edge == len(bins):
+            chunks.append((start, int(edge - start)))
+            start = int(edge)
+    return chunks
+
+
+def channel_sum(values, chanbin):
+    """Sum groups of ``chanbin`` adjacent channels (axis 1); a short last group is kept."""
+    if chanbin <= 1:
+        return values
+    return np.add.reduceat(values, np.arange(0, values.shape[1], chanbin), axis=1)
+
+
+def average_group(block, order, starts, chanbin, vis_columns):
+    """Average one set of output rows.
+
+    Args:
+        block (dict): Input columns of the chunk
+        order (np.ndarray): Chunk-local input rows sorted by output row
+        starts (np.ndarray): Offsets into ``order`` where each output row begins
+        chanbin (int): Channels averaged together
+        vis_columns (list): Visibility columns present in ``block``
+
+    Returns:
+        dict: Output columns, one entry per output row
+    """
+    def rsum(values):
+        return np.add.reduceat(values[order], starts, axis=0)
+
+    flag = block["FLAG"]
+    if "WEIGHT_SPECTRUM" in block:
+        weight = block["WEIGHT_SPECTRUM"].astype(np.float64)
+    else:
+        weight = np.broadcast_to(block["WEIGHT"][:, None, :], flag.shape).astype(np.float64)
+    good = ~flag
+    w_good = weight * good
+    sum_w = channel_sum(rsum(w_good), chanbin)
+    sum_w_all = channel_sum(rsum(weight), chanbin)
+    n_good = channel_sum(rsum(good.astype(np.int32)), chanbin)
+    n_all = channel_sum(rsum(np.ones(flag.shape, dtype=np.int32)), chanbin)
+
+    out = {"FLAG": n_good == 0}
+    for col in vis_columns:
+        data = block[col]
+        mean_good = channel_sum(rsum(data * w_good), chanbin)
+        mean_all = channel_sum(rsum(data * weight), chanbin)
+        mean_plain = channel_sum(rsum(data), chanbin) / n_all
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # unflagged samples by weight; fully flagged cells keep the (flagged) mean of everything
+            mean = np.where(sum_w > 0, mean_good / sum_w,
+                            np.where(sum_w_all > 0, mean_all / sum_w_all, mean_plain))
+        out[col] = mean.astype(data.dtype)
+
+    if "WEIGHT_SPECTRUM" in block:
+        out["WEIGHT_SPECTRUM"] = np.where(n_good > 0, sum_w, 0.0).astype(block["WEIGHT_SPECTRUM"].dtype)
+        if "SIGMA_SPECTRUM" in block:
+            with np.errstate(divide="ignore"):
+                out["SIGMA_SPECTRUM"] = np.where(sum_w > 0, 1.0 / np.sqrt(sum_w), 0.0).astype(block["SIGMA_SPECTRUM"].dtype)
+
+    # Row-level quantities: a row/correlation contributes if any of its channels is unflagged
+    row_good = good.any(axis=1)
+    weight_row = block["WEIGHT"].astype(np.float64)
+    out["WEIGHT"] = rsum(weight_row * row_good).astype(block["WEIGHT"].dtype)
+    if "SIGMA" in block:
+        with np.errstate(divide="ignore"):
+            out["SIGMA"] = np.where(out["WEIGHT"] > 0, 1.0 / np.sqrt(out["WEIGHT"]), 0.0).astype(block["SIGMA"].dtype)
+    out["FLAG_ROW"] = out["FLAG"].all(axis=(1, 2))
+
+    row_w = (weight_row * row_good).mean(axis=1)
+    count = rsum(np.ones(len(row_w)))
+    sum_row_w = rsum(row_w)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["UVW"] = np.where(sum_row_w[:, None] > 0, rsum(block["UVW"] * row_w[:, None]) / sum_row_w[:, None],
+                              rsum(block["UVW"]) / count[:, None])
+        any_good = row_good.any(axis=1)
+        n_row_good = rsum(any_good.astype(np.float64))
+        out["TIME_CENTROID"] = np.where(n_row_good > 0, rsum(block["TIME_CENTROID"] * any_good) / n_row_good,
+                                        rsum(block["TIME_CENTROID"]) / count)
+    out["EXPOSURE"] = np.where(n_row_good > 0, rsum(block["EXPOSURE"] * any_good), rsum(block["EXPOSURE"]))
+
+    # TIME is the centre of the span covered by the bin's integrations, INTERVAL its length
+    lo = np.minimum.reduceat((block["TIME"] - block["INTERVAL"] / 2)[order], starts)
+    hi = np.maximum.reduceat((block["TIME"] + block["INTERVAL"] / 2)[order], starts)
+    out["TIME"] = 0.5 * (lo + hi)
+    out["INTERVAL"] = hi - lo
+
+    first = order[starts]
+    for col, values in block.items():
+        if col not in out and col not in DERIVED_COLUMNS:
+            out[col] = values[first]
+    return out
+
+
+def average_chunk(block, out_rows, groups, chanbin, vis_columns, pool=None):
+    """Average a bin-aligned chunk, one baseline group per thread.
+
+    Args:
+        block (dict): Input columns of the chunk
+        out_rows (np.ndarray): Output row of every input row in the chunk
+        groups (np.ndarray): Baseline group of every input row in the chunk
+        chanbin (int): Channels averaged together
+        vis_columns (list): Visibility columns to average
+        pool (ThreadPoolExecutor): Optional pool for the baseline groups
+
+    Returns:
+        tuple: (first output row, dict of output columns for a contiguous range of rows)
+    """
+    out0 = int(out_rows.min())
+    nout = int(out_rows.max()) - out0 + 1
+
+    def run(g):
+        rows = np.flatnonzero(groups == g)
+        order = rows[np.argsort(out_rows[rows], kind="stable")]
+        sorted_out = out_rows[order]
+        starts = np.flatnonzero(np.r_[True, sorted_out[1:] != sorted_out[:-1]])
+        return sorted_out[starts] - out0, average_group(block, order, starts, chanbin, vis_columns)
+
+    ids = np.unique(groups)
+    results = list(pool.map(run, ids)) if pool is not None and len(ids) > 1 else [run(g) for g in ids]
+    merged = {}
+    for local, out in results:
+        for col, values in out.items():
+            if col not in merged:
+                merged[col] = np.empty((nout,) + values.shape[1:], dtype=values.dtype)
+            merged[col][local] = values
+    return out0, merged
+
+
+def _rechannelise_columns(tab, nchan_out, skip=()):
+    """Recreate the spectral columns of an empty table with ``nchan_out`` channels."""
+    for col in SPECTRAL_COLUMNS:
+        if col not in tab.colnames() or col in skip:
+            continue
+        if companion_columns(tab, [col]):
+            raise ValueError(f"{col} is stored compressed; pass a layout to channel-average it")
+        desc = tab.getcoldesc(col)
+        dminfo = tab.getdminfo(col)
+        if "shape" in desc:
+            desc["shape"] = np.array([nchan_out] + list(desc["shape"][1:]))
+        spec = dict(dminfo.get("SPEC", {}))
+        spec.pop("HYPERCUBES", None)
+        if "DEFAULTTILESHAPE" in spec:
+            tile = np.array(spec["DEFAULTTILESHAPE"])
+            tile[1] = min(tile[1], nchan_out)
+            spec["DEFAULTTILESHAPE"] = tile
+        dminfo["SPEC"] = spec
+        tab.removecols(col)
+        if dminfo["NAME"] in {dm["NAME"] for dm in tab.getdminfo().values()}:
+            # the column shared a manager with others; give it one of its own
+            dminfo["NAME"] = f"{col}_avg"
+        tab.addcols(maketabdesc(makecoldesc(col, desc)), dminfo)
+
+
+def _average_spectral_window(outputvis, chanbin):
+    """Update SPECTRAL_WINDOW for ``chanbin``-channel averaging; returns the new channel count."""
+    with table(os.path.join(outputvis, "SPECTRAL_WINDOW"), readonly=False, ack=False) as spw:
+        nchan_out = None
+        for row in range(spw.nrows()):
+            freqs = spw.getcell("CHAN_FREQ", row)
+            starts = np.arange(0, len(freqs), chanbin)
+            counts = np.diff(np.r_[starts, len(freqs)])
+            spw.putcell("CHAN_FREQ", row, np.add.reduceat(freqs, starts) / counts)
+            for col in ("CHAN_WIDTH", "EFFECTIVE_BW", "RESOLUTION"):
+                if col in spw.colnames():
+                    spw.putcell(col, row, np.add.reduceat(spw.getcell(col, row), starts))
+            spw.putcell("NUM_CHAN", row, len(starts))
+            nchan_out = len(starts)
+    return nchan_out
+
+
+def average_ms(msname, outputvis, timebin="9.90s", chanbin=1, workers=1, chunk_rows=DEFAULT_CHUNK_ROWS, layout=None,
+               resume=False):
+    """Time (and optionally channel) average an MS into a new MS in one streaming pass.
+
+    Mirrors ``mstransform(timeaverage=True, datacolumn='all')``:
+    visibilities are weighted means of the unflagged samples, WEIGHT and
+    WEIGHT_SPECTRUM are summed, SIGMA is 1/sqrt(WEIGHT), UVW is
+    weight-averaged, TIME/INTERVAL span the contributing integrations and
+    EXPOSURE sums the unflagged ones. A cell is flagged only if all its
+    inputs are.
+
+    Args:
+        msname (str): Time-ordered input measurement set
+        outputvis (str): Output measurement set; replaced if present
+        timebin (str): Averaging interval, e.g. '9.90s' ('inf' averages whole scans)
+        chanbin (int): Channels averaged together
+        workers (int): Threads averaging baseline groups in parallel
+        chunk_rows (int): Approximate input rows per streamed block
+        layout (ms_layout.Layout): Storage layout of the output (default: the input's)
+        resume (bool): Commit every block to a write journal, and carry on from
+            it if ``outputvis`` is a partial output of the same write (see ms_journal.py)
+
+    Returns:
+        int: Number of output rows
+    """
+    timebin_s = parse_solint(timebin)
+    with table(msname, ack=False) as src:
+        out_row, nout, bins = plan_output_rows(src, timebin_s)
+        columns = copyable_columns(src)
+        vis_columns = [c for c in VIS_COLUMNS if c in columns]
+        a1, a2 = src.getcol("ANTENNA1"), src.getcol("ANTENNA2")
+    _, baseline = np.unique(np.stack([a1, a2], axis=1), axis=0, return_inverse=True)
+    baseline = baseline.ravel()
+    groups = baseline * max(workers, 1) // (baseline.max() + 1)
+
+    journal = None
+    if resume:
+        key = digest("average", table_fingerprint(msname), timebin_s, chanbin, chunk_rows, str(layout))
+        journal = WriteJournal(outputvis, key, ["TIME", "DATA"])
+    resumed = journal is not None and journal.resumable()
+    if resumed:
+        print(f"resuming the write of {outputvis} from its journal")
+    else:
+        create_empty_like(msname, outputvis, drop_columns=())
+        if chanbin > 1:
+            nchan_out = _average_spectral_window(outputvis, chanbin)
+    with table(msname, ack=False) as src, table(outputvis, readonly=False, ack=False) as dst:
+        first, written = journal.resume_point(dst) if resumed else (0, 0)
+        if not resumed:
+            relaid = apply_layout(dst, layout) if layout is not None else []
+            if chanbin > 1:
+                _rechannelise_columns(dst, nchan_out, skip=relaid)
+            dst.addrows(nout)
+            if journal is not None:
+                journal.start(nout)
+
+        def read_chunk(start, n):
+            return {c: src.getcol(c, startrow=start, nrow=n) for c in columns}
+
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        chunks = [(start, n) for start, n in bin_aligned_chunks(bins, chunk_rows) if start >= first]
+        try:
+            for (start, n), block in prefetch_chunks(read_chunk, chunks):
+                out0, averaged = average_chunk(block, out_row[start:start + n], groups[start:start + n],
+                                               chanbin, vis_columns, pool=pool)
+                nrow = len(averaged["TIME"])
+                for col, values in averaged.items():
+                    dst.putcol(col, values, startrow=out0, nrow=nrow)
+                if journal is not None:
+                    journal.commit(dst, start, n, out_start=out0, out_nrow=nrow)
+                written += nrow
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        dst.flush()
+        if written != nout or dst.nrows() != nout:
+            raise RuntimeError(f"Row count mismatch writing {outputvis}: wrote {written} of {nout}, table has {dst.nrows()}")
+    if journal is not None:
+        journal.finish()
+    return written
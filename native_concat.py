@@ -0,0 +1,209 @@
+"""Native concatenation of per-scan measurement sets.
+
+The per-scan avg MSs of a beam are each time-ordered, cover disjoint time
+ranges and carry identical subtables, so CASA ``concat(timesort=True)``
+spends most of its time re-sorting and re-checking what is already known.
+``concat_ms`` instead compares the small subtables directly, preallocates
+the output, merges the inputs by TIME and bulk-copies contiguous runs of
+rows. ``virtual_concat`` writes a casacore concatenated table that only
+references the inputs, for consumers that just read through casacore
+(its subtables are keywords into the first input, not directories of
+its own, so it is no input for the pipeline stages after concat).
+"""
+import os
+import shutil
+
+import numpy as np
+from casacore.tables import table
+
+from ms_stream import DEFAULT_CHUNK_ROWS, copyable_columns, create_empty_like, iter_row_chunks, prefetch_chunks
+
+CHECK_SUBTABLES = ("ANTENNA", "FEED", "SPECTRAL_WINDOW", "POLARIZATION", "DATA_DESCRIPTION", "FIELD")
+"""Subtables that must be identical for rows to be concatenated without re-indexing"""
+
+SKIP_SUBTABLE_COLUMNS = ("TIME",)
+"""Subtable columns that record when a row was written, so may differ between scans"""
+
+
+def _column_values(tab, col):
+    try:
+        return tab.getcol(col)
+    except RuntimeError:
+        # variable-shaped or partly undefined column
+        return tab.getvarcol(col)
+
+
+def _values_equal(a, b):
+    if isinstance(a, dict) or isinstance(b, dict):
+        return isinstance(a, dict) and isinstance(b, dict) and a.keys() == b.keys() and all(
+            _values_equal(a[k], b[k]) for k in a)
+    a, b = np.asarray(a), np.asarray(b)
+    return a.shape == b.shape and bool(np.all(a == b))
+
+
+def subtable_mismatches(msnames, subtables=CHECK_SUBTABLES):
+    """Compare the given subtables of every MS with those of the first one.
+
+    Returns:
+        list: "<ms>: <SUBTABLE>/<COLUMN>" for every difference (empty if all match)
+    """
+    mismatches = []
+    for sub in subtables:
+        with table(os.path.join(msnames[0], sub), ack=False) as ref:
+            ref_nrows = ref.nrows()
+            reference = {c: _column_values(ref, c) for c in ref.colnames() if c not in SKIP_SUBTABLE_COLUMNS}
+        for msname in msnames[1:]:
+            with table(os.path.join(msname, sub), ack=False) as tab:
+                if tab.nrows() != ref_nrows:
+                    mismatches.append(f"{msname}: {sub}/nrows")
+                    continue
+                for col, values in reference.items():
+                    if col not in tab.colnames() or not _values_equal(values, _column_values(tab, col)):
+                        mismatches.append(f"{msname}: {sub}/{col}")
+    return mismatches
+
+
+def merge_runs(times):
+    """Plan a k-way merge of time-ordered inputs as contiguous copy runs.
+
+    The merge is a stable sort on TIME, so rows with equal times keep the
+    input order. Disjoint, time-ordered inputs give one run per input.
+
+    Args:
+        times (list): TIME column of each input
+
+    Returns:
+        list: (input index, first input row, nrow, first output row) per run
+    """
+    src = np.concatenate([np.full(len(t), k) for k, t in enumerate(times)])
+    rows = np.concatenate([np.arange(len(t)) for t in times])
+    order = np.argsort(np.concatenate(times), kind="stable")
+    src, rows = src[order], rows[order]
+    breaks = np.flatnonzero((np.diff(src) != 0) | (np.diff(rows) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(order)]])
+    return [(int(src[s]), int(rows[s]), int(e - s), int(s)) for s, e in zip(starts, ends)]
+
+
+def scan_offsets(scans):
+    """Offsets that keep the scan numbers of each input distinct from those of earlier inputs.
+
+    Args:
+        scans (list): SCAN_NUMBER column of each input
+
+    Returns:
+        list: Offset to add to each input's scan numbers
+    """
+    offsets, highest = [], None
+    for s in scans:
+        if len(s) == 0:
+            offsets.append(0)
+            continue
+        offset = 0 if highest is None or s.min() > highest else highest - s.min() + 1
+        offsets.append(int(offset))
+        highest = s.max() + offset if highest is None else max(highest, s.max() + offset)
+    return offsets
+
+
+def concat_ms(msnames, outputvis, chunk_rows=DEFAULT_CHUNK_ROWS, check_subtables=True, layout=None):
+    """Concatenate measurement sets that share their subtables into one time-sorted MS.
+
+    The output takes its subtables from the first input, with the
+    OBSERVATION time range widened to cover every input and POINTING rows
+    appended. Scan numbers that collide with an earlier input are shifted.
+
+    Args:
+        msnames (list): Input measurement sets
+        outputvis (str): Output measurement set; replaced if present
+        chunk_rows (int): Maximum rows per bulk copy
+        check_subtables (bool): Refuse inputs whose CHECK_SUBTABLES differ
+        layout (ms_layout.Layout): Storage layout of the output (default: the first input's)
+
+    Returns:
+        int: Number of rows written
+    """
+    if check_subtables:
+        mismatches = subtable_mismatches(msnames)
+        if mismatches:
+            raise ValueError("Inputs do not share subtables (use CASA concat instead):\n  " + "\n  ".join(mismatches))
+
+    inputs = [table(m, ack=False) for m in msnames]
+    try:
+        columns = copyable_columns(inputs[0])
+        for msname, tab in zip(msnames[1:], inputs[1:]):
+            missing = set(columns) - set(copyable_columns(tab))
+            if missing:
+                raise ValueError(f"{msname} lacks columns {sorted(missing)} present in {msnames[0]}")
+        times = [tab.getcol("TIME") for tab in inputs]
+        offsets = scan_offsets([tab.getcol("SCAN_NUMBER") for tab in inputs])
+        runs = merge_runs(times)
+        nrows = sum(len(t) for t in times)
+        print(f"Concatenating {len(msnames)} MS ({nrows} rows in {len(runs)} runs) -> {outputvis}")
+
+        create_empty_like(msnames[0], outputvis, drop_columns=(), layout=layout)
+        chunks = [(k, start + s, n, dst + s) for k, start, length, dst in runs
+                  for s, n in iter_row_chunks(length, chunk_rows)]
+
+        def read_chunk(k, start, n, dst):
+            block = {c: inputs[k].getcol(c, startrow=start, nrow=n) for c in columns}
+            block["SCAN_NUMBER"] = block["SCAN_NUMBER"] + offsets[k]
+            return block
+
+        with table(outputvis, readonly=False, ack=False) as out:
+            out.addrows(nrows)
+            written = 0
+            for (k, start, n, dst), block in prefetch_chunks(read_chunk, chunks):
+                for col, values in block.items():
+                    out.putcol(col, values, startrow=dst, nrow=n)
+                written += n
+            out.flush()
+            if written != nrows or out.nrows() != nrows:
+                raise RuntimeError(f"Row count mismatch writing {outputvis}: wrote {written} of {nrows}, table has {out.nrows()}")
+    finally:
+        for tab in inputs:
+            tab.close()
+
+    _merge_observation_and_pointing(msnames, outputvis, times)
+    return nrows
+
+
+def _merge_observation_and_pointing(msnames, outputvis, times):
+    with table(os.path.join(outputvis, "OBSERVATION"), readonly=False, ack=False) as ob:
+        if ob.nrows():
+            t = np.concatenate(times)
+            if len(t):
+                time_range = ob.getcell("TIME_RANGE", 0)
+                ob.putcell("TIME_RANGE", 0, np.array([min(time_range[0], t.min()), max(time_range[1], t.max())]))
+    with table(os.path.join(outputvis, "POINTING"), readonly=False, ack=False) as pt:
+        for msname in msnames[1:]:
+            with table(os.path.join(msname, "POINTING"), ack=False) as src:
+                if src.nrows() == 0:
+                    continue
+                start = pt.nrows()
+                pt.addrows(src.nrows())
+                for col in copyable_columns(src):
+                    pt.putcol(col, src.getcol(col), startrow=start, nrow=src.nrows())
+
+
+def virtual_concat(msnames, outputvis):
+    """Write ``outputvis`` as a casacore concatenated table referencing ``msnames``.
+
+    Nothing is copied: the output lists the inputs (which must stay in
+    place) and uses the subtables of the first one. Rows are in input
+    order, so pass the inputs sorted by time. Scan numbers are not
+    renumbered. Use only for consumers that read.
+
+    Returns:
+        int: Number of rows in the concatenation
+    """
+    if os.path.isdir(outputvis):
+        print(f"found existing copy of {outputvis}. removing prior to write")
+        shutil.rmtree(outputvis)
+    mismatches = subtable_mismatches(msnames)
+    if mismatches:
+        raise ValueError("Inputs do not share subtables; a virtual concat would mislabel rows:\n  " + "\n  ".join(mismatches))
+    tab = table([os.path.abspath(m) for m in msnames], ack=False)
+    nrows = tab.nrows()
+    tab.rename(outputvis)
+    tab.close()
+    return nrows
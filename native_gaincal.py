@@ -0,0 +1,294 @@
+from casacore.tables import table
+import numpy as np
+import os
+import re
+from typing import NamedTuple
+
+from caltable_tools import write_caltable
+from ms_stream import DEFAULT_CHUNK_ROWS, get_spectral_setup, iter_row_chunks
+
+
+class SolutionIntervals(NamedTuple):
+    """Structure to hold the mapping of visibility rows onto solution intervals"""
+
+    row_sol: np.ndarray
+    """Solution index of every row, shape (nrow,)"""
+    times: np.ndarray
+    """Mean time of each solution interval in seconds, shape (nsol,)"""
+    intervals: np.ndarray
+    """Length of each solution interval in seconds, shape (nsol,)"""
+    scans: np.ndarray
+    """First scan number of each solution interval, shape (nsol,)"""
+
+
+class VisibilitySums(NamedTuple):
+    """Weighted per-baseline sums over every sample in a solution cell"""
+
+    vm: np.ndarray
+    """sum(w V conj(M)), Hermitian, shape (nsol, npol, nant, nant)"""
+    mm: np.ndarray
+    """sum(w |M|^2), symmetric, shape (nsol, npol, nant, nant)"""
+    vv: np.ndarray
+    """sum(w |V|^2), symmetric, shape (nsol, npol, nant, nant)"""
+    count: np.ndarray
+    """Number of unflagged samples per (nsol, npol)"""
+
+
+def parse_solint(solint):
+    """Convert a CASA solint string ('inf', 'int', '300s', '2min', '1h') to seconds.
+
+    Returns:
+        float: np.inf for 'inf', 0.0 for 'int' (one solution per timestamp)
+    """
+    solint = str(solint).strip().lower()
+    if solint in ("inf", ""):
+        return np.inf
+    if solint == "int":
+        return 0.0
+    match = re.fullmatch(r"([0-9.]+)\s*(s|min|h)?", solint)
+    if not match:
+        raise ValueError(f"Cannot parse solint '{solint}'")
+    scale = {"s": 1.0, None: 1.0, "min": 60.0, "h": 3600.0}[match.group(2)]
+    return float(match.group(1)) * scale
+
+
+def assign_solution_intervals(times, scans, solint, combine_scan=False):
+    """Group rows into solution intervals the way gaincal does.
+
+    Intervals start at the first timestamp of each scan (or of the whole MS
+    with combine='scan') and a new one begins once ``solint`` has elapsed.
+
+    Args:
+        times (np.ndarray): TIME of every row
+        scans (np.ndarray): SCAN_NUMBER of every row
+        solint (str): CASA solution interval
+        combine_scan (bool): Let intervals span scan boundaries
+
+    Returns:
+        SolutionIntervals: Row mapping and per-interval metadata
+    """
+    solint_s = parse_solint(solint)
+    keys = np.zeros_like(scans) if combine_scan else scans
+    pairs = np.rec.fromarrays([keys, times], names="key,time")
+    upairs, inv = np.unique(pairs, return_inverse=True)
+
+    pair_sol = np.empty(len(upairs), dtype=int)
+    sol, key0, t0 = -1, None, None
+    for k, (key, t) in enumerate(zip(upairs["key"], upairs["time"])):
+        if key != key0 or solint_s == 0.0 or t - t0 >= solint_s - 1e-3:
+            sol += 1
+            key0, t0 = key, t
+        pair_sol[k] = sol
+    row_sol = pair_sol[inv.ravel()]
+
+    nsol = sol + 1
+    counts = np.bincount(pair_sol, minlength=nsol)
+    sol_times = np.bincount(pair_sol, weights=upairs["time"], minlength=nsol) / counts
+    tmin = np.full(nsol, np.inf)
+    tmax = np.full(nsol, -np.inf)
+    np.minimum.at(tmin, pair_sol, upairs["time"])
+    np.maximum.at(tmax, pair_sol, upairs["time"])
+    dt = np.median(np.diff(np.unique(times))) if len(np.unique(times)) > 1 else 0.0
+    sol_scans = np.zeros(nsol, dtype=int)
+    first_row = np.unique(row_sol, return_index=True)[1]
+    sol_scans[:] = scans[first_row]
+    return SolutionIntervals(row_sol, sol_times, tmax - tmin + dt, sol_scans)
+
+
+def accumulate_sums(msname, intervals, nant, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Pre-average DATA against MODEL_DATA into (solution interval x baseline) cells.
+
+    Only parallel-hand correlations are used; channels are summed because
+    G solutions have one channel per SPW. The MS is read once, in blocks.
+
+    Returns:
+        VisibilitySums: Per-cell sums needed by the solver and the SNR estimate
+    """
+    _, corr_product = get_spectral_setup(msname)
+    parallel = np.flatnonzero(corr_product[:, 0] == corr_product[:, 1])
+    pol_of_corr = corr_product[parallel, 0]
+    npol = 2
+    nsol = len(intervals.times)
+    ncell = nsol * npol * nant * nant
+    vm = np.zeros(ncell, dtype=np.complex128)
+    mm = np.zeros(ncell)
+    vv = np.zeros(ncell)
+    count = np.zeros(nsol * npol)
+
+    with table(msname, ack=False) as tab:
+        has_spectrum = "WEIGHT_SPECTRUM" in tab.colnames() and tab.iscelldefined("WEIGHT_SPECTRUM", 0)
+        for start, n in iter_row_chunks(tab.nrows(), chunk_rows):
+            a1 = tab.getcol("ANTENNA1", startrow=start, nrow=n)
+            a2 = tab.getcol("ANTENNA2", startrow=start, nrow=n)
+            cross = a1 != a2
+            data = tab.getcol("DATA", startrow=start, nrow=n)[cross][..., parallel]
+            model = tab.getcol("MODEL_DATA", startrow=start, nrow=n)[cross][..., parallel]
+            flag = tab.getcol("FLAG", startrow=start, nrow=n)[cross][..., parallel]
+            if has_spectrum:
+                w = tab.getcol("WEIGHT_SPECTRUM", startrow=start, nrow=n)[cross][..., parallel]
+            else:
+                w = tab.getcol("WEIGHT", startrow=start, nrow=n)[cross][:, None, parallel]
+            w = np.where(flag, 0.0, w)
+            a1, a2 = a1[cross], a2[cross]
+            sol = intervals.row_sol[start:start + n][cross]
+
+            s_vm = (w * data * np.conj(model)).sum(axis=1)
+            s_mm = (w * np.abs(model) ** 2).sum(axis=1)
+            s_vv = (w * np.abs(data) ** 2).sum(axis=1)
+            s_n = (~flag).sum(axis=1)
+            for k, pol in enumerate(pol_of_corr):
+                base = (sol * npol + pol) * nant
+                ij = (base + a1) * nant + a2
+                ji = (base + a2) * nant + a1
+                for idx, sign in ((ij, 1), (ji, -1)):
+                    vm.real += np.bincount(idx, weights=s_vm[:, k].real, minlength=ncell)
+                    vm.imag += sign * np.bincount(idx, weights=s_vm[:, k].imag, minlength=ncell)
+                    mm += np.bincount(idx, weights=s_mm[:, k], minlength=ncell)
+                    vv += np.bincount(idx, weights=s_vv[:, k], minlength=ncell)
+                count += np.bincount(sol * npol + pol, weights=s_n[:, k], minlength=nsol * npol)
+
+    shape = (nsol, npol, nant, nant)
+    return VisibilitySums(vm.reshape(shape), mm.reshape(shape), vv.reshape(shape), count.reshape(nsol, npol))
+
+
+def stefcal(sums, calmode="ap", maxiter=100, tol=1e-6):
+    """Solve g_i conj(g_j) for every solution interval and polarisation at once.
+
+    Batched StEFCal: g_i <- sum_j R_ij g_j / sum_j Q_ij |g_j|^2, with the
+    update averaged with the previous iterate on every second step.
+
+    Args:
+        sums (VisibilitySums): Output of ``accumulate_sums``
+        calmode (str): 'p' (unit-amplitude gains) or 'ap'
+        maxiter (int): Maximum number of iterations
+        tol (float): Convergence threshold on the relative gain change
+
+    Returns:
+        tuple: (gains, valid), gains (nsol, npol, nant) and a mask of antennas with data
+    """
+    vm, mm = sums.vm, sums.mm
+    gains = np.ones(vm.shape[:-1], dtype=np.complex128)
+    valid = mm.sum(axis=-1) > 0
+    for it in range(maxiter):
+        num = np.einsum("...ij,...j->...i", vm, gains)
+        den = np.einsum("...ij,...j->...i", mm, np.abs(gains) ** 2)
+        new = np.where(valid, num / np.where(valid, den, 1), gains)
+        if calmode == "p":
+            new = np.where(np.abs(new) > 0, new / np.abs(new), 1)
+        if it % 2 == 1:
+            new = 0.5 * (new + gains)
+            if calmode == "p":
+                new = np.where(np.abs(new) > 0, new / np.abs(new), 1)
+        change = np.abs(new - gains).max(axis=-1) / np.maximum(np.abs(new).max(axis=-1), 1e-30)
+        gains = new
+        if np.all(change < tol):
+            break
+    return gains, valid
+
+
+def solution_snr(sums, gains):
+    """Formal SNR of each antenna solution, with the noise scaled by the reduced chi-squared of its interval."""
+    g = gains
+    model_power = np.abs(g[..., :, None]) ** 2 * np.abs(g[..., None, :]) ** 2 * sums.mm
+    cross = np.real(np.conj(g[..., :, None] * np.conj(g[..., None, :])) * sums.vm)
+    chi2 = 0.5 * (sums.vv - 2 * cross + model_power).sum(axis=(-1, -2))
+    nant_valid = (sums.mm.sum(axis=-1) > 0).sum(axis=-1)
+    dof = 2 * sums.count - 2 * nant_valid
+    scale = np.where(dof > 0, chi2 / np.maximum(dof, 1), np.inf)
+    info = np.einsum("...ij,...j->...i", sums.mm, np.abs(g) ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err = np.sqrt(scale[..., None] / info)
+        snr = np.where(info > 0, np.abs(g) / err, 0.0)
+    return np.nan_to_num(snr), np.nan_to_num(err, posinf=0.0)
+
+
+def resolve_refants(msname, refant):
+    """Map a CASA refant string ('AK06', 'ak06,ak07' or '5') to antenna indices in priority order."""
+    if not refant:
+        return []
+    with table(os.path.join(msname, "ANTENNA"), ack=False) as at:
+        names = [str(n).upper() for n in at.getcol("NAME")]
+    indices = []
+    for ref in refant.split(","):
+        ref = ref.strip().upper()
+        if ref.isdigit():
+            indices.append(int(ref))
+        elif ref in names:
+            indices.append(names.index(ref))
+        else:
+            print(f"WARN: refant {ref} not found in {msname}; ignoring")
+    return indices
+
+
+def reference_phases(gains, usable, refants, sums):
+    """Rotate each solution so its reference antenna has zero phase.
+
+    The first usable antenna in ``refants`` is used per interval; if none
+    is usable, the antenna with the most weight in that interval is.
+
+    Returns:
+        tuple: (rotated gains, reference antenna per interval)
+    """
+    nsol = gains.shape[0]
+    weight = sums.mm.sum(axis=(1, 3))
+    ref = np.argmax(np.where(usable.any(axis=1), weight, -1), axis=-1)
+    has_pol = sums.count > 0
+    chosen = np.zeros(nsol, dtype=bool)
+    for r in refants:
+        ok = ~chosen & (usable[:, :, r] | ~has_pol).all(axis=1)
+        ref[ok] = r
+        chosen |= ok
+    ref_gain = gains[np.arange(nsol), :, ref]
+    rot = np.conj(ref_gain) / np.where(np.abs(ref_gain) > 0, np.abs(ref_gain), 1)
+    return gains * rot[:, :, None], ref
+
+
+def solve_gains(msname, caltable, solint, calmode="p", combine="", refant="", minsnr=3.0, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Native replacement for gaincal(gaintype='G') that writes a CASA-compatible G table.
+
+    DATA, MODEL_DATA and FLAG are read once; all solution intervals are
+    then solved together.
+
+    Args:
+        msname (str): Measurement set with DATA and MODEL_DATA
+        caltable (str): Output calibration table
+        solint (str): CASA solution interval
+        calmode (str): 'p' or 'ap'
+        combine (str): CASA combine string; only 'scan' changes the result
+        refant (str): Reference antenna name(s) or index
+        minsnr (float): Solutions below this SNR are flagged
+        chunk_rows (int): Rows per streamed block
+
+    Returns:
+        str: ``caltable``
+    """
+    if calmode not in ("p", "ap"):
+        raise ValueError(f"Unsupported calmode '{calmode}' (use 'p' or 'ap')")
+    with table(msname, ack=False) as tab:
+        if "MODEL_DATA" not in tab.colnames():
+            raise ValueError(f"MODEL_DATA column not found in {msname}")
+        times = tab.getcol("TIME")
+        scans = tab.getcol("SCAN_NUMBER")
+        field_id = int(tab.getcell("FIELD_ID", 0))
+    with table(os.path.join(msname, "ANTENNA"), ack=False) as at:
+        nant = at.nrows()
+
+    combine_scan = "scan" in [c.strip() for c in combine.split(",")]
+    intervals = assign_solution_intervals(times, scans, solint, combine_scan=combine_scan)
+    sums = accumulate_sums(msname, intervals, nant, chunk_rows=chunk_rows)
+    gains, valid = stefcal(sums, calmode=calmode)
+    snr, err = solution_snr(sums, gains)
+    usable = valid & (snr >= minsnr)
+    gains, ref = reference_phases(gains, usable, resolve_refants(msname, refant), sums)
+    flags = ~usable
+    gains = np.where(flags, 1.0 + 0j, gains)
+
+    # (nsol, npol, nant) -> (nsol, nant, nchan=1, npol)
+    to_cal = lambda a: np.moveaxis(a, 1, 2)[:, :, None, :]
+    nflag = flags.sum()
+    print(f"native gaincal: {len(intervals.times)} intervals x {nant} antennas; {nflag}/{flags.size} solutions flagged")
+    return write_caltable(
+        caltable, msname, intervals.times, intervals.intervals, to_cal(gains), to_cal(flags),
+        snr=to_cal(snr), paramerr=to_cal(err), weight=to_cal(sums.mm.sum(axis=-1)),
+        scans=intervals.scans, field_id=field_id, refant=int(np.bincount(ref).argmax()), vistype="G Jones",
+    )
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""Predict WSClean source lists into MODEL_DATA with a blocked NumPy DFT.
+
+Replaces crystalball for the self-cal loop. The ``*-sources.txt`` list
+written by ``wsclean -save-source-list`` is parsed into arrays (point
+and Gaussian components, ordinary or logarithmic polynomial spectra) and
+the visibilities
+
+    V(r, c) = sum_s S_s(nu_c) G_s(r, nu_c) exp(-2 pi i (u l + v m + w (n - 1)) nu_c / c)
+
+are evaluated over (rows x sources) tiles: each tile holds the per-source
+phasor for one channel and steps to the next channel with a single
+complex multiply, so the complex exponential is only evaluated every
+RESYNC_CHANNELS channels. Row tiles run on a thread pool (NumPy releases
+the GIL), tiles are sized to a memory budget, and MODEL_DATA is written
+one streamed block at a time. Parallel hands get the Stokes I model,
+cross hands zero, as crystalball does.
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from casacore.tables import makecoldesc, maketabdesc, table
+
+from ms_generation import unshare_columns
+from ms_index import table_fingerprint
+from ms_journal import WriteJournal, digest
+from ms_stream import DEFAULT_CHUNK_ROWS, get_spectral_setup, iter_row_chunks, prefetch_chunks
+
+C_LIGHT = 299792458.0
+"""Speed of light in m/s"""
+
+RESYNC_CHANNELS = 32
+"""Channels between exact re-evaluations of the phasor recurrence (bounds rounding drift)"""
+
+DEFAULT_TILE_BYTES = 32 * 1024 ** 2
+"""Memory budget of one (rows x sources) complex128 tile; each thread holds about three"""
+
+GAUSS_SCALE = np.pi ** 2 / (4.0 * np.log(2.0) * C_LIGHT ** 2)
+"""exp(-GAUSS_SCALE * (u'^2 + v'^2) * nu^2) is the transform of a Gaussian with unit FWHM (u, v in m)"""
+
+
+class SourceList(NamedTuple):
+    """Components of a WSClean source list, one array entry per component"""
+
+    names: np.ndarray
+    """Component names"""
+    ra: np.ndarray
+    """Right ascension in radians"""
+    dec: np.ndarray
+    """Declination in radians"""
+    flux: np.ndarray
+    """Stokes I at the reference frequency in Jy"""
+    spectral: np.ndarray
+    """(ncomp, nterms) spectral coefficients, zero-padded"""
+    log_si: np.ndarray
+    """True where the spectral terms are logarithmic"""
+    ref_freq: np.ndarray
+    """Reference frequency in Hz"""
+    major: np.ndarray
+    """Major-axis FWHM in radians (0 for point sources)"""
+    minor: np.ndarray
+    """Minor-axis FWHM in radians"""
+    orientation: np.ndarray
+    """Position angle of the major axis in radians (east of north)"""
+
+    @property
+    def gaussian(self):
+        return self.major > 0
+
+
+def _split_fields(line):
+    """Split a source-list line on commas outside [...] (the spectral terms)."""
+    return [f.strip() for f in re.split(r",(?![^\[]*\])", line)]
+
+
+def parse_ra(text):
+    """WSClean RA (hh:mm:ss.s, or degrees with a 'deg' suffix) to radians."""
+    if text.endswith("deg"):
+        return np.deg2rad(float(text[:-3]))
+    h, m, s = text.split(":")
+    sign = -1.0 if h.strip().startswith("-") else 1.0
+    return sign * np.deg2rad(15.0 * (abs(float(h)) + float(m) / 60.0 + float(s) / 3600.0))
+
+
+def parse_dec(text):
+    """WSClean Dec (dd.mm.ss.s or dd:mm:ss.s, or degrees with a 'deg' suffix) to radians."""
+    if text.endswith("deg"):
+        return np.deg2rad(float(text[:-3]))
+    parts = text.split(":") if ":" in text else text.split(".", 2)
+    d, m, s = parts
+    sign = -1.0 if d.strip().startswith("-") else 1.0
+    return sign * np.deg2rad(abs(float(d)) + float(m) / 60.0 + float(s) / 3600.0)
+
+
+def parse_wsclean_source_list(path):
+    """Read a WSClean (makesourcedb-style) source list.
+
+    The "Format = ..." header gives the column order and defaults such as
+    ReferenceFrequency='...'. Rows without a type or position (patch
+    lines) are skipped.
+
+    Returns:
+        SourceList: The components, in file order
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    header = next((line for line in lines if line.lower().startswith("format")), None)
+    if header is None:
+        raise ValueError(f"{path}: no 'Format = ...' header line")
+    columns, defaults = [], {}
+    for field in _split_fields(header.split("=", 1)[1]):
+        name, _, default = field.partition("=")
+        columns.append(name.strip())
+        if default:
+            defaults[name.strip()] = default.strip().strip("'\"")
+    index = {name.lower(): i for i, name in enumerate(columns)}
+
+    def get(fields, name):
+        i = index.get(name.lower())
+        value = fields[i] if i is not None and i < len(fields) else ""
+        return value or defaults.get(name, "")
+
+    rows = []
+    for line in lines:
+        if line is header:
+            continue
+        fields = _split_fields(line)
+        if not get(fields, "Type") or not get(fields, "Ra") or not get(fields, "Dec"):
+            continue
+        spi = get(fields, "SpectralIndex").strip("[]")
+        gaussian = get(fields, "Type").upper() == "GAUSSIAN"
+        rows.append((
+            get(fields, "Name"),
+            parse_ra(get(fields, "Ra")),
+            parse_dec(get(fields, "Dec")),
+            float(get(fields, "I") or 0.0),
+            [float(x) for x in spi.split(",") if x.strip()],
+            get(fields, "LogarithmicSI").lower() == "true",
+            float(get(fields, "ReferenceFrequency") or 0.0),
+            np.deg2rad(float(get(fields, "MajorAxis") or 0.0) / 3600.0) if gaussian else 0.0,
+            np.deg2rad(float(get(fields, "MinorAxis") or 0.0) / 3600.0) if gaussian else 0.0,
+            np.deg2rad(float(get(fields, "Orientation") or 0.0)) if gaussian else 0.0,
+        ))
+    nterms = max((len(r[4]) for r in rows), default=0)
+    spectral = np.zeros((len(rows), nterms))
+    for i, r in enumerate(rows):
+        spectral[i, :len(r[4])] = r[4]
+    col = lambda k, dtype=float: np.array([r[k] for r in rows], dtype=dtype)
+    return SourceList(names=col(0, object), ra=col(1), dec=col(2), flux=col(3), spectral=spectral,
+                      log_si=col(5, bool), ref_freq=col(6), major=col(7), minor=col(8), orientation=col(9))
+
+
+def select_components(sources, mask):
+    """Subset of ``sources`` (boolean mask or index array)."""
+    return SourceList(*(field[mask] for field in sources))
+
+
+def brightest(sources, n):
+    """The ``n`` components with the largest |I| at their reference frequency (all if n <= 0)."""
+    if n <= 0 or n >= len(sources.flux):
+        return sources
+    return select_components(sources, np.sort(np.argsort(-np.abs(sources.flux), kind="stable")[:n]))
+
+
+def spectral_flux(sources, freqs):
+    """Stokes I of every component at ``freqs``, shape (ncomp, nchan).
+
+    Ordinary polynomial: I + sum_k c_k (nu/nu0 - 1)^(k+1).
+    Logarithmic: I (nu/nu0)^(sum_k c_k log10(nu/nu0)^k).
+    """
+    ref = np.where(sources.ref_freq > 0, sources.ref_freq, freqs[0])
+    x = freqs[None, :] / ref[:, None]
+    flux = np.repeat(sources.flux[:, None], len(freqs), axis=1)
+    if sources.spectral.shape[1] == 0:
+        return flux
+    powers = np.arange(sources.spectral.shape[1])
+    lin = sources.flux[:, None] + np.einsum("sk,skc->sc", sources.spectral, (x - 1.0)[:, None, :] ** (powers[None, :, None] + 1))
+    exponent = np.einsum("sk,skc->sc", sources.spectral, np.log10(x)[:, None, :] ** powers[None, :, None])
+    log = sources.flux[:, None] * x ** exponent
+    return np.where(sources.log_si[:, None], log, lin)
+
+
+def radec_to_lmn(ra, dec, ra0, dec0):
+    """Direction cosines of (ra, dec) relative to the phase centre (ra0, dec0), shape (3, ncomp)."""
+    dra = ra - ra0
+    l = np.cos(dec) * np.sin(dra)
+    m = np.sin(dec) * np.cos(dec0) - np.cos(dec) * np.sin(dec0) * np.cos(dra)
+    n = np.sqrt(np.clip(1.0 - l ** 2 - m ** 2, 0.0, None))
+    return np.stack([l, m, n - 1.0])
+
+
+def _gauss_uv_terms(uvw, sources):
+    """(u'^2 + v'^2) of each (row, Gaussian component), in the component's scaled frame."""
+    em = sources.major * np.cos(sources.orientation)
+    el = sources.major * np.sin(sources.orientation)
+    ratio = np.divide(sources.minor, sources.major, out=np.zeros_like(sources.major), where=sources.major > 0)
+    u, v = uvw[:, 0:1], uvw[:, 1:2]
+    u1 = (u * em - v * el) * ratio
+    v1 = u * el + v * em
+    return u1 ** 2 + v1 ** 2
+
+
+def predict_tile(uvw, lmn, flux, gauss_q, freqs, out):
+    """Accumulate the model of one (rows x sources) tile into ``out`` (nrow, nchan).
+
+    Args:
+        uvw (np.ndarray): (nrow, 3) baseline coordinates in metres
+        lmn (np.ndarray): (3, nsrc) direction cosines (third row n - 1)
+        flux (np.ndarray): (nsrc, nchan) Stokes I per channel
+        gauss_q (np.ndarray): (nrow, nsrc) Gaussian uv terms, or None for point sources
+        freqs (np.ndarray): (nchan,) channel frequencies in Hz
+        out (np.ndarray): (nrow, nchan) complex accumulator
+    """
+    delay = uvw @ lmn  # (nrow, nsrc) path difference in metres
+    k = -2.0 * np.pi * freqs / C_LIGHT
+    dk = np.diff(k)
+    uniform = len(freqs) < 3 or np.allclose(dk, dk[0], rtol=1e-9, atol=0.0)
+    step = np.exp(1j * dk[0] * delay) if uniform and len(freqs) > 1 else None
+    phasor = None
+    for c in range(len(freqs)):
+        if phasor is None or step is None or c % RESYNC_CHANNELS == 0:
+            phasor = np.exp(1j * k[c] * delay)
+        else:
+            phasor *= step
+        if gauss_q is None:
+            out[:, c] += phasor @ flux[:, c]
+        else:
+            out[:, c] += (phasor * np.exp(-gauss_q * (GAUSS_SCALE * freqs[c] ** 2))) @ flux[:, c]
+
+
+def predict_rows(uvw, lmn, flux, sources, freqs, workers=1, tile_bytes=DEFAULT_TILE_BYTES, pool=None):
+    """Model visibilities (Stokes I) for a block of rows, shape (nrow, nchan).
+
+    Rows are split into tiles run on ``pool`` (or inline); within a tile,
+    sources are processed in groups so a (rows x sources) tile stays
+    within ``tile_bytes``. Point sources and Gaussians are kept in
+    separate groups so points never pay for the Gaussian envelope.
+    """
+    nrow, nchan = len(uvw), len(freqs)
+    out = np.zeros((nrow, nchan), dtype=np.complex128)
+    nsrc = lmn.shape[1]
+    if nrow == 0 or nsrc == 0:
+        return out
+    elems = max(tile_bytes // 16, 1)
+    rows_per_tile = max(min(nrow, -(-nrow // max(workers, 1)), 4096), 1)
+    srcs_per_tile = max(elems // rows_per_tile, 1)
+    gaussian = sources.gaussian
+    groups = []
+    for idx in (np.flatnonzero(~gaussian), np.flatnonzero(gaussian)):
+        groups += [idx[i:i + srcs_per_tile] for i in range(0, len(idx), srcs_per_tile)]
+
+    def run(r0):
+        r1 = min(r0 + rows_per_tile, nrow)
+        block = out[r0:r1]
+        for idx in groups:
+            q = None
+            if gaussian[idx[0]]:
+                q = _gauss_uv_terms(uvw[r0:r1], select_components(sources, idx))
+            predict_tile(uvw[r0:r1], lmn[:, idx], flux[idx], q, freqs, block)
+
+    starts = range(0, nrow, rows_per_tile)
+    if pool is None:
+        for r0 in starts:
+            run(r0)
+    else:
+        list(pool.map(run, starts))
+    return out
+
+
+def _ensure_column(tab, column):
+    """Add ``column`` shaped and stored like DATA if the MS does not have it yet."""
+    if column in tab.colnames():
+        return
+    desc = tab.getcoldesc("DATA")
+    dminfo = tab.getdminfo("DATA")
+    dminfo["NAME"] = f"{column}_dm"
+    spec = dict(dminfo.get("SPEC", {}))
+    spec.pop("HYPERCUBES", None)
+    dminfo["SPEC"] = spec
+    tab.addcols(maketabdesc(makecoldesc(column, desc)), dminfo)
+
+
+def phase_centre(msname, field):
+    """PHASE_DIR (ra, dec) of FIELD row ``field``."""
+    with table(os.path.join(msname, "FIELD"), ack=False) as fld:
+        if field >= fld.nrows():
+            raise ValueError(f"{msname} has {fld.nrows()} fields; field {field} does not exist")
+        direction = np.asarray(fld.getcell("PHASE_DIR", field), dtype=float).reshape(-1, 2)[0]
+    return direction[0], direction[1]
+
+
+def predict_sources(msname, sources, column="MODEL_DATA", field=0, workers=1, chunk_rows=DEFAULT_CHUNK_ROWS,
+                    tile_bytes=DEFAULT_TILE_BYTES, base_ms=None, resume=False):
+    """Predict ``sources`` into ``column`` of ``msname``.
+
+    By default the prediction replaces ``column`` in the rows of ``field``;
+    rows of other fields keep their current values. With ``base_ms`` it is
+    added to that MS's ``column`` instead (``msname`` itself, or a parent
+    generation with the same rows), which is how a delta between two
+    source lists is applied; components with negative flux subtract.
+
+    Args:
+        msname (str): Measurement set (single SPW)
+        sources (SourceList): Components to predict
+        column (str): Output column, created like DATA if missing
+        field (int): FIELD_ID whose phase centre the components are placed against
+        workers (int): Threads evaluating row tiles
+        chunk_rows (int): Rows per streamed block
+        tile_bytes (int): Memory budget of one (rows x sources) tile
+        base_ms (str): MS whose ``column`` the prediction is added to
+        resume (bool): Commit every block to a write journal in ``msname``, and carry
+            on from it after an interrupted run of the same prediction (see ms_journal.py).
+            Ignored when adding to ``msname``'s own ``column``, which cannot be repeated.
+
+    Returns:
+        int: Number of rows written
+    """
+    freqs, corr_product = get_spectral_setup(msname)
+    parallel = corr_product[:, 0] == corr_product[:, 1]
+    lmn = radec_to_lmn(sources.ra, sources.dec, *phase_centre(msname, field))
+    flux = spectral_flux(sources, freqs)
+    action = "adding" if base_ms is not None else "predicting"
+    print(f"{action} {len(sources.flux)} components ({int(sources.gaussian.sum())} Gaussian) "
+          f"into {msname}:{column} ({len(freqs)} channels, {workers} threads)")
+
+    other = None
+    if base_ms is not None and os.path.realpath(base_ms) != os.path.realpath(msname):
+        with table(msname, ack=False) as tab:
+            nrows = tab.nrows()
+        base_freqs, _ = get_spectral_setup(base_ms)
+        other = table(base_ms, ack=False)
+        if other.nrows() != nrows or base_freqs.shape != freqs.shape or not np.allclose(base_freqs, freqs):
+            other.close()
+            raise ValueError(f"{base_ms} does not have the rows and channels of {msname}")
+    journal = None
+    if resume and (base_ms is None or other is not None):
+        with table(msname, ack=False) as tab:
+            nrows = tab.nrows()
+        # msname is the output, so its own fingerprint changes with every block written
+        base = [os.path.realpath(base_ms), table_fingerprint(base_ms)] if other is not None else None
+        journal = WriteJournal(msname, digest("predict", nrows, column, field, *sources, base, chunk_rows), [column])
+    resumed = journal is not None and journal.resumable()
+    unshare_columns(msname, [column])
+    with table(msname, readonly=False, ack=False) as tab, ThreadPoolExecutor(max_workers=workers) as pool:
+        _ensure_column(tab, column)
+        nrows = tab.nrows()
+        first, written = (0, 0)
+        if resumed:
+            first, written = journal.resume_point(tab)
+            print(f"resuming the prediction into {msname}:{column} from row {first}")
+        elif journal is not None:
+            journal.start(nrows)
+
+        def read_chunk(start, n):
+            block = {c: tab.getcol(c, startrow=start, nrow=n) for c in ("UVW", "FIELD_ID")}
+            if other is not None:
+                for c in ("TIME", "ANTENNA1", "ANTENNA2"):
+                    if not np.array_equal(tab.getcol(c, startrow=start, nrow=n), other.getcol(c, startrow=start, nrow=n)):
+                        raise ValueError(f"{base_ms} rows {start}-{start + n} differ from {msname} in {c}")
+                block[column] = other.getcol(column, startrow=start, nrow=n)
+            elif base_ms is not None:
+                block[column] = tab.getcol(column, startrow=start, nrow=n)
+            return block
+
+        chunks = [(start, n) for start, n in iter_row_chunks(nrows, chunk_rows) if start >= first]
+        try:
+            for (start, n), block in prefetch_chunks(read_chunk, chunks):
+                rows = block["FIELD_ID"] == field
+                vis = predict_rows(block["UVW"][rows], lmn, flux, sources, freqs, workers=workers, tile_bytes=tile_bytes, pool=pool)
+                index = np.ix_(rows, np.arange(len(freqs)), np.flatnonzero(parallel))
+                if base_ms is not None:
+                    model = block[column]
+                    model[index] += vis[:, :, None]
+                else:
+                    if rows.all():
+                        model = np.zeros((n, len(freqs), len(parallel)), dtype=np.complex64)
+                    else:
+                        model = tab.getcol(column, startrow=start, nrow=n)
+                        model[rows] = 0
+                    model[index] = vis[:, :, None]
+                tab.putcol(column, model, startrow=start, nrow=n)
+                if journal is not None:
+                    journal.commit(tab, start, n)
+                written += n
+        finally:
+            if other is not None:
+                other.close()
+        tab.flush()
+    if journal is not None:
+        journal.finish()
+    return written
+
+
+def predict_ms(msname, source_list, column="MODEL_DATA", num_sources=0, field=0, workers=1,
+               chunk_rows=DEFAULT_CHUNK_ROWS, tile_bytes=DEFAULT_TILE_BYTES, resume=False):
+    """Predict a WSClean source list into ``column`` of ``msname``.
+
+    Args:
+        msname (str): Measurement set (single SPW)
+        source_list (str): WSClean ``*-sources.txt``
+        column (str): Output column, created like DATA if missing
+        num_sources (int): Keep only the N brightest components (0 = all)
+        field (int): FIELD_ID whose phase centre the components are placed against
+        workers (int): Threads evaluating row tiles
+        chunk_rows (int): Rows per streamed block
+        tile_bytes (int): Memory budget of one (rows x sources) tile
+        resume (bool): Journal the write and resume an interrupted one
+
+    Returns:
+        int: Number of rows written
+    """
+    sources = brightest(parse_wsclean_source_list(source_list), num_sources)
+    return predict_sources(msname, sources, column=column, field=field, workers=workers, chunk_rows=chunk_rows,
+                           tile_bytes=tile_bytes, resume=resume)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Predict a WSClean source list into MODEL_DATA (crystalball replacement).")
+    p.add_argument("ms", help="Measurement set.")
+    p.add_argument("-sm", "--sky-model", required=True, help="WSClean source list (*-sources.txt).")
+    p.add_argument("-o", "--output-column", default="MODEL_DATA", help="Column to write.")
+    p.add_argument("-ns", "--num-sources", type=int, default=0, help="Predict only the N brightest components (0 = all).")
+    p.add_argument("-f", "--field", type=int, default=0, help="FIELD_ID to predict.")
+    p.add_argument("-j", "--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", 1)), help="Threads (default: $SLURM_CPUS_PER_TASK or 1).")
+    p.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per streamed block.")
+    p.add_argument("--tile-mb", type=float, default=DEFAULT_TILE_BYTES / 1024 ** 2, help="Memory budget of one rows x sources tile in MB.")
+    p.add_argument("--resume", action="store_true", help="Journal the write and resume an interrupted one (see ms_journal.py).")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    t0 = time.perf_counter()
+    nrows = predict_ms(args.ms, args.sky_model, column=args.output_column, num_sources=args.num_sources, field=args.field,
+                       workers=args.workers, chunk_rows=args.chunk_rows, tile_bytes=int(args.tile_mb * 1024 ** 2),
+                       resume=args.resume)
+    print(f"wrote {nrows} rows of {args.output_column} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+from astropy.io import fits
+from casacore.tables import table, default_ms, makearrcoldesc, maketabdesc
+from typing import NamedTuple
+import numpy as np
+import os
+import shutil
+
+from ms_layout import apply_layout
+from ms_stream import DEFAULT_CHUNK_ROWS, iter_row_chunks, prefetch_chunks
+
+C_LIGHT = 299792458.0
+"""Speed of light in m/s; UVFITS u,v,w are in light-seconds"""
+
+AIPS_TO_CASA_STOKES = {1: 1, 2: 2, 3: 3, 4: 4, -1: 5, -2: 8, -3: 6, -4: 7, -5: 9, -6: 12, -7: 10, -8: 11}
+"""AIPS STOKES axis codes (RR=-1 .. YX=-8) to casacore Stokes enum values"""
+
+CASA_STOKES_RECEPTORS = {1: (0, 0), 2: (0, 0), 3: (0, 0), 4: (0, 0), 5: (0, 0), 6: (0, 1), 7: (1, 0), 8: (1, 1),
+                         9: (0, 0), 10: (0, 1), 11: (1, 0), 12: (1, 1)}
+"""Receptor pair (CORR_PRODUCT) of each casacore Stokes value"""
+
+
+class UVFitsInfo(NamedTuple):
+    """Layout and metadata of a random-groups UVFITS file."""
+
+    ngroups: int
+    """Number of visibility groups (MS rows)"""
+    freqs: np.ndarray
+    """Channel frequencies in Hz"""
+    chan_width: float
+    """Channel width in Hz"""
+    corr_types: np.ndarray
+    """casacore Stokes value of each correlation"""
+    antenna_names: list
+    """Antenna names from the AN table, indexed by antenna number - 1"""
+    antenna_positions: np.ndarray
+    """(nant, 3) ITRF antenna positions in metres"""
+    field_name: str
+    """OBJECT keyword"""
+    phase_dir: np.ndarray
+    """(ra, dec) of the phase centre in radians"""
+    telescope: str
+    """TELESCOP keyword"""
+    axes: dict
+    """CTYPE -> numpy axis of the group data array"""
+
+
+def read_uvfits_info(hdul):
+    """Parse the primary header and AN table of an open UVFITS file.
+
+    Args:
+        hdul (HDUList): Opened with ``fits.open(..., memmap=True)``
+
+    Returns:
+        UVFitsInfo: Layout and metadata
+    """
+    hdr = hdul[0].header
+    naxis = hdr["NAXIS"]
+    # FITS axis k (k >= 2) is numpy axis naxis - k + 1 of the group data
+    axes = {hdr[f"CTYPE{k}"].strip(): naxis - k + 1 for k in range(2, naxis + 1)}
+    ctype = {hdr[f"CTYPE{k}"].strip(): k for k in range(2, naxis + 1)}
+
+    def axis_values(name):
+        k = ctype[name]
+        n = hdr[f"NAXIS{k}"]
+        return hdr[f"CRVAL{k}"] + (np.arange(1, n + 1) - hdr.get(f"CRPIX{k}", 1.0)) * hdr.get(f"CDELT{k}", 1.0)
+
+    if "IF" in ctype and hdr[f"NAXIS{ctype['IF']}"] > 1:
+        raise ValueError("Multi-IF UVFITS files are not supported by the native importer")
+    freqs = axis_values("FREQ")
+    stokes = np.rint(axis_values("STOKES")).astype(int)
+    corr_types = np.array([AIPS_TO_CASA_STOKES[s] for s in stokes], dtype=np.int32)
+
+    an = hdul["AIPS AN"]
+    nosta = np.asarray(an.data["NOSTA"], dtype=int)
+    nant = int(nosta.max())
+    names = [f"ANT{i + 1}" for i in range(nant)]
+    positions = np.zeros((nant, 3))
+    centre = np.array([an.header.get(f"ARRAY{c}", 0.0) for c in "XYZ"])
+    for sta, name, xyz in zip(nosta, an.data["ANNAME"], an.data["STABXYZ"]):
+        names[sta - 1] = str(name).strip()
+        positions[sta - 1] = np.asarray(xyz) + centre
+
+    ra = hdr[f"CRVAL{ctype['RA']}"] if "RA" in ctype else hdr.get("OBSRA", 0.0)
+    dec = hdr[f"CRVAL{ctype['DEC']}"] if "DEC" in ctype else hdr.get("OBSDEC", 0.0)
+    return UVFitsInfo(
+        ngroups=hdr["GCOUNT"],
+        freqs=freqs,
+        chan_width=float(hdr.get(f"CDELT{ctype['FREQ']}", 0.0)),
+        corr_types=corr_types,
+        antenna_names=names,
+        antenna_positions=positions,
+        field_name=str(hdr.get("OBJECT", "")).strip(),
+        phase_dir=np.deg2rad([ra, dec]),
+        telescope=str(hdr.get("TELESCOP", "")).strip(),
+        axes=axes,
+    )
+
+
+def _par(groups, name):
+    """Group parameter ``name`` (summed over repeats, as for split DATE), or None."""
+    return groups.par(name) if name in groups.parnames else None
+
+
+def decode_baselines(groups):
+    """0-based ANTENNA1/ANTENNA2 from BASELINE (256- or 2048-antenna encoding) or explicit params."""
+    a1, a2 = _par(groups, "ANTENNA1"), _par(groups, "ANTENNA2")
+    if a1 is not None and a2 is not None:
+        return np.rint(a1).astype(np.int32) - 1, np.rint(a2).astype(np.int32) - 1
+    bl = np.floor(groups.par("BASELINE") + 1e-3).astype(np.int64)
+    big = bl > 65536
+    a1 = np.where(big, (bl - 65536) // 2048, bl // 256)
+    a2 = np.where(big, (bl - 65536) % 2048, bl % 256)
+    return a1.astype(np.int32) - 1, a2.astype(np.int32) - 1
+
+
+def groups_to_rows(groups, info, interval=None):
+    """Convert a block of random groups to MS main-table columns.
+
+    Args:
+        groups (GroupData): Slice of the memory-mapped group data
+        info (UVFitsInfo): File layout
+        interval (float): Integration time if the file has no INTTIM parameter
+
+    Returns:
+        dict: Column name -> array for ``len(groups)`` rows
+    """
+    n = len(groups)
+    cube = np.asarray(groups.data)
+    # Drop the degenerate RA/DEC/IF axes and order as (row, chan, corr, complex)
+    order = [0] + [info.axes[a] for a in ("FREQ", "STOKES", "COMPLEX")]
+    keep = set(order)
+    index = tuple(slice(None) if ax in keep else 0 for ax in range(cube.ndim))
+    squeezed_axes = [ax for ax in range(cube.ndim) if ax in keep]
+    cube = cube[index].transpose([squeezed_axes.index(ax) for ax in order])
+
+    weight = cube[..., 2]
+    data = (cube[..., 0] + 1j * cube[..., 1]).astype(np.complex64)
+    flag = weight <= 0
+    row_weight = np.where(flag, 0.0, weight).sum(axis=1).astype(np.float32)
+    with np.errstate(divide="ignore"):
+        sigma = np.where(row_weight > 0, 1.0 / np.sqrt(row_weight), 0.0).astype(np.float32)
+
+    jd = groups.par("DATE")
+    if "_DATE" in groups.parnames:
+        jd = jd + groups.par("_DATE")
+    times = (jd - 2400000.5) * 86400.0
+    inttim = _par(groups, "INTTIM")
+    intervals = np.asarray(inttim, dtype=np.float64) if inttim is not None else np.full(n, interval or 0.0)
+    a1, a2 = decode_baselines(groups)
+    uvw = np.stack([groups.par("UU"), groups.par("VV"), groups.par("WW")], axis=1) * C_LIGHT
+    return {
+        "TIME": times,
+        "TIME_CENTROID": times,
+        "INTERVAL": intervals,
+        "EXPOSURE": intervals,
+        "ANTENNA1": a1,
+        "ANTENNA2": a2,
+        "UVW": uvw,
+        "DATA": data,
+        "FLAG": flag,
+        "FLAG_ROW": flag.all(axis=(1, 2)),
+        "WEIGHT": row_weight,
+        "SIGMA": sigma,
+        "SCAN_NUMBER": np.ones(n, dtype=np.int32),
+    }
+
+
+def guess_interval(groups, sample=100000):
+    """Median spacing of the distinct times in the first ``sample`` groups (for files without INTTIM)."""
+    jd = groups[:sample].par("DATE")
+    steps = np.diff(np.unique(np.round(jd * 86400.0, 4)))
+    return float(np.median(steps)) if len(steps) else 0.0
+
+
+def _tiled_dminfo(nchan, ncorr, bytes_per_tile=1 << 20):
+    """CASA-like data managers: one TiledShapeStMan per bulk column, StandardStMan for the rest."""
+    rows = max(1, bytes_per_tile // (8 * nchan * ncorr))
+    dminfo = {}
+    for i, (col, shape) in enumerate([("DATA", [ncorr, nchan]), ("FLAG", [ncorr, nchan]), ("WEIGHT", [ncorr]),
+                                      ("SIGMA", [ncorr]), ("UVW", [3])]):
+        dminfo[f"*{i + 1}"] = {"TYPE": "TiledShapeStMan", "NAME": f"Tiled{col}", "COLUMNS": [col],
+                               "SPEC": {"DEFAULTTILESHAPE": np.array(shape + [rows], dtype=np.int32)}}
+    return dminfo
+
+
+def create_ms_for_uvfits(msname, info):
+    """Create an empty MS with the subtables described by ``info``.
+
+    Args:
+        msname (str): Output path; replaced if present
+        info (UVFitsInfo): Parsed UVFITS metadata
+
+    Returns:
+        str: ``msname``
+    """
+    if os.path.isdir(msname):
+        print(f"found existing copy of {msname}. removing prior to write")
+        shutil.rmtree(msname)
+    nchan, ncorr = len(info.freqs), len(info.corr_types)
+    desc = maketabdesc([makearrcoldesc("DATA", 0j, shape=[nchan, ncorr], valuetype="complex")])
+    default_ms(msname, desc, _tiled_dminfo(nchan, ncorr)).close()
+
+    nant = len(info.antenna_names)
+    with table(os.path.join(msname, "ANTENNA"), readonly=False, ack=False) as at:
+        at.addrows(nant)
+        at.putcol("NAME", info.antenna_names)
+        at.putcol("STATION", info.antenna_names)
+        at.putcol("POSITION", info.antenna_positions)
+        at.putcol("DISH_DIAMETER", np.full(nant, 12.0))
+        at.putcol("TYPE", ["GROUND-BASED"] * nant)
+        at.putcol("MOUNT", ["ALT-AZ"] * nant)
+    with table(os.path.join(msname, "FEED"), readonly=False, ack=False) as fe:
+        fe.addrows(nant)
+        fe.putcol("ANTENNA_ID", np.arange(nant, dtype=np.int32))
+        fe.putcol("SPECTRAL_WINDOW_ID", np.full(nant, -1, dtype=np.int32))
+        fe.putcol("NUM_RECEPTORS", np.full(nant, 2, dtype=np.int32))
+        linear = any(t >= 9 for t in info.corr_types)
+        for row in range(nant):
+            fe.putcell("POLARIZATION_TYPE", row, ["X", "Y"] if linear else ["R", "L"])
+            fe.putcell("RECEPTOR_ANGLE", row, np.zeros(2))
+            fe.putcell("BEAM_OFFSET", row, np.zeros((2, 2)))
+            fe.putcell("POL_RESPONSE", row, np.eye(2, dtype=np.complex64))
+            fe.putcell("POSITION", row, np.zeros(3))
+    with table(os.path.join(msname, "SPECTRAL_WINDOW"), readonly=False, ack=False) as sw:
+        width = np.full(nchan, abs(info.chan_width))
+        sw.addrows(1)
+        sw.putcell("CHAN_FREQ", 0, info.freqs)
+        sw.putcell("CHAN_WIDTH", 0, width)
+        sw.putcell("EFFECTIVE_BW", 0, width)
+        sw.putcell("RESOLUTION", 0, width)
+        sw.putcell("NUM_CHAN", 0, nchan)
+        sw.putcell("REF_FREQUENCY", 0, info.freqs[0])
+        sw.putcell("TOTAL_BANDWIDTH", 0, width.sum())
+        sw.putcell("MEAS_FREQ_REF", 0, 5)
+    with table(os.path.join(msname, "POLARIZATION"), readonly=False, ack=False) as po:
+        po.addrows(1)
+        po.putcell("NUM_CORR", 0, ncorr)
+        po.putcell("CORR_TYPE", 0, info.corr_types)
+        po.putcell("CORR_PRODUCT", 0, np.array([CASA_STOKES_RECEPTORS[t] for t in info.corr_types], dtype=np.int32))
+    with table(os.path.join(msname, "DATA_DESCRIPTION"), readonly=False, ack=False) as dd:
+        dd.addrows(1)
+    with table(os.path.join(msname, "FIELD"), readonly=False, ack=False) as fd:
+        fd.addrows(1)
+        fd.putcell("NAME", 0, info.field_name)
+        for col in ("PHASE_DIR", "DELAY_DIR", "REFERENCE_DIR"):
+            fd.putcell(col, 0, info.phase_dir[None, :])
+    with table(os.path.join(msname, "OBSERVATION"), readonly=False, ack=False) as ob:
+        ob.addrows(1)
+        ob.putcell("TELESCOPE_NAME", 0, info.telescope)
+    return msname
+
+
+def import_uvfits(uvfits, msname, chunk_rows=DEFAULT_CHUNK_ROWS, transform=None, layout=None):
+    """Convert a random-groups UVFITS file to an MS in one streaming pass.
+
+    The file is memory-mapped and converted in blocks of ``chunk_rows``
+    groups; the next block is decoded while the current one is written.
+
+    Args:
+        uvfits (str): Input UVFITS file
+        msname (str): Output measurement set; replaced if present
+        chunk_rows (int): Groups per streamed block
+        transform (callable): Optional ``transform(columns) -> columns`` applied
+            to every block before it is written (e.g. calibration)
+        layout (ms_layout.Layout): Storage layout of the output (default: ~1 MiB row tiles)
+
+    Returns:
+        int: Number of rows written
+    """
+    with fits.open(uvfits, memmap=True) as hdul:
+        info = read_uvfits_info(hdul)
+        groups = hdul[0].data
+        interval = None if "INTTIM" in groups.parnames else guess_interval(groups)
+        create_ms_for_uvfits(msname, info)
+        if layout is not None:
+            with table(msname, readonly=False, ack=False) as tab:
+                apply_layout(tab, layout)
+
+        def read_chunk(start, n):
+            columns = groups_to_rows(groups[start:start + n], info, interval=interval)
+            return transform(columns) if transform is not None else columns
+
+        with table(msname, readonly=False, ack=False) as tab:
+            tab.addrows(info.ngroups)
+            written = 0
+            tmin, tmax = np.inf, -np.inf
+            for (start, n), columns in prefetch_chunks(read_chunk, iter_row_chunks(info.ngroups, chunk_rows)):
+                for col, values in columns.items():
+                    tab.putcol(col, values, startrow=start, nrow=n)
+                tmin, tmax = min(tmin, columns["TIME"].min()), max(tmax, columns["TIME"].max())
+                written += n
+            tab.flush()
+            if written != info.ngroups or tab.nrows() != info.ngroups:
+                raise RuntimeError(f"Row count mismatch writing {msname}: wrote {written} of {info.ngroups}, table has {tab.nrows()}")
+    if written:
+        with table(os.path.join(msname, "OBSERVATION"), readonly=False, ack=False) as ob:
+            ob.putcell("TIME_RANGE", 0, np.array([tmin, tmax]))
+    return written
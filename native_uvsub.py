@@ -0,0 +1,119 @@
+from casacore.tables import table
+import threading
+
+from ms_generation import create_derived_ms, derived_columns, unshare_columns
+from ms_index import table_fingerprint
+from ms_journal import WriteJournal, digest
+from ms_stream import (
+    DEFAULT_CHUNK_ROWS,
+    iter_row_chunks,
+    prefetch_chunks,
+)
+
+
+def _source_column(tab):
+    """uvsub subtracts from CORRECTED_DATA when present, otherwise from DATA."""
+    return "CORRECTED_DATA" if "CORRECTED_DATA" in tab.colnames() else "DATA"
+
+
+def subtract_to_new_ms(msname, outputvis, chunk_rows=DEFAULT_CHUNK_ROWS, share_parent=False, layout=None, resume=False):
+    """Write DATA = DATA - MODEL_DATA into a new MS in one streaming pass.
+
+    Equivalent to uvsub + split(datacolumn='corrected'). Blocks are
+    double-buffered: the next block is read while the current one is
+    written, with at most two blocks in memory.
+
+    Args:
+        msname (str): Input measurement set with MODEL_DATA
+        outputvis (str): Output measurement set; replaced if present
+        chunk_rows (int): Rows per streamed block
+        share_parent (bool): Write a copy-on-write generation that hardlinks
+            every column except DATA
+        layout (ms_layout.Layout): Storage layout of the output (default: the input's)
+        resume (bool): Commit every block to a write journal, and carry on from
+            it if ``outputvis`` is a partial output of the same write (see ms_journal.py)
+
+    Returns:
+        int: Number of rows written
+    """
+    with table(msname, ack=False) as src:
+        if "MODEL_DATA" not in src.colnames():
+            raise ValueError(f"MODEL_DATA column not found in {msname}; predict a model before uvsub")
+        nrows = src.nrows()
+    journal = None
+    if resume:
+        key = digest("uvsub", table_fingerprint(msname), chunk_rows, share_parent, str(layout))
+        journal = WriteJournal(outputvis, key, ["DATA"])
+    resumed = journal is not None and journal.resumable()
+    if resumed:
+        print(f"resuming the write of {outputvis} from its journal")
+        passthrough = derived_columns(msname, ["DATA"], share_parent=share_parent)
+    else:
+        passthrough = create_derived_ms(msname, outputvis, ["DATA"], share_parent=share_parent, layout=layout)
+        if journal is not None:
+            journal.start(nrows)
+    with table(msname, ack=False) as src, table(outputvis, readonly=False, ack=False) as dst:
+        if not share_parent and not resumed:
+            dst.addrows(nrows)
+        first, written = journal.resume_point(dst) if resumed else (0, 0)
+        data_col = _source_column(src)
+
+        def read_chunk(start, n):
+            block = {c: src.getcol(c, startrow=start, nrow=n) for c in passthrough}
+            block["DATA"] = src.getcol(data_col, startrow=start, nrow=n)
+            block["DATA"] -= src.getcol("MODEL_DATA", startrow=start, nrow=n)
+            return block
+
+        chunks = [(start, n) for start, n in iter_row_chunks(nrows, chunk_rows) if start >= first]
+        for (start, n), block in prefetch_chunks(read_chunk, chunks):
+            if len(block["DATA"]) != n:
+                raise RuntimeError(f"Short read from {msname}: expected {n} rows at {start}, got {len(block['DATA'])}")
+            for col, values in block.items():
+                dst.putcol(col, values, startrow=start, nrow=n)
+            if journal is not None:
+                journal.commit(dst, start, n)
+            written += n
+        dst.flush()
+        if written != nrows or dst.nrows() != nrows:
+            raise RuntimeError(f"Row count mismatch writing {outputvis}: wrote {written} of {nrows}, table has {dst.nrows()}")
+    if journal is not None:
+        journal.finish()
+    return written
+
+
+def subtract_in_place(msname, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Overwrite DATA with DATA - MODEL_DATA in ``msname`` itself.
+
+    No new MS is written, so the unsubtracted visibilities are lost. If
+    DATA is hardlinked to another generation it is unshared first.
+    Reads are still prefetched, but table access is serialised because
+    reads and writes go to the same table.
+
+    Args:
+        msname (str): Measurement set with MODEL_DATA
+        chunk_rows (int): Rows per streamed block
+
+    Returns:
+        int: Number of rows rewritten
+    """
+    lock = threading.Lock()
+    unshare_columns(msname, ["DATA"])
+    with table(msname, readonly=False, ack=False) as tab:
+        if "MODEL_DATA" not in tab.colnames():
+            raise ValueError(f"MODEL_DATA column not found in {msname}; predict a model before uvsub")
+        data_col = _source_column(tab)
+
+        def read_chunk(start, n):
+            with lock:
+                data = tab.getcol(data_col, startrow=start, nrow=n)
+                model = tab.getcol("MODEL_DATA", startrow=start, nrow=n)
+            data -= model
+            return data
+
+        written = 0
+        for (start, n), data in prefetch_chunks(read_chunk, iter_row_chunks(tab.nrows(), chunk_rows)):
+            with lock:
+                tab.putcol("DATA", data, startrow=start, nrow=n)
+            written += n
+        tab.flush()
+    return written
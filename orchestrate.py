@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""Submit the pipeline as a DAG with per-beam dependencies.
+
+pipeline.sh chains whole array jobs with ``afterok``, so every beam waits
+for the slowest beam at each step of the self-cal loop. Here the
+per-beam part of the pipeline (concat -> [wsclean -> mask -> crystalball
+-> selfcal] x N -> uvsub -> applycal -> predict -> uvsub [-> snapshot]) is
+submitted with ``aftercorr`` dependencies: task i of a beam-level array
+only waits for task i (the same beam) of the arrays it depends on. The per-scan stages
+(import, flagging, average) glob their inputs at run time, so they keep
+whole-array ``afterok`` dependencies.
+
+The tasks run the same run_*.sh scripts with the same settings as the
+submit_* functions of pipeline.sh; the settings are read by sourcing
+pipeline_config.sh, so environment overrides work the same way. With
+SIZING=fit every job requests the time, memory and CPUs that
+resource_sizing.py predicts for its largest array task.
+
+Executors:
+    slurm    sbatch every task (default)
+    dry-run  print the sbatch commands instead
+    local    run the array tasks as local subprocesses, honouring the
+             dependencies (a Slurm stand-in for testing)
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, NamedTuple, Tuple
+
+from telemetry import write_record
+
+SCALAR_SETTINGS = (
+    "SBID", "DATA_ROOT", "UVFITS_PATTERN", "BIND_SRC", "FLINT_WSCLEAN_SIF", "FLINT_CASA_SIF",
+    "IMPORT_SCRIPT", "RUN_IMPORT", "IMPORT_CPUS", "IMPORT_MEM", "IMPORT_ENGINE",
+    "INGEST_MODE", "RUN_INGEST", "INGEST_CPUS", "INGEST_MEM",
+    "FLAG_SCRIPT", "RUN_FLAG", "FLAG_COLUMN", "FLAG_CPUS", "FLAG_MEM", "FLAG_CARRY", "FLAG_RULE", "SCRIPT_DIR",
+    "AVERAGE_SCRIPT", "AVERAGE_PYTHON", "TIMEBIN", "CHANBIN", "AVERAGE_ENGINE", "RUN_AVERAGE", "AVERAGE_CPUS", "AVERAGE_MEM",
+    "OUT_ROOT", "CONCAT_PYTHON", "CONCAT_SCRIPT", "RUN_CONCAT", "CONCAT_CPUS", "CONCAT_MEM", "CONCAT_ENGINE",
+    "RUN_WSCLEAN", "RUN_CB", "RUN_SELFCAL", "RUN_APPLYCAL", "RUN_BANDPASS", "RUN_UVSUB", "RUN_FLINT_MASK", "RUN_CLEARCAL",
+    "ARRAY_SPEC", "BIGARRAY_SPEC", "SCAN_SHARDS", "SCAN_WORKERS", "WSCLEAN_CPUS", "WSCLEAN_MEM", "SC_CPUS", "SC_MEM", "FM_CPUS", "FM_MEM",
+    "CB_TIME", "CB_CPUS", "CB_MEM", "CB_OUTPUT_COLUMN", "CB_NUM_WORKERS", "CB_ROW_CHUNKS", "CB_MODEL_CHUNKS", "CB_MEMORY_FRACTION", "CB_ENGINE",
+    "CB_INCREMENTAL", "CB_MAX_DELTA_FRACTION",
+    "FLOOD_FILL_POSITIVE_SEED_CLIP", "FLOOD_FILL_POSITIVE_FLOOD_CLIP", "FLOOD_FILL_MAC_BOX_SIZE", "BEAM_SHAPE_ERODE_MIN_RESPONSE",
+    "SC_FIELD", "SC_SPW", "SC_REFANT", "SC_COMBINE", "SC_MINSNR", "SC_PARANG", "SC_APPLY_CALWT", "SC_SOLVER",
+    "APPLY_ENGINE", "SHARE_PARENT", "STAGE_CACHE", "CASA_WORKER", "MS_LAYOUT", "TELEMETRY", "SIZING", "SIZING_HISTORY", "SIZING_GROUPS", "SIZING_CPUS",
+    "UVSUB_OUT_PREFIX", "UVSUB_MODE", "RUN_SNAPSHOT", "SNAPSHOT_TIMESTEP", "SNAPSHOT_SHARDS", "SNAPSHOT_WORKERS",
+    "SNAPSHOT_CPUS", "SNAPSHOT_MEM", "SNAPSHOT_TIME", "SNAPSHOT_PLAN_MEM", "SNAPSHOT_PLAN_TIME", "SNAPSHOT_OPTS", "RESUME_WRITES", "RESUME_SIGNAL_S", "RESUME_MAX_REQUEUES",
+)
+"""pipeline_config.sh variables used to build the tasks"""
+
+ARRAY_SETTINGS = ("IMG_TAGS", "WSCLEAN_OPTS", "SC_INDEX", "SC_CALMODE", "SC_SOLINT", "SC_PREFIX")
+"""pipeline_config.sh bash arrays used to build the self-cal rounds"""
+
+
+class Task(NamedTuple):
+    """One array job of the pipeline"""
+
+    name: str
+    """Unique name within the DAG, e.g. wsclean_selfcal_2"""
+    script: str
+    """run_*.sh script to submit"""
+    array: str
+    """Slurm array spec"""
+    job_name: str
+    """Slurm job name"""
+    log: str
+    """Log file prefix under logs/"""
+    time: str
+    """Wall time limit"""
+    cpus: str
+    """CPUs per array task"""
+    mem: str
+    """Memory per array task"""
+    env: Dict[str, str]
+    """Variables exported to the script (the submit_* --export list)"""
+    afterok: Tuple[str, ...] = ()
+    """Tasks whose whole array must succeed first"""
+    aftercorr: Tuple[str, ...] = ()
+    """Tasks whose same-index array task must succeed first"""
+    signal: str = ""
+    """sbatch --signal of a task that requeues itself near its time limit (requeue.sh), e.g. B:USR1@300; empty for none"""
+
+
+def load_settings(config):
+    """Source ``config`` in bash and return its scalar settings and arrays."""
+    lines = [f'source "{config}" >/dev/null']
+    for name in SCALAR_SETTINGS:
+        lines.append(f'printf "S\\0%s\\0%s\\0" {name} "${{{name}-}}"')
+    for name in ARRAY_SETTINGS:
+        lines.append(f'printf "A\\0%s\\0%s\\0" {name} "${{#{name}[@]}}"; printf "%s\\0" "${{{name}[@]}}"')
+    out = subprocess.run(["bash", "-c", "\n".join(lines)], check=True, capture_output=True).stdout.decode()
+    fields = out.split("\0")
+    settings, pos = {}, 0
+    while pos < len(fields) - 1:
+        kind, name, value = fields[pos:pos + 3]
+        pos += 3
+        if kind == "S":
+            settings[name] = value
+        else:
+            n = int(value)
+            settings[name] = fields[pos:pos + n]
+            pos += n
+    return settings
+
+
+def parse_array_spec(spec):
+    """Expand a Slurm array spec such as "0-35", "0-500%10" or "1,3,5-7" to task indices."""
+    spec = spec.split("%")[0]
+    indices = []
+    for part in spec.split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            step = 1
+            if ":" in hi:
+                hi, step = hi.split(":")
+            indices.extend(range(int(lo), int(hi) + 1, int(step)))
+        elif part:
+            indices.append(int(part))
+    return indices
+
+
+def shard_array_spec(spec, shards):
+    """Array spec with ``shards`` consecutive tasks for every index of ``spec`` (task i is index i // shards).
+
+    A %N limit on the running tasks is kept.
+    """
+    indices = [i * shards + k for i in parse_array_spec(spec) for k in range(shards)]
+    runs = []
+    for i in indices:
+        if runs and i == runs[-1][1] + 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    limit = spec[spec.index("%"):] if "%" in spec else ""
+    return ",".join(f"{lo}-{hi}" if hi > lo else str(lo) for lo, hi in runs) + limit
+
+
+def scan_time(base, scans_per_task):
+    """Wall time of a per-scan array task: the one-scan limit ``base`` (HH:MM:SS) times the scans it handles."""
+    h, m, sec = (int(x) for x in base.split(":"))
+    total = (h * 3600 + m * 60 + sec) * scans_per_task
+    return f"{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}"
+
+
+def build_dag(s):
+    """The pipeline.sh sequence as a list of Tasks in submission order.
+
+    Args:
+        s (dict): Settings from ``load_settings``, plus SCANS_PER_TASK
+
+    Returns:
+        list: Tasks, each after the tasks it depends on
+    """
+    tasks = []
+    common = {"STAGE_CACHE": s["STAGE_CACHE"], "CASA_WORKER": s["CASA_WORKER"], "MS_LAYOUT": s["MS_LAYOUT"], "TELEMETRY": s["TELEMETRY"], "SBID": s["SBID"], "DATA_ROOT": s["DATA_ROOT"]}
+
+    def add(name, script, array, job_name, log, time_limit, cpus, mem, env, afterok=(), aftercorr=(), engine=""):
+        # as requeue_opts in pipeline.sh: only stages whose engine journals its writes (ms_journal.py) are requeued
+        signal = ""
+        if s["RESUME_WRITES"] and engine in ("native", "stream"):
+            signal = f"B:USR1@{s['RESUME_SIGNAL_S']}"
+            env = {**env, "RESUME_WRITES": s["RESUME_WRITES"], "RESUME_MAX_REQUEUES": s["RESUME_MAX_REQUEUES"]}
+        tasks.append(Task(name, script, array, job_name, log, time_limit, cpus, mem, {**common, **env},
+                          tuple(a for a in afterok if a), tuple(a for a in aftercorr if a), signal))
+        return name
+
+    casa = {"FLINT_CASA_SIF": s["FLINT_CASA_SIF"], "BIND_SRC": s["BIND_SRC"]}
+    per_scan = s.get("SCANS_PER_TASK", 1)
+
+    def flag(name, pattern, after, mode="full", parent=""):
+        mode = mode if s["FLAG_CARRY"] else "full"
+        return add(name, s["RUN_FLAG"], s["BIGARRAY_SPEC"], "aoflagger_array", "aoflagger", scan_time("00:30:00", per_scan), s["FLAG_CPUS"], s["FLAG_MEM"],
+                   {"PATTERN": pattern, "SCRIPT_DIR": s["SCRIPT_DIR"], "FLAG_SCRIPT": s["FLAG_SCRIPT"],
+                    "COLUMN": s["FLAG_COLUMN"], "RUN_FLAG": s["RUN_FLAG"], "SHARDS": s["SCAN_SHARDS"], "FLAG_MODE": mode,
+                    "FLAG_PARENT": parent, "FLAG_RULE": s["FLAG_RULE"], "TIMEBIN": s["TIMEBIN"], "FLAG_STORE": s["FLAG_CARRY"]},
+                   afterok=[after])
+
+    def applycal(name, job_name, log, script, pattern, cal_dir, extension, delete_previous, afterok=(), aftercorr=()):
+        return add(name, script, s["ARRAY_SPEC"], job_name, log, "02:00:00", s["SC_CPUS"], s["SC_MEM"],
+                   {"PATTERN": pattern, **casa, "SCRIPT": "applycal_ms_beams.py", "CAL_DIR": cal_dir, "EXTENSION": extension,
+                    "DELETE_PREVIOUS": delete_previous, "ENGINE": s["APPLY_ENGINE"], "SHARE_PARENT": s["SHARE_PARENT"]},
+                   afterok=afterok, aftercorr=aftercorr, engine=s["APPLY_ENGINE"])
+
+    def wsclean(name, pattern, img_tag, opts, idx, fits_mask_tag, aftercorr):
+        return add(name, s["RUN_WSCLEAN"], s["ARRAY_SPEC"], "wsclean_ms", "wsclean", "04:00:00", s["WSCLEAN_CPUS"], s["WSCLEAN_MEM"],
+                   {"PATTERN": pattern, "FLINT_WSCLEAN_SIF": s["FLINT_WSCLEAN_SIF"], "IMG_TAG": img_tag, "INDEX": str(idx),
+                    "BIND_SRC": s["BIND_SRC"], "WSCLEAN_OPTS": opts, "FITS_MASK_TAG": fits_mask_tag}, aftercorr=aftercorr)
+
+    def flintmask(name, pattern, img_tag, idx, after):
+        return add(name, s["RUN_FLINT_MASK"], s["ARRAY_SPEC"], "flint_mask", "flint_mask", "00:30:00", s["FM_CPUS"], s["FM_MEM"],
+                   {"SELFCAL": "1", "PATTERN": pattern, "IMG_TAG": img_tag, "INDEX": str(idx),
+                    "FLOOD_FILL_POSITIVE_SEED_CLIP": s["FLOOD_FILL_POSITIVE_SEED_CLIP"],
+                    "FLOOD_FILL_POSITIVE_FLOOD_CLIP": s["FLOOD_FILL_POSITIVE_FLOOD_CLIP"],
+                    "FLOOD_FILL_MAC_BOX_SIZE": s["FLOOD_FILL_MAC_BOX_SIZE"],
+                    "BEAM_SHAPE_ERODE_MIN_RESPONSE": s["BEAM_SHAPE_ERODE_MIN_RESPONSE"]}, aftercorr=[after])
+
+    def crystalball(name, pattern, img_tag, idx, selfcal_flag, after):
+        return add(name, s["RUN_CB"], s["ARRAY_SPEC"], "cb_predict", "crystalball", s["CB_TIME"], s["CB_CPUS"], s["CB_MEM"],
+                   {"SELFCAL": selfcal_flag, "PATTERN": pattern, "IMG_TAG": img_tag, "OUTPUT_COLUMN": s["CB_OUTPUT_COLUMN"],
+                    "INDEX": str(idx), "NUM_WORKERS": s["CB_NUM_WORKERS"], "ROW_CHUNKS": s["CB_ROW_CHUNKS"],
+                    "MODEL_CHUNKS": s["CB_MODEL_CHUNKS"], "MEMORY_FRACTION": s["CB_MEMORY_FRACTION"],
+                    "PREDICT_ENGINE": s["CB_ENGINE"], "PREDICT_INCREMENTAL": s["CB_INCREMENTAL"],
+                    "MAX_DELTA_FRACTION": s["CB_MAX_DELTA_FRACTION"]}, aftercorr=[after], engine=s["CB_ENGINE"])
+
+    def selfcal(name, pattern, r, after):
+        return add(name, s["RUN_SELFCAL"], s["ARRAY_SPEC"], "selfcal_ms", "selfcal", "02:00:00", s["SC_CPUS"], s["SC_MEM"],
+                   {"PATTERN": pattern, **casa, "SCRIPT": "selfcal_ms_beams.py", "INDEX": s["SC_INDEX"][r],
+                    "CALMODE": s["SC_CALMODE"][r], "SOLINT": s["SC_SOLINT"][r], "FIELD": s["SC_FIELD"], "SPW": s["SC_SPW"],
+                    "REFANT": s["SC_REFANT"], "COMBINE": s["SC_COMBINE"], "MINSNR": s["SC_MINSNR"], "PARANG": s["SC_PARANG"],
+                    "CALTABLE_PREFIX": s["SC_PREFIX"][r], "PLOT_DIR": "plots", "APPLY_CALWT": s["SC_APPLY_CALWT"],
+                    "SOLVER": s["SC_SOLVER"], "APPLY_ENGINE": s["APPLY_ENGINE"], "SHARE_PARENT": s["SHARE_PARENT"]},
+                   aftercorr=[after], engine=s["APPLY_ENGINE"])
+
+    def uvsub(name, pattern, idx, ext, selfcal_flag, after):
+        return add(name, s["RUN_UVSUB"], s["ARRAY_SPEC"], "uvsub_ms", "uvsub", "02:00:00", s["SC_CPUS"], s["SC_MEM"],
+                   {"SELFCAL": selfcal_flag, "PATTERN": pattern, **casa, "SCRIPT": "uvsub_ms_beams.py", "INDEX": str(idx),
+                    "EXTENSION": ext, "OUT_PREFIX": s["UVSUB_OUT_PREFIX"], "UVSUB_MODE": s["UVSUB_MODE"],
+                    "SHARE_PARENT": s["SHARE_PARENT"]}, aftercorr=[after], engine=s["UVSUB_MODE"])
+
+    # ---- per-scan stages (whole-array dependencies) ----
+    if s["INGEST_MODE"] == "fused":
+        last = add("ingest", s["RUN_INGEST"], s["BIGARRAY_SPEC"], "ingest_array", "ingest", scan_time("00:45:00", per_scan), s["INGEST_CPUS"], s["INGEST_MEM"],
+                   {"UVFITS_PATTERN": s["UVFITS_PATTERN"], "SCRIPT_DIR": s["SCRIPT_DIR"], "CAL_DIR": "cal", "EXTENSION": "B0",
+                    "FLAG_COLUMN": s["FLAG_COLUMN"], "FLAG_STORE": s["FLAG_CARRY"], "SHARDS": s["SCAN_SHARDS"],
+                    "INGEST_WORKERS": s["SCAN_WORKERS"], **casa})
+    else:
+        imp = add("import", s["RUN_IMPORT"], s["BIGARRAY_SPEC"], "importuvfits_array", "importuvfits", scan_time("00:10:00", per_scan), s["IMPORT_CPUS"], s["IMPORT_MEM"],
+                  {"UVFITS_PATTERN": s["UVFITS_PATTERN"], "IMPORT_SCRIPT": s["IMPORT_SCRIPT"], "IMPORT_ENGINE": s["IMPORT_ENGINE"],
+                   "SHARDS": s["SCAN_SHARDS"], "IMPORT_WORKERS": s["SCAN_WORKERS"], **casa})
+        fl1 = flag("flag_raw", "20??*/*beam*.20????????????.ms", imp)
+        bp = applycal("bandpass", "bandpass_ms", "bandpass", s["RUN_BANDPASS"], "20??*/*beam{beam:02d}*.20????????????.ms", "cal", "B0",
+                      "--delete-previous", afterok=[fl1])
+        last = flag("flag_calB0", "20??*/*beam*.20????????????.calB0.ms", bp, "changed", ".calB0.ms:.ms")
+    av = add("average", s["RUN_AVERAGE"], s["BIGARRAY_SPEC"], "average_array", "average", scan_time("01:00:00", per_scan), s["AVERAGE_CPUS"], s["AVERAGE_MEM"],
+             {"PATTERN": "20??*/*beam*.20????????????.calB0.ms", "SCRIPT_DIR": s["SCRIPT_DIR"], "SCRIPT": s["AVERAGE_SCRIPT"],
+              "PYTHON": s["AVERAGE_PYTHON"], "TIMEBIN": s["TIMEBIN"], "CHANBIN": s["CHANBIN"], "AVERAGE_ENGINE": s["AVERAGE_ENGINE"],
+              "SHARDS": s["SCAN_SHARDS"], "AVERAGE_MS_WORKERS": s["SCAN_WORKERS"]},
+             afterok=[last], engine=s["AVERAGE_ENGINE"])
+    fl3 = flag("flag_avg", "20??*/*beam*.20????????????.avg.calB0.ms", av, "inherit", ".avg.calB0.ms:.calB0.ms")
+    cat = add("concat", s["RUN_CONCAT"], s["ARRAY_SPEC"], "concat_ms", "concat", "01:00:00", s["CONCAT_CPUS"], s["CONCAT_MEM"],
+              {"OUT_ROOT": s["OUT_ROOT"], "PATTERN": "20??*/*beam{beam:02d}*.20????????????.avg.calB0.ms",
+               "PYTHON": s["CONCAT_PYTHON"], "SCRIPT": s["CONCAT_SCRIPT"], "CONCAT_ENGINE": s["CONCAT_ENGINE"]}, afterok=[fl3])
+
+    # ---- per-beam self-cal loop (array task i = beam i throughout) ----
+    beam_ms = "*beam{beam:02d}.avg.calB0.ms"
+    tags, opts, sc_index = s["IMG_TAGS"], s["WSCLEAN_OPTS"], s["SC_INDEX"]
+    nrounds = len(sc_index)
+    idx0 = int(sc_index[0]) - 1
+    img = wsclean("wsclean_initial_scratch", beam_ms, "initial_scratch", opts[0], idx0, "", aftercorr=[cat])
+    mask = flintmask("mask_initial_scratch", beam_ms, "initial_scratch", idx0, img)
+    img = wsclean(f"wsclean_{tags[0]}", beam_ms, tags[0], opts[0], idx0, "initial_scratch", aftercorr=[mask])
+    mask = flintmask(f"mask_{tags[0]}", beam_ms, tags[0], idx0, img)
+    cb = crystalball(f"crystalball_{tags[0]}", beam_ms, tags[0], idx0, "1", mask)
+    for r in range(1, nrounds + 1):
+        sc = selfcal(f"selfcal_{sc_index[r - 1]}", beam_ms, r - 1, cb)
+        # round r images the selfcal_<r> MS inside the previous round's mask (which selfcal already waited for)
+        idx = int(sc_index[r]) - 1 if r < nrounds else int(sc_index[-1])
+        img = wsclean(f"wsclean_{tags[r]}", beam_ms, tags[r], opts[r], idx, tags[r - 1], aftercorr=[sc])
+        mask = flintmask(f"mask_{tags[r]}", beam_ms, tags[r], idx, img)
+        cb = crystalball(f"crystalball_{tags[r]}", beam_ms, tags[r], idx, "1", mask)
+    last_idx = int(sc_index[-1])
+    sub = uvsub("uvsub_continuum", beam_ms, last_idx, "B0", "1", cb)
+
+    # ---- self-cal solutions back onto the native-resolution scans of each beam ----
+    chain = ",".join(f"G{i}" for i in sc_index)
+    ac = applycal("applycal_native", "applycal_ms", "applycal", s["RUN_APPLYCAL"], "20??*/*beam{beam:02d}*.20????????????.calB0.ms",
+                  "caltables", chain, "", aftercorr=[sub])
+    native_ms = f"20??*/*beam{{beam:02d}}*.20????????????.calG{sc_index[-1]}.ms"
+    cb = crystalball("crystalball_native", native_ms, tags[nrounds], last_idx, "0", ac)
+    sub = uvsub("uvsub_native", native_ms, last_idx, f"G{sc_index[-1]}", "0", cb)
+
+    # ---- snapshot imaging of the native-resolution residuals (SNAPSHOT_SHARDS array tasks per beam) ----
+    if s["SNAPSHOT_TIMESTEP"]:
+        shards = int(s["SNAPSHOT_SHARDS"])
+        residual_ms = native_ms if s["UVSUB_MODE"] == "inplace" else native_ms.replace(".ms", f".{s['UVSUB_OUT_PREFIX']}.ms")
+        # each beam is planned once, then every imaging shard of the beam reads that plan
+        plan = add("snapshot_plan", s["RUN_SNAPSHOT"], s["ARRAY_SPEC"], "snapshot_plan", "snapshot_plan", s["SNAPSHOT_PLAN_TIME"],
+                   "2", s["SNAPSHOT_PLAN_MEM"],
+                   {"PATTERN": residual_ms, "SCRIPT_DIR": s["SCRIPT_DIR"], **casa, "SNAPSHOT_STEP": "plan",
+                    "SNAPSHOT_TIMESTEP": s["SNAPSHOT_TIMESTEP"]}, aftercorr=[sub])
+        add("snapshot", s["RUN_SNAPSHOT"], shard_array_spec(s["ARRAY_SPEC"], shards), "snapshot_ms", "snapshot", s["SNAPSHOT_TIME"],
+            s["SNAPSHOT_CPUS"], s["SNAPSHOT_MEM"],
+            {"PATTERN": residual_ms, "SCRIPT_DIR": s["SCRIPT_DIR"], "FLINT_WSCLEAN_SIF": s["FLINT_WSCLEAN_SIF"],
+             "BIND_SRC": s["BIND_SRC"], "SNAPSHOT_STEP": "image", "SNAPSHOT_SHARDS": str(shards),
+             "SNAPSHOT_WORKERS": s["SNAPSHOT_WORKERS"], "SNAPSHOT_OPTS": s["SNAPSHOT_OPTS"]},
+            # with shards the task indices no longer match the beams of the plan array
+            afterok=[plan] if shards > 1 else (), aftercorr=[plan] if shards == 1 else ())
+    return tasks
+
+
+def sbatch_command(task, dep_ids):
+    """sbatch argv for ``task``; ``dep_ids`` maps task names to submitted job ids."""
+    deps = [f"afterok:{dep_ids[d]}" for d in task.afterok] + [f"aftercorr:{dep_ids[d]}" for d in task.aftercorr]
+    cmd = ["sbatch", "--parsable", f"--array={task.array}", f"--job-name={task.job_name}", f"--time={task.time}",
+           f"--cpus-per-task={task.cpus}", f"--mem={task.mem}",
+           f"--output=logs/{task.log}_%A_%a.out", f"--error=logs/{task.log}_%A_%a.err"]
+    if deps:
+        cmd.append("--dependency=" + ",".join(deps))
+    if task.signal:
+        cmd += ["--requeue", f"--signal={task.signal}"]
+    # values go through the environment: some (extension chains, WSClean options) contain commas
+    cmd += ["--export=ALL", task.script]
+    return cmd
+
+
+def record_submit(task, ids):
+    """Append the ``submit`` telemetry record of ``task`` (job id ``ids[task.name]``) for telemetry_report.py."""
+    if task.env.get("TELEMETRY"):
+        write_record({"kind": "submit", "task": task.name, "job_id": ids[task.name], "array": task.array,
+                      "afterok": [ids[d] for d in task.afterok], "aftercorr": [ids[d] for d in task.aftercorr],
+                      "ts": time.time()}, path=task.env["TELEMETRY"])
+
+
+def submit_slurm(tasks, dry_run=False):
+    """Submit every task with sbatch (or print the commands) and return name -> job id."""
+    ids = {}
+    for n, task in enumerate(tasks):
+        cmd = sbatch_command(task, ids)
+        if dry_run:
+            exports = " ".join(f"{k}={v!r}" for k, v in task.env.items())
+            print(f"[{task.name}] {exports} {' '.join(cmd)}")
+            ids[task.name] = f"<{task.name}>"
+            continue
+        result = subprocess.run(cmd, env={**os.environ, **task.env}, capture_output=True, text=True)
+        jid = result.stdout.strip().split(";")[0]
+        if result.returncode != 0 or not jid:
+            print(f"sbatch not successful for {task.name}: {result.stderr.strip()}", file=sys.stderr)
+            sys.exit(1)
+        ids[task.name] = jid
+        record_submit(task, ids)
+        print(f"submitted {task.name} {jid}")
+    return ids
+
+
+def run_local(tasks, workers=1, log_dir="logs"):
+    """Run the DAG as local subprocesses, one per array task, honouring afterok/aftercorr.
+
+    A task whose dependency failed is cancelled, like Slurm's
+    DependencyNeverSatisfied.
+
+    Returns:
+        dict: (task name, array index) -> "ok", "failed" or "cancelled"
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    by_name = {t.name: t for t in tasks}
+    job_ids = {t.name: str(1000 + n) for n, t in enumerate(tasks)}
+    for task in tasks:
+        record_submit(task, job_ids)
+    units = [(t.name, i) for t in tasks for i in parse_array_spec(t.array)]
+    indices = {t.name: set(parse_array_spec(t.array)) for t in tasks}
+    state = {}
+
+    def blockers(name, i):
+        """(pending deps, failed deps) of one array task"""
+        task = by_name[name]
+        deps = [(d, j) for d in task.afterok for j in indices[d]]
+        deps += [(d, i) for d in task.aftercorr if i in indices[d]]
+        pending = [u for u in deps if state.get(u) in (None, "running")]
+        failed = [u for u in deps if state.get(u) in ("failed", "cancelled")]
+        return pending, failed
+
+    def run_unit(name, i):
+        task = by_name[name]
+        env = {**os.environ, **task.env, "SLURM_JOB_ID": job_ids[name], "SLURM_ARRAY_JOB_ID": job_ids[name],
+               "SLURM_ARRAY_TASK_ID": str(i), "SLURM_CPUS_PER_TASK": str(task.cpus), "SLURM_JOB_NAME": task.job_name}
+        stem = os.path.join(log_dir, f"{task.log}_{job_ids[name]}_{i}")
+        with open(f"{stem}.out", "w") as out, open(f"{stem}.err", "w") as err:
+            return subprocess.run(["bash", task.script], env=env, stdout=out, stderr=err).returncode
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            for unit in units:
+                if unit in state:
+                    continue
+                pending, failed = blockers(*unit)
+                if failed:
+                    state[unit] = "cancelled"
+                    print(f"cancelled {unit[0]}[{unit[1]}]: dependency {failed[0][0]}[{failed[0][1]}] did not succeed")
+                elif not pending and len(running) < workers:
+                    state[unit] = "running"
+                    running[pool.submit(run_unit, *unit)] = unit
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = running.pop(future)
+                rc = future.result()
+                state[unit] = "ok" if rc == 0 else "failed"
+                print(f"{'done' if rc == 0 else 'FAILED'} {unit[0]}[{unit[1]}]" + ("" if rc == 0 else f" (exit {rc})"), flush=True)
+    return state
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Submit the pipeline as a DAG with per-beam (aftercorr) dependencies.")
+    p.add_argument("--executor", choices=["slurm", "dry-run", "local"], default="slurm", help="Where to run the tasks.")
+    p.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_config.sh"),
+                   help="Settings file to source (pipeline_config.sh).")
+    p.add_argument("--local-workers", type=int, default=1, help="Concurrent array tasks for --executor local.")
+    p.add_argument("--skip-symlink", action="store_true", help="Do not run symlink_uvfits.sh first.")
+    p.add_argument("--list", action="store_true", help="Print the DAG and exit.")
+    return p.parse_args()
+
+
+def pipeline_settings(config):
+    """Settings of ``config`` with the per-scan array spec sized to the UVFITS files on disk, as pipeline.sh does."""
+    settings = load_settings(config)
+    n = len(glob.glob(os.path.join(settings["DATA_ROOT"], settings["SBID"], "202*", "*.uvfits")))
+    settings["SCANS_PER_TASK"] = 1
+    if settings["SCAN_SHARDS"]:
+        # one array task per shard of scans, each processing its slice in one interpreter
+        shards = int(settings["SCAN_SHARDS"])
+        settings["BIGARRAY_SPEC"] = f"0-{shards - 1}"
+        settings["SCANS_PER_TASK"] = max(-(-n // shards), 1)
+    elif not os.environ.get("BIGARRAY_SPEC"):
+        settings["BIGARRAY_SPEC"] = f"0-{max(n - 1, 0)}"
+    return settings
+
+
+def main():
+    args = parse_args()
+    settings = pipeline_settings(args.config)
+    tasks = build_dag(settings)
+
+    if args.list:
+        for task in tasks:
+            deps = [f"afterok:{d}" for d in task.afterok] + [f"aftercorr:{d}" for d in task.aftercorr]
+            print(f"{task.name:28s} {task.script:28s} array={task.array:8s} {' '.join(deps)}")
+        return
+    if settings["SIZING"]:
+        from resource_sizing import size_dag
+        tasks = size_dag(tasks, settings, record=args.executor != "dry-run")
+
+    os.makedirs("logs", exist_ok=True)
+    os.makedirs("plots", exist_ok=True)
+    if not args.skip_symlink and args.executor != "dry-run":
+        subprocess.run(["./symlink_uvfits.sh", settings["SBID"]], check=True)
+
+    if args.executor == "local":
+        t0 = time.perf_counter()
+        state = run_local(tasks, workers=args.local_workers)
+        bad = sorted(u for u, st in state.items() if st != "ok")
+        print(f"local run finished in {time.perf_counter() - t0:.0f}s: {len(state) - len(bad)}/{len(state)} array tasks succeeded")
+        sys.exit(2 if bad else 0)
+    submit_slurm(tasks, dry_run=args.executor == "dry-run")
+    print("Pipeline submitted.")
+
+
+if __name__ == "__main__":
+    main()
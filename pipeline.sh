@@ -1,125 +1,77 @@
 #!/bin/bash
 set -euo pipefail
 
-# -------------------- USER DEFAULTS (override via env or edit) --------------------
-USER=$( whoami )
-SBID=${SBID:-SB77974}
-DATA_ROOT=${DATA_ROOT:-/fred/oz451/"${USER}"/data}
-UVFITS_PATTERN=${UVFITS_PATTERN:-"20??*/*beam*.uvfits"}             # relative under DATA_ROOT/SBID
-PATTERN=${PATTERN:-"*beam{beam:02d}*.avg.calB0.ms"}             # relative under DATA_ROOT/SBID
-BIND_SRC=${BIND_SRC:-/fred/oz451}
-
-FLINT_WSCLEAN_SIF=${FLINT_WSCLEAN_SIF:-/fred/oz451/containers/flint-containers_wsclean.sif}
-FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/containers/flint-containers_casa.sif}
-
-IMPORT_SCRIPT=${IMPORT_SCRIPT:-import_array.py}
-RUN_IMPORT=${RUN_IMPORT:-run_import.sh}
-IMPORT_CPUS=${IMPORT_CPUS:-2}
-IMPORT_MEM=${IMPORT_MEM:-1G}
-
-FLAG_SCRIPT=${FLAG_SCRIPT:-flag.sh}
-RUN_FLAG=${RUN_FLAG:-run_flag.sh}
-FLAG_COLUMN="DATA"
-FLAG_CPUS=${FLAG_CPUS:-4}
-FLAG_MEM=${FLAG_MEM:-12G}
-SCRIPT_DIR=${SCRIPT_DIR:-/fred/oz451/$USER/scripts/lotrun_processing}
-
-AVERAGE_SCRIPT=${AVERAGE_SCRIPT:-average_ms_beams.py}
-AVERAGE_PYTHON=${AVERAGE_PYTHON:-"apptainer exec --bind /fred/oz451:/fred/oz451 /fred/oz451/${USER}/containers/flint-containers_casa.sif python3"}
-TIMEBIN=${TIMEBIN:-"9.90s"}
-RUN_AVERAGE=${RUN_AVERAGE:-run_average_beams.sh}
-AVERAGE_CPUS=${AVERAGE_CPUS:-4}
-AVERAGE_MEM=${AVERAGE_MEM:-4G}
-
-OUT_ROOT=${OUT_ROOT:-/fred/oz451/$USER/data}
-PATTERN=${PATTERN:-"20??*/*beam{beam:02d}*.20????????????.avg.ms"}
-CONCAT_PYTHON=${CONCAT_PYTHON:-"apptainer exec --bind /fred/oz451:/fred/oz451 /fred/oz451/$USER/containers/flint-containers_casa.sif python3"}
-CONCAT_SCRIPT=${CONCAT_SCRIPT:-concat_ms_beams.py}
-RUN_CONCAT=${RUN_CONCAT:-run_concat_beams.sh}
-CONCAT_CPUS=${CONCAT_CPUS:-4}
-CONCAT_MEM=${CONCAT_MEM:-16G}
-
-# -------------------------------------------------------
-
-RUN_WSCLEAN=${RUN_WSCLEAN:-run_wsclean_beams.sh}
-RUN_CB=${RUN_CB:-run_crystalball_beams.sh}
-RUN_SELFCAL=${RUN_SELFCAL:-run_selfcal_beams.sh}
-RUN_APPLYCAL=${RUN_APPLYCAL:-run_applycal_beams.sh}
-RUN_BANDPASS=${RUN_BANDPASS:-run_applycal_beams.sh}
-RUN_UVSUB=${RUN_UVSUB:-run_uvsub_beams.sh}
-RUN_FLINT_MASK=${RUN_FLINT_MASK:-run_flintmask_beams.sh}
-RUN_CLEARCAL=${RUN_CLEARCAL:-run_clearcal_beams.sh}
-
-ARRAY_SPEC=${ARRAY_SPEC:-0-35}
-BIGARRAY_SPEC=${BIGARRAY_SPEC:-0-500}
-WSCLEAN_CPUS=${WSCLEAN_CPUS:-4}
-WSCLEAN_MEM=${WSCLEAN_MEM:-16G}
-SC_CPUS=${SC_CPUS:-8}
-SC_MEM=${SC_MEM:-4G}
-FM_CPUS=${FM_CPUS:-1}
-FM_MEM=${FM_MEM:-1G}
-
-
-# Crystalball defaults
-CB_TIME=${CB_TIME:-"03:15:00"}
-CB_CPUS=${CB_CPUS:-32}
-CB_MEM=${CB_MEM:-54G}
-CB_OUTPUT_COLUMN=${CB_OUTPUT_COLUMN:-MODEL_DATA}
-CB_NUM_WORKERS=${CB_NUM_WORKERS:-2048} #i have no clue why 2048 speeds up things despite only having 32 cpus but whtever
-CB_ROW_CHUNKS=${CB_ROW_CHUNKS:-0}
-CB_MODEL_CHUNKS=${CB_MODEL_CHUNKS:-0}
-CB_MEMORY_FRACTION=${CB_MEMORY_FRACTION:-0.8}
-
-#flint_masking defaults
-FLOOD_FILL_POSITIVE_SEED_CLIP=${FLOOD_FILL_POSITIVE_SEED_CLIP:-1.1}
-FLOOD_FILL_POSITIVE_FLOOD_CLIP=${FLOOD_FILL_POSITIVE_FLOOD_CLIP:-0.7}
-FLOOD_FILL_MAC_BOX_SIZE=${FLOOD_FILL_MAC_BOX_SIZE:-350}
-BEAM_SHAPE_ERODE_MIN_RESPONSE=${BEAM_SHAPE_ERODE_MIN_RESPONSE:-0.75}
-
-# CASA self-cal defaults
-SC_FIELD=${SC_FIELD:-""}
-SC_SPW=${SC_SPW:-""}
-SC_REFANT=${SC_REFANT:-""}
-SC_COMBINE=${SC_COMBINE:-scan}
-SC_MINSNR=${SC_MINSNR:-3.0}
-SC_PARANG=${SC_PARANG:-""}          # set non-empty to enable
-SC_APPLY_CALWT=${SC_APPLY_CALWT:-False} #was True
-
-# -------------------- PIPELINE CONFIG (round-specific params) --------------------
-
-UVSUB_OUT_PREFIX=${UVSUB_OUT_PREFIX:-"uvsub"}
-
-# IMG_TAG per round (0 = initial pre-selfcal imaging; 1..4 are successive re-imaging passes
-declare -a IMG_TAGS=("initial" "selfcal_1" "selfcal_2" "selfcal_3" "selfcal_4" "selfcal_5" "selfcal_6")
-
-# WSClean options per round (round 0 can use a shallower set; others deepen progressively)
-declare -a WSCLEAN_OPTS
-WSCLEAN_OPTS[0]="${WSCLEAN_OPTS0:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 25000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 3 -auto-mask 15.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[1]="${WSCLEAN_OPTS1:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 2 -auto-mask 15.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[2]="${WSCLEAN_OPTS2:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 8.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[3]="${WSCLEAN_OPTS3:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[4]="${WSCLEAN_OPTS4:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 3.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[5]="${WSCLEAN_OPTS5:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 0.5 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-WSCLEAN_OPTS[6]="${WSCLEAN_OPTS6:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 0.5 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
-
-# Self-cal rounds: index, mode, solint, caltable prefix (only rounds 1..4 have self-cal; 4 = amplitude+phase)
-# declare -a SC_INDEX=(1 2 3 4)
-# declare -a SC_CALMODE=("p" "p" "p" "ap")
-# declare -a SC_SOLINT=("480s" "300s" "120s" "600s")
-# declare -a SC_PREFIX=("selfcal1_p" "selfcal2_p" "selfcal3_p" "selfcal4_ap")
-
-declare -a SC_INDEX=(1 2 3 4 5 6)
-declare -a SC_CALMODE=("p" "p" "p" "p" "ap" "ap")
-declare -a SC_SOLINT=("480s" "300s" "120s" "30s" "600s" "300s")
-declare -a SC_PREFIX=("selfcal1_p" "selfcal2_p" "selfcal3_p" "selfcal4_p" "selfcal5_ap" "selfcal6_ap" )
+# settings (defaults, containers, per-round WSClean/self-cal parameters) live in pipeline_config.sh;
+# orchestrate.py submits the same steps with per-beam (aftercorr) dependencies
+source "$(dirname "${BASH_SOURCE[0]}")/pipeline_config.sh"
+
 
 # -------------------- HELPERS --------------------
 
+# wall time of a per-scan array task: the one-scan limit times the scans each task handles
+scan_time() {
+  local h m s total
+  IFS=: read -r h m s <<< "$1"
+  total=$(( (10#${h}*3600 + 10#${m}*60 + 10#${s}) * SCANS_PER_TASK ))
+  printf '%02d:%02d:%02d' $(( total / 3600 )) $(( total % 3600 / 60 )) $(( total % 60 ))
+}
+
+# append a submit record (task name, job id, the job it waits for) to ${TELEMETRY} so telemetry_report.py
+# can rebuild the dependency chain; prints nothing, as the submit_* output is the job id
+record_submit() {
+  local task="$1" jid="$2" dep="${3:-}"
+  [[ -z "${TELEMETRY}" || -z "${jid}" ]] && return 0
+  TELEMETRY="${TELEMETRY}" python3 "$(dirname "${BASH_SOURCE[0]}")/telemetry.py" submit --task "${task}" --job-id "${jid}" ${dep:+--afterok "${dep}"} >&2 || true
+}
+
+# array spec of the snapshot job: SNAPSHOT_SHARDS consecutive tasks for every beam of ARRAY_SPEC (a lo-hi range,
+# optionally with a %N limit on the running tasks, which is kept)
+snapshot_array() {
+  local lo hi limit=""
+  [[ "${ARRAY_SPEC}" == *%* ]] && limit="%${ARRAY_SPEC#*%}"
+  IFS=- read -r lo hi <<< "${ARRAY_SPEC%%\%*}"
+  echo "$(( lo * SNAPSHOT_SHARDS ))-$(( (${hi:-$lo} + 1) * SNAPSHOT_SHARDS - 1 ))${limit}"
+}
+
+# sbatch flags of a stage whose native writes are journaled, as "requeue_opts ENGINE" with the stage's engine setting:
+# with RESUME_WRITES and a journaling engine (native, or stream for uvsub) Slurm sends the batch shell USR1
+# RESUME_SIGNAL_S seconds before the time limit and requeue.sh requeues the task; prints nothing otherwise, as an
+# untrapped USR1 would kill the wrapper
+requeue_opts() {
+  if [[ -n "${RESUME_WRITES}" && ( "$1" == native || "$1" == stream ) ]]; then
+    echo "--requeue --signal=B:USR1@${RESUME_SIGNAL_S}"
+  fi
+}
+
+# sbatch an array job as "sized_sbatch TASK ARRAY TIME CPUS MEM SBATCH_ARGS..." and print its job id. With SIZING=fit,
+# resource_sizing.py splits the array into groups of tasks with equal requests sized from past runs, one job per
+# group, and the ids are printed joined by ':' (as afterok accepts them); SIZING=record only records the task sizes
+sized_sbatch() {
+  local task="$1" array="$2" time="$3" cpus="$4" mem="$5" plan indices g_cpus g_mem g_time jid
+  local -a ids=()
+  shift 5
+  plan="${array} ${cpus} ${mem} ${time}"
+  if [[ -n "${SIZING}" ]]; then
+    plan=$(TELEMETRY="${TELEMETRY}" python3 "$(dirname "${BASH_SOURCE[0]}")/resource_sizing.py" plan --mode "${SIZING}" \
+             --task "${task}" --array "${array}" --time "${time}" --cpus "${cpus}" --mem "${mem}" \
+             --root "${DATA_ROOT}/${SBID}" --uvfits-pattern "${UVFITS_PATTERN}" ${SCAN_SHARDS:+--shards "${SCAN_SHARDS}"} \
+             --groups "${SIZING_GROUPS}" ${SIZING_CPUS:+--fit-cpus} --history "${SIZING_HISTORY}") \
+      || plan="${array} ${cpus} ${mem} ${time}"
+  fi
+  while read -r indices g_cpus g_mem g_time; do
+    jid=$(sbatch --array="${indices}" --time="${g_time}" --cpus-per-task="${g_cpus}" --mem="${g_mem}" "$@" | awk '{print $4}')
+    [[ -z "${jid}" ]] && return 0    # prints nothing: the caller reports the failed submission
+    ids+=("${jid}")
+  done <<< "${plan}"
+  ( IFS=:; echo "${ids[*]}" )
+}
+
 
 submit_importuvfits() {
   local dep jid
   dep="${1:-}"
-  jid=$(sbatch --array="${BIGARRAY_SPEC}" --job-name=importuvfits_array --time=00:10:00 --cpus-per-task="${IMPORT_CPUS}" --mem="${IMPORT_MEM}" --output=logs/importuvfits_%A_%a.out --error=logs/importuvfits_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",UVFITS_PATTERN="${UVFITS_PATTERN}",IMPORT_SCRIPT="${IMPORT_SCRIPT}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}" "${RUN_IMPORT}" | awk '{print $4}')
+  jid=$(sized_sbatch "import" "${BIGARRAY_SPEC}" "$(scan_time 00:10:00)" "${IMPORT_CPUS}" "${IMPORT_MEM}" --job-name=importuvfits_array --output=logs/importuvfits_%A_%a.out --error=logs/importuvfits_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",UVFITS_PATTERN="${UVFITS_PATTERN}",IMPORT_SCRIPT="${IMPORT_SCRIPT}",IMPORT_ENGINE="${IMPORT_ENGINE}",SHARDS="${SCAN_SHARDS}",IMPORT_WORKERS="${SCAN_WORKERS}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}" "${RUN_IMPORT}")
+  record_submit "import" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -128,10 +80,26 @@ submit_importuvfits() {
 }
 
 
-submit_flag() {
-  local dep jid pattern
+submit_ingest() {
+  local dep jid
   dep="${1:-}"
-  jid=$(sbatch --array="${BIGARRAY_SPEC}" --job-name=aoflagger_array --time=00:30:00 --cpus-per-task="${FLAG_CPUS}" --mem="${FLAG_MEM}" --output=logs/aoflagger_%A_%a.out --error=logs/aoflagger_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",FLAG_SCRIPT="${FLAG_SCRIPT}",COLUMN="${FLAG_COLUMN}",RUN_FLAG="${RUN_FLAG}" "${RUN_FLAG}" | awk '{print $4}')
+  jid=$(sized_sbatch "ingest" "${BIGARRAY_SPEC}" "$(scan_time 00:45:00)" "${INGEST_CPUS}" "${INGEST_MEM}" --job-name=ingest_array --output=logs/ingest_%A_%a.out --error=logs/ingest_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",UVFITS_PATTERN="${UVFITS_PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",CAL_DIR="cal",EXTENSION="B0",FLAG_COLUMN="${FLAG_COLUMN}",FLAG_STORE="${FLAG_CARRY}",SHARDS="${SCAN_SHARDS}",INGEST_WORKERS="${SCAN_WORKERS}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}" "${RUN_INGEST}")
+  record_submit "ingest" "${jid}" "${dep}"
+  echo "${jid}"
+  if [ -z "${jid}" ]; then
+    echo "sbatch not successful. exiting"
+    exit
+  fi
+}
+
+
+submit_flag() {
+  local dep jid pattern mode parent label
+  dep="${1:-}"; mode="${2:-full}"; parent="${3:-}"
+  case "${mode}" in changed) label=flag_calB0 ;; inherit) label=flag_avg ;; *) label=flag_raw ;; esac
+  [[ -z "${FLAG_CARRY}" ]] && mode=full
+  jid=$(sized_sbatch "${label}" "${BIGARRAY_SPEC}" "$(scan_time 00:30:00)" "${FLAG_CPUS}" "${FLAG_MEM}" --job-name=aoflagger_array --output=logs/aoflagger_%A_%a.out --error=logs/aoflagger_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",FLAG_SCRIPT="${FLAG_SCRIPT}",COLUMN="${FLAG_COLUMN}",RUN_FLAG="${RUN_FLAG}",SHARDS="${SCAN_SHARDS}",FLAG_MODE="${mode}",FLAG_PARENT="${parent}",FLAG_RULE="${FLAG_RULE}",TIMEBIN="${TIMEBIN}",FLAG_STORE="${FLAG_CARRY}" "${RUN_FLAG}")
+  record_submit "${label}" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -142,7 +110,8 @@ submit_flag() {
 submit_average() {
   local dep jid
   dep="${1:-}"
-  jid=$(sbatch --array="${BIGARRAY_SPEC}" --job-name=average_array --time=01:00:00 --cpus-per-task="${AVERAGE_CPUS}" --mem="${AVERAGE_MEM}" --output=logs/average_%A_%a.out --error=logs/average_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",SCRIPT="${AVERAGE_SCRIPT}",PYTHON="${AVERAGE_PYTHON}",TIMEBIN="${TIMEBIN}" "${RUN_AVERAGE}" | awk '{print $4}')
+  jid=$(sized_sbatch "average" "${BIGARRAY_SPEC}" "$(scan_time 01:00:00)" "${AVERAGE_CPUS}" "${AVERAGE_MEM}" --job-name=average_array --output=logs/average_%A_%a.out --error=logs/average_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${AVERAGE_ENGINE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",SCRIPT="${AVERAGE_SCRIPT}",PYTHON="${AVERAGE_PYTHON}",TIMEBIN="${TIMEBIN}",CHANBIN="${CHANBIN}",AVERAGE_ENGINE="${AVERAGE_ENGINE}",SHARDS="${SCAN_SHARDS}",AVERAGE_MS_WORKERS="${SCAN_WORKERS}" "${RUN_AVERAGE}")
+  record_submit "average" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -153,7 +122,8 @@ submit_average() {
 submit_concat() {
   local dep jid
   dep="${1:-}"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=concat_ms --time=01:00:00 --cpus-per-task="${CONCAT_CPUS}" --mem="${CONCAT_MEM}" --output=logs/concat_%A_%a.out --error=logs/concat_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",OUT_ROOT="${OUT_ROOT}",PATTERN="${PATTERN}",PYTHON="${CONCAT_PYTHON}",SCRIPT="${CONCAT_SCRIPT}" "${RUN_CONCAT}" | awk '{print $4}')
+  jid=$(sized_sbatch "concat" "${ARRAY_SPEC}" 01:00:00 "${CONCAT_CPUS}" "${CONCAT_MEM}" --job-name=concat_ms --output=logs/concat_%A_%a.out --error=logs/concat_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",OUT_ROOT="${OUT_ROOT}",PATTERN="${PATTERN}",PYTHON="${CONCAT_PYTHON}",SCRIPT="${CONCAT_SCRIPT}",CONCAT_ENGINE="${CONCAT_ENGINE}" "${RUN_CONCAT}")
+  record_submit "concat" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -164,7 +134,8 @@ submit_concat() {
 submit_wsclean() {
   local dep img_tag opts jid idx fits_mask_tag
   dep="${1:-}"; img_tag="$2"; opts="$3"; idx="$4"; fits_mask_tag="${5:-}"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=wsclean_ms --time=04:00:00 --cpus-per-task="${WSCLEAN_CPUS}" --mem="${WSCLEAN_MEM}" --output=logs/wsclean_%A_%a.out --error=logs/wsclean_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_WSCLEAN_SIF="${FLINT_WSCLEAN_SIF}",IMG_TAG="${img_tag}",INDEX="${idx}",BIND_SRC="${BIND_SRC}",WSCLEAN_OPTS="${opts}",FITS_MASK_TAG="${fits_mask_tag}" "${RUN_WSCLEAN}" | awk '{print $4}')
+  jid=$(sized_sbatch "wsclean_${img_tag}" "${ARRAY_SPEC}" 04:00:00 "${WSCLEAN_CPUS}" "${WSCLEAN_MEM}" --job-name=wsclean_ms --output=logs/wsclean_%A_%a.out --error=logs/wsclean_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_WSCLEAN_SIF="${FLINT_WSCLEAN_SIF}",IMG_TAG="${img_tag}",INDEX="${idx}",BIND_SRC="${BIND_SRC}",WSCLEAN_OPTS="${opts}",FITS_MASK_TAG="${fits_mask_tag}" "${RUN_WSCLEAN}")
+  record_submit "wsclean_${img_tag}" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -176,7 +147,8 @@ submit_wsclean() {
 submit_flintmask() {
     local dep img_tag jid idx selfcal_flag
     dep="${1:-}"; img_tag="$2"; idx="$3"; selfcal_flag="$4";
-    jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=flint_mask --time=00:30:00 --cpus-per-task="${FM_CPUS}" --mem="${FM_MEM}" --output=logs/flint_mask_%A_%a.out --error=logs/flint_mask_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",IMG_TAG="${img_tag}",INDEX="${idx}",FLOOD_FILL_POSITIVE_SEED_CLIP="${FLOOD_FILL_POSITIVE_SEED_CLIP}",FLOOD_FILL_POSITIVE_FLOOD_CLIP="${FLOOD_FILL_POSITIVE_FLOOD_CLIP}",FLOOD_FILL_MAC_BOX_SIZE="${FLOOD_FILL_MAC_BOX_SIZE}",BEAM_SHAPE_ERODE_MIN_RESPONSE="${BEAM_SHAPE_ERODE_MIN_RESPONSE}" "${RUN_FLINT_MASK}" | awk '{print $4}' )
+    jid=$(sized_sbatch "mask_${img_tag}" "${ARRAY_SPEC}" 00:30:00 "${FM_CPUS}" "${FM_MEM}" --job-name=flint_mask --output=logs/flint_mask_%A_%a.out --error=logs/flint_mask_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",IMG_TAG="${img_tag}",INDEX="${idx}",FLOOD_FILL_POSITIVE_SEED_CLIP="${FLOOD_FILL_POSITIVE_SEED_CLIP}",FLOOD_FILL_POSITIVE_FLOOD_CLIP="${FLOOD_FILL_POSITIVE_FLOOD_CLIP}",FLOOD_FILL_MAC_BOX_SIZE="${FLOOD_FILL_MAC_BOX_SIZE}",BEAM_SHAPE_ERODE_MIN_RESPONSE="${BEAM_SHAPE_ERODE_MIN_RESPONSE}" "${RUN_FLINT_MASK}")
+    record_submit "mask_${img_tag}" "${jid}" "${dep}"
     echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -186,9 +158,11 @@ submit_flintmask() {
 
 
 submit_crystalball() {
-    local dep img_tag jid idx selfcal_flag
+    local dep img_tag jid idx selfcal_flag label
     dep="${1:-}"; img_tag="$2"; idx="$3"; selfcal_flag="${4:-0}"
-    jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=cb_predict --time="${CB_TIME}" --cpus-per-task="${CB_CPUS}" --mem="${CB_MEM}" --output=logs/crystalball_%A_%a.out --error=logs/crystalball_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",IMG_TAG="${img_tag}",OUTPUT_COLUMN="${CB_OUTPUT_COLUMN}",INDEX="${idx}",NUM_WORKERS="${CB_NUM_WORKERS}",ROW_CHUNKS="${CB_ROW_CHUNKS}",MODEL_CHUNKS="${CB_MODEL_CHUNKS}",MEMORY_FRACTION="${CB_MEMORY_FRACTION}" "${RUN_CB}" | awk '{print $4}')
+    label="crystalball_${img_tag}"; [[ "${selfcal_flag}" == "0" ]] && label=crystalball_native
+    jid=$(sized_sbatch "${label}" "${ARRAY_SPEC}" "${CB_TIME}" "${CB_CPUS}" "${CB_MEM}" --job-name=cb_predict --output=logs/crystalball_%A_%a.out --error=logs/crystalball_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${CB_ENGINE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",IMG_TAG="${img_tag}",OUTPUT_COLUMN="${CB_OUTPUT_COLUMN}",INDEX="${idx}",NUM_WORKERS="${CB_NUM_WORKERS}",ROW_CHUNKS="${CB_ROW_CHUNKS}",MODEL_CHUNKS="${CB_MODEL_CHUNKS}",MEMORY_FRACTION="${CB_MEMORY_FRACTION}",PREDICT_ENGINE="${CB_ENGINE}",PREDICT_INCREMENTAL="${CB_INCREMENTAL}",MAX_DELTA_FRACTION="${CB_MAX_DELTA_FRACTION}" "${RUN_CB}")
+    record_submit "${label}" "${jid}" "${dep}"
     echo "${jid}"
     if [ -z "${jid}" ]; then
 	echo "sbatch not successful. exiting"
@@ -200,7 +174,8 @@ submit_crystalball() {
 submit_bandpass() {
   local dep cal_dir extension jid delete_previous
   dep="${1:-}"; cal_dir="$2"; extension="$3"; delete_previous="$4"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=bandpass_ms --time=02:00:00 --cpus-per-task="${SC_CPUS}" --mem="${SC_MEM}" --output=logs/bandpass_%A_%a.out --error=logs/bandpass_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=applycal_ms_beams.py,CAL_DIR="${cal_dir}",EXTENSION="${extension}",DELETE_PREVIOUS="${delete_previous}" "${RUN_BANDPASS}" | awk '{print $4}')
+  jid=$(sized_sbatch "bandpass" "${ARRAY_SPEC}" 02:00:00 "${SC_CPUS}" "${SC_MEM}" --job-name=bandpass_ms --output=logs/bandpass_%A_%a.out --error=logs/bandpass_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${APPLY_ENGINE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=applycal_ms_beams.py,CAL_DIR="${cal_dir}",EXTENSION="${extension}",DELETE_PREVIOUS="${delete_previous}",ENGINE="${APPLY_ENGINE}",SHARE_PARENT="${SHARE_PARENT}" "${RUN_BANDPASS}")
+  record_submit "bandpass" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -212,7 +187,8 @@ submit_bandpass() {
 submit_applycal() {
   local dep cal_dir extension jid delete_previous
   dep="${1:-}"; cal_dir="$2"; extension="$3"; delete_previous="$4"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=applycal_ms --time=02:00:00 --cpus-per-task="${SC_CPUS}" --mem="${SC_MEM}" --output=logs/applycal_%A_%a.out --error=logs/applycal_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=applycal_ms_beams.py,CAL_DIR="${cal_dir}",EXTENSION="${extension}",DELETE_PREVIOUS="${delete_previous}" "${RUN_APPLYCAL}" | awk '{print $4}')
+  jid=$(sized_sbatch "applycal_native" "${ARRAY_SPEC}" 02:00:00 "${SC_CPUS}" "${SC_MEM}" --job-name=applycal_ms --output=logs/applycal_%A_%a.out --error=logs/applycal_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${APPLY_ENGINE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=applycal_ms_beams.py,CAL_DIR="${cal_dir}",EXTENSION="${extension}",DELETE_PREVIOUS="${delete_previous}",ENGINE="${APPLY_ENGINE}",SHARE_PARENT="${SHARE_PARENT}" "${RUN_APPLYCAL}")
+  record_submit "applycal_native" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -223,7 +199,8 @@ submit_applycal() {
 submit_selfcal() {
   local dep idx calmode solint prefix jid
   dep="${1:-}"; idx="$2"; calmode="$3"; solint="$4"; prefix="$5"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=selfcal_ms --time=02:00:00 --cpus-per-task="${SC_CPUS}" --mem="${SC_MEM}" --output=logs/selfcal_%A_%a.out --error=logs/selfcal_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=selfcal_ms_beams.py,INDEX="${idx}",CALMODE="${calmode}",SOLINT="${solint}",FIELD="${SC_FIELD}",SPW="${SC_SPW}",REFANT="${SC_REFANT}",COMBINE="${SC_COMBINE}",MINSNR="${SC_MINSNR}",PARANG="${SC_PARANG}",CALTABLE_PREFIX="${prefix}",PLOT_DIR="plots",APPLY_CALWT="${SC_APPLY_CALWT}" "${RUN_SELFCAL}" | awk '{print $4}')
+  jid=$(sized_sbatch "selfcal_${idx}" "${ARRAY_SPEC}" 02:00:00 "${SC_CPUS}" "${SC_MEM}" --job-name=selfcal_ms --output=logs/selfcal_%A_%a.out --error=logs/selfcal_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${APPLY_ENGINE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=selfcal_ms_beams.py,INDEX="${idx}",CALMODE="${calmode}",SOLINT="${solint}",FIELD="${SC_FIELD}",SPW="${SC_SPW}",REFANT="${SC_REFANT}",COMBINE="${SC_COMBINE}",MINSNR="${SC_MINSNR}",PARANG="${SC_PARANG}",CALTABLE_PREFIX="${prefix}",PLOT_DIR="plots",APPLY_CALWT="${SC_APPLY_CALWT}",SOLVER="${SC_SOLVER}",APPLY_ENGINE="${APPLY_ENGINE}",SHARE_PARENT="${SHARE_PARENT}" "${RUN_SELFCAL}")
+  record_submit "selfcal_${idx}" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -232,9 +209,33 @@ submit_selfcal() {
 }
 
 submit_uvsub() {
-  local dep idx out_prefix ext jid selfcal_flag
+  local dep idx out_prefix ext jid selfcal_flag label
   dep="${1:-}"; idx="$2"; out_prefix="$3"; ext="$4"; selfcal_flag="$5";
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=uvsub_ms --time=02:00:00 --cpus-per-task="${SC_CPUS}" --mem="${SC_MEM}" --output=logs/uvsub_%A_%a.out --error=logs/uvsub_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=uvsub_ms_beams.py,INDEX="${idx}",EXTENSION="${ext}",OUT_PREFIX="${out_prefix}" "${RUN_UVSUB}" | awk '{print $4}')
+  label=uvsub_continuum; [[ "${selfcal_flag}" == "0" ]] && label=uvsub_native
+  jid=$(sized_sbatch "${label}" "${ARRAY_SPEC}" 02:00:00 "${SC_CPUS}" "${SC_MEM}" --job-name=uvsub_ms --output=logs/uvsub_%A_%a.out --error=logs/uvsub_%A_%a.err ${dep:+--dependency=afterok:${dep}} $(requeue_opts "${UVSUB_MODE}") --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",RESUME_WRITES="${RESUME_WRITES}",RESUME_MAX_REQUEUES="${RESUME_MAX_REQUEUES}",SELFCAL="${selfcal_flag}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=uvsub_ms_beams.py,INDEX="${idx}",EXTENSION="${ext}",OUT_PREFIX="${out_prefix}",UVSUB_MODE="${UVSUB_MODE}",SHARE_PARENT="${SHARE_PARENT}" "${RUN_UVSUB}")
+  record_submit "${label}" "${jid}" "${dep}"
+  echo "${jid}"
+  if [ -z "${jid}" ]; then
+    echo "sbatch not successful. exiting"
+    exit
+  fi
+}
+
+submit_snapshot() {
+  local dep jid
+  dep="${1:-}"
+  # each beam is planned once (one TIME/FLAG pass per MS) by a plan array, then imaged by an array of
+  # SNAPSHOT_SHARDS tasks per beam (task i is beam i / SNAPSHOT_SHARDS) that all read that plan; not sized,
+  # as resource_sizing.py sizes array tasks by beam
+  jid=$(sbatch --array="${ARRAY_SPEC}" --time="${SNAPSHOT_PLAN_TIME}" --cpus-per-task=2 --mem="${SNAPSHOT_PLAN_MEM}" --job-name=snapshot_plan --output=logs/snapshot_plan_%A_%a.out --error=logs/snapshot_plan_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SNAPSHOT_STEP=plan,SNAPSHOT_TIMESTEP="${SNAPSHOT_TIMESTEP}" "${RUN_SNAPSHOT}" | awk '{print $4}')
+  record_submit "snapshot_plan" "${jid}" "${dep}"
+  if [ -z "${jid}" ]; then
+    echo "sbatch not successful. exiting"
+    exit
+  fi
+  dep="${jid}"
+  jid=$(sbatch --array="$(snapshot_array)" --time="${SNAPSHOT_TIME}" --cpus-per-task="${SNAPSHOT_CPUS}" --mem="${SNAPSHOT_MEM}" --job-name=snapshot_ms --output=logs/snapshot_%A_%a.out --error=logs/snapshot_%A_%a.err --dependency=afterok:${dep} --export=ALL,TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",SCRIPT_DIR="${SCRIPT_DIR}",FLINT_WSCLEAN_SIF="${FLINT_WSCLEAN_SIF}",BIND_SRC="${BIND_SRC}",SNAPSHOT_STEP=image,SNAPSHOT_SHARDS="${SNAPSHOT_SHARDS}",SNAPSHOT_WORKERS="${SNAPSHOT_WORKERS}",SNAPSHOT_OPTS="${SNAPSHOT_OPTS}" "${RUN_SNAPSHOT}" | awk '{print $4}')
+  record_submit "snapshot" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -245,7 +246,8 @@ submit_uvsub() {
 submit_clearcal() {
   local dep extension jid
   dep="${1:-}";  extension="$2"
-  jid=$(sbatch --array="${ARRAY_SPEC}" --job-name=clearcal_ms --time=02:00:00 --cpus-per-task="${SC_CPUS}" --mem="${SC_MEM}" --output=logs/clearcal_%A_%a.out --error=logs/clearcal_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=clearcal_ms_beams.py,EXTENSION="${extension}" "${RUN_CLEARCAL}" | awk '{print $4}')
+  jid=$(sized_sbatch "clearcal" "${ARRAY_SPEC}" 02:00:00 "${SC_CPUS}" "${SC_MEM}" --job-name=clearcal_ms --output=logs/clearcal_%A_%a.out --error=logs/clearcal_%A_%a.err ${dep:+--dependency=afterok:${dep}} --export=ALL,STAGE_CACHE="${STAGE_CACHE}",CASA_WORKER="${CASA_WORKER}",MS_LAYOUT="${MS_LAYOUT}",TELEMETRY="${TELEMETRY}",SBID="${SBID}",DATA_ROOT="${DATA_ROOT}",PATTERN="${PATTERN}",FLINT_CASA_SIF="${FLINT_CASA_SIF}",BIND_SRC="${BIND_SRC}",SCRIPT=clearcal_ms_beams.py,EXTENSION="${extension}" "${RUN_CLEARCAL}")
+  record_submit "clearcal" "${jid}" "${dep}"
   echo "${jid}"
   if [ -z "${jid}" ]; then
     echo "sbatch not successful. exiting"
@@ -257,31 +259,45 @@ submit_clearcal() {
 # -------------------- PIPELINE EXECUTION --------------------
 mkdir -p logs plots
 n=$( ls -l ${DATA_ROOT}/${SBID}/202*/*.uvfits  | wc -l )
-BIGARRAY_SPEC="0-$((n-1))"
+if [[ -n "${SCAN_SHARDS}" ]]; then
+  # one array task per shard of scans, each processing its slice in one interpreter
+  BIGARRAY_SPEC="0-$(( SCAN_SHARDS - 1 ))"
+  SCANS_PER_TASK=$(( (n + SCAN_SHARDS - 1) / SCAN_SHARDS ))
+else
+  BIGARRAY_SPEC="0-$((n-1))"
+  SCANS_PER_TASK=1
+fi
 ###
 #steps before selfcal, to add in here for automated processing
 #1. symlink uvfits
 ####
 ./symlink_uvfits.sh "${SBID}"
 
-#2. import uvfits
-jid_imp=$(submit_importuvfits "" )
-echo "submitted importuvfits ${jid_imp}"
-
-#3. run_flag.sh on ms (flag.sh)
-PATTERN="20??*/*beam*.20????????????.ms"    # relative under data-root/SBID
-jid_fl1=$(submit_flag "${jid_imp}" )
-echo "submitted flag ${jid_fl1}"
-
-PATTERN="20??*/*beam{beam:02d}*.20????????????.ms"    # relative under data-root/SBID
-#apply bandpass to the native res
-jid_ac1=$(submit_bandpass "${jid_fl1}" "cal" "B0" "--delete-previous" )
-echo "submitted bandpass ${jid_ac1}"
-
-#now flag bandpass calibrated data
-PATTERN="20??*/*beam*.20????????????.calB0.ms"    # relative under data-root/SBID
-jid_fl2=$(submit_flag "${jid_ac1}" )
-echo "submitted flag ${jid_fl2}"
+if [[ "${INGEST_MODE}" == "fused" ]]; then
+  #2-5. import + bandpass + flag in one pass, straight to .calB0.ms
+  jid_fl2=$(submit_ingest "" )
+  echo "submitted fused ingest ${jid_fl2}"
+  PATTERN="20??*/*beam*.20????????????.calB0.ms"    # relative under data-root/SBID
+else
+  #2. import uvfits
+  jid_imp=$(submit_importuvfits "" )
+  echo "submitted importuvfits ${jid_imp}"
+
+  #3. run_flag.sh on ms (flag.sh)
+  PATTERN="20??*/*beam*.20????????????.ms"    # relative under data-root/SBID
+  jid_fl1=$(submit_flag "${jid_imp}" )
+  echo "submitted flag ${jid_fl1}"
+
+  PATTERN="20??*/*beam{beam:02d}*.20????????????.ms"    # relative under data-root/SBID
+  #apply bandpass to the native res
+  jid_ac1=$(submit_bandpass "${jid_fl1}" "cal" "B0" "--delete-previous" )
+  echo "submitted bandpass ${jid_ac1}"
+
+  #now flag bandpass calibrated data
+  PATTERN="20??*/*beam*.20????????????.calB0.ms"    # relative under data-root/SBID
+  jid_fl2=$(submit_flag "${jid_ac1}" changed ".calB0.ms:.ms" )
+  echo "submitted flag ${jid_fl2}"
+fi
 ####
 
 #6. run_average_beams.sh (average_ms_beams.py)
@@ -289,7 +305,7 @@ jid_av1=$(submit_average "${jid_fl2}" )
 echo "submitted average ${jid_av1}"
 
 PATTERN="20??*/*beam*.20????????????.avg.calB0.ms"    # relative under data-root/SBID
-jid_fl3=$(submit_flag "${jid_av1}" )
+jid_fl3=$(submit_flag "${jid_av1}" inherit ".avg.calB0.ms:.calB0.ms" )
 echo "submitted flag ${jid_fl3}"
 
 PATTERN="20??*/*beam{beam:02d}*.20????????????.avg.calB0.ms"    # relative under data-root/SBID
@@ -387,21 +403,12 @@ echo "submitted continuum uvsub ${jid_sb7}"
 #now applycal selfcal onto highres visibilities, crystalball sky model, and uvsub
 ###
 #step 2: apply selfcal to native res
-jid_ac_old=$jid_sb7
+#G1..G6 are applied to the calB0 MSs in a single applycal pass (tables composed per beam)
 PATTERN="20??*/*beam{beam:02d}*.20????????????.calB0.ms"    # relative under data-root/SBID
-for i in "${SC_INDEX[@]}";
-do
-    if (( i > 1 ))
-    then
-	dp="--delete-previous"
-    else
-	dp=""
-    fi
-    #jid_ac=$(submit_applycal "${jid_ac_old}" "caltables" "G${i}" "${dp}")
-    #echo "submitted craco applycal ${jid_ac}"
-    jid_ac_old=$jid_ac    
-    PATTERN="20??*/*beam{beam:02d}*.20????????????.calG${i}.ms"    # relative under data-root/SBID
-done
+SC_CHAIN=$( IFS=,; echo "${SC_INDEX[*]/#/G}" )
+jid_ac_old=$(submit_applycal "${jid_sb7}" "caltables" "${SC_CHAIN}" "")
+echo "submitted craco applycal ${jid_ac_old}"
+PATTERN="20??*/*beam{beam:02d}*.20????????????.calG${SC_INDEX[-1]}.ms"    # relative under data-root/SBID
 echo $PATTERN
 #step : crystalball model from 2h continuyum beam onto native res beam
 jid_cb=$(submit_crystalball "${jid_ac_old}" "${IMG_TAGS[6]}" "$(( SC_INDEX[5] ))" "0" )
@@ -411,5 +418,13 @@ echo "submitted craco crystalball ${jid_cb}"
 jid_uvs=$(submit_uvsub "${jid_cb}" "${SC_INDEX[5]}" "${UVSUB_OUT_PREFIX}" "G6" "0" )
 echo "submitted craco uvsub ${jid_uvs}"
 
+#step : snapshot imaging of the native-res residuals
+if [[ -n "${SNAPSHOT_TIMESTEP}" ]]; then
+  PATTERN="20??*/*beam{beam:02d}*.20????????????.calG${SC_INDEX[-1]}.${UVSUB_OUT_PREFIX}.ms"
+  [[ "${UVSUB_MODE}" == "inplace" ]] && PATTERN="20??*/*beam{beam:02d}*.20????????????.calG${SC_INDEX[-1]}.ms"
+  jid_snap=$(submit_snapshot "${jid_uvs}")
+  echo "submitted craco snapshot imaging ${jid_snap}"
+fi
+
 echo "Pipeline submitted."
 
@@ -0,0 +1,178 @@
+#!/bin/bash
+# Settings shared by pipeline.sh and orchestrate.py (sourced, not run).
+# Every value can be overridden from the environment.
+
+# -------------------- USER DEFAULTS (override via env or edit) --------------------
+USER=$( whoami )
+SBID=${SBID:-SB77974}
+DATA_ROOT=${DATA_ROOT:-/fred/oz451/"${USER}"/data}
+UVFITS_PATTERN=${UVFITS_PATTERN:-"20??*/*beam*.uvfits"}             # relative under DATA_ROOT/SBID
+PATTERN=${PATTERN:-"*beam{beam:02d}*.avg.calB0.ms"}             # relative under DATA_ROOT/SBID
+BIND_SRC=${BIND_SRC:-/fred/oz451}
+
+FLINT_WSCLEAN_SIF=${FLINT_WSCLEAN_SIF:-/fred/oz451/containers/flint-containers_wsclean.sif}
+FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/containers/flint-containers_casa.sif}
+
+IMPORT_SCRIPT=${IMPORT_SCRIPT:-import_array.py}
+RUN_IMPORT=${RUN_IMPORT:-run_import.sh}
+IMPORT_CPUS=${IMPORT_CPUS:-2}
+IMPORT_MEM=${IMPORT_MEM:-1G}
+IMPORT_ENGINE=${IMPORT_ENGINE:-casa}   # casa (importuvfits) or native (memory-mapped importer, see native_uvfits.py)
+# INGEST_MODE=fused replaces import -> flag -> bandpass -> flag with one array (run_ingest.sh / ingest_uvfits.py)
+INGEST_MODE=${INGEST_MODE:-separate}
+RUN_INGEST=${RUN_INGEST:-run_ingest.sh}
+INGEST_CPUS=${INGEST_CPUS:-4}
+INGEST_MEM=${INGEST_MEM:-12G}
+
+FLAG_SCRIPT=${FLAG_SCRIPT:-flag.sh}
+RUN_FLAG=${RUN_FLAG:-run_flag.sh}
+FLAG_COLUMN="DATA"
+FLAG_CPUS=${FLAG_CPUS:-4}
+FLAG_MEM=${FLAG_MEM:-12G}
+FLAG_CARRY=${FLAG_CARRY:-""}  # set non-empty to carry flags between generations (flag_store.py): .calB0 re-flags only changed time ranges, .avg inherits
+FLAG_RULE=${FLAG_RULE:-any}   # FLAG_CARRY: averaged cell flagged if any (or "fraction:F") of its input samples were
+SCRIPT_DIR=${SCRIPT_DIR:-/fred/oz451/$USER/scripts/lotrun_processing}
+
+AVERAGE_SCRIPT=${AVERAGE_SCRIPT:-average_ms_beams.py}
+AVERAGE_PYTHON=${AVERAGE_PYTHON:-"apptainer exec --bind /fred/oz451:/fred/oz451 /fred/oz451/${USER}/containers/flint-containers_casa.sif python3"}
+TIMEBIN=${TIMEBIN:-"9.90s"}
+CHANBIN=${CHANBIN:-1}
+AVERAGE_ENGINE=${AVERAGE_ENGINE:-casa}   # casa (mstransform) or native (streaming averager, see native_average.py)
+RUN_AVERAGE=${RUN_AVERAGE:-run_average_beams.sh}
+AVERAGE_CPUS=${AVERAGE_CPUS:-4}
+AVERAGE_MEM=${AVERAGE_MEM:-4G}
+
+OUT_ROOT=${OUT_ROOT:-/fred/oz451/$USER/data}
+PATTERN=${PATTERN:-"20??*/*beam{beam:02d}*.20????????????.avg.ms"}
+CONCAT_PYTHON=${CONCAT_PYTHON:-"apptainer exec --bind /fred/oz451:/fred/oz451 /fred/oz451/$USER/containers/flint-containers_casa.sif python3"}
+CONCAT_SCRIPT=${CONCAT_SCRIPT:-concat_ms_beams.py}
+RUN_CONCAT=${RUN_CONCAT:-run_concat_beams.sh}
+CONCAT_CPUS=${CONCAT_CPUS:-4}
+CONCAT_MEM=${CONCAT_MEM:-16G}
+CONCAT_ENGINE=${CONCAT_ENGINE:-casa}   # casa or native (k-way merge, see native_concat.py); not virtual: later stages write to the MS and open its subtables
+
+# -------------------------------------------------------
+
+RUN_WSCLEAN=${RUN_WSCLEAN:-run_wsclean_beams.sh}
+RUN_CB=${RUN_CB:-run_crystalball_beams.sh}
+RUN_SELFCAL=${RUN_SELFCAL:-run_selfcal_beams.sh}
+RUN_APPLYCAL=${RUN_APPLYCAL:-run_applycal_beams.sh}
+RUN_BANDPASS=${RUN_BANDPASS:-run_applycal_beams.sh}
+RUN_UVSUB=${RUN_UVSUB:-run_uvsub_beams.sh}
+RUN_FLINT_MASK=${RUN_FLINT_MASK:-run_flintmask_beams.sh}
+RUN_CLEARCAL=${RUN_CLEARCAL:-run_clearcal_beams.sh}
+RUN_SNAPSHOT=${RUN_SNAPSHOT:-run_snapshot_beams.sh}
+
+ARRAY_SPEC=${ARRAY_SPEC:-0-35}
+BIGARRAY_SPEC=${BIGARRAY_SPEC:-0-500}
+SCAN_SHARDS=${SCAN_SHARDS:-""}    # set to N to run the per-scan stages (import/ingest, flag, average) as N array tasks over slices of the scans
+SCAN_WORKERS=${SCAN_WORKERS:-1}   # scans processed concurrently inside each sharded task
+WSCLEAN_CPUS=${WSCLEAN_CPUS:-4}
+WSCLEAN_MEM=${WSCLEAN_MEM:-16G}
+SC_CPUS=${SC_CPUS:-8}
+SC_MEM=${SC_MEM:-4G}
+FM_CPUS=${FM_CPUS:-1}
+FM_MEM=${FM_MEM:-1G}
+
+
+# Crystalball defaults
+CB_TIME=${CB_TIME:-"03:15:00"}
+CB_CPUS=${CB_CPUS:-32}
+CB_MEM=${CB_MEM:-54G}
+CB_OUTPUT_COLUMN=${CB_OUTPUT_COLUMN:-MODEL_DATA}
+CB_NUM_WORKERS=${CB_NUM_WORKERS:-2048} #i have no clue why 2048 speeds up things despite only having 32 cpus but whtever
+CB_ROW_CHUNKS=${CB_ROW_CHUNKS:-0}
+CB_MODEL_CHUNKS=${CB_MODEL_CHUNKS:-0}
+CB_MEMORY_FRACTION=${CB_MEMORY_FRACTION:-0.8}
+CB_ENGINE=${CB_ENGINE:-crystalball}  # crystalball, or native (native_predict.py; CB_NUM_WORKERS is ignored, it threads over CB_CPUS)
+CB_INCREMENTAL=${CB_INCREMENTAL:-""}  # with CB_ENGINE=native, set non-empty to predict only the change between rounds (model_delta.py)
+CB_MAX_DELTA_FRACTION=${CB_MAX_DELTA_FRACTION:-0.5}  # full re-predict when the delta exceeds this fraction of the new list
+
+#flint_masking defaults
+FLOOD_FILL_POSITIVE_SEED_CLIP=${FLOOD_FILL_POSITIVE_SEED_CLIP:-1.1}
+FLOOD_FILL_POSITIVE_FLOOD_CLIP=${FLOOD_FILL_POSITIVE_FLOOD_CLIP:-0.7}
+FLOOD_FILL_MAC_BOX_SIZE=${FLOOD_FILL_MAC_BOX_SIZE:-350}
+BEAM_SHAPE_ERODE_MIN_RESPONSE=${BEAM_SHAPE_ERODE_MIN_RESPONSE:-0.75}
+
+# CASA self-cal defaults
+SC_FIELD=${SC_FIELD:-""}
+SC_SPW=${SC_SPW:-""}
+SC_REFANT=${SC_REFANT:-""}
+SC_COMBINE=${SC_COMBINE:-scan}
+SC_MINSNR=${SC_MINSNR:-3.0}
+SC_PARANG=${SC_PARANG:-""}          # set non-empty to enable
+SC_APPLY_CALWT=${SC_APPLY_CALWT:-False} #was True
+SC_SOLVER=${SC_SOLVER:-casa}        # casa (gaincal) or native (batched StEFCal)
+
+# applycal engine for bandpass/applycal steps: casa (applycal+split) or native (single-pass python-casacore)
+APPLY_ENGINE=${APPLY_ENGINE:-casa}
+# set non-empty to write native applycal/selfcal/stream-uvsub outputs as copy-on-write generations
+# (unchanged subtables and columns hardlinked to the parent MS; see ms_generation.py)
+SHARE_PARENT=${SHARE_PARENT:-""}
+# set non-empty to make every stage skip MSs/images whose outputs are already up to date, so a
+# resubmitted pipeline only recomputes what changed (records live next to the outputs; see stage_cache.py)
+STAGE_CACHE=${STAGE_CACHE:-""}
+# set non-empty to run the casatasks of the casa engines in a casa_worker daemon started by each array task on its
+# own allocation (see casa_worker.py / casa_worker.sh), instead of importing CASA in every task
+CASA_WORKER=${CASA_WORKER:-""}
+# storage-manager layout for every MS a stage writes (see ms_layout.py): rows, time, channel or
+# <nchan>x<nrow> tiles, optionally lossy-compressed with :cc16 or :dysco[bits]; empty keeps each engine's
+MS_LAYOUT=${MS_LAYOUT:-""}
+# JSONL file every job appends its submit/start/end and per-step timing records to (see telemetry.py;
+# summarise with telemetry_report.py); set empty to record nothing
+TELEMETRY=${TELEMETRY-"${DATA_ROOT}/${SBID}/telemetry.jsonl"}
+# per-task --time/--mem (and --cpus-per-task) from past runs (see resource_sizing.py): "fit" sizes every array task
+# from the telemetry files in SIZING_HISTORY and submits each job as up to SIZING_GROUPS arrays of equal requests;
+# "record" keeps the requests above but records each task's input size so later runs can fit; empty does neither
+SIZING=${SIZING:-""}
+SIZING_HISTORY=${SIZING_HISTORY:-"${DATA_ROOT}/*/telemetry.jsonl"}  # telemetry files (globs allowed) to fit on
+SIZING_GROUPS=${SIZING_GROUPS:-4}
+SIZING_CPUS=${SIZING_CPUS:-""}    # set non-empty to also cut CPUs to the measured use (leave empty with the casa engines: CPU of tasks run by a casa_worker daemon is not recorded)
+# set non-empty to journal the block writes of the native engines (average, applycal, selfcal apply, stream uvsub,
+# native predict; see ms_journal.py) and submit those stages requeueable: RESUME_SIGNAL_S seconds before the time
+# limit a task requeues itself (requeue.sh) and its next run carries on from the last committed block instead of
+# row 0. Pair with STAGE_CACHE so the requeued run also skips the MSs it had finished
+RESUME_WRITES=${RESUME_WRITES:-""}
+RESUME_SIGNAL_S=${RESUME_SIGNAL_S:-300}
+RESUME_MAX_REQUEUES=${RESUME_MAX_REQUEUES:-3}   # requeues per task before it is left to hit its time limit
+
+# snapshot imaging of the native-resolution residuals after the last uvsub (see snapshot_plan.py): set to the
+# seconds per image (rounded to whole integrations; 0 = every integration) to run it; empty skips the step
+SNAPSHOT_TIMESTEP=${SNAPSHOT_TIMESTEP:-""}
+SNAPSHOT_SHARDS=${SNAPSHOT_SHARDS:-1}       # array tasks per beam, each imaging a slice of the beam's intervals
+SNAPSHOT_WORKERS=${SNAPSHOT_WORKERS:-4}     # wsclean processes run at once in each task
+SNAPSHOT_CPUS=${SNAPSHOT_CPUS:-16}
+SNAPSHOT_MEM=${SNAPSHOT_MEM:-32G}
+SNAPSHOT_TIME=${SNAPSHOT_TIME:-"04:00:00"}
+SNAPSHOT_PLAN_MEM=${SNAPSHOT_PLAN_MEM:-8G}   # the plan array (one task per beam) that the imaging shards read
+SNAPSHOT_PLAN_TIME=${SNAPSHOT_PLAN_TIME:-"01:00:00"}
+SNAPSHOT_OPTS=${SNAPSHOT_OPTS:-"-data-column DATA -pol i -weight briggs 0.5 -scale 12asec -size 1536 1536 -niter 0"}
+
+# -------------------- PIPELINE CONFIG (round-specific params) --------------------
+
+UVSUB_OUT_PREFIX=${UVSUB_OUT_PREFIX:-"uvsub"}
+UVSUB_MODE=${UVSUB_MODE:-casa}      # casa, stream or inplace (see uvsub_ms_beams.py --mode)
+
+# IMG_TAG per round (0 = initial pre-selfcal imaging; 1..4 are successive re-imaging passes
+declare -a IMG_TAGS=("initial" "selfcal_1" "selfcal_2" "selfcal_3" "selfcal_4" "selfcal_5" "selfcal_6")
+
+# WSClean options per round (round 0 can use a shallower set; others deepen progressively)
+declare -a WSCLEAN_OPTS
+WSCLEAN_OPTS[0]="${WSCLEAN_OPTS0:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 25000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 3 -auto-mask 15.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[1]="${WSCLEAN_OPTS1:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 2 -auto-mask 15.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[2]="${WSCLEAN_OPTS2:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 8.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[3]="${WSCLEAN_OPTS3:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[4]="${WSCLEAN_OPTS4:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 1.0 -auto-mask 3.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[5]="${WSCLEAN_OPTS5:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 0.5 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+WSCLEAN_OPTS[6]="${WSCLEAN_OPTS6:-"-data-column DATA -save-source-list -multiscale -multiscale-scale-bias 0.8 -niter 100000 -pol xx -weight briggs 0.5 -scale 12asec -size 1536 1536 -auto-threshold 0.5 -auto-mask 5.0 -join-channels -channels-out 4 -fit-spectral-pol 3"}"
+
+# Self-cal rounds: index, mode, solint, caltable prefix (only rounds 1..4 have self-cal; 4 = amplitude+phase)
+# declare -a SC_INDEX=(1 2 3 4)
+# declare -a SC_CALMODE=("p" "p" "p" "ap")
+# declare -a SC_SOLINT=("480s" "300s" "120s" "600s")
+# declare -a SC_PREFIX=("selfcal1_p" "selfcal2_p" "selfcal3_p" "selfcal4_ap")
+
+declare -a SC_INDEX=(1 2 3 4 5 6)
+declare -a SC_CALMODE=("p" "p" "p" "p" "ap" "ap")
+declare -a SC_SOLINT=("480s" "300s" "120s" "30s" "600s" "300s")
+declare -a SC_PREFIX=("selfcal1_p" "selfcal2_p" "selfcal3_p" "selfcal4_p" "selfcal5_ap" "selfcal6_ap" )
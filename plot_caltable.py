@@ -1,44 +1,256 @@
 #!/usr/bin/env python3
+"""Render diagnostic plots and summary statistics of caltables in bulk.
 
-import casaconfig
-casaconfig.logfile = "/dev/null"
+plotms draws one caltable axis per call and is slow and unreliable
+without a display, so the self-cal solutions of an SBID (36 beams x 7
+rounds) went unchecked. Here every caltable is read with python-casacore
+(``caltable_tools.read_caltable``: CPARAM, FLAG, TIME and ANTENNA1 in one
+getcol each). It is drawn with matplotlib's Agg backend as a grid of
+per-antenna panels, one figure for phase and one for amplitude:
 
-def plot_solutions(caltable: str, figfile_base: str):
+* tables with several solution times (G) are plotted against time, one
+  point per solution and polarisation, averaged over the unflagged
+  channels
+* tables with a single solution time (B) are plotted against frequency
+
+Each table also gets per-antenna statistics, saved next to its plots as
+``<table>.qa.json``: number of solutions, flagged fraction, phase RMS
+(scatter in time about each channel's mean phase, in degrees; empty for
+single-time tables) and the mean and RMS of the amplitude. The
+statistics of every table found are gathered into one CSV with a row per
+(table, antenna).
+
+Tables are rendered on a pool of worker processes. With the stage cache
+(stage_cache.py) a table is only rendered again when it changed since
+its plots were made. A run over all beams and rounds of an SBID::
+
+    plot_caltable.py --root ${DATA_ROOT}/${SBID} --workers 8
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+
+from task_pool import run_tasks
+from telemetry import step
+
+DEFAULT_PATTERNS = ("**/caltables/*.G[0-9]*", "cal/*beam*.B0")
+"""Caltables under --root: the self-cal G tables of every beam and the bandpass tables"""
+
+QA_VERSION = 1
+"""Bumped whenever the plots or statistics change, so cached ones are redrawn"""
+
+SUMMARY_FIELDS = ("caltable", "beam", "round", "antenna", "name", "nsol", "flagged_fraction",
+                  "phase_rms_deg", "amp_mean", "amp_rms")
+"""Columns of the summary CSV"""
+
+_BEAM = re.compile(r"beam(\d+)")
+
+
+def output_paths(caltable, out_dir):
+    """(phase png, amplitude png, statistics json) of ``caltable`` in ``out_dir``."""
+    base = os.path.join(out_dir, os.path.basename(os.path.normpath(caltable)))
+    return f"{base}.phase.png", f"{base}.amp.png", f"{base}.qa.json"
+
+
+def antenna_names(caltable, nant):
+    """Antenna names from the ANTENNA subtable, padded with indices where it is short."""
+    from casacore.tables import table
+    try:
+        with table(os.path.join(caltable, "ANTENNA"), ack=False) as at:
+            names = list(at.getcol("NAME"))
+    except RuntimeError:
+        names = []
+    return names[:nant] + [str(a) for a in range(len(names), nant)]
+
+
+def solution_stats(sol):
+    """Per-antenna statistics of a caltable's solutions.
+
+    Args:
+        sol (CalSolutions): Solutions from ``caltable_tools.read_caltable``
+
+    Returns:
+        list: One dict per antenna with nsol, flagged_fraction, phase_rms_deg (None for a
+        single solution time or no unflagged solutions), amp_mean and amp_rms
     """
-    Plot calibration solutions using plotms (recommended in modern CASA).
-    Saves phase-vs-time and amplitude-vs-time PNGs next to your caltable.
+    import numpy as np
+    ntime, nant = sol.gains.shape[:2]
+    good = ~sol.flags
+    amp = np.abs(sol.gains)
+    unit = np.where(good, sol.gains / np.where(amp > 0, amp, 1), 0)
+    # scatter in time about the mean phasor of each (antenna, channel, polarisation)
+    mean = unit.sum(axis=0, keepdims=True)
+    dev = np.degrees(np.angle(unit * np.conj(mean)))
+    stats = []
+    for a in range(nant):
+        g = good[:, a]
+        n = int(g.sum())
+        stats.append({
+            "nsol": int(g.size),
+            "flagged_fraction": 1.0 - n / g.size if g.size else 1.0,
+            "phase_rms_deg": float(np.sqrt(np.mean(dev[:, a][g] ** 2))) if n and ntime > 1 else None,
+            "amp_mean": float(amp[:, a][g].mean()) if n else None,
+            "amp_rms": float(amp[:, a][g].std()) if n else None,
+        })
+    return stats
+
+
+def _panel_series(sol):
+    """x values, axis label and per-antenna (phase deg, amplitude, good) arrays of shape (nx, npol) to plot."""
+    import numpy as np
+    good = ~sol.flags
+    if len(sol.times) > 1:
+        # channel average of the unflagged solutions: (ntime, nant, npol)
+        n = good.sum(axis=2)
+        g = np.where(good, sol.gains, 0).sum(axis=2) / np.maximum(n, 1)
+        x = (sol.times - sol.times[0]) / 60.0
+        return x, "time (min)", g, n > 0
+    return sol.freqs / 1e6, "frequency (MHz)", sol.gains[0].transpose(1, 0, 2), good[0].transpose(1, 0, 2)
+
+
+def plot_solutions(caltable, figfile_base, sol=None, names=None):
+    """Plot the phase and amplitude of every antenna's solutions in ``caltable``.
+
+    Args:
+        caltable (str): Calibration table
+        figfile_base (str): Output name; ``.phase.png`` and ``.amp.png`` are appended
+        sol (CalSolutions): Solutions already read from ``caltable``
+        names (list): Antenna names
+
+    Returns:
+        tuple: (phase png, amplitude png)
     """
-    try:
-        from casaplotms import plotms  # CASA 6 plotms interface
-    except Exception as e:
-        # Some packaged CASA expose plotms via casatasks; try that path too
-        try:
-            from casatasks import plotms  # fallback
-        except Exception:
-            raise RuntimeError(f"plotms is not available in this CASA build: {e}")
-
-    # 1) Phase vs Time
-    phase_png = f"{figfile_base}.phase.png"
-    plotms(
-        vis=caltable,          # plotms accepts calibration tables as 'vis'
-        xaxis="time",
-        yaxis="phase",
-        coloraxis="baseline",
-        showgui=False,
-        plotfile=phase_png,
-        overwrite=True
-    )
-
-    # 2) Amplitude vs Time (optional; comment out if you only want phase)
-    amp_png = f"{figfile_base}.amp.png"
-    plotms(
-        vis=caltable,
-        xaxis="time",
-        yaxis="amp",
-        coloraxis="baseline",
-        showgui=False,
-        plotfile=amp_png,
-        overwrite=True
-    )
-
-    print(f"Saved plots:\n  {phase_png}\n  {amp_png}")
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from caltable_tools import read_caltable
+
+    sol = sol if sol is not None else read_caltable(caltable)
+    nant, npol = sol.gains.shape[1], sol.gains.shape[3]
+    names = names or antenna_names(caltable, nant)
+    x, xlabel, g, good = _panel_series(sol)
+    ncols = int(np.ceil(np.sqrt(nant)))
+    nrows = int(np.ceil(nant / ncols))
+    title = os.path.basename(os.path.normpath(caltable))
+    phase, amp = np.degrees(np.angle(g)), np.abs(g)
+    # one figure for both plots: the amplitude plot only swaps the y data of the phase plot's lines
+    fig, axes = plt.subplots(nrows, ncols, figsize=(2.2 * ncols, 1.6 * nrows), sharex=True, sharey=True, squeeze=False)
+    lines = []
+    for a, ax in enumerate(axes.flat):
+        if a >= nant:
+            ax.set_visible(False)
+            continue
+        for p in range(npol):
+            ok = good[:, a, p]
+            lines.append((ax.plot(x[ok], phase[:, a, p][ok], ".", ms=2)[0], a, p, ok))
+        ax.set_title(names[a], fontsize=7, pad=2)
+        ax.tick_params(labelsize=6)
+    fig.supxlabel(xlabel, fontsize=8)
+    fig.suptitle(title, fontsize=9)
+    # fixed margins: tight_layout measures every tick label of every panel, which dominates the run time
+    fig.subplots_adjust(left=0.06, right=0.99, bottom=0.07, top=0.92, wspace=0.08, hspace=0.3)
+    outputs = []
+    for kind, values, ylabel in (("phase", phase, "phase (deg)"), ("amp", amp, "amplitude")):
+        if kind == "phase":
+            axes[0, 0].set_ylim(-180, 180)
+        else:
+            for line, a, p, ok in lines:
+                line.set_ydata(values[:, a, p][ok])
+            finite = values[good]
+            lo, hi = (finite.min(), finite.max()) if finite.size else (0.0, 1.0)
+            pad = 0.05 * (hi - lo) or 0.05
+            axes[0, 0].set_ylim(lo - pad, hi + pad)
+        fig.supylabel(ylabel, fontsize=8)
+        path = f"{figfile_base}.{kind}.png"
+        fig.savefig(path, dpi=80)
+        outputs.append(path)
+    plt.close(fig)
+    return tuple(outputs)
+
+
+def render_table(caltable, out_dir, use_cache=True):
+    """Plot ``caltable`` and write its statistics unless the cache says they are current."""
+    from stage_cache import Stage
+    phase_png, amp_png, stats_json = output_paths(caltable, out_dir)
+    stage = Stage("caltable_qa", [caltable], [phase_png, amp_png, stats_json], {"version": QA_VERSION})
+    if use_cache and stage.complete():
+        print(f"{caltable}: plots are up to date")
+        return
+    stage.begin()
+    from caltable_tools import read_caltable
+    with step("plot_caltable", ms=caltable):
+        sol = read_caltable(caltable)
+        names = antenna_names(caltable, sol.gains.shape[1])
+        plot_solutions(caltable, phase_png[:-len(".phase.png")], sol=sol, names=names)
+        stats = [{"antenna": a, "name": n, **s} for a, (n, s) in enumerate(zip(names, solution_stats(sol)))]
+        with open(stats_json, "w") as f:
+            json.dump({"caltable": os.path.abspath(caltable), "antennas": stats}, f, indent=1)
+    stage.commit()
+
+
+def find_caltables(root, patterns=DEFAULT_PATTERNS):
+    """Caltables under ``root`` matching any of ``patterns`` (directories only), sorted."""
+    found = set()
+    for pattern in patterns:
+        found.update(p for p in glob.glob(os.path.join(root, pattern), recursive=True) if os.path.isdir(p))
+    return sorted(found)
+
+
+def write_summary(caltables, out_dir, path):
+    """Gather the statistics of ``caltables`` into one CSV; returns the number of rows written."""
+    nrows = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for caltable in caltables:
+            stats_json = output_paths(caltable, out_dir)[2]
+            if not os.path.exists(stats_json):
+                continue
+            with open(stats_json) as s:
+                stats = json.load(s)
+            name = os.path.basename(os.path.normpath(caltable))
+            beam = _BEAM.search(name)
+            for row in stats["antennas"]:
+                writer.writerow({"caltable": name, "beam": int(beam.group(1)) if beam else "",
+                                 "round": name.rsplit(".", 1)[-1], **{k: "" if v is None else v for k, v in row.items()}})
+                nrows += 1
+    return nrows
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Plot caltable solutions and summarise them per antenna, without plotms.")
+    p.add_argument("caltables", nargs="*", help="Caltables to render (default: those found under --root).")
+    p.add_argument("--root", default=None, help="Directory to search for caltables, e.g. DATA_ROOT/SBID.")
+    p.add_argument("--pattern", nargs="+", default=list(DEFAULT_PATTERNS), help="Globs under --root ('**' recurses).")
+    p.add_argument("--out-dir", default=None, help="Directory for the plots and statistics (default: ROOT/plots).")
+    p.add_argument("--summary", default=None, help="Summary CSV (default: OUT_DIR/caltable_qa.csv).")
+    p.add_argument("--workers", type=int, default=1, help="Tables rendered concurrently.")
+    p.add_argument("--force", action="store_true", help="Render every table, even if its plots are up to date.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    caltables = list(args.caltables)
+    if args.root:
+        caltables += find_caltables(args.root, args.pattern)
+    if not caltables:
+        sys.exit("plot_caltable.py: no caltables given or found")
+    out_dir = args.out_dir or os.path.join(args.root or ".", "plots")
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"Rendering {len(caltables)} caltables into {out_dir} with {args.workers} workers")
+    tasks = [(os.path.basename(os.path.normpath(t)), (t, out_dir, not args.force)) for t in caltables]
+    failures = run_tasks(render_table, tasks, workers=args.workers)
+    summary = args.summary or os.path.join(out_dir, "caltable_qa.csv")
+    print(f"Wrote {write_summary(caltables, out_dir, summary)} antenna rows to {summary}")
+    if failures:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
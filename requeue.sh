@@ -0,0 +1,38 @@
+# Requeue helper for the run_*.sh wrappers whose python writes are journaled (see ms_journal.py); sourced, not run.
+# pipeline.sh submits those stages with --requeue --signal=B:USR1@${RESUME_SIGNAL_S} when RESUME_WRITES is set:
+# Slurm then signals the batch shell that long before the time limit, and the task requeues itself so that its
+# next run (same array index, same --export) resumes the interrupted write instead of timing out and starting over.
+# With RESUME_WRITES empty, or outside Slurm, every helper is a no-op apart from running the command.
+
+RESUME_WRITES=${RESUME_WRITES:-""}                  # set non-empty to journal writes (--resume) and requeue on USR1
+RESUME_MAX_REQUEUES=${RESUME_MAX_REQUEUES:-3}       # requeues per task before it is left to hit its time limit
+
+# resumable COMMAND...: run COMMAND, requeueing the job if USR1 arrives while it runs. bash only runs a trap
+# between commands, so COMMAND runs in the background and is waited for until it exits
+resumable() {
+  local pid status
+  if [[ -z "${RESUME_WRITES}" || -z "${SLURM_JOB_ID:-}" ]]; then
+    "$@"
+    return
+  fi
+  "$@" &
+  pid=$!
+  trap resume_requeue USR1
+  while :; do
+    status=0
+    wait "${pid}" || status=$?
+    # a wait cut short by the trap returns >128 while COMMAND is still running
+    (( status > 128 )) && kill -0 "${pid}" 2>/dev/null || break
+  done
+  trap - USR1
+  return "${status}"
+}
+
+resume_requeue() {
+  if (( ${SLURM_RESTART_COUNT:-0} >= RESUME_MAX_REQUEUES )); then
+    echo "WARN: time limit near, but job ${SLURM_JOB_ID} was already requeued ${SLURM_RESTART_COUNT:-0} times; not requeueing"
+    return 0
+  fi
+  echo "Time limit near: requeueing job ${SLURM_JOB_ID}; its next run resumes from the write journals"
+  scontrol requeue "${SLURM_JOB_ID}" || echo "WARN: could not requeue job ${SLURM_JOB_ID}"
+}
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""Size the Slurm requests of each pipeline job from past telemetry.
+
+pipeline_config.sh gives every array task of a job the same ``--time``,
+``--cpus-per-task`` and ``--mem`` (``CB_MEM=54G``, ``WSCLEAN_MEM=16G``,
+...), however much data its scan or beam has: small beams over-reserve
+and queue longer, large ones hit the wall-time limit. With ``SIZING=fit``
+each job is sized per array task instead:
+
+* features: the visibilities (rows x channels x polarisations) and bytes
+  of the UVFITS files a task works on, read from their FITS headers. The
+  pipeline submits every job up front, before most of its MSs exist, so
+  the UVFITS inputs stand in for them: a per-scan task (import, ingest,
+  flag, average) covers its file (or its shard of the files), a
+  beam-level task every scan of its beam. Crystalball also scales with
+  the components of its source list, counted when the list exists and
+  otherwise taken from past runs
+* cost model: for every job name (``crystalball_selfcal_2``, ...; the
+  whole stage when a name has too few samples) least-squares lines of
+  wall time against the work and of peak RSS against the visibilities,
+  fitted to the ``sizing`` records of past runs joined with their ``job``
+  and ``step`` telemetry
+* requests: the predicted wall time and RSS of each task plus headroom,
+  rounded up; with ``SIZING_CPUS`` the CPUs are also cut to the measured
+  use. Tasks are put in at most ``SIZING_GROUPS`` groups of equal
+  requests and pipeline.sh submits one array job per group (their ids
+  joined by ':' make up the dependency of the next job)
+
+Jobs without a model (no history yet, or a stage without telemetry such
+as the flint mask) keep their configured requests. ``SIZING=record``
+keeps them all but still writes the ``sizing`` records, so a few runs
+build up the history that ``SIZING=fit`` needs::
+
+    resource_sizing.py plan --task NAME --array SPEC --time T --cpus C --mem M --root DIR [...]
+    resource_sizing.py dry-run [--config pipeline_config.sh] [--history FILE ...]
+
+``plan`` prints one "INDICES CPUS MEM TIME" line per group; ``dry-run``
+prints the predicted cost and the requests of every job and stage of
+the pipeline without submitting anything. Only the standard library is
+used.
+"""
+import argparse
+import glob
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from orchestrate import parse_array_spec
+from shard import Shard, shard_items
+from telemetry import ms_fields, write_record
+from telemetry_report import collect_jobs, duration, load_records, steps_by_unit
+
+PER_SCAN_STAGES = ("import", "ingest", "flag", "average")
+"""Stages whose array index is a scan (or a shard of scans) rather than a beam"""
+
+MIN_SAMPLES = 3
+"""Past array tasks needed before a job name (or stage) gets a model"""
+
+TIME_HEADROOM = 1.5
+"""Requested wall time as a multiple of the predicted one"""
+
+MEM_HEADROOM = 1.25
+"""Requested memory as a multiple of the predicted peak RSS (plus MEM_PAD_MB)"""
+
+MEM_PAD_MB = 512
+"""Memory added for the wrapper, apptainer and page-cache slack"""
+
+MIN_TIME_S = 600
+MIN_MEM_MB = 1024
+TIME_STEP_S = 300
+
+
+class Fit(NamedTuple):
+    """Least-squares line ``y = intercept + slope * x`` through the samples of one model"""
+
+    intercept: float
+    """y at x = 0"""
+    slope: float
+    """y per unit of x (visibilities, or visibilities x components)"""
+    margin: float
+    """90th percentile of the samples' excess over the line"""
+
+    def predict(self, x):
+        """Central estimate of y at ``x``."""
+        return self.intercept + self.slope * x
+
+    def upper(self, x):
+        """Estimate at ``x`` that 90% of the past samples stayed under."""
+        return self.predict(x) + self.margin
+
+
+class CostModel(NamedTuple):
+    """Wall time and memory of one job name (or stage) against the work of an array task"""
+
+    key: str
+    """Job name or stage the samples came from"""
+    samples: int
+    """Number of past array tasks fitted"""
+    wall: Fit
+    """Wall time in seconds"""
+    rss: Optional[Fit]
+    """Peak RSS in MB against the visibilities alone (None without step records)"""
+    cpus_used: Optional[float]
+    """90th percentile of the CPUs busy on average (CPU time / wall time)"""
+    components: Optional[float]
+    """Median source-list components of the samples (crystalball)"""
+
+
+def stage_of(task):
+    """Pipeline stage of a job name, e.g. "crystalball" for "crystalball_selfcal_2"."""
+    return task.split("_")[0]
+
+
+def parse_time(spec):
+    """Slurm time limit ("MM", "MM:SS", "HH:MM:SS" or "D-HH:MM:SS") in seconds."""
+    days, _, rest = spec.rpartition("-")
+    parts = [int(x) for x in rest.split(":")]
+    if days:
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+    else:
+        hours, minutes, seconds = ([0, 0] + parts)[-3:] if len(parts) > 1 else (0, parts[0], 0)
+    return int(days or 0) * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(seconds):
+    """Seconds as a Slurm time limit, HH:MM:SS."""
+    seconds = int(math.ceil(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_mem(spec):
+    """Slurm memory ("500M", "16G", plain numbers are MB) in MB."""
+    spec = str(spec).strip().upper()
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 ** 2}
+    if spec[-1:] in units:
+        return float(spec[:-1]) * units[spec[-1]]
+    return float(spec)
+
+
+def format_mem(mb):
+    """MB as a Slurm memory request, in GB when it is whole GB."""
+    mb = int(math.ceil(mb))
+    return f"{mb // 1024}G" if mb % 1024 == 0 else f"{mb}M"
+
+
+def format_indices(indices):
+    """Array task indices as a compact Slurm array spec, e.g. "0-3,7,9-11"."""
+    parts, indices = [], sorted(indices)
+    start = prev = indices[0]
+    for i in indices[1:] + [None]:
+        if i is not None and i == prev + 1:
+            prev = i
+            continue
+        parts.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = i
+    return ",".join(parts)
+
+
+def array_spec(indices, array):
+    """Slurm array spec of ``indices``, keeping the %N task limit of the configured spec ``array``."""
+    limit = array.partition("%")[2]
+    return format_indices(indices) + (f"%{limit}" if limit else "")
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+# -------------------- features --------------------
+
+def _header_cards(path):
+    """Keyword -> value string of the primary FITS header of ``path``."""
+    cards = {}
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(2880)
+            if len(block) < 2880:
+                return cards
+            for k in range(0, 2880, 80):
+                card = block[k:k + 80].decode("ascii", "replace")
+                key = card[:8].strip()
+                if key == "END":
+                    return cards
+                if card[8:10] == "= ":
+                    cards[key] = card[10:].split("/")[0].strip().strip("'").strip()
+
+
+def uvfits_shape(path):
+    """Rows (random groups), channels, polarisations and bytes of a UVFITS file from its header."""
+    shape = {"rows": 0, "nchan": 1, "npol": 1, "bytes": 0}
+    try:
+        shape["bytes"] = os.path.getsize(path)
+        cards = _header_cards(path)
+        axes = {cards.get(f"CTYPE{k}", ""): int(cards[f"NAXIS{k}"]) for k in range(2, int(cards["NAXIS"]) + 1)}
+        shape.update(rows=int(cards.get("GCOUNT", 0)), nchan=axes.get("FREQ", 1), npol=axes.get("STOKES", 1))
+    except (OSError, KeyError, ValueError) as e:
+        print(f"WARN: could not read the UVFITS header of {path}: {e}", file=sys.stderr)
+    return shape
+
+
+def source_components(root, beam, tag=None):
+    """Components in the source list of ``beam`` imaged as ``tag`` (the newest list of the beam without one), or None."""
+    suffix = f".{tag}_img-sources.txt" if tag else "_img-sources.txt"
+    paths = glob.glob(os.path.join(root, f"*beam{beam:02d}*{suffix}"))
+    if not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime)) as f:
+        return sum(1 for line in f if line.strip() and not line.startswith(("Format", "#")))
+
+
+def _crystalball_tag(task):
+    """IMG_TAG of a crystalball job name; None for crystalball_native (which predicts from the last list)."""
+    tag = task[len("crystalball_"):]
+    return None if tag == "native" else tag
+
+
+def task_features(task, indices, root, uvfits_pattern, shards=None):
+    """Features of every array task of job ``task``.
+
+    Args:
+        task (str): Job name, e.g. "flag_raw" or "wsclean_selfcal_1"
+        indices (list): Array task indices
+        root (str): DATA_ROOT/SBID
+        uvfits_pattern (str): UVFITS glob relative to ``root``
+        shards (int): SCAN_SHARDS (per-scan stages then take slices of the scans)
+
+    Returns:
+        dict: index -> {"files", "rows", "nchan", "npol", "vis", "bytes", "components"}
+    """
+    uvfits = sorted(glob.glob(os.path.join(root, uvfits_pattern)))
+    stage = stage_of(task)
+    if stage in PER_SCAN_STAGES:
+        if shards:
+            inputs = {i: shard_items(uvfits, Shard(i, shards)) if i < shards else [] for i in indices}
+        else:
+            inputs = {i: uvfits[i:i + 1] for i in indices}
+    else:
+        by_beam = defaultdict(list)
+        for path in uvfits:
+            by_beam[ms_fields(path)["beam"]].append(path)
+        inputs = {i: by_beam.get(i, []) for i in indices}
+    features = {}
+    for i, paths in inputs.items():
+        shapes = [uvfits_shape(p) for p in paths]
+        features[i] = {"files": len(paths), "rows": sum(s["rows"] for s in shapes),
+                       "nchan": max((s["nchan"] for s in shapes), default=0), "npol": max((s["npol"] for s in shapes), default=0),
+                       "vis": sum(s["rows"] * s["nchan"] * s["npol"] for s in shapes), "bytes": sum(s["bytes"] for s in shapes),
+                       "components": source_components(root, i, _crystalball_tag(task)) if stage == "crystalball" else None}
+    return features
+
+
+def work(features, model=None):
+    """Work of an array task: its visibilities, times the source-list components for crystalball."""
+    vis = features.get("vis") or 0
+    if features.get("components") is not None:
+        return vis * max(features["components"], 1)
+    if model is not None and model.components:
+        return vis * model.components
+    return vis
+
+
+# -------------------- cost models --------------------
+
+def fit_line(xs, ys):
+    """Least-squares Fit of ys against xs with a non-negative intercept and slope."""
+    n = len(xs)
+    mx, my = sum(xs) / n, sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx > 0 else 0.0
+    intercept = my - slope * mx
+    if slope < 0:
+        slope, intercept = 0.0, my
+    elif intercept < 0:
+        sx2 = sum(x * x for x in xs)
+        slope, intercept = (sum(x * y for x, y in zip(xs, ys)) / sx2 if sx2 > 0 else 0.0), 0.0
+    margin = _quantile([max(y - intercept - slope * x, 0.0) for x, y in zip(xs, ys)], 0.9)
+    return Fit(intercept, slope, margin)
+
+
+def history_paths(specs):
+    """Telemetry files named by ``specs``: paths or globs, several per string separated by spaces."""
+    paths = []
+    for spec in specs or ():
+        for pattern in spec.split():
+            paths.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    return [p for p in dict.fromkeys(paths) if os.path.isfile(p)]
+
+
+def load_samples(paths):
+    """Past array tasks with their features: job name -> list of {"features", "wall_s", "rss_mb", "cpus_used"}.
+
+    An array task counts when its job has a ``submit`` record, it left start
+    and end records, and a ``sizing`` record of the same job name and index
+    was written before the submit. Failed tasks are left out unless they ran
+    into their time limit, which makes them a lower bound worth keeping.
+    """
+    records = [rec for path in paths for rec in load_records(path)]
+    jobs, units = collect_jobs(records)
+    steps = steps_by_unit(records)
+    sizing = defaultdict(list)
+    for rec in sorted((r for r in records if r.get("kind") == "sizing"), key=lambda r: r.get("ts") or 0):
+        sizing[(rec.get("task"), str(rec.get("array_task_id")))].append(rec)
+    samples = defaultdict(list)
+    for key, unit in units.items():
+        job = jobs.get(key[0])
+        if job is None or unit["start"] is None or unit["end"] is None:
+            continue
+        submitted = job["submit_ts"] or unit["start"]
+        candidates = [r for r in sizing.get((job["task"], key[1]), []) if (r.get("ts") or 0) <= submitted]
+        if not candidates:
+            continue
+        rec, wall = candidates[-1], unit["end"] - unit["start"]
+        if unit["status"] not in (0, None) and wall < 0.95 * (rec.get("time_s") or math.inf):
+            continue
+        features = dict(rec.get("features") or {})
+        if stage_of(job["task"]) == "crystalball" and features.get("components") is None and rec.get("root"):
+            features["components"] = source_components(rec["root"], int(key[1]), _crystalball_tag(job["task"]))
+        unit_steps = steps.get(key, [])
+        peaks = [s["peak_rss_mb"] for s in unit_steps if s.get("peak_rss_mb")]
+        cpu = sum(s.get("cpu_s") or 0.0 for s in unit_steps)
+        samples[job["task"]].append({"features": features, "wall_s": wall, "rss_mb": max(peaks) if peaks else None,
+                                     "cpus_used": cpu / wall if unit_steps and wall > 0 else None})
+    return samples
+
+
+def fit_model(key, samples):
+    """CostModel of ``samples`` (None with fewer than MIN_SAMPLES)."""
+    if len(samples) < MIN_SAMPLES:
+        return None
+    components = [s["features"]["components"] for s in samples if s["features"].get("components") is not None]
+    partial = CostModel(key, len(samples), Fit(0.0, 0.0, 0.0), None, None,
+                        sorted(components)[len(components) // 2] if components else None)
+    xs = [work(s["features"], partial) for s in samples]
+    with_rss = [(s["features"].get("vis") or 0, s["rss_mb"]) for s in samples if s["rss_mb"] is not None]
+    used = [s["cpus_used"] for s in samples if s["cpus_used"] is not None]
+    return partial._replace(wall=fit_line(xs, [s["wall_s"] for s in samples]),
+                            rss=fit_line(*zip(*with_rss)) if len(with_rss) >= MIN_SAMPLES else None,
+                            cpus_used=_quantile(used, 0.9) if used else None)
+
+
+def fit_models(samples):
+    """Job name -> CostModel, plus stage -> CostModel fitted on all the stage's samples as a fallback."""
+    models, by_stage = {}, defaultdict(list)
+    for task, task_samples in samples.items():
+        by_stage[stage_of(task)].extend(task_samples)
+        models[task] = fit_model(task, task_samples)
+    for stage, stage_samples in by_stage.items():
+        models.setdefault(stage, fit_model(stage, stage_samples))
+    return {k: m for k, m in models.items() if m is not None}
+
+
+def load_models(specs):
+    """CostModels fitted on the telemetry files named by ``specs`` (see history_paths)."""
+    return fit_models(load_samples(history_paths(specs)))
+
+
+def model_for(models, task):
+    """Model of job ``task``, else of its stage, else None."""
+    return models.get(task) or models.get(stage_of(task))
+
+
+# -------------------- requests --------------------
+
+def size_request(model, features, cpus, mem_mb, time_s, fit_cpus=False, max_time_s=48 * 3600, max_mem_mb=256 * 1024):
+    """(cpus, mem MB, time s) for one array task: the configured request without a model, else the prediction plus headroom."""
+    if model is None:
+        return cpus, mem_mb, time_s
+    x = work(features, model)
+    time_s = min(max(math.ceil(model.wall.upper(x) * TIME_HEADROOM / TIME_STEP_S) * TIME_STEP_S, MIN_TIME_S), max_time_s)
+    if model.rss is not None:
+        mem_mb = min(max(math.ceil((model.rss.upper(features.get("vis") or 0) * MEM_HEADROOM + MEM_PAD_MB) / 1024) * 1024, MIN_MEM_MB), max_mem_mb)
+    if fit_cpus and model.cpus_used:
+        cpus = min(cpus, max(int(math.ceil(model.cpus_used * 1.25)), 1))
+    return cpus, mem_mb, time_s
+
+
+def group_requests(requests, max_groups):
+    """Array tasks with equal requests in at most ``max_groups`` groups.
+
+    Beyond ``max_groups`` distinct requests the tasks are ordered by time
+    and memory and cut into ``max_groups`` runs of equal size, each
+    requesting the largest time, memory and CPUs in it.
+
+    Args:
+        requests (dict): index -> (cpus, mem MB, time s)
+        max_groups (int): Most groups (array jobs) to make
+
+    Returns:
+        list: (indices, cpus, mem MB, time s) per group, by first index
+    """
+    distinct = defaultdict(list)
+    for i, req in requests.items():
+        distinct[req].append(i)
+    if len(distinct) <= max_groups:
+        groups = [(sorted(ix), *req) for req, ix in distinct.items()]
+    else:
+        order = sorted(requests, key=lambda i: (requests[i][2], requests[i][1], requests[i][0]))
+        groups = []
+        for k in range(max_groups):
+            chunk = order[k * len(order) // max_groups:(k + 1) * len(order) // max_groups]
+            if chunk:
+                groups.append((sorted(chunk), *(max(requests[i][j] for i in chunk) for j in range(3))))
+    return sorted(groups, key=lambda g: g[0][0])
+
+
+def plan_task(task, array, cpus, mem, time_limit, root, uvfits_pattern, shards=None, models=None, mode="fit",
+              max_groups=4, fit_cpus=False, record=True):
+    """Groups of array tasks and their requests for one job, writing a ``sizing`` record per task.
+
+    Args:
+        task (str): Job name (the ``submit`` record's task)
+        array (str): Configured Slurm array spec
+        cpus (int): Configured CPUs per task (also the most a sized task gets)
+        mem (str): Configured memory, e.g. "54G"
+        time_limit (str): Configured time limit
+        root (str): DATA_ROOT/SBID
+        uvfits_pattern (str): UVFITS glob relative to ``root``
+        shards (int): SCAN_SHARDS
+        models (dict): From ``load_models``
+        mode (str): "fit" to size from ``models``, "record" to keep the configured requests
+        max_groups (int): Most array jobs to split the job into
+        fit_cpus (bool): Also cut the CPUs to the measured use
+        record (bool): Write the ``sizing`` records to $TELEMETRY
+
+    Returns:
+        tuple: (groups as from ``group_requests``, index -> dict of features, model and prediction)
+    """
+    indices = parse_array_spec(array)
+    features = task_features(task, indices, root, uvfits_pattern, shards)
+    model = model_for(models or {}, task) if mode == "fit" else None
+    configured = (int(cpus), parse_mem(mem), parse_time(time_limit))
+    requests, details, now = {}, {}, time.time()
+    for i in indices:
+        requests[i] = size_request(model, features[i], *configured, fit_cpus=fit_cpus)
+        x = work(features[i], model)
+        details[i] = {"features": features[i], "model": model.key if model else None,
+                      "predicted_wall_s": model.wall.predict(x) if model else None,
+                      "predicted_rss_mb": model.rss.predict(features[i].get("vis") or 0) if model and model.rss else None}
+        if record:
+            write_record({"kind": "sizing", "task": task, "stage": stage_of(task), "array_task_id": str(i), "root": root,
+                          "cpus": requests[i][0], "mem_mb": requests[i][1], "time_s": requests[i][2], **details[i], "ts": now})
+    return group_requests(requests, max_groups), details
+
+
+def _plan_settings(settings):
+    """plan_task keyword arguments from pipeline_config.sh settings."""
+    return {"root": os.path.join(settings["DATA_ROOT"], settings["SBID"]), "uvfits_pattern": settings["UVFITS_PATTERN"],
+            "shards": int(settings["SCAN_SHARDS"]) if settings["SCAN_SHARDS"] else None,
+            "fit_cpus": bool(settings["SIZING_CPUS"])}
+
+
+def size_dag(tasks, settings, models=None, record=True):
+    """orchestrate.py Tasks with their requests sized (SIZING=fit) or only recorded (SIZING=record).
+
+    aftercorr dependencies pair array tasks of one job with those of
+    another, so an orchestrated job is not split into groups: every task
+    gets the largest request of its array.
+    """
+    mode = settings["SIZING"]
+    if models is None and mode == "fit":
+        models = load_models([settings["SIZING_HISTORY"]])
+    sized = []
+    for task in tasks:
+        groups, _ = plan_task(task.name, task.array, task.cpus, task.mem, task.time, models=models, mode=mode,
+                              max_groups=1, record=record, **_plan_settings(settings))
+        _, cpus, mem_mb, time_s = groups[0]
+        if mode == "fit":
+            task = task._replace(cpus=str(cpus), mem=format_mem(mem_mb), time=format_time(time_s))
+        sized.append(task)
+    return sized
+
+
+# -------------------- command line --------------------
+
+def dry_run(settings, models, max_groups):
+    """Print the predicted cost and the requests of every job and stage of the pipeline."""
+    from orchestrate import build_dag
+
+    print(f"{'job':28s} {'tasks':>5s}  {'model':28s} {'wall med / max':>17s} {'RSS max':>8s}  {'configured':20s} sized groups")
+    stages = defaultdict(lambda: {"tasks": 0, "wall_s": 0.0, "configured": 0.0, "sized": 0.0})
+    for task in build_dag(settings):
+        groups, details = plan_task(task.name, task.array, task.cpus, task.mem, task.time, models=models, mode="fit",
+                                    max_groups=max_groups, record=False, **_plan_settings(settings))
+        walls = [d["predicted_wall_s"] for d in details.values() if d["predicted_wall_s"] is not None]
+        rss = [d["predicted_rss_mb"] for d in details.values() if d["predicted_rss_mb"] is not None]
+        model = model_for(models, task.name)
+        stage = stages[stage_of(task.name)]
+        stage["tasks"] += len(details)
+        stage["wall_s"] += sum(walls)
+        stage["configured"] += len(details) * int(task.cpus) * parse_time(task.time) / 3600
+        stage["sized"] += sum(len(ix) * c * t for ix, c, _, t in groups) / 3600
+        configured = f"{task.cpus} {task.mem} {task.time}"
+        sized = "; ".join(f"[{array_spec(ix, task.array)}] {c} {format_mem(m)} {format_time(t)}" for ix, c, m, t in groups)
+        walls_text = f"{duration(sorted(walls)[len(walls) // 2])} / {duration(max(walls))}" if walls else "-"
+        print(f"{task.name:28s} {len(details):5d}  {(f'{model.key} ({model.samples})' if model else '-'):28s} "
+              f"{walls_text:>17s} {(format_mem(max(rss)) if rss else '-'):>8s}  {configured:20s} {sized}")
+    print(f"\n{'stage':12s} {'tasks':>6s} {'predicted run':>14s} {'CPU-h reserved (configured -> sized)':>38s}")
+    for name, stage in stages.items():
+        print(f"{name:12s} {stage['tasks']:6d} {duration(stage['wall_s']) if stage['wall_s'] else '-':>14s} "
+              f"{stage['configured']:18.1f} -> {stage['sized']:.1f}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Size the Slurm requests of pipeline jobs from past telemetry.")
+    sub = p.add_subparsers(dest="command", required=True)
+    plan = sub.add_parser("plan", help="Print 'INDICES CPUS MEM TIME' per group of array tasks of one job.")
+    plan.add_argument("--task", required=True, help="Job name, e.g. flag_raw or crystalball_selfcal_2.")
+    plan.add_argument("--array", required=True, help="Configured Slurm array spec.")
+    plan.add_argument("--time", required=True, help="Configured time limit.")
+    plan.add_argument("--cpus", type=int, required=True, help="Configured CPUs per task (the most a sized task gets).")
+    plan.add_argument("--mem", required=True, help="Configured memory per task.")
+    plan.add_argument("--root", required=True, help="DATA_ROOT/SBID.")
+    plan.add_argument("--uvfits-pattern", default="20??*/*beam*.uvfits", help="UVFITS glob relative to --root.")
+    plan.add_argument("--shards", type=int, default=None, help="SCAN_SHARDS of the per-scan stages.")
+    plan.add_argument("--mode", choices=["fit", "record"], default="fit",
+                      help="fit: size from --history; record: keep the configured requests, only write sizing records.")
+    plan.add_argument("--groups", type=int, default=4, help="Most array jobs to split the job into.")
+    plan.add_argument("--fit-cpus", action="store_true", help="Also cut the CPUs to the measured use.")
+    plan.add_argument("--history", nargs="*", default=[], help="Telemetry files (or globs) of past runs.")
+    dry = sub.add_parser("dry-run", help="Print the predicted cost and requests of every job of the pipeline.")
+    dry.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_config.sh"),
+                     help="Settings file to source (pipeline_config.sh).")
+    dry.add_argument("--history", nargs="*", default=None, help="Telemetry files (or globs) of past runs (default: SIZING_HISTORY).")
+    dry.add_argument("--groups", type=int, default=None, help="Most array jobs per job (default: SIZING_GROUPS).")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "dry-run":
+        from orchestrate import pipeline_settings
+
+        settings = pipeline_settings(args.config)
+        models = load_models(args.history if args.history is not None else [settings["SIZING_HISTORY"]])
+        print(f"{len(models)} cost models from past runs: {', '.join(sorted(models)) or 'none'}\n")
+        dry_run(settings, models, args.groups or int(settings["SIZING_GROUPS"] or 1))
+        return
+    models = load_models(args.history) if args.mode == "fit" else None
+    groups, _ = plan_task(args.task, args.array, args.cpus, args.mem, args.time, args.root, args.uvfits_pattern,
+                          shards=args.shards, models=models, mode=args.mode, max_groups=args.groups, fit_cpus=args.fit_cpus)
+    for indices, cpus, mem_mb, time_s in groups:
+        print(f"{array_spec(indices, args.array)} {cpus} {format_mem(mem_mb)} {format_time(time_s)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,13 @@ PYTHON=${PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${CASA_SIF} pytho
 
 # Column to use in average ("DATA" default)
 TIMEBIN=${TIMEBIN:-"9.90s"}
+CHANBIN=${CHANBIN:-1}               # channels to average together (1 = none)
+AVERAGE_ENGINE=${AVERAGE_ENGINE:-casa}  # casa (mstransform) or native (streaming python-casacore averager)
+STAGE_CACHE=${STAGE_CACHE:-""}  # set non-empty to skip work whose outputs are up to date (see stage_cache.py)
+MS_LAYOUT=${MS_LAYOUT:-""}  # storage layout of the output MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
+AVERAGE_WORKERS=${AVERAGE_WORKERS:-${SLURM_CPUS_PER_TASK:-1}}  # baseline-group threads for the native engine
+SHARDS=${SHARDS:-""}  # set to N to average slice SLURM_ARRAY_TASK_ID of N of the MSs in this task (see shard.py)
+AVERAGE_MS_WORKERS=${AVERAGE_MS_WORKERS:-1}  # MSs of the shard averaged concurrently
 
 # -----------------------------------------------------
 
@@ -41,6 +48,10 @@ shopt -u nullglob
 
 # Create log dir if not exists
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/requeue.sh"    # with RESUME_WRITES, resume journaled writes and requeue near the time limit
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job average
 
 # # Check prerequisites
 # if [[ ! -f "$MS_LIST_FILE" ]]; then
@@ -53,8 +64,14 @@ if [[ ! -f "$SCRIPT" ]]; then
     exit 1
 fi
 
-# Pick the MS for this array index
-MSFILE=${msnames[${SLURM_ARRAY_TASK_ID}]} #$(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" "$MS_LIST_FILE" || true)
+# Pick the MS for this array index (or, with SHARDS, let the script take its slice of all of them)
+if [[ -n "${SHARDS}" ]]; then
+    MSFILE="shard ${SLURM_ARRAY_TASK_ID}/${SHARDS} of ${#msnames[@]} MSs"
+    select=(--ms "${msnames[@]}" --shard "${SLURM_ARRAY_TASK_ID}/${SHARDS}" --ms-workers "${AVERAGE_MS_WORKERS}")
+else
+    MSFILE=${msnames[${SLURM_ARRAY_TASK_ID}]} #$(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" "$MS_LIST_FILE" || true)
+    select=(--ms "$MSFILE")
+fi
 
 # if [[ -z "${MSFILE:-}" ]]; then
 #     echo "ERROR: No entry in '$MS_LIST_FILE' for SLURM_ARRAY_TASK_ID=$SLURM_ARRAY_TASK_ID" >&2
@@ -70,5 +87,5 @@ echo "Averaging to time: $TIMEBIN"
 module load apptainer
 
 # Run the averaging
-$PYTHON "$SCRIPT" --ms "$MSFILE" --timebin "${TIMEBIN}"
+resumable $PYTHON $(casa_worker_for "${AVERAGE_ENGINE}") "$SCRIPT" "${select[@]}" --timebin "${TIMEBIN}" --chanbin "${CHANBIN}" --engine "${AVERAGE_ENGINE}" --workers "${AVERAGE_WORKERS}" ${STAGE_CACHE:+--stage-cache} ${RESUME_WRITES:+--resume} ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
 
@@ -20,6 +20,11 @@ CAL_DIR=${CAL_DIR:-cal}
 EXTENSION=${EXTENSION:-"B0"}
 SCRIPT=${SCRIPT:-applycal_ms_beams.py}
 DELETE_PREVIOUS=${DELETE_PREVIOUS:-""} #set to --delete-previous if you want to delete previous gen
+ENGINE=${ENGINE:-casa} #casa (applycal+split) or native (single-pass python-casacore apply)
+SHARE_PARENT=${SHARE_PARENT:-""} #set non-empty with ENGINE=native to hardlink unchanged columns from the previous generation
+WORKERS=${WORKERS:-1} #worker processes for the MSs of this beam (e.g. ${SLURM_CPUS_PER_TASK})
+IO_WORKERS=${IO_WORKERS:-${WORKERS}} #max workers reading/writing MSs at once, to spare the Lustre OSTs
+MS_LAYOUT=${MS_LAYOUT:-""} #storage layout of the output MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
 # Apptainer CASA container (flint-containers_casa) default runner:
 CASA_SIF=${CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
 BIND_SRC=${BIND_SRC:-/fred/oz451}
@@ -27,10 +32,14 @@ PYTHON=${PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${CASA_SIF} pytho
 # ---------------------------------------------------------------------
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/requeue.sh"    # with RESUME_WRITES, resume journaled writes and requeue near the time limit
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job bandpass "${SLURM_ARRAY_TASK_ID}"
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
 echo "SBID=$SBID DATA_ROOT=$DATA_ROOT CAL_DIR=$CAL_DIR BEAM=$SLURM_ARRAY_TASK_ID PATTERN=$PATTERN"
 echo "Container: ${CASA_SIF}; Bind: ${BIND_SRC}"
 
 # Execute inside the CASA container
-$PYTHON "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --pattern "$PATTERN" --cal-dir "$CAL_DIR" --extension "${EXTENSION}" --beam "$SLURM_ARRAY_TASK_ID" ${DELETE_PREVIOUS:+--delete-previous}
+resumable $PYTHON $(casa_worker_for "${ENGINE}") "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --pattern "$PATTERN" --cal-dir "$CAL_DIR" --extension "${EXTENSION}" --beam "$SLURM_ARRAY_TASK_ID" --workers "${WORKERS}" --io-workers "${IO_WORKERS}" --engine "${ENGINE}" ${DELETE_PREVIOUS:+--delete-previous} ${SHARE_PARENT:+--share-parent} ${RESUME_WRITES:+--resume} ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
@@ -16,6 +16,8 @@ SBID=${SBID:-SB77974}
 DATA_ROOT=${DATA_ROOT:-/fred/oz451/${USER}/data}
 PATTERN=${PATTERN:-"20*/*beam{beam:02d}*.calG6.ms"}
 SCRIPT=${SCRIPT:-clearcal_ms_beams.py}
+WORKERS=${WORKERS:-1} #worker processes for the MSs of this beam (e.g. ${SLURM_CPUS_PER_TASK})
+IO_WORKERS=${IO_WORKERS:-${WORKERS}} #max workers reading/writing MSs at once, to spare the Lustre OSTs
 # Apptainer CASA container (flint-containers_casa) default runner:
 CASA_SIF=${CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
 BIND_SRC=${BIND_SRC:-/fred/oz451}
@@ -23,10 +25,13 @@ PYTHON=${PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${CASA_SIF} pytho
 # ---------------------------------------------------------------------
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job clearcal "${SLURM_ARRAY_TASK_ID}"
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
 echo "SBID=$SBID DATA_ROOT=$DATA_ROOT BEAM=$SLURM_ARRAY_TASK_ID PATTERN=$PATTERN"
 echo "Container: ${CASA_SIF}; Bind: ${BIND_SRC}"
 
 # Execute inside the CASA container
-$PYTHON "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --pattern "$PATTERN" --beam "$SLURM_ARRAY_TASK_ID"
+$PYTHON $(casa_worker_for casa) "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --pattern "$PATTERN" --beam "$SLURM_ARRAY_TASK_ID" --workers "${WORKERS}" --io-workers "${IO_WORKERS}"
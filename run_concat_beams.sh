@@ -17,8 +17,19 @@ OUT_ROOT=${OUT_ROOT:-/fred/oz451/${USER}/data}
 PATTERN=${PATTERN:-"20??*/*beam{beam:02d}*.20????????????.avg.calB0.ms"}   # relative under data-root/SBID
 PYTHON=${PYTHON:-'apptainer exec --bind /fred/oz451:/fred/oz451 /fred/oz451/${USER}/containers/flint-containers_casa.sif python3'}
 SCRIPT=${SCRIPT:-concat_ms_beams.py}
+CONCAT_ENGINE=${CONCAT_ENGINE:-casa}   # casa or native (k-way merge, see native_concat.py)
+STAGE_CACHE=${STAGE_CACHE:-""}  # set non-empty to skip work whose outputs are up to date (see stage_cache.py)
+MS_LAYOUT=${MS_LAYOUT:-""}  # storage layout of the output MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
 # ---------------------------------------------------------------------
 
+# the MS written here is imaged, predicted into and self-calibrated in place, and those stages open its
+# subtables by path: a virtual concat (concat_ms_beams.py --engine virtual) has neither real subtables nor
+# columns of its own, so it is only for read-only use outside the pipeline
+if [[ "${CONCAT_ENGINE}" == "virtual" ]]; then
+    echo "ERROR: CONCAT_ENGINE=virtual is not supported by the pipeline; use casa or native" >&2
+    exit 1
+fi
+
 # Resolve the beam-specific glob by formatting {beam:02d}
 beam="${SLURM_ARRAY_TASK_ID}"
 printf -v beam2 "%02d" "${beam}"
@@ -26,6 +37,9 @@ root="${DATA_ROOT}/${SBID}"
 glob="${PATTERN//\{beam:02d\}/$beam2}"
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job concat "${SLURM_ARRAY_TASK_ID}"
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
 echo "SBID=$SBID DATA_ROOT=$DATA_ROOT OUT_ROOT=$OUT_ROOT BEAM=$SLURM_ARRAY_TASK_ID"
@@ -33,5 +47,5 @@ echo "SBID=$SBID DATA_ROOT=$DATA_ROOT OUT_ROOT=$OUT_ROOT BEAM=$SLURM_ARRAY_TASK_
 module load apptainer
 
 # ------------------------- EXECUTION LINE -----------------------------
-$PYTHON "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --out-root "$OUT_ROOT" --pattern "${glob}" --beam "$SLURM_ARRAY_TASK_ID"
+$PYTHON $(casa_worker_for "${CONCAT_ENGINE}") "$SCRIPT" --sbid "$SBID" --data-root "$DATA_ROOT" --out-root "$OUT_ROOT" --pattern "${glob}" --beam "$SLURM_ARRAY_TASK_ID" --engine "$CONCAT_ENGINE" ${STAGE_CACHE:+--stage-cache} ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
 # ---------------------------------------------------------------------
@@ -31,6 +31,15 @@ MEMORY_FRACTION=${MEMORY_FRACTION:-0.8}             # crystalball -mf
 REGION_FILE=${REGION_FILE:-}                         # crystalball -w (optional DS9 region)
 PREDICT_ONLY=${PREDICT_ONLY:-}                       # crystalball -po (set to 1 to enable)
 NUM_BRIGHTEST_SOURCES=${NUM_BRIGHTEST_SOURCES:-0}   # crystalball -ns (0 = all)
+PREDICT_ENGINE=${PREDICT_ENGINE:-crystalball}        # crystalball, or native (native_predict.py: threaded NumPy DFT, no dask)
+PREDICT_SCRIPT=${PREDICT_SCRIPT:-${PWD}/native_predict.py}
+CHUNK_ROWS=${CHUNK_ROWS:-20000}                      # native: rows per streamed block
+PREDICT_INCREMENTAL=${PREDICT_INCREMENTAL:-}         # native: set non-empty to predict only the change from the previous round's model (model_delta.py)
+DELTA_SCRIPT=${DELTA_SCRIPT:-${PWD}/model_delta.py}
+MAX_DELTA_FRACTION=${MAX_DELTA_FRACTION:-0.5}        # native incremental: full predict when the delta exceeds this fraction of the list
+STAGE_CACHE=${STAGE_CACHE:-""}                       # set non-empty to skip MSs already predicted from the same source list
+STAGE_CACHE_SCRIPT=${STAGE_CACHE_SCRIPT:-${PWD}/stage_cache.py}
+CACHE_PYTHON=${CACHE_PYTHON:-python3}                # stage_cache.py only needs the standard library
 # ---------------------------------------------------------------------------
 
 module load python-scientific/3.11.5-foss-2023b
@@ -38,6 +47,9 @@ unset PYTHONPATH
 source ${CRYSTALBALL_ENV}/bin/activate
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/requeue.sh"    # with RESUME_WRITES, resume journaled writes and requeue near the time limit
+telemetry_job crystalball "${SLURM_ARRAY_TASK_ID}"
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
 echo "SBID=$SBID DATA_ROOT=$DATA_ROOT BEAM=$SLURM_ARRAY_TASK_ID PATTERN=$PATTERN"
@@ -94,6 +106,16 @@ cb_opts=( "-o" "${OUTPUT_COLUMN}" "-j" "${NUM_WORKERS}" "-mf" "${MEMORY_FRACTION
 [[ -n "${PREDICT_ONLY}" ]]    && cb_opts+=( "-po" )
 [[ "${NUM_BRIGHTEST_SOURCES}" -gt 0 ]] && cb_opts+=( "-ns" "${NUM_BRIGHTEST_SOURCES}" )
 
+# native_predict.py takes the same -o/-ns/-f flags; it threads over SLURM_CPUS_PER_TASK
+np_opts=( "-o" "${OUTPUT_COLUMN}" "-j" "${SLURM_CPUS_PER_TASK:-1}" "--chunk-rows" "${CHUNK_ROWS}" )
+[[ -n "${FIELD}" ]] && np_opts+=( "-f" "${FIELD}" )
+[[ "${NUM_BRIGHTEST_SOURCES}" -gt 0 ]] && np_opts+=( "-ns" "${NUM_BRIGHTEST_SOURCES}" )
+[[ -n "${RESUME_WRITES}" ]] && np_opts+=( "--resume" )
+if [[ "${PREDICT_ENGINE}" == "native" && -n "${REGION_FILE}" ]]; then
+    echo "ERROR: PREDICT_ENGINE=native does not support REGION_FILE; use PREDICT_ENGINE=crystalball"
+    exit 1
+fi
+
 for ms in "${msnames[@]}"; do
     # Derive the WSClean source list path from the earlier -name "${ms%.ms}.img"
     
@@ -113,13 +135,41 @@ for ms in "${msnames[@]}"; do
       exit 1
       #continue
   fi
+  cache_state="logs/stage_crystalball_${SLURM_JOB_ID}_${SLURM_ARRAY_TASK_ID}_$(basename "${ms}").json"
+  if [[ -n "${STAGE_CACHE}" ]] && ${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" check --state "${cache_state}" --stage "crystalball_${IMG_TAG}" \
+         --inputs "${ms}" "${src_list}" --outputs "${ms}" --param "column=${OUTPUT_COLUMN}" --param "field=${FIELD}" \
+         --param "region=${REGION_FILE}" --param "predict_only=${PREDICT_ONLY}" --param "brightest=${NUM_BRIGHTEST_SOURCES}" \
+         --param "engine=${PREDICT_ENGINE}"; then
+      continue
+  fi
   echo "Predicting model -> MS=${ms}"
   echo "Using source list: ${src_list}"
 
-  # Execute crystalball CLI inside environment
+  # Execute crystalball CLI (or the native predictor) inside environment
   echo "running:"
-  echo "${CRYSTALBALL_ENV}/bin/crystalball ${ms} -sm ${src_list} ${cb_opts[@]}"
-  ${CRYSTALBALL_ENV}/bin/crystalball ${ms} -sm ${src_list} ${cb_opts[@]}
+  if [[ "${PREDICT_ENGINE}" == "native" && -n "${PREDICT_INCREMENTAL}" ]]; then
+      # the previous self-cal generation has the same rows and holds the previous round's model
+      base_opts=()
+      if (( SELFCAL == 1 && INDEX > 0 )); then
+          if (( INDEX == 1 )); then
+              base_ms="${ms%.selfcal_${INDEX}.ms}.calB0.ms"
+          else
+              base_ms="${ms%.selfcal_${INDEX}.ms}.selfcal_$(( INDEX - 1 )).ms"
+          fi
+          [[ -d "${base_ms}" && "${base_ms}" != "${ms}" ]] && base_opts=( "--base-ms" "${base_ms}" )
+      fi
+      echo "python ${DELTA_SCRIPT} ${ms} -sm ${src_list} ${np_opts[@]} ${base_opts[@]} --max-delta-fraction ${MAX_DELTA_FRACTION}"
+      resumable telemetry_run predict_delta "${ms}" python "${DELTA_SCRIPT}" "${ms}" -sm "${src_list}" "${np_opts[@]}" "${base_opts[@]}" --max-delta-fraction "${MAX_DELTA_FRACTION}"
+  elif [[ "${PREDICT_ENGINE}" == "native" ]]; then
+      echo "python ${PREDICT_SCRIPT} ${ms} -sm ${src_list} ${np_opts[@]}"
+      resumable telemetry_run predict "${ms}" python "${PREDICT_SCRIPT}" "${ms}" -sm "${src_list}" "${np_opts[@]}"
+  else
+      echo "${CRYSTALBALL_ENV}/bin/crystalball ${ms} -sm ${src_list} ${cb_opts[@]}"
+      telemetry_run crystalball "${ms}" ${CRYSTALBALL_ENV}/bin/crystalball ${ms} -sm ${src_list} ${cb_opts[@]}
+  fi
+  if [[ -n "${STAGE_CACHE}" ]]; then
+      ${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" commit --state "${cache_state}" || echo "WARN: could not record the prediction into ${ms} in the stage cache"
+  fi
   #apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${CRYSTALBALL_SIF}" \
   #  crystalball "${ms}" -sm "${src_list}" "${cb_opts[@]}"
 done
@@ -35,6 +35,22 @@ export script_dir=${SCRIPT_DIR:-$PWD}
 
 AOFLAGGER_OPTIONS="-column $COLUMN -strategy $script_dir/aoflagger/ASKAP.lua -v"
 
+STAGE_CACHE=${STAGE_CACHE:-""}                                      # set non-empty to skip MSs already flagged with this strategy
+STAGE_CACHE_SCRIPT=${STAGE_CACHE_SCRIPT:-${script_dir}/stage_cache.py}
+CACHE_PYTHON=${CACHE_PYTHON:-python3}                               # stage_cache.py only needs the standard library
+SHARDS=${SHARDS:-""}                                                # set to N to flag slice SLURM_ARRAY_TASK_ID of N of the MSs in this task
+
+# Flag carry-over between generations (flag_store.py)
+FLAG_MODE=${FLAG_MODE:-full}          # full: aoflagger on everything; changed: inherit the parent's stored flags and re-run aoflagger
+                                      # only on time ranges whose statistics changed; inherit: take the parent's flags through the averaging, no aoflagger
+FLAG_PARENT=${FLAG_PARENT:-""}        # "suffix:parent_suffix" naming an MS's parent, e.g. ".calB0.ms:.ms"
+FLAG_RULE=${FLAG_RULE:-any}           # inherit: averaged cell flagged if any (or "fraction:F") of its input samples were
+TIMEBIN=${TIMEBIN:-9.90s}             # inherit: averaging interval the MS was made with
+FLAG_STORE=${FLAG_STORE:-""}          # set non-empty to save <ms>.flags.zip after flagging (always done when FLAG_MODE is not full)
+FLAG_STORE_SCRIPT=${FLAG_STORE_SCRIPT:-${script_dir}/flag_store.py}
+FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
+STORE_PYTHON=${STORE_PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_CASA_SIF} python3}
+
 # -----------------------------------------------------
 
 root="${DATA_ROOT}/${SBID}"
@@ -47,6 +63,8 @@ msnames=( ${search_glob} )
 shopt -u nullglob
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+telemetry_job flag
 
 # if [[ ! -x "$FLAG_SCRIPT" ]]; then
 #     echo "ERROR: FLAG_SCRIPT '$FLAG_SCRIPT' not found or not executable." >&2
@@ -67,26 +85,81 @@ fi
 
 # 3) Ensure index is in range
 idx=${SLURM_ARRAY_TASK_ID}
-if (( idx < 0 || idx >= ${#msnames[@]} )); then
-    echo "ERROR: SLURM_ARRAY_TASK_ID=${idx} is out of range (0..$(( ${#msnames[@]} - 1 ))) for ${#msnames[@]} files." >&2
+ntasks=${SHARDS:-${#msnames[@]}}
+if (( idx < 0 || idx >= ntasks )); then
+    echo "ERROR: SLURM_ARRAY_TASK_ID=${idx} is out of range (0..$(( ntasks - 1 ))) for ${ntasks} tasks." >&2
     exit 0
 fi
 
-MSFILE=${msnames[$idx]}
-
-if [[ -z "${MSFILE:-}" ]]; then
-    echo "ERROR: No entry in '$search_glob' for SLURM_ARRAY_TASK_ID=$SLURM_ARRAY_TASK_ID" >&2
-    exit 1
+# 4) This task's MS, or with SHARDS its contiguous slice of them (same split as shard.py)
+if [[ -n "${SHARDS}" ]]; then
+    start=$(( idx * ${#msnames[@]} / SHARDS ))
+    end=$(( (idx + 1) * ${#msnames[@]} / SHARDS ))
+    todo=( "${msnames[@]:start:end-start}" )
+else
+    todo=( "${msnames[$idx]}" )
 fi
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} starting on $(hostname)"
-echo "Using MS: $MSFILE"
+echo "Using MS:   ${todo[*]:-none}"
 echo "Column:   $COLUMN"
 echo "script_dir: $script_dir"
 
 #module load aoflagger
 module load apptainer
 
-# Run the flagging
-${AOFLAGGER} ${AOFLAGGER_OPTIONS} "$MSFILE"
-
+for MSFILE in "${todo[@]}"; do
+    mode="${FLAG_MODE}"
+    parent_opts=()
+    if [[ "${mode}" != "full" ]]; then
+        parent="${MSFILE%${FLAG_PARENT%%:*}}${FLAG_PARENT#*:}"
+        if [[ -z "${FLAG_PARENT}" || "${parent}" == "${MSFILE}" || ! -f "${parent}.flags.zip" ]]; then
+            echo "WARN: no flag store of the parent of $MSFILE ('${parent}.flags.zip'); running aoflagger on all of it"
+            mode=full
+        else
+            parent_opts=( "--parent" "${parent}" )
+        fi
+    fi
+
+    cache_state="logs/stage_flag_${SLURM_JOB_ID}_${SLURM_ARRAY_TASK_ID}.json"
+    cache_inputs=( "$MSFILE" "$script_dir/aoflagger/ASKAP.lua" )
+    [[ "${mode}" != "full" ]] && cache_inputs+=( "${parent}.flags.zip" )
+    if [[ -n "${STAGE_CACHE}" ]] && ${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" check --state "${cache_state}" --stage "flag_${COLUMN}" \
+           --inputs "${cache_inputs[@]}" --outputs "$MSFILE" --param "mode=${mode}" --param "rule=${FLAG_RULE}"; then
+        continue
+    fi
+
+    # Copy-on-write generations (ms_generation.py) hardlink column files to their
+    # parent MS; give this MS private copies before aoflagger rewrites them in place
+    find "$MSFILE" -maxdepth 1 -type f -links +1 -exec sh -c 'cp -p "$1" "$1.unshare" && mv -f "$1.unshare" "$1"' _ {} \;
+
+    # Run the flagging
+    case "${mode}" in
+        full)
+            telemetry_run aoflagger "$MSFILE" ${AOFLAGGER} ${AOFLAGGER_OPTIONS} "$MSFILE"
+            ;;
+        changed)
+            telemetry_run flag_inherit "$MSFILE" ${STORE_PYTHON} "${FLAG_STORE_SCRIPT}" inherit "$MSFILE" "${parent_opts[@]}"
+            intervals=$(${STORE_PYTHON} "${FLAG_STORE_SCRIPT}" plan "$MSFILE" "${parent_opts[@]}" --column "$COLUMN")
+            while read -r start end; do
+                [[ -z "${start}" ]] && continue
+                echo "re-flagging timesteps ${start}-${end} of $MSFILE"
+                telemetry_run aoflagger_interval "$MSFILE" ${AOFLAGGER} ${AOFLAGGER_OPTIONS} -interval "${start}" "${end}" "$MSFILE"
+            done <<< "${intervals}"
+            ;;
+        inherit)
+            telemetry_run flag_inherit "$MSFILE" ${STORE_PYTHON} "${FLAG_STORE_SCRIPT}" inherit "$MSFILE" "${parent_opts[@]}" --rule "${FLAG_RULE}" --timebin "${TIMEBIN}"
+            ;;
+        *)
+            echo "ERROR: unknown FLAG_MODE '${FLAG_MODE}' (full, changed or inherit)" >&2
+            exit 1
+            ;;
+    esac
+    if [[ -n "${FLAG_STORE}" || "${FLAG_MODE}" != "full" ]]; then
+        telemetry_run flag_save "$MSFILE" ${STORE_PYTHON} "${FLAG_STORE_SCRIPT}" save "$MSFILE" --column "$COLUMN"
+    fi
+
+    if [[ -n "${STAGE_CACHE}" ]]; then
+        ${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" commit --state "${cache_state}" || echo "WARN: could not record flagging of $MSFILE in the stage cache"
+    fi
+done
@@ -18,6 +18,11 @@ SBID=${SBID:-SB77974}
 DATA_ROOT=${DATA_ROOT:-/fred/oz451/${USER}/data}
 UVFITS_PATTERN=${UVFITS_PATTERN:-"20??*/*beam*.20????????????*.uvfits"}
 IMPORT_SCRIPT=${IMPORT_SCRIPT:-${PWD}/import_array.py}
+IMPORT_ENGINE=${IMPORT_ENGINE:-casa}            # casa (importuvfits) or native (memory-mapped importer, see native_uvfits.py)
+IMPORT_CHUNK_ROWS=${IMPORT_CHUNK_ROWS:-20000}    # UVFITS groups per block for the native engine
+MS_LAYOUT=${MS_LAYOUT:-""}                       # storage layout of the MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
+SHARDS=${SHARDS:-""}                            # set to N to import slice SLURM_ARRAY_TASK_ID of N of the files in this task (see shard.py)
+IMPORT_WORKERS=${IMPORT_WORKERS:-1}             # files of the shard imported concurrently
 FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
 BIND_SRC=${BIND_SRC:-/fred/oz451}
 PYTHON=${PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_CASA_SIF} python3}
@@ -27,6 +32,9 @@ root="${DATA_ROOT}/${SBID}"
 search_glob="${root}/${UVFITS_PATTERN}"
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job import
 
 shopt -s nullglob
 uvfits=( ${search_glob} )
@@ -53,15 +61,22 @@ echo "Data root:     ${root}"
 echo "Pattern:       ${UVFITS_PATTERN}"
 echo "Files found:   ${#uvfits[@]}"
 echo "Import script: ${IMPORT_SCRIPT}"
+echo "Engine:        ${IMPORT_ENGINE}"
 echo "Array index:   ${SLURM_ARRAY_TASK_ID}"
 
-if (( SLURM_ARRAY_TASK_ID >= ${#uvfits[@]} )); then
-    echo "Index ${SLURM_ARRAY_TASK_ID} out of range for ${#uvfits[@]} files - skipping."
+if (( SLURM_ARRAY_TASK_ID >= ${SHARDS:-${#uvfits[@]}} )); then
+    echo "Index ${SLURM_ARRAY_TASK_ID} out of range for ${SHARDS:-${#uvfits[@]}} tasks - skipping."
     exit 0
 fi
 
 module load apptainer
 
-$PYTHON "${IMPORT_SCRIPT}" -i "${SLURM_ARRAY_TASK_ID}" -f "${uvfits[@]}"
+if [[ -n "${SHARDS}" ]]; then
+    select=(--shard "${SLURM_ARRAY_TASK_ID}/${SHARDS}" --workers "${IMPORT_WORKERS}")
+else
+    select=(-i "${SLURM_ARRAY_TASK_ID}")
+fi
+$PYTHON $(casa_worker_for "${IMPORT_ENGINE}") "${IMPORT_SCRIPT}" "${select[@]}" -f "${uvfits[@]}" --engine "${IMPORT_ENGINE}" --chunk-rows "${IMPORT_CHUNK_ROWS}" \
+    ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} completed."
@@ -0,0 +1,107 @@
+#!/bin/bash
+#SBATCH --job-name=ingest_array
+#SBATCH --output=logs/ingest_%A_%a.out
+#SBATCH --error=logs/ingest_%A_%a.err
+#SBATCH --time=00:45:00
+#SBATCH --cpus-per-task=4
+#SBATCH --mem=12G
+#SBATCH --array=0-500
+# Optional: limit concurrency to avoid filesystem contention
+# #SBATCH --array=0-500%10
+
+# Fused ingest (ingest_uvfits.py): UVFITS -> .calB0.ms with the bandpass applied
+# while streaming, then aoflagger on the new MS in the same job. Replaces the
+# import -> flag -> bandpass -> flag sequence of separate arrays.
+
+set -euo pipefail
+
+# -------------------- USER CONFIG --------------------
+SBID=${SBID:-SB77974}
+DATA_ROOT=${DATA_ROOT:-/fred/oz451/${USER}/data}
+UVFITS_PATTERN=${UVFITS_PATTERN:-"20??*/*beam*.20????????????*.uvfits"}
+SCRIPT_DIR=${SCRIPT_DIR:-${PWD}}
+INGEST_SCRIPT=${INGEST_SCRIPT:-${SCRIPT_DIR}/ingest_uvfits.py}
+CAL_DIR=${CAL_DIR:-cal}                                  # relative under DATA_ROOT/SBID
+EXTENSION=${EXTENSION:-B0}
+FLAG_STRATEGY=${FLAG_STRATEGY:-${SCRIPT_DIR}/aoflagger/ASKAP.lua}   # set empty to skip flagging
+FLAG_COLUMN=${FLAG_COLUMN:-DATA}
+FLAG_STORE=${FLAG_STORE:-""}                              # set non-empty to save <ms>.flags.zip after flagging, for the .avg MSs to inherit (flag_store.py)
+FLAG_STORE_SCRIPT=${FLAG_STORE_SCRIPT:-${SCRIPT_DIR}/flag_store.py}
+SHARDS=${SHARDS:-""}                                      # set to N to ingest slice SLURM_ARRAY_TASK_ID of N of the files in this task (see shard.py)
+INGEST_WORKERS=${INGEST_WORKERS:-1}                       # files of the shard ingested concurrently
+MS_LAYOUT=${MS_LAYOUT:-""}                                # storage layout of the calibrated MS, e.g. time or rows:cc16 (see ms_layout.py)
+FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
+FLINT_AOFLAGGER_SIF=${FLINT_AOFLAGGER_SIF:-/fred/oz451/${USER}/containers/flint-containers_aoflagger.sif}
+BIND_SRC=${BIND_SRC:-/fred/oz451}
+PYTHON=${PYTHON:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_CASA_SIF} python3}
+# run here, outside the CASA container (which has neither aoflagger nor apptainer), as in run_flag.sh
+AOFLAGGER=${AOFLAGGER:-apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_AOFLAGGER_SIF} aoflagger}
+# -----------------------------------------------------
+
+root="${DATA_ROOT}/${SBID}"
+search_glob="${root}/${UVFITS_PATTERN}"
+
+mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+telemetry_job ingest
+
+shopt -s nullglob
+uvfits=( ${search_glob} )
+shopt -u nullglob
+
+if [[ ! -d "${root}" ]]; then
+    echo "ERROR: Data root '${root}' not found." >&2
+    exit 1
+fi
+
+if [[ ! -f "${INGEST_SCRIPT}" ]]; then
+    echo "ERROR: INGEST_SCRIPT '${INGEST_SCRIPT}' not found." >&2
+    exit 1
+fi
+
+if [[ ${#uvfits[@]} -eq 0 ]]; then
+    echo "ERROR: No .uvfits files matched pattern: '${search_glob}'" >&2
+    exit 1
+fi
+
+echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} starting on $(hostname)"
+echo "SBID:          ${SBID}"
+echo "Data root:     ${root}"
+echo "Pattern:       ${UVFITS_PATTERN}"
+echo "Files found:   ${#uvfits[@]}"
+echo "Cal tables:    ${root}/${CAL_DIR}/*.${EXTENSION}"
+echo "Strategy:      ${FLAG_STRATEGY:-none}"
+echo "Array index:   ${SLURM_ARRAY_TASK_ID}"
+
+if (( SLURM_ARRAY_TASK_ID >= ${SHARDS:-${#uvfits[@]}} )); then
+    echo "Index ${SLURM_ARRAY_TASK_ID} out of range for ${SHARDS:-${#uvfits[@]}} tasks - skipping."
+    exit 0
+fi
+
+module load apptainer
+
+# this task's files: with SHARDS its contiguous slice of them (same split as shard.py)
+idx=${SLURM_ARRAY_TASK_ID}
+if [[ -n "${SHARDS}" ]]; then
+    select=(--shard "${idx}/${SHARDS}" --workers "${INGEST_WORKERS}")
+    start=$(( idx * ${#uvfits[@]} / SHARDS ))
+    end=$(( (idx + 1) * ${#uvfits[@]} / SHARDS ))
+    todo=( "${uvfits[@]:start:end-start}" )
+else
+    select=(-i "${idx}")
+    todo=( "${uvfits[$idx]}" )
+fi
+$PYTHON "${INGEST_SCRIPT}" "${select[@]}" -f "${uvfits[@]}" --cal-dir "${root}/${CAL_DIR}" --extension "${EXTENSION}" \
+    ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
+
+for uvfile in "${todo[@]}"; do
+    msfile="${uvfile%.uvfits}.cal${EXTENSION}.ms"
+    if [[ -n "${FLAG_STRATEGY}" ]]; then
+        telemetry_run aoflagger "${msfile}" ${AOFLAGGER} -column "${FLAG_COLUMN}" -strategy "${FLAG_STRATEGY}" -v "${msfile}"
+    fi
+    if [[ -n "${FLAG_STORE}" ]]; then
+        telemetry_run flag_save "${msfile}" ${PYTHON} "${FLAG_STORE_SCRIPT}" save "${msfile}" --column "${FLAG_COLUMN}"
+    fi
+done
+
+echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} completed."
@@ -31,11 +31,20 @@ PARANG=${PARANG:-""}               # set to non-empty (e.g., "1") to enable
 CALTABLE_PREFIX=${CALTABLE_PREFIX:-"selfcal_p"}
 PLOT_DIR=${PLOT_DIR:-"plots"}
 APPLY_CALWT=${APPLY_CALWT:-"True"}
+SOLVER=${SOLVER:-"casa"}           # casa (gaincal) or native (batched StEFCal)
+APPLY_ENGINE=${APPLY_ENGINE:-"casa"} # casa (applycal+split) or native (single-pass python-casacore apply)
+SHARE_PARENT=${SHARE_PARENT:-""}   # set non-empty with APPLY_ENGINE=native to hardlink unchanged columns from the previous round
+STAGE_CACHE=${STAGE_CACHE:-""}  # set non-empty to skip work whose outputs are up to date (see stage_cache.py)
+MS_LAYOUT=${MS_LAYOUT:-""}  # storage layout of the output MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
 # ---------------------------------------------------------------------------
 
 module load apptainer
 
 mkdir -p logs "${PLOT_DIR}"
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/requeue.sh"    # with RESUME_WRITES, resume journaled writes and requeue near the time limit
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job selfcal "${SLURM_ARRAY_TASK_ID}"
 
 beam="${SLURM_ARRAY_TASK_ID}"
 printf -v beam2 "%02d" "${beam}"
@@ -54,8 +63,8 @@ fi
 
 for ms in "${msnames[@]}"; do
   echo "Self-cal (phase-only) on: ${ms}"
-  apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_CASA_SIF}" \
-    python3 "${SCRIPT}" \
+  resumable apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_CASA_SIF}" \
+    python3 $(casa_worker_for "${SOLVER}" "${APPLY_ENGINE}") "${SCRIPT}" \
       --ms "${ms}" \
       --index "${INDEX}" \
       --solint "${SOLINT}" \
@@ -68,5 +77,11 @@ for ms in "${msnames[@]}"; do
       --caltable-prefix "${CALTABLE_PREFIX}" \
       --plot-dir "${PLOT_DIR}" \
       $( [[ -n "${PARANG}" ]] && echo "--parang" ) \
-      --apply-calwt "${APPLY_CALWT}"
+      --apply-calwt "${APPLY_CALWT}" \
+      --solver "${SOLVER}" \
+      --apply-engine "${APPLY_ENGINE}" \
+      $( [[ -n "${SHARE_PARENT}" ]] && echo "--share-parent" ) \
+      $( [[ -n "${STAGE_CACHE}" ]] && echo "--stage-cache" ) \
+      ${RESUME_WRITES:+--resume} \
+      ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
 done
@@ -0,0 +1,92 @@
+#!/bin/bash
+#SBATCH --job-name=snapshot_ms
+#SBATCH --output=logs/snapshot_%A_%a.out
+#SBATCH --error=logs/snapshot_%A_%a.err
+#SBATCH --time=04:00:00
+#SBATCH --cpus-per-task=16
+#SBATCH --mem=32G
+#SBATCH --array=0-35
+# Optional: #SBATCH --partition=standard
+
+set -euo pipefail
+
+# -------------------- User-configurable via --export --------------------
+SBID=${SBID:-SB77974}
+DATA_ROOT=${DATA_ROOT:-/fred/oz451/${USER}/data}
+PATTERN=${PATTERN:-"20??*/*beam{beam:02d}*.20????????????.calG6.uvsub.ms"}   # relative under data-root/SBID
+FLINT_WSCLEAN_SIF=${FLINT_WSCLEAN_SIF:-/fred/oz451/${USER}/containers/flint-containers_wsclean.sif}
+FLINT_CASA_SIF=${FLINT_CASA_SIF:-/fred/oz451/${USER}/containers/flint-containers_casa.sif}
+BIND_SRC=${BIND_SRC:-/fred/oz451}
+SCRIPT=${SCRIPT:-${SCRIPT_DIR:-$PWD}/snapshot_plan.py}
+PLAN_PYTHON=${PLAN_PYTHON:-"apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_CASA_SIF} python3"}   # planning needs python-casacore
+IMAGE_PYTHON=${IMAGE_PYTHON:-python3}                           # the image step only needs the standard library
+
+SNAPSHOT_STEP=${SNAPSHOT_STEP:-all}           # plan (task i plans beam i), image (from those plans) or all (plan then image)
+SNAPSHOT_TIMESTEP=${SNAPSHOT_TIMESTEP:-0}     # seconds per image, rounded to whole integrations; 0 images every integration
+SNAPSHOT_SHARDS=${SNAPSHOT_SHARDS:-1}         # array tasks per beam: task i images slice i % SHARDS of beam i / SHARDS
+SNAPSHOT_WORKERS=${SNAPSHOT_WORKERS:-4}       # wsclean processes run at once in each task (sharing its CPUs)
+SNAPSHOT_TAG=${SNAPSHOT_TAG:-snapshot}
+SNAPSHOT_OPTS=${SNAPSHOT_OPTS:-"-data-column DATA -pol i -weight briggs 0.5 -scale 12asec -size 1536 1536 -niter 0"}
+# -----------------------------------------------------------------------
+
+# every shard of a beam needs the same plan, and planning is a full TIME/FLAG pass over the MS: with
+# SNAPSHOT_SHARDS > 1 a plan array (one task per beam) writes <MS>.<tag>.plan.json first and the image
+# array depends on it, rather than each shard planning (and caching the plan in the MS) at once
+if [[ "${SNAPSHOT_STEP}" == "all" && "${SNAPSHOT_SHARDS}" -gt 1 ]]; then
+    echo "ERROR: SNAPSHOT_SHARDS=${SNAPSHOT_SHARDS} needs SNAPSHOT_STEP=plan, then SNAPSHOT_STEP=image once it has run" >&2
+    exit 1
+fi
+
+mkdir -p logs
+if [[ "${SNAPSHOT_STEP}" == "plan" ]]; then
+    stage=snapshot_plan
+    beam=${SLURM_ARRAY_TASK_ID}
+    shard=0
+else
+    stage=snapshot
+    beam=$(( SLURM_ARRAY_TASK_ID / SNAPSHOT_SHARDS ))
+    shard=$(( SLURM_ARRAY_TASK_ID % SNAPSHOT_SHARDS ))
+fi
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+telemetry_job "${stage}" "${beam}"
+
+echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
+echo "SBID=$SBID DATA_ROOT=$DATA_ROOT BEAM=${beam} SHARD=${shard}/${SNAPSHOT_SHARDS} STEP=${SNAPSHOT_STEP} PATTERN=$PATTERN"
+
+module load apptainer
+
+# Resolve the beam-specific glob by formatting {beam:02d}
+printf -v beam2 "%02d" "${beam}"
+root="${DATA_ROOT}/${SBID}"
+glob="${PATTERN//\{beam:02d\}/$beam2}"
+search_glob="${root}/${glob}"
+
+shopt -s nullglob
+msnames=( ${search_glob} )
+shopt -u nullglob
+
+if [[ ${#msnames[@]} -eq 0 ]]; then
+    echo "WARN: No MS found for SBID=$SBID beam=${beam2} using pattern '${search_glob}'"
+    exit 0
+fi
+
+for msname in "${msnames[@]}"
+do
+    outname="${msname%.ms}.${SNAPSHOT_TAG}"
+    plan="${outname}.plan.json"
+    if [[ "${SNAPSHOT_STEP}" != "image" ]]; then
+        echo "Planning snapshots of ${msname} every ${SNAPSHOT_TIMESTEP}s -> ${plan}"
+        # written aside and renamed, so an image task never reads a partial plan
+        telemetry_run snapshot_plan "${msname}" ${PLAN_PYTHON} "${SCRIPT}" plan "${msname}" --timestep "${SNAPSHOT_TIMESTEP}" --out "${plan}.tmp"
+        mv -f "${plan}.tmp" "${plan}"
+    fi
+    [[ "${SNAPSHOT_STEP}" == "plan" ]] && continue
+    if [[ ! -f "${plan}" ]]; then
+        echo "ERROR: no snapshot plan ${plan}; run SNAPSHOT_STEP=plan first" >&2
+        exit 1
+    fi
+    echo "Imaging shard ${shard}/${SNAPSHOT_SHARDS} of ${msname} -> ${outname}-tNNNN"
+    ${IMAGE_PYTHON} "${SCRIPT}" image --plan "${plan}" --name "${outname}" --shard "${shard}/${SNAPSHOT_SHARDS}" \
+	--workers "${SNAPSHOT_WORKERS}" --wsclean "apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_WSCLEAN_SIF} wsclean" \
+	-- ${SNAPSHOT_OPTS}
+done
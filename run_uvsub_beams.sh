@@ -21,11 +21,20 @@ SCRIPT=${SCRIPT:-uvsub_ms_beams.py}
 
 # uvsub parameters (override per submission as needed)
 OUT_PREFIX=${OUT_PREFIX:-"uvsub"}
+UVSUB_MODE=${UVSUB_MODE:-casa}    # casa (uvsub+split), stream (write .uvsub.ms directly) or inplace (overwrite DATA)
+SHARE_PARENT=${SHARE_PARENT:-""}  # set non-empty with UVSUB_MODE=stream to hardlink everything but DATA from the input MS
+STAGE_CACHE=${STAGE_CACHE:-""}  # set non-empty to skip work whose outputs are up to date (see stage_cache.py)
+MS_LAYOUT=${MS_LAYOUT:-""}  # storage layout of the output MS, e.g. time or rows:cc16 (see ms_layout.py); empty keeps the engine's
 INDEX=${INDEX:-1}
 SELFCAL=${SELFCAL:-1}
+UVSUB_WORKERS=${UVSUB_WORKERS:-1}  # MSs of this beam processed concurrently
 # ---------------------------------------------------------------------------
 
 module load apptainer
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+source "${SCRIPT_DIR:-$PWD}/requeue.sh"    # with RESUME_WRITES, resume journaled writes and requeue near the time limit
+source "${SCRIPT_DIR:-$PWD}/casa_worker.sh"  # with CASA_WORKER, run the casatasks in a daemon of this task
+telemetry_job uvsub "${SLURM_ARRAY_TASK_ID}"
 
 
 # Format beam index and glob pattern
@@ -75,9 +84,7 @@ do
 done
 
 
-for ms in "${msnames[@]}"
-do
-    echo "uvsub on: ${ms}"
-    apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_CASA_SIF}" python3 "${SCRIPT}" --ms "${ms}" --index "${INDEX}" --out-prefix "${OUT_PREFIX}"
-done
+# all MSs of the beam in one interpreter
+printf 'uvsub on: %s\n' "${msnames[@]}"
+resumable apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_CASA_SIF}" python3 $(casa_worker_for "${UVSUB_MODE}") "${SCRIPT}" --ms "${msnames[@]}" --workers "${UVSUB_WORKERS}" --index "${INDEX}" --out-prefix "${OUT_PREFIX}" --mode "${UVSUB_MODE}" ${SHARE_PARENT:+--share-parent} ${RESUME_WRITES:+--resume} ${STAGE_CACHE:+--stage-cache} ${MS_LAYOUT:+--layout "${MS_LAYOUT}"}
   
@@ -21,10 +21,15 @@ WSCLEAN_OPTS=${WSCLEAN_OPTS:-"-save-source-list -multiscale -multiscale-scale-bi
 FITS_MASK_TAG=${FITS_MASK_TAG:-}
 IMG_TAG=${IMG_TAG:-"initial"}
 INDEX=${INDEX:-0}
+STAGE_CACHE=${STAGE_CACHE:-""}                                  # set non-empty to skip MSs already imaged with these options
+STAGE_CACHE_SCRIPT=${STAGE_CACHE_SCRIPT:-${PWD}/stage_cache.py}
+CACHE_PYTHON=${CACHE_PYTHON:-python3}                           # stage_cache.py only needs the standard library
 
 # -----------------------------------------------------------------------
 
 mkdir -p logs
+source "${SCRIPT_DIR:-$PWD}/telemetry.sh"  # start/end and step records to ${TELEMETRY} (see telemetry.py)
+telemetry_job wsclean "${SLURM_ARRAY_TASK_ID}"
 
 echo "Job ${SLURM_JOB_ID}.${SLURM_ARRAY_TASK_ID} on $(hostname)"
 echo "SBID=$SBID DATA_ROOT=$DATA_ROOT BEAM=$SLURM_ARRAY_TASK_ID PATTERN=$PATTERN"
@@ -90,14 +95,28 @@ do
     fi
     outname="${msname%.ms}.${IMG_TAG}_img"
     echo "outname is $outname"
+    # wsclean also writes MODEL_DATA, so the MS is an output of the stage as well as an input
+    if [[ " ${NEW_WSCLEAN_OPTS} " == *" -join-channels "* ]]; then
+	image="${outname}-MFS-image.fits"
+    else
+	image="${outname}-image.fits"
+    fi
+    cache_state="logs/stage_wsclean_${SLURM_JOB_ID}_${SLURM_ARRAY_TASK_ID}_${i}.json"
+    if [[ -n "${STAGE_CACHE}" ]] && ${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" check --state "${cache_state}" --stage "wsclean_${IMG_TAG}" \
+	   --inputs "${msname}" ${FITS_MASK_TAG:+"${FITS_MASK}"} --outputs "${image}" "${msname}" --param "opts=${NEW_WSCLEAN_OPTS}"; then
+	continue
+    fi
     echo "Running WSClean: MS=${msname} -> name=${outname}"
     echo "apptainer exec --bind ${BIND_SRC}:${BIND_SRC} ${FLINT_WSCLEAN_SIF} wsclean -name ${outname} ${NEW_WSCLEAN_OPTS} ${msname}"
-    apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_WSCLEAN_SIF}" wsclean -name "${outname}" ${NEW_WSCLEAN_OPTS} "${msname}"
+    telemetry_run wsclean "${msname}" apptainer exec --bind "${BIND_SRC}:${BIND_SRC}" "${FLINT_WSCLEAN_SIF}" wsclean -name "${outname}" ${NEW_WSCLEAN_OPTS} "${msname}"
     rm -rf "${outname}*-00*.fits"
     rm -rf "${outname}-MFS-dirty.fits"
     rm -rf "${outname}-MFS-psf.fits"
     rm -rf "${outname}-MFS-residual.fits"
     #rm -rf "${outname}-MFS-model.fits"
+    if [[ -n "${STAGE_CACHE}" ]]; then
+	${CACHE_PYTHON} "${STAGE_CACHE_SCRIPT}" commit --state "${cache_state}" || echo "WARN: could not record ${outname} in the stage cache"
+    fi
 done
 
 # for msname in "${msnames[@]}"; do
@@ -3,8 +3,8 @@ import argparse
 import os
 import sys
 from datetime import datetime
-import casaconfig
-casaconfig.logfile = "/dev/null"
+from casa_worker import casa_tasks
+from telemetry import step
 
 def parse_args():
     p = argparse.ArgumentParser(description="Phase-only self-calibration loop in CASA.")
@@ -21,6 +21,12 @@ def parse_args():
     p.add_argument("--caltable-prefix", default="selfcal_p", help="Prefix for output cal tables.")
     p.add_argument("--plot-dir", default="plots", help="Directory to store diagnostic plots.")
     p.add_argument("--apply-calwt", type=str, default="False", help="applycal calwt flag (True/False).")
+    p.add_argument("--solver", choices=["casa", "native"], default="casa", help="casa: gaincal; native: batched StEFCal solver writing a CASA-compatible G table.")
+    p.add_argument("--apply-engine", choices=["casa", "native"], default="casa", help="casa: applycal+split; native: single-pass python-casacore apply writing the next selfcal MS directly.")
+    p.add_argument("--stage-cache", action="store_true", help="Skip the round if its MS and caltable were already produced from the same input and parameters (see stage_cache.py).")
+    p.add_argument("--layout", default="", help="Storage layout of the next selfcal MS, e.g. time or time:cc16 (see ms_layout.py; needs python-casacore). Default: as written by the apply engine.")
+    p.add_argument("--share-parent", action="store_true", help="With --apply-engine native, hardlink unchanged subtables and columns from the previous round's MS (copy-on-write generation).")
+    p.add_argument("--resume", action="store_true", help="With --apply-engine native, journal each written block and resume an interrupted round's MS instead of rewriting it (see ms_journal.py).")
     return p.parse_args()
 
 def has_model_column(ms):
@@ -36,7 +42,9 @@ def has_model_column(ms):
         return False
 
 def solve_gain_phase(ms, caltable, solint, args):
-    from casatasks import gaincal
+    if getattr(args, "solver", "casa") == "native":
+        return solve_gain_native(ms, caltable, solint, args)
+    gaincal = casa_tasks("gaincal")
     print(f"[{datetime.now().isoformat()}] gaincal: vis={ms}, caltable={caltable}, solint={solint}, calmode='{args.calmode}'")
     gaincal(
         vis=ms,
@@ -53,6 +61,22 @@ def solve_gain_phase(ms, caltable, solint, args):
     )
 
 
+def solve_gain_native(ms, caltable, solint, args):
+    from native_gaincal import solve_gains
+    if args.field or args.spw or args.parang:
+        raise ValueError("native solver does not support --field/--spw selection or --parang; use --solver casa")
+    print(f"[{datetime.now().isoformat()}] native gaincal: vis={ms}, caltable={caltable}, solint={solint}, calmode='{args.calmode}'")
+    solve_gains(
+        ms,
+        caltable,
+        solint,
+        calmode=args.calmode,
+        combine=args.combine,
+        refant=args.refant,
+        minsnr=args.minsnr
+    )
+
+
 def plot_solutions(caltable: str, figfile_base: str):
     """
     Plot calibration solutions using plotms (recommended in modern CASA).
@@ -124,21 +148,53 @@ def plot_solutions(caltable: str, figfile_base: str):
 #             print(f"WARNING: Unable to plot calibration table '{caltable}': {e}", file=sys.stderr)
 
 def apply_gain(old_ms, new_ms, gaintables, args):
-    from casatasks import applycal, split
+    if getattr(args, "apply_engine", "casa") == "native":
+        return apply_gain_native(old_ms, new_ms, gaintables, args)
+    applycal, split = casa_tasks("applycal", "split")
     print(f"[{datetime.now().isoformat()}] applycal: vis={old_ms}, gaintable={gaintables}")
-    applycal(
-        vis=old_ms,
-        field=args.field,
-        spw=args.spw,
-        gaintable=gaintables,
-        gainfield=[""] * len(gaintables),
-        interp=["linear,nearest"] * len(gaintables),
-        calwt=[args.apply_calwt.lower() == "true"] * len(gaintables),
-        parang=args.parang,
-        flagbackup=True
-    )
+    with step("applycal", ms=old_ms):
+        applycal(
+            vis=old_ms,
+            field=args.field,
+            spw=args.spw,
+            gaintable=gaintables,
+            gainfield=[""] * len(gaintables),
+            interp=["linear,nearest"] * len(gaintables),
+            calwt=[args.apply_calwt.lower() == "true"] * len(gaintables),
+            parang=args.parang,
+            flagbackup=True
+        )
     print(f"[{datetime.now().isoformat()}] split: vis={old_ms}, outputvis={new_ms}, datcolumn='corrected'")
-    split(vis=old_ms, outputvis=new_ms, datacolumn="corrected")
+    with step("split", ms=new_ms):
+        split(vis=old_ms, outputvis=new_ms, datacolumn="corrected")
+    if args.layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=new_ms):
+            relayout_ms(new_ms, parse_layout(args.layout))
+
+
+def apply_gain_native(old_ms, new_ms, gaintables, args):
+    from caltable_tools import GainInterpolator
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_applycal import apply_to_new_ms
+    if args.field or args.spw or args.parang:
+        raise ValueError("native apply does not support --field/--spw selection or --parang; use --apply-engine casa")
+    interpolators = [GainInterpolator.from_caltable(t, time_interp="linear", freq_interp="nearest") for t in gaintables]
+    print(f"[{datetime.now().isoformat()}] native applycal: vis={old_ms}, gaintable={gaintables}, outputvis={new_ms}, share_parent={args.share_parent}")
+    now, later = split_deferred(parse_layout(args.layout))
+    with step("apply", ms=new_ms) as rec:
+        rec["rows"] = apply_to_new_ms(
+            old_ms,
+            new_ms,
+            interpolators,
+            calwt=args.apply_calwt.lower() == "true",
+            share_parent=args.share_parent,
+            layout=now,
+            resume=args.resume
+        )
+    if later is not None:
+        with step("relayout", ms=new_ms):
+            relayout_ms(new_ms, later)
     
     
 def main():
@@ -169,15 +225,30 @@ def main():
     caltable = os.path.join(os.path.dirname(ms), "caltables", f"{os.path.basename(ms).replace('.calB0.ms', '')}_{args.caltable_prefix}.sol{index}_{solint}.G{index}")
     # CASA table names must be directory-like; ensure no forbidden chars:
     #caltable = caltable.replace(":", "").replace("/", "_")
-    solve_gain_phase(old_ms, caltable, solint, args)
+    stage = None
+    if args.stage_cache:
+        from stage_cache import Stage
+        params = {k: getattr(args, k) for k in ("solint", "calmode", "field", "spw", "refant", "combine", "minsnr",
+                                                  "parang", "apply_calwt", "solver", "apply_engine", "layout")}
+        # CASA applycal writes CORRECTED_DATA into old_ms, so it is an output too
+        outputs = [new_ms, caltable] + ([old_ms] if args.apply_engine == "casa" else [])
+        stage = Stage(f"selfcal_{index}", [old_ms], outputs, params)
+        if stage.complete():
+            print(f"[{datetime.now().isoformat()}] {new_ms} and {caltable} are up to date; skipping self-cal round {index}")
+            return
+        stage.begin()
+
+    with step("solve", ms=old_ms, solver=args.solver, solint=solint):
+        solve_gain_phase(old_ms, caltable, solint, args)
     #os.makedirs(os.path.join(os.path.dirname(ms), 'caltables'))
     
-    figfile = os.path.join(real_plotdir, os.path.basename(caltable) + ".selfcal.png")
-    #plot_solutions(caltable, figfile)
+    # solution plots: plot_caltable.py renders every beam's caltables in one batch (plotms here was too slow headless)
     #produced_tables.append(caltable)
 
     caltables = [caltable]
     apply_gain(old_ms, new_ms, caltables, args)
+    if stage is not None:
+        stage.commit()
     print("Self-cal complete. Solutions applied to CORRECTED_DATA. You can image that column.")
     print(f"Produced caltables: {caltable}")
     #for t in produced_tables:
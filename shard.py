@@ -0,0 +1,62 @@
+"""Split a list of files between the tasks of a Slurm array.
+
+The per-scan entry points used to take one file per array task, paying
+for apptainer, the interpreter and the casatasks import every time.
+With ``--shard i/N`` a task takes the i-th of N contiguous, balanced
+slices of the sorted file list and processes all of it in one
+interpreter. The shell wrappers slice the same way (``start = i*n/N``,
+``end = (i+1)*n/N``), so every file belongs to exactly one shard.
+"""
+import argparse
+from typing import NamedTuple
+
+
+class Shard(NamedTuple):
+    """One slice of a file list"""
+
+    index: int
+    """Shard number, 0 <= index < count"""
+    count: int
+    """Total number of shards"""
+
+
+def parse_shard(spec):
+    """Parse "i/N" (argparse ``type=``)."""
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got {spec!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {spec!r} needs 0 <= i < N")
+    return Shard(index, count)
+
+
+def shard_items(items, shard):
+    """The slice of ``items`` belonging to ``shard`` (all of them if ``shard`` is None)."""
+    items = list(items)
+    if shard is None:
+        return items
+    n = len(items)
+    return items[shard.index * n // shard.count:(shard.index + 1) * n // shard.count]
+
+
+def read_file_list(path):
+    """Paths listed one per line in ``path`` (blank lines and # comments ignored)."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def select_files(files=(), file_list=None, shard=None):
+    """Sorted union of ``files`` and the paths in ``file_list``, cut down to ``shard``."""
+    paths = list(files or ())
+    if file_list:
+        paths += read_file_list(file_list)
+    return shard_items(sorted(set(paths)), shard)
+
+
+def add_shard_arguments(parser):
+    """Add --shard and --file-list to an entry point's parser."""
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Process only slice i of N of the (sorted) file list, e.g. 3/40.")
+    parser.add_argument("--file-list", default=None,
+                        help="Text file listing input paths, one per line.")
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Plan and run short-timescale (snapshot) imaging of an MS in parallel.
+
+``ms_tools.get_fast_imaging_intervals`` only counts the intervals to give
+``wsclean -intervals-out``, and a single wsclean then images them one
+after another. Here the MS is planned once and the imaging is spread
+over many wsclean processes:
+
+* plan (needs python-casacore): one chunked pass over TIME and FLAG finds
+  the row range, row count and unflagged rows of every timestep. This is
+  cached as a sidecar inside the MS (``snapshot_plan.json``, invalidated
+  by any write to the main table like the ms_index sidecar). The
+  timesteps are then cut into intervals of a whole number of timesteps
+  (``round(timestep / tsamp)``), each with its row range, start/end time
+  and effective timestep. Intervals whose rows are all flagged are marked
+  so they are never imaged
+* image (standard library only, so it can run outside the casa
+  container): the unflagged intervals are grouped into contiguous blocks
+  of equal-width intervals. Each block is one wsclean call with
+  ``-interval a b -intervals-out K``, so per-call overhead is paid per
+  block rather than per image. Blocks are split between the tasks of a
+  Slurm array with ``--shard i/N`` and run ``--workers`` at a time. The
+  images are renamed ``<name>-tNNNN-*.fits`` with NNNN the global interval
+  number, so skipped intervals leave gaps rather than shifting the rest
+
+::
+
+    snapshot_plan.py plan MS --timestep 10 --out plan.json
+    snapshot_plan.py image --plan plan.json --name OUT [--shard i/N] [--workers W] \\
+        --wsclean "apptainer exec ... wsclean" -- WSCLEAN_OPTS ...
+"""
+import argparse
+import glob
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+from shard import parse_shard, shard_items
+from task_pool import run_tasks
+from telemetry import step
+
+PLAN_NAME = "snapshot_plan.json"
+"""Sidecar file name, stored inside the MS directory"""
+
+PLAN_VERSION = 1
+"""Bumped whenever the sidecar layout changes, so old sidecars are rebuilt"""
+
+CHUNK_ROWS = 20000
+"""Rows per block of the streaming pass (ms_stream.DEFAULT_CHUNK_ROWS, which needs python-casacore to import)"""
+
+
+class Interval(NamedTuple):
+    """One snapshot image: a run of consecutive timesteps"""
+
+    index: int
+    """Interval number within the MS (the NNNN of the image names)"""
+    start_step: int
+    """First timestep (wsclean -interval start index)"""
+    end_step: int
+    """Timestep after the last one (exclusive, like -interval)"""
+    start_row: int
+    """First main-table row holding one of its timesteps"""
+    end_row: int
+    """Row after the last one holding one of its timesteps"""
+    start_time: float
+    """TIME of the first timestep (MJD seconds)"""
+    end_time: float
+    """TIME of the last timestep (MJD seconds)"""
+    rows: int
+    """Rows in the interval"""
+    flagged: bool
+    """Every row of the interval is fully flagged: nothing to image"""
+
+
+class IntervalPlan(NamedTuple):
+    """Snapshot intervals of an MS for one imaging timestep"""
+
+    ms: str
+    """Measurement set"""
+    timestep: float
+    """Requested imaging timestep in seconds (0: one image per timestep)"""
+    tsamp: float
+    """Median spacing of the timesteps in seconds"""
+    steps_per_interval: int
+    """Timesteps per interval (the last interval may have fewer)"""
+    effective_timestep: float
+    """steps_per_interval * tsamp"""
+    nsteps: int
+    """Timesteps in the MS"""
+    intervals: List[Interval]
+    """Every interval, flagged ones included"""
+
+
+class Block(NamedTuple):
+    """Contiguous equal-width intervals imaged by one wsclean call"""
+
+    first: int
+    """Index of the first interval"""
+    count: int
+    """Number of intervals (-intervals-out)"""
+    start_step: int
+    """-interval start index"""
+    end_step: int
+    """-interval end index (exclusive)"""
+
+    def wsclean_args(self):
+        return ["-interval", str(self.start_step), str(self.end_step), "-intervals-out", str(self.count)]
+
+
+def _fingerprint(msname):
+    from ms_index import table_fingerprint
+    return table_fingerprint(msname)
+
+
+def build_timestep_summary(msname, chunk_rows=CHUNK_ROWS):
+    """Row range, row count and unflagged rows of every timestep, from one chunked pass over TIME and FLAG.
+
+    Returns:
+        dict: "time", "start_row", "end_row", "rows" and "unflagged_rows" lists, in time order
+    """
+    import numpy as np
+    from casacore.tables import table
+
+    from ms_stream import iter_row_chunks, prefetch_chunks
+
+    parts = []
+    with table(msname, ack=False) as tab:
+        has_flag_row = "FLAG_ROW" in tab.colnames()
+
+        def read_chunk(start, n):
+            block = {c: tab.getcol(c, startrow=start, nrow=n) for c in ("TIME", "FLAG")}
+            if has_flag_row:
+                block["FLAG_ROW"] = tab.getcol("FLAG_ROW", startrow=start, nrow=n)
+            return block
+
+        for (start, n), block in prefetch_chunks(read_chunk, iter_row_chunks(tab.nrows(), chunk_rows)):
+            times, inverse = np.unique(block["TIME"], return_inverse=True)
+            rows = np.arange(start, start + n)
+            usable = ~block["FLAG"].reshape(n, -1).all(axis=1)
+            if has_flag_row:
+                usable &= ~block["FLAG_ROW"]
+            first = np.full(len(times), np.iinfo(np.int64).max)
+            last = np.full(len(times), -1)
+            np.minimum.at(first, inverse, rows)
+            np.maximum.at(last, inverse, rows)
+            parts.append((times, first, last + 1, np.bincount(inverse, minlength=len(times)),
+                          np.bincount(inverse, weights=usable, minlength=len(times)).astype(int)))
+    if not parts:
+        return {"time": [], "start_row": [], "end_row": [], "rows": [], "unflagged_rows": []}
+    times, first, end, rows, unflagged = (np.concatenate(x) for x in zip(*parts))
+    # a timestep split across chunks appears once per chunk: merge them
+    utimes, inverse = np.unique(times, return_inverse=True)
+    merged_first = np.full(len(utimes), np.iinfo(np.int64).max)
+    merged_end = np.zeros(len(utimes), dtype=np.int64)
+    np.minimum.at(merged_first, inverse, first)
+    np.maximum.at(merged_end, inverse, end)
+    return {"time": utimes.tolist(), "start_row": merged_first.tolist(), "end_row": merged_end.tolist(),
+            "rows": np.bincount(inverse, weights=rows).astype(int).tolist(),
+            "unflagged_rows": np.bincount(inverse, weights=unflagged).astype(int).tolist()}
+
+
+def timestep_summary(msname, rebuild=False, chunk_rows=CHUNK_ROWS):
+    """The cached timestep summary of ``msname``, rebuilt (and re-cached) when missing or stale."""
+    path = os.path.join(msname, PLAN_NAME)
+    fingerprint = _fingerprint(msname)
+    if not rebuild:
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            if stored.get("version") == PLAN_VERSION and stored.get("fingerprint") == fingerprint:
+                return stored["timesteps"]
+        except (OSError, ValueError):
+            pass
+    summary = build_timestep_summary(msname, chunk_rows=chunk_rows)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump({"version": PLAN_VERSION, "fingerprint": fingerprint, "timesteps": summary}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        # a read-only MS still gets its plan, just not cached
+        print(f"WARN: could not write {path}: {e}")
+    return summary
+
+
+def plan_intervals(msname, timestep=None, rebuild=False, chunk_rows=CHUNK_ROWS):
+    """Cut the timesteps of ``msname`` into snapshot intervals of about ``timestep`` seconds.
+
+    Args:
+        msname (str): Measurement set
+        timestep (float): Imaging timestep in seconds; None or 0 images every timestep
+        rebuild (bool): Ignore the cached timestep summary
+        chunk_rows (int): Rows per block of the streaming pass
+
+    Returns:
+        IntervalPlan: The intervals, flagged ones included
+    """
+    summary = timestep_summary(msname, rebuild=rebuild, chunk_rows=chunk_rows)
+    times = summary["time"]
+    nsteps = len(times)
+    gaps = sorted(b - a for a, b in zip(times, times[1:]))
+    tsamp = gaps[len(gaps) // 2] if gaps else 0.0
+    width = max(int(round(timestep / tsamp)), 1) if timestep and tsamp > 0 else 1
+    intervals = []
+    for k, lo in enumerate(range(0, nsteps, width)):
+        hi = min(lo + width, nsteps)
+        intervals.append(Interval(index=k, start_step=lo, end_step=hi,
+                                  start_row=min(summary["start_row"][lo:hi]), end_row=max(summary["end_row"][lo:hi]),
+                                  start_time=times[lo], end_time=times[hi - 1], rows=sum(summary["rows"][lo:hi]),
+                                  flagged=sum(summary["unflagged_rows"][lo:hi]) == 0))
+    return IntervalPlan(ms=os.path.abspath(msname), timestep=float(timestep or 0.0), tsamp=tsamp, steps_per_interval=width,
+                        effective_timestep=width * tsamp, nsteps=nsteps, intervals=intervals)
+
+
+def write_plan(plan, path):
+    fields = plan._asdict()
+    fields["intervals"] = [i._asdict() for i in plan.intervals]
+    with open(path, "w") as f:
+        json.dump(fields, f, indent=1)
+
+
+def read_plan(path):
+    with open(path) as f:
+        fields = json.load(f)
+    fields["intervals"] = [Interval(**i) for i in fields["intervals"]]
+    return IntervalPlan(**fields)
+
+
+def plan_blocks(plan, nblocks=1):
+    """Group the unflagged intervals of ``plan`` into about ``nblocks`` contiguous blocks of equal-width intervals.
+
+    A block never spans a flagged interval or the shorter last interval, so
+    ``-intervals-out`` splits it exactly at the plan's interval boundaries.
+
+    Returns:
+        list: Blocks in interval order
+    """
+    runs, run = [], []
+    for interval in plan.intervals:
+        width = interval.end_step - interval.start_step
+        if run and (interval.flagged or width != run[-1].end_step - run[-1].start_step):
+            runs.append(run)
+            run = []
+        if not interval.flagged:
+            run.append(interval)
+    if run:
+        runs.append(run)
+    usable = sum(len(r) for r in runs)
+    if not usable:
+        return []
+    size = max(-(-usable // max(nblocks, 1)), 1)
+    blocks = []
+    for run in runs:
+        for i in range(0, len(run), size):
+            part = run[i:i + size]
+            blocks.append(Block(first=part[0].index, count=len(part), start_step=part[0].start_step, end_step=part[-1].end_step))
+    return blocks
+
+
+def _rename_outputs(block_name, name, block):
+    """Rename wsclean's <block_name>[-tJJJJ]-* images to <name>-tNNNN-* with NNNN the global interval number."""
+    for path in sorted(glob.glob(f"{glob.escape(block_name)}-*")):
+        rest = path[len(block_name) + 1:]
+        j = 0
+        if block.count > 1:
+            if not (rest[:1] == "t" and rest[1:5].isdigit() and rest[5:6] == "-"):
+                continue
+            j, rest = int(rest[1:5]), rest[6:]
+        os.replace(path, f"{name}-t{block.first + j:04d}-{rest}")
+
+
+def image_block(wsclean, opts, msname, name, block):
+    """Run one wsclean call for ``block`` of ``msname`` and give its images their global interval numbers."""
+    block_name = f"{name}-block{block.first:04d}"
+    temp_dir = None
+    if "-temp-dir" not in opts:
+        # wsclean names its reordered files after the MS, so concurrent blocks of one MS each need their own
+        temp_dir = f"{block_name}.tmp"
+        os.makedirs(temp_dir, exist_ok=True)
+        opts = ["-temp-dir", temp_dir] + opts
+    cmd = wsclean + ["-name", block_name] + block.wsclean_args() + opts + [msname]
+    try:
+        with step("snapshot", ms=msname, first_interval=block.first, intervals=block.count):
+            print(" ".join(shlex.quote(c) for c in cmd), flush=True)
+            subprocess.run(cmd, check=True)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    _rename_outputs(block_name, name, block)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Plan and run parallel snapshot imaging of an MS.")
+    sub = p.add_subparsers(dest="command", required=True)
+    plan = sub.add_parser("plan", help="Plan the snapshot intervals of an MS (needs python-casacore).")
+    plan.add_argument("ms", help="Measurement set.")
+    plan.add_argument("--timestep", type=float, default=None, help="Imaging timestep in seconds (default: every timestep).")
+    plan.add_argument("--out", default=None, help="Write the plan as JSON to this file.")
+    plan.add_argument("--rebuild", action="store_true", help="Ignore the cached timestep summary.")
+    plan.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows per block of the streaming pass.")
+    image = sub.add_parser("image", help="Image the blocks of a plan that belong to this task.")
+    image.add_argument("--plan", required=True, help="Plan written by 'plan --out'.")
+    image.add_argument("--name", required=True, help="Image name prefix (wsclean -name); images are <name>-tNNNN-*.fits.")
+    image.add_argument("--wsclean", default="wsclean", help="wsclean command, e.g. 'apptainer exec ... wsclean'.")
+    image.add_argument("--shard", type=parse_shard, default=None, help="Image only slice i of N of the blocks, e.g. 3/8.")
+    image.add_argument("--workers", type=int, default=1, help="wsclean processes run at once.")
+    image.add_argument("--blocks-per-worker", type=int, default=1,
+                       help="Blocks per worker and shard (more gives finer load balancing, at one wsclean start each).")
+    image.add_argument("opts", nargs=argparse.REMAINDER, help="-- wsclean options ...")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "plan":
+        plan = plan_intervals(args.ms, timestep=args.timestep, rebuild=args.rebuild, chunk_rows=args.chunk_rows)
+        skipped = sum(1 for i in plan.intervals if i.flagged)
+        print(f"{args.ms}: {plan.nsteps} timesteps (tsamp {plan.tsamp:.3f}s) -> {len(plan.intervals)} intervals of "
+              f"{plan.steps_per_interval} timesteps ({plan.effective_timestep:.3f}s), {skipped} fully flagged")
+        if args.out:
+            write_plan(plan, args.out)
+        return
+
+    plan = read_plan(args.plan)
+    opts = args.opts[1:] if args.opts[:1] == ["--"] else args.opts
+    if "-j" not in opts:
+        # share the task's cores between the concurrent wsclean processes
+        cores = int(os.environ.get("SLURM_CPUS_PER_TASK") or os.cpu_count() or 1)
+        opts = ["-j", str(max(cores // max(args.workers, 1), 1))] + opts
+    if "-no-update-model-required" not in opts:
+        opts = ["-no-update-model-required"] + opts  # concurrent processes must not write MODEL_DATA of the same MS
+    nshards = args.shard.count if args.shard else 1
+    blocks = shard_items(plan_blocks(plan, nshards * max(args.workers, 1) * args.blocks_per_worker), args.shard)
+    skipped = sum(1 for i in plan.intervals if i.flagged)
+    print(f"{plan.ms}: imaging {sum(b.count for b in blocks)} intervals in {len(blocks)} blocks "
+          f"({skipped} fully flagged intervals skipped in the whole plan)")
+    tasks = [(f"intervals {b.first}-{b.first + b.count - 1}", (shlex.split(args.wsclean), opts, plan.ms, args.name, b))
+             for b in blocks]
+    failures = run_tasks(image_block, tasks, workers=args.workers)
+    if failures:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Stage-level memoisation so a re-run of the pipeline skips finished work.
+
+Every output of a cached stage (an MS, caltable or image) carries a
+sidecar with its *lineage*: the records of the stages that produced it
+and of any later stage that modified it in place (flagging, wsclean
+writing MODEL_DATA, crystalball). Each record holds a hash of the stage's
+parameters, references to the exact state of its inputs, and the
+fingerprint (sizes and mtimes of the table files) the output had when the
+stage finished.
+
+A stage is complete when every output still matches its last recorded
+fingerprint, its lineage contains the stage with the same parameters and
+inputs, and each input is still in the state the stage read: either its
+lineage still starts with the recorded prefix (later in-place stages are
+fine) or, for files without a lineage, the fingerprint is unchanged. An
+input that no longer exists is treated as consumed by the stage (e.g.
+``--delete-previous``). Anything modified outside the cache loses its
+lineage, so every stage that read or wrote it runs again.
+
+Usable from python (``Stage``) and from the shell wrappers::
+
+    stage_cache.py check --state FILE --stage NAME --inputs ... --outputs ... [--param k=v ...]
+    <run the stage>
+    stage_cache.py commit --state FILE
+
+``check`` exits 0 when the stage can be skipped; otherwise it saves the
+input snapshot to FILE and exits 1. Only the standard library is used,
+so the wrappers can call it with any python3.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime
+
+SIDECAR_NAME = "stage_cache.json"
+"""Sidecar file name inside directory outputs (MSs, caltables); files get <name>.stage.json"""
+
+CACHE_VERSION = 1
+"""Bumped whenever the sidecar layout changes, so old records are ignored"""
+
+
+def sidecar_path(path):
+    return os.path.join(path, SIDECAR_NAME) if os.path.isdir(path) else f"{path}.stage.json"
+
+
+def path_fingerprint(path):
+    """Sizes and mtimes of the files that change whenever ``path`` is written (None if it does not exist).
+
+    For a casacore table only the top-level table.* files are used (they
+    include table.dat, which casacore rewrites on every write), so sidecars
+    such as this one or ms_index.json do not count.
+    """
+    if not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return [[os.path.basename(path), st.st_size, st.st_mtime_ns]]
+    names = sorted(f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+    table_files = [f for f in names if f.startswith("table.") and f != "table.lock"]
+    entries = []
+    for f in table_files or [f for f in names if f != SIDECAR_NAME]:
+        st = os.stat(os.path.join(path, f))
+        entries.append([f, st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def load_lineage(path):
+    """Return the lineage records of ``path``, or None if it has no sidecar or was modified since the last record."""
+    try:
+        with open(sidecar_path(path)) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    lineage = stored.get("lineage") or None
+    if (stored.get("version") != CACHE_VERSION or stored.get("path") != os.path.abspath(path)
+            or lineage is None or lineage[-1].get("fingerprint") != path_fingerprint(path)):
+        # hardlinked copies (copy-on-write generations) inherit the parent's sidecar; the path check drops it
+        return None
+    return lineage
+
+
+def _write_lineage(path, lineage):
+    target = sidecar_path(path)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CACHE_VERSION, "path": os.path.abspath(path), "lineage": lineage}, f, indent=1)
+    # replacing (not rewriting) the file also detaches it from any hardlinked parent
+    os.replace(tmp, target)
+
+
+def input_ref(path):
+    """Reference to the current state of an input: a lineage prefix, or its fingerprint."""
+    lineage = load_lineage(path)
+    if lineage is not None:
+        return {"path": os.path.abspath(path), "depth": len(lineage), "id": _digest([r["id"] for r in lineage])}
+    fingerprint = path_fingerprint(path)
+    if fingerprint is None:
+        raise FileNotFoundError(f"stage input {path} does not exist")
+    return {"path": os.path.abspath(path), "depth": None, "id": _digest(fingerprint)}
+
+
+def ref_is_current(ref):
+    """Whether an input is still in the state ``ref`` recorded (a missing input counts as consumed)."""
+    path = ref["path"]
+    if not os.path.exists(path):
+        return True
+    if ref["depth"] is None:
+        return _digest(path_fingerprint(path)) == ref["id"]
+    lineage = load_lineage(path)
+    return (lineage is not None and len(lineage) >= ref["depth"]
+            and _digest([r["id"] for r in lineage[:ref["depth"]]]) == ref["id"])
+
+
+class Stage:
+    """One cacheable unit of work: a named step with its inputs, outputs and parameters.
+
+    Outputs that are also inputs are modified in place: their lineage is
+    extended rather than restarted.
+    """
+
+    def __init__(self, name, inputs, outputs, params=None):
+        self.name = name
+        self.inputs = [os.path.abspath(p) for p in inputs]
+        self.outputs = [os.path.abspath(p) for p in outputs]
+        self.params = _digest(params or {})
+        self.snapshot = None
+
+    def complete(self):
+        """Whether every output already holds the result of this stage on the current inputs."""
+        if not self.outputs:
+            return False
+        for out in self.outputs:
+            lineage = load_lineage(out)
+            if lineage is None:
+                return False
+            records = [r for r in lineage if r["stage"] == self.name and r["params"] == self.params
+                       and sorted(ref["path"] for ref in r["inputs"]) == sorted(self.inputs)]
+            if not records or not all(ref_is_current(ref) for ref in records[-1]["inputs"]):
+                return False
+        return True
+
+    def begin(self):
+        """Snapshot the inputs; call just before running the stage."""
+        self.snapshot = {
+            "inputs": [input_ref(p) for p in self.inputs],
+            "lineages": {p: load_lineage(p) or [] for p in self.outputs if p in self.inputs},
+        }
+        return self.snapshot
+
+    def commit(self):
+        """Record the finished stage in the sidecar of every output."""
+        if self.snapshot is None:
+            raise RuntimeError(f"stage {self.name}: commit() without begin()")
+        refs = self.snapshot["inputs"]
+        record_id = _digest([self.name, self.params, refs])
+        for out in self.outputs:
+            fingerprint = path_fingerprint(out)
+            if fingerprint is None:
+                if out in self.inputs:
+                    # an in-place input the stage went on to delete (e.g. --delete-previous)
+                    continue
+                raise FileNotFoundError(f"stage {self.name} did not produce {out}")
+            record = {"stage": self.name, "params": self.params, "inputs": refs, "id": record_id,
+                      "fingerprint": fingerprint, "time": datetime.now().isoformat()}
+            lineage = self.snapshot["lineages"].get(out, [])
+            _write_lineage(out, lineage + [record])
+
+    def to_state(self):
+        return {"name": self.name, "inputs": self.inputs, "outputs": self.outputs, "params": self.params,
+                "snapshot": self.snapshot}
+
+    @classmethod
+    def from_state(cls, state):
+        stage = cls(state["name"], state["inputs"], state["outputs"])
+        stage.params = state["params"]
+        stage.snapshot = state["snapshot"]
+        return stage
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Check or record a cached pipeline stage.")
+    sub = p.add_subparsers(dest="command", required=True)
+    check = sub.add_parser("check", help="Exit 0 if the stage is complete, else snapshot its inputs to --state and exit 1.")
+    check.add_argument("--state", required=True, help="File to hold the input snapshot until commit.")
+    check.add_argument("--stage", required=True, help="Stage name, e.g. wsclean_selfcal_2.")
+    check.add_argument("--inputs", nargs="*", default=[], help="Files or tables the stage reads.")
+    check.add_argument("--outputs", nargs="+", required=True, help="Files or tables the stage writes (list an input again if it is modified in place).")
+    check.add_argument("--param", action="append", default=[], help="key=value parameter (repeatable).")
+    commit = sub.add_parser("commit", help="Record the stage saved by check as complete.")
+    commit.add_argument("--state", required=True, help="File written by check.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "commit":
+        with open(args.state) as f:
+            Stage.from_state(json.load(f)).commit()
+        os.remove(args.state)
+        return
+    params = dict(p.split("=", 1) for p in args.param)
+    stage = Stage(args.stage, args.inputs, args.outputs, params)
+    if stage.complete():
+        print(f"stage {args.stage} is up to date for {' '.join(args.outputs)}; skipping")
+        sys.exit(0)
+    stage.begin()
+    with open(args.state, "w") as f:
+        json.dump(stage.to_state(), f)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic ASKAP/CRACO-like measurement sets for benchmarks.
+
+Everything is generated with python-casacore, so no CASA install or real
+data is needed.
+"""
+import argparse
+import os
+import shutil
+
+import numpy as np
+from astropy.io import fits
+from casacore.tables import table, default_ms, makearrcoldesc, maketabdesc
+
+from caltable_tools import write_caltable
+
+ASKAP_NANT = 36
+MJD_START_S = 60963.0 * 86400.0
+CORR_PRODUCTS = {1: [[0, 0]], 2: [[0, 0], [1, 1]], 4: [[0, 0], [0, 1], [1, 0], [1, 1]]}
+CORR_TYPES = {1: [9], 2: [9, 12], 4: [9, 10, 11, 12]}
+
+
+def _antenna_positions(nant, rng):
+    """ITRF-like positions scattered over ~6 km around the MRO."""
+    centre = np.array([-2556743.7, 5097440.0, -2847749.5])
+    return centre + rng.uniform(-3000, 3000, size=(nant, 3))
+
+
+def make_synthetic_ms(msname, nant=ASKAP_NANT, ntime=60, nchan=32, ncorr=4, nscan=1, tsamp=10.0,
+                      freq0=743.5e6, chan_width=1e6, with_model=True, gains=None, noise=0.1, seed=0):
+    """Create a small point-source MS with optional MODEL_DATA and antenna gain corruption.
+
+    DATA = g_i conj(g_j) MODEL + noise, where MODEL is a 1 Jy source at a
+    small offset from phase centre.
+
+    Args:
+        msname (str): Output path; replaced if present
+        nant (int): Number of antennas
+        ntime (int): Integrations per scan
+        nchan (int): Number of channels
+        ncorr (int): 1, 2 or 4 correlations
+        nscan (int): Number of scans, each ``ntime`` integrations long
+        tsamp (float): Integration time in seconds
+        freq0 (float): Frequency of the first channel in Hz
+        chan_width (float): Channel width in Hz
+        with_model (bool): Also write MODEL_DATA
+        gains (np.ndarray): Optional (nscan*ntime, nant, 2) complex gains applied to DATA
+        noise (float): Gaussian noise sigma per real/imag component
+        seed (int): Random seed
+
+    Returns:
+        str: ``msname``
+    """
+    rng = np.random.default_rng(seed)
+    if os.path.isdir(msname):
+        shutil.rmtree(msname)
+    cols = [makearrcoldesc("DATA", 0j, shape=[nchan, ncorr], valuetype="complex")]
+    if with_model:
+        cols.append(makearrcoldesc("MODEL_DATA", 0j, shape=[nchan, ncorr], valuetype="complex"))
+    tab = default_ms(msname, maketabdesc(cols))
+
+    a1, a2 = np.triu_indices(nant, 1)
+    nbl = len(a1)
+    ntimes = ntime * nscan
+    times = MJD_START_S + np.arange(ntimes) * tsamp
+    scans = np.repeat(np.arange(1, nscan + 1), ntime)
+    nrow = nbl * ntimes
+    positions = _antenna_positions(nant, rng)
+    freqs = freq0 + np.arange(nchan) * chan_width
+
+    # Earth-rotation-free UVWs are enough for throughput work
+    uvw = np.tile(positions[a2] - positions[a1], (ntimes, 1))
+    l, m = 1e-3, -5e-4
+    phase = -2j * np.pi * (uvw[:, 0, None] * l + uvw[:, 1, None] * m) * freqs[None, :] / 299792458.0
+    model = np.repeat(np.exp(phase)[:, :, None], ncorr, axis=2).astype(np.complex64)
+    cross_hand = [i for i, (p, q) in enumerate(CORR_PRODUCTS[ncorr]) if p != q]
+    model[..., cross_hand] = 0
+    data = model.copy()
+    if gains is not None:
+        tidx = np.repeat(np.arange(ntimes), nbl)
+        ant1, ant2 = np.tile(a1, ntimes), np.tile(a2, ntimes)
+        for c, (p, q) in enumerate(CORR_PRODUCTS[ncorr]):
+            data[..., c] *= (gains[tidx, ant1, p] * np.conj(gains[tidx, ant2, q]))[:, None]
+    data += (noise * (rng.normal(size=data.shape) + 1j * rng.normal(size=data.shape))).astype(np.complex64)
+
+    tab.addrows(nrow)
+    tab.putcol("TIME", np.repeat(times, nbl))
+    tab.putcol("TIME_CENTROID", np.repeat(times, nbl))
+    tab.putcol("INTERVAL", np.full(nrow, tsamp))
+    tab.putcol("EXPOSURE", np.full(nrow, tsamp))
+    tab.putcol("ANTENNA1", np.tile(a1, ntimes).astype(np.int32))
+    tab.putcol("ANTENNA2", np.tile(a2, ntimes).astype(np.int32))
+    tab.putcol("SCAN_NUMBER", np.repeat(scans, nbl).astype(np.int32))
+    tab.putcol("UVW", uvw)
+    tab.putcol("DATA", data)
+    if with_model:
+        tab.putcol("MODEL_DATA", model)
+    tab.putcol("FLAG", np.zeros(data.shape, dtype=bool))
+    tab.putcol("WEIGHT", np.full((nrow, ncorr), 1.0 / (2 * noise ** 2), dtype=np.float32))
+    tab.putcol("SIGMA", np.full((nrow, ncorr), np.sqrt(2) * noise, dtype=np.float32))
+    tab.close()
+
+    with table(os.path.join(msname, "ANTENNA"), readonly=False, ack=False) as at:
+        at.addrows(nant)
+        at.putcol("NAME", [f"ak{i + 1:02d}" for i in range(nant)])
+        at.putcol("STATION", [f"ak{i + 1:02d}" for i in range(nant)])
+        at.putcol("POSITION", positions)
+        at.putcol("DISH_DIAMETER", np.full(nant, 12.0))
+        at.putcol("TYPE", ["GROUND-BASED"] * nant)
+        at.putcol("MOUNT", ["ALT-AZ"] * nant)
+    with table(os.path.join(msname, "SPECTRAL_WINDOW"), readonly=False, ack=False) as sw:
+        sw.addrows(1)
+        sw.putcell("CHAN_FREQ", 0, freqs)
+        sw.putcell("CHAN_WIDTH", 0, np.full(nchan, chan_width))
+        sw.putcell("EFFECTIVE_BW", 0, np.full(nchan, chan_width))
+        sw.putcell("RESOLUTION", 0, np.full(nchan, chan_width))
+        sw.putcell("NUM_CHAN", 0, nchan)
+        sw.putcell("REF_FREQUENCY", 0, freqs[0])
+        sw.putcell("TOTAL_BANDWIDTH", 0, nchan * chan_width)
+        sw.putcell("MEAS_FREQ_REF", 0, 5)
+    with table(os.path.join(msname, "POLARIZATION"), readonly=False, ack=False) as po:
+        po.addrows(1)
+        po.putcell("NUM_CORR", 0, ncorr)
+        po.putcell("CORR_PRODUCT", 0, np.array(CORR_PRODUCTS[ncorr], dtype=np.int32))
+        po.putcell("CORR_TYPE", 0, np.array(CORR_TYPES[ncorr], dtype=np.int32))
+    with table(os.path.join(msname, "DATA_DESCRIPTION"), readonly=False, ack=False) as dd:
+        dd.addrows(1)
+    with table(os.path.join(msname, "FIELD"), readonly=False, ack=False) as fd:
+        fd.addrows(1)
+        fd.putcell("NAME", 0, "LTR_SYNTH")
+        direction = np.array([[4.60, -0.41]])
+        for col in ("PHASE_DIR", "DELAY_DIR", "REFERENCE_DIR"):
+            fd.putcell(col, 0, direction)
+    with table(os.path.join(msname, "OBSERVATION"), readonly=False, ack=False) as ob:
+        ob.addrows(1)
+        ob.putcell("TELESCOPE_NAME", 0, "ASKAP")
+        ob.putcell("TIME_RANGE", 0, np.array([times[0], times[-1]]))
+    return msname
+
+
+def random_gains(ntimes, nant, amp_scatter=0.1, phase_scatter=0.5, drift=0.02, seed=1):
+    """Smoothly drifting antenna gains of shape (ntimes, nant, 2)."""
+    rng = np.random.default_rng(seed)
+    amp = 1 + amp_scatter * rng.normal(size=(1, nant, 2))
+    phase = phase_scatter * rng.normal(size=(1, nant, 2)) + np.cumsum(drift * rng.normal(size=(ntimes, nant, 2)), axis=0)
+    return amp * np.exp(1j * phase)
+
+
+def make_synthetic_caltable(caltable, msname, ntime=1, bandpass=False, seed=2):
+    """Write a B0-like (per-channel) or G-like (one channel) caltable matching ``msname``."""
+    rng = np.random.default_rng(seed)
+    with table(msname, ack=False) as tab:
+        times = np.unique(tab.getcol("TIME"))
+    with table(os.path.join(msname, "ANTENNA"), ack=False) as at:
+        nant = at.nrows()
+    with table(os.path.join(msname, "SPECTRAL_WINDOW"), ack=False) as sw:
+        nchan = int(sw.getcell("NUM_CHAN", 0)) if bandpass else 1
+    sol_times = np.linspace(times[0], times[-1], ntime)
+    interval = np.full(ntime, (times[-1] - times[0]) / max(ntime, 1))
+    gains = (1 + 0.05 * rng.normal(size=(ntime, nant, nchan, 2))) * np.exp(1j * 0.3 * rng.normal(size=(ntime, nant, nchan, 2)))
+    flags = np.zeros(gains.shape, dtype=bool)
+    vistype = "B Jones" if bandpass else "G Jones"
+    return write_caltable(caltable, msname, sol_times, interval, gains, flags, vistype=vistype)
+
+
+def make_synthetic_uvfits(path, nant=ASKAP_NANT, ntime=60, nchan=32, tsamp=10.0, freq0=743.5e6, chan_width=1e6,
+                          noise=0.1, flag_fraction=0.0, seed=0):
+    """Write a CRACO-like random-groups UVFITS file (XX, YY, XY, YX; no IF axis).
+
+    The visibilities are the same point-source model as ``make_synthetic_ms``
+    plus noise; a random ``flag_fraction`` of samples get negative weights.
+
+    Returns:
+        str: ``path``
+    """
+    rng = np.random.default_rng(seed)
+    a1, a2 = np.triu_indices(nant, 1)
+    nbl = len(a1)
+    ngroups = nbl * ntime
+    positions = _antenna_positions(nant, rng)
+    freqs = freq0 + np.arange(nchan) * chan_width
+    times = MJD_START_S + np.arange(ntime) * tsamp + tsamp / 2
+    jd = np.repeat(times / 86400.0 + 2400000.5, nbl)
+    uvw_m = np.tile(positions[a2] - positions[a1], (ntime, 1))
+
+    l, m = 1e-3, -5e-4
+    phase = -2j * np.pi * (uvw_m[:, 0, None] * l + uvw_m[:, 1, None] * m) * freqs[None, :] / 299792458.0
+    vis = np.zeros((ngroups, nchan, 4), dtype=np.complex64)
+    vis[..., 0] = vis[..., 1] = np.exp(phase)
+    vis += (noise * (rng.normal(size=vis.shape) + 1j * rng.normal(size=vis.shape))).astype(np.complex64)
+    weight = np.full(vis.shape, 1.0 / (2 * noise ** 2), dtype=np.float32)
+    weight[rng.random(vis.shape) < flag_fraction] *= -1
+    # (group, DEC, RA, FREQ, STOKES, COMPLEX)
+    cube = np.stack([vis.real, vis.imag, weight], axis=-1).astype(np.float32)[:, None, None]
+
+    jd0 = np.floor(jd[0]) + 0.5
+    pardata = [uvw_m[:, 0] / 299792458.0, uvw_m[:, 1] / 299792458.0, uvw_m[:, 2] / 299792458.0,
+               np.full(ngroups, jd0), jd - jd0, np.tile(256 * (a1 + 1) + (a2 + 1), ntime).astype(np.float64), np.full(ngroups, tsamp)]
+    groups = fits.GroupData(cube, bitpix=-32, parnames=["UU", "VV", "WW", "DATE", "DATE", "BASELINE", "INTTIM"],
+                            pardata=pardata)
+    hdu = fits.GroupsHDU(groups)
+    hdr = hdu.header
+    ra, dec = np.rad2deg(4.60), np.rad2deg(-0.41)
+    for k, (ctype, crval, cdelt) in enumerate([("COMPLEX", 1.0, 1.0), ("STOKES", -5.0, -1.0), ("FREQ", freqs[0], chan_width),
+                                                ("RA", ra, 1.0), ("DEC", dec, 1.0)], start=2):
+        hdr[f"CTYPE{k}"] = ctype
+        hdr[f"CRVAL{k}"] = crval
+        hdr[f"CDELT{k}"] = cdelt
+        hdr[f"CRPIX{k}"] = 1.0
+        hdr[f"CROTA{k}"] = 0.0
+    hdr["OBJECT"] = "LTR_SYNTH"
+    hdr["TELESCOP"] = "ASKAP"
+    hdr["INSTRUME"] = "CRACO"
+    hdr["EPOCH"] = 2000.0
+    hdr["BUNIT"] = "JY"
+    hdr["OBSRA"] = ra
+    hdr["OBSDEC"] = dec
+    hdr["DATE-OBS"] = "2025-10-15"
+
+    an = fits.BinTableHDU.from_columns([
+        fits.Column(name="ANNAME", format="8A", array=[f"ak{i + 1:02d}" for i in range(nant)]),
+        fits.Column(name="STABXYZ", format="3D", unit="METERS", array=positions),
+        fits.Column(name="ORBPARM", format="0D", array=np.zeros((nant, 0))),
+        fits.Column(name="NOSTA", format="1J", array=np.arange(1, nant + 1)),
+        fits.Column(name="MNTSTA", format="1J", array=np.zeros(nant, dtype=np.int32)),
+        fits.Column(name="STAXOF", format="1E", array=np.zeros(nant)),
+        fits.Column(name="POLTYA", format="1A", array=["X"] * nant),
+        fits.Column(name="POLAA", format="1E", array=np.zeros(nant)),
+        fits.Column(name="POLCALA", format="1E", array=np.zeros(nant)),
+        fits.Column(name="POLTYB", format="1A", array=["Y"] * nant),
+        fits.Column(name="POLAB", format="1E", array=np.zeros(nant)),
+        fits.Column(name="POLCALB", format="1E", array=np.zeros(nant)),
+    ], name="AIPS AN")
+    for key, value in [("EXTVER", 1), ("ARRAYX", 0.0), ("ARRAYY", 0.0), ("ARRAYZ", 0.0), ("GSTIA0", 0.0),
+                       ("DEGPDY", 360.9856), ("FREQ", freqs[0]), ("RDATE", "2025-10-15"), ("POLARX", 0.0),
+                       ("POLARY", 0.0), ("UT1UTC", 0.0), ("DATUTC", 0.0), ("TIMSYS", "UTC"), ("ARRNAM", "ASKAP"),
+                       ("XYZHAND", "RIGHT"), ("FRAME", "ITRF"), ("NUMORB", 0), ("NOPCAL", 2), ("POLTYPE", "")]:
+        an.header[key] = value
+    fits.HDUList([hdu, an]).writeto(path, overwrite=True)
+    return path
+
+
+def _sexagesimal(value, dot_separated=False):
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    d = int(value)
+    m = int((value - d) * 60)
+    s = ((value - d) * 60 - m) * 60
+    sep = "." if dot_separated else ":"
+    return f"{sign}{d:02d}{sep}{m:02d}{sep}{s:09.6f}"
+
+
+def make_synthetic_source_list(path, nsrc=200, gaussian_fraction=0.2, radius_deg=1.5, ref_freq=743.5e6,
+                               phase_dir=(4.60, -0.41), seed=3):
+    """Write a WSClean-format source list scattered around the synthetic MS phase centre.
+
+    Fluxes follow a steep power law; every second component has a
+    logarithmic spectrum, the rest ordinary polynomial terms, and
+    ``gaussian_fraction`` of them are Gaussians of 10-90 arcsec.
+    """
+    rng = np.random.default_rng(seed)
+    lines = ["Format = Name, Type, Ra, Dec, I, SpectralIndex, LogarithmicSI, "
+             f"ReferenceFrequency='{ref_freq:.0f}', MajorAxis, MinorAxis, Orientation"]
+    for i in range(nsrc):
+        ra = np.rad2deg(phase_dir[0]) + rng.uniform(-radius_deg, radius_deg) / np.cos(phase_dir[1])
+        dec = np.rad2deg(phase_dir[1]) + rng.uniform(-radius_deg, radius_deg)
+        flux = 0.01 * (1 - rng.uniform()) ** -1.5
+        spectral = f"[{rng.normal(-0.7, 0.2):.4f},{rng.normal(0, 0.05):.4f}]"
+        log_si = "true" if i % 2 else "false"
+        if rng.uniform() < gaussian_fraction:
+            major = rng.uniform(10, 90)
+            shape = f"GAUSSIAN,{_sexagesimal(ra / 15)},{_sexagesimal(dec, True)},{flux:.6f},{spectral},{log_si},," \
+                    f"{major:.3f},{major * rng.uniform(0.3, 1):.3f},{rng.uniform(0, 180):.2f}"
+        else:
+            shape = f"POINT,{_sexagesimal(ra / 15)},{_sexagesimal(dec, True)},{flux:.6f},{spectral},{log_si},,,,"
+        lines.append(f"s0c{i},{shape}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Write a synthetic ASKAP/CRACO-like MS for benchmarking.")
+    p.add_argument("--ms", required=True, help="Output measurement set path.")
+    p.add_argument("--nant", type=int, default=ASKAP_NANT, help="Number of antennas.")
+    p.add_argument("--ntime", type=int, default=60, help="Integrations per scan.")
+    p.add_argument("--nscan", type=int, default=1, help="Number of scans.")
+    p.add_argument("--nchan", type=int, default=32, help="Number of channels.")
+    p.add_argument("--ncorr", type=int, default=4, choices=[1, 2, 4], help="Number of correlations.")
+    p.add_argument("--tsamp", type=float, default=10.0, help="Integration time in seconds.")
+    p.add_argument("--seed", type=int, default=0, help="Random seed.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    make_synthetic_ms(args.ms, nant=args.nant, ntime=args.ntime, nchan=args.nchan, ncorr=args.ncorr,
+                      nscan=args.nscan, tsamp=args.tsamp, seed=args.seed)
+    print(f"Wrote {args.ms}")
+
+
+if __name__ == "__main__":
+    main()
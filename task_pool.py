@@ -0,0 +1,87 @@
+"""Process pool for the per-MS loops of the *_ms_beams.py scripts.
+
+``run_tasks`` runs one function per (beam, MS) task, either inline or on a
+pool of worker processes. A separate I/O cap limits how many tasks hold an
+``io_slot`` at once, so extra workers can compute while at most
+``io_workers`` of them stream from/to Lustre.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import multiprocessing
+import sys
+import time
+import traceback
+
+_IO_SLOTS = None
+
+
+def _init_worker(io_slots):
+    global _IO_SLOTS
+    _IO_SLOTS = io_slots
+
+
+@contextmanager
+def io_slot():
+    """Hold one of the pool's I/O slots for the duration of the block (no-op outside a pool)."""
+    if _IO_SLOTS is None:
+        yield
+        return
+    with _IO_SLOTS:
+        yield
+
+
+def _run_one(func, args):
+    """Run a task, returning (error message or None, elapsed seconds) instead of raising."""
+    t0 = time.perf_counter()
+    try:
+        func(*args)
+        return None, time.perf_counter() - t0
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return f"{type(e).__name__}: {e}", time.perf_counter() - t0
+
+
+def run_tasks(func, tasks, workers=1, io_workers=None):
+    """Run ``func(*args)`` for every task and report progress as each finishes.
+
+    A failing task is reported and the others carry on, so callers can keep
+    the "exit 2 if anything failed" convention.
+
+    Args:
+        func (callable): Module-level function (it must be picklable)
+        tasks (list): (label, args) pairs
+        workers (int): Worker processes; 1 runs the tasks inline
+        io_workers (int): Maximum tasks inside ``io_slot`` at once (default: ``workers``)
+
+    Returns:
+        list: (label, error message) of every failed task
+    """
+    total = len(tasks)
+    failures = []
+
+    def report(done, label, error, elapsed):
+        if error is None:
+            print(f"[{done}/{total}] done: {label} ({elapsed:.1f}s)", flush=True)
+        else:
+            print(f"[{done}/{total}] ERROR: {label} failed after {elapsed:.1f}s: {error}", file=sys.stderr, flush=True)
+            failures.append((label, error))
+
+    if workers <= 1:
+        for done, (label, args) in enumerate(tasks, start=1):
+            report(done, label, *_run_one(func, args))
+        return failures
+
+    # spawn rather than fork: CASA tools do not survive being forked
+    ctx = multiprocessing.get_context("spawn")
+    io_slots = ctx.BoundedSemaphore(io_workers or workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(io_slots,)) as pool:
+        futures = {pool.submit(_run_one, func, args): label for label, args in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            label = futures[future]
+            try:
+                error, elapsed = future.result()
+            except Exception as e:
+                # the worker process itself died (e.g. OOM-killed)
+                error, elapsed = f"{type(e).__name__}: {e}", 0.0
+            report(done, label, error, elapsed)
+    return failures
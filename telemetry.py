@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Structured telemetry of a pipeline run, one JSON record per line.
+
+Records are appended to the file named by ``$TELEMETRY`` (pipeline_config.sh
+sets ``${DATA_ROOT}/${SBID}/telemetry.jsonl``); when it is unset or empty
+nothing is measured or written. There are three kinds of record:
+
+* ``submit``: one Slurm job and the job ids it depends on, written by
+  pipeline.sh and orchestrate.py as each job is submitted
+* ``job``: the start and end (with the exit status) of one array task of a
+  run_*.sh wrapper (telemetry.sh)
+* ``step``: one timed sub-step of an entry point (applycal, split,
+  validate, aoflagger, ...) with its wall and CPU time, bytes read and
+  written, peak RSS, and the MS, beam and scan it worked on
+
+Every record also carries the stage (``$TELEMETRY_STAGE``, set by the
+wrapper), the Slurm job / array ids, the host and the pid. In python::
+
+    from telemetry import step
+    with step("split", ms=msname) as rec:
+        split(...)
+        rec["rows"] = nrows
+
+CPU time covers this process and the children it has waited for; tasks run
+by a casa_worker daemon show up as wall time only. Bytes are the read() /
+write() totals of /proc/self/io, which unlike the block-device counters
+include Lustre traffic. From the shell (only the standard library is used,
+so any python3 will do)::
+
+    telemetry.py job --event start|end [--status N] [--beam B]
+    telemetry.py run --step NAME [--ms PATH] -- COMMAND ...
+    telemetry.py submit --task NAME --job-id ID [--afterok ID ...] [--aftercorr ID ...]
+
+``telemetry_report.py`` turns the file into the critical path of the run,
+per-stage throughput and the slowest beams.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Linux
+    fcntl = None
+
+_BEAM = re.compile(r"beam(\d+)")
+_SCAN = re.compile(r"\.(20\d{12})\.")
+
+_OPEN_STEPS = []
+_WARNED = False
+
+
+def telemetry_path():
+    """The telemetry file of this run, or None when telemetry is off."""
+    return os.environ.get("TELEMETRY") or None
+
+
+def context():
+    """Fields shared by every record: stage, Slurm ids, host and pid."""
+    env = os.environ
+    return {"stage": env.get("TELEMETRY_STAGE") or None,
+            "job_id": env.get("SLURM_ARRAY_JOB_ID") or env.get("SLURM_JOB_ID") or None,
+            "array_task_id": env.get("SLURM_ARRAY_TASK_ID") or None,
+            "slurm_job_id": env.get("SLURM_JOB_ID") or None,
+            "job_name": env.get("SLURM_JOB_NAME") or None,
+            "host": socket.gethostname(), "pid": os.getpid()}
+
+
+def ms_fields(msname):
+    """MS path with the beam and scan (observation timestamp) parsed from its name."""
+    if not msname:
+        return {}
+    base = os.path.basename(os.path.normpath(msname))
+    beam, scan = _BEAM.search(base), _SCAN.search(base)
+    return {"ms": os.path.abspath(msname), "beam": int(beam.group(1)) if beam else None,
+            "scan": scan.group(1) if scan else None}
+
+
+def write_record(record, path=None):
+    """Append one record to the telemetry file as a single line.
+
+    Telemetry never fails the pipeline: an unwritable file is reported once
+    and otherwise ignored.
+
+    Args:
+        record (dict): JSON-serialisable fields
+        path (str): Telemetry file (default: ``$TELEMETRY``; nothing is written without one)
+    """
+    global _WARNED
+    path = path or telemetry_path()
+    if not path:
+        return
+    line = (json.dumps(record, default=str) + "\n").encode()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except OSError:
+                    pass  # e.g. Lustre mounted without flock; O_APPEND writes of one line are still whole
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        if not _WARNED:
+            print(f"WARN: could not write telemetry to {path}: {e}", file=sys.stderr)
+            _WARNED = True
+
+
+def _proc_io():
+    """(bytes read, bytes written) by this process so far, or zeros without /proc."""
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+def _peak_rss_mb():
+    """High-water mark of this process's resident set in MB (VmHWM)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is inherited across fork/exec, so it is only a fallback
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reset_peak_rss():
+    """Restart the VmHWM high-water mark so the next reading covers one step (Linux >= 4.0)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _cpu_seconds():
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+@contextmanager
+def step(name, ms=None, stage=None, **fields):
+    """Time a sub-step of an entry point and append its ``step`` record on exit.
+
+    The yielded dict is the record: add fields such as ``rows`` to it inside
+    the block. A step that raises is recorded with its exception type as the
+    status and the exception propagates. Steps may nest; the peak RSS of an
+    enclosing step includes its inner steps.
+
+    Args:
+        name (str): Sub-step name, e.g. "applycal", "split" or "validate"
+        ms (str): MS the step works on (its beam and scan are parsed from the name)
+        stage (str): Pipeline stage (default: ``$TELEMETRY_STAGE``)
+        **fields: Extra fields for the record
+    """
+    if not telemetry_path():
+        yield dict(fields)
+        return
+    record = {"kind": "step", **context(), "step": name, **ms_fields(ms), **fields}
+    if stage:
+        record["stage"] = stage
+    if _OPEN_STEPS:
+        _OPEN_STEPS[-1]["inner_peak"] = max(_OPEN_STEPS[-1]["inner_peak"], _peak_rss_mb())
+    _reset_peak_rss()
+    frame = {"inner_peak": 0.0}
+    _OPEN_STEPS.append(frame)
+    rchar, wchar = _proc_io()
+    cpu, t0, wall0 = _cpu_seconds(), time.time(), time.perf_counter()
+    status = "ok"
+    try:
+        yield record
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _OPEN_STEPS.pop()
+        wall = time.perf_counter() - wall0
+        cpu = _cpu_seconds() - cpu
+        rchar2, wchar2 = _proc_io()
+        peak = max(_peak_rss_mb(), frame["inner_peak"])
+        if _OPEN_STEPS:
+            _OPEN_STEPS[-1]["inner_peak"] = max(_OPEN_STEPS[-1]["inner_peak"], peak)
+        record.update(ts=t0, wall_s=wall, cpu_s=cpu, cpu_util=cpu / wall if wall > 0 else None,
+                      peak_rss_mb=peak, bytes_read=rchar2 - rchar, bytes_written=wchar2 - wchar, status=status)
+        write_record(record)
+
+
+def run_command(name, command, ms=None):
+    """Run ``command`` as a recorded step (for the shell wrappers) and return its exit status.
+
+    CPU time and peak RSS are those of the command and its children; bytes
+    are the block-device counters the kernel keeps for it, which stay zero
+    on network filesystems such as Lustre.
+    """
+    record = {"kind": "step", **context(), "step": name, **ms_fields(ms)}
+    t0, wall0 = time.time(), time.perf_counter()
+    proc = subprocess.Popen(command)
+    _, wait_status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = returncode = os.waitstatus_to_exitcode(wait_status)
+    if returncode < 0:
+        returncode = 128 - returncode  # killed by a signal: report it the way the shell does
+    wall = time.perf_counter() - wall0
+    cpu = usage.ru_utime + usage.ru_stime
+    record.update(ts=t0, wall_s=wall, cpu_s=cpu, cpu_util=cpu / wall if wall > 0 else None,
+                  peak_rss_mb=usage.ru_maxrss / 1024, bytes_read=usage.ru_inblock * 512, bytes_written=usage.ru_oublock * 512,
+                  status="ok" if returncode == 0 else f"exit {returncode}")
+    write_record(record)
+    return returncode
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Write pipeline telemetry records (to $TELEMETRY).")
+    sub = p.add_subparsers(dest="command", required=True)
+    job = sub.add_parser("job", help="Record the start or end of this array task.")
+    job.add_argument("--event", choices=["start", "end"], required=True)
+    job.add_argument("--status", type=int, default=None, help="Exit status (with --event end).")
+    job.add_argument("--beam", type=int, default=None, help="Beam the task processes, for beam-level stages.")
+    run = sub.add_parser("run", help="Run a command and record it as a step.")
+    run.add_argument("--step", required=True, help="Step name, e.g. aoflagger or wsclean.")
+    run.add_argument("--ms", default=None, help="MS the command works on.")
+    run.add_argument("cmd", nargs=argparse.REMAINDER, help="-- COMMAND ...")
+    submit = sub.add_parser("submit", help="Record a submitted job and its dependencies.")
+    submit.add_argument("--task", required=True, help="Name of the job in the pipeline, e.g. flag_raw.")
+    submit.add_argument("--job-id", required=True, help="Job id, or ids joined by ':' for a job submitted in groups.")
+    submit.add_argument("--array", default=None, help="Slurm array spec of the job.")
+    submit.add_argument("--afterok", nargs="*", default=[], help="Job ids whose whole array must succeed first.")
+    submit.add_argument("--aftercorr", nargs="*", default=[], help="Job ids whose same-index task must succeed first.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+        if not cmd:
+            sys.exit("telemetry.py run: no command given")
+        sys.exit(run_command(args.step, cmd, ms=args.ms) if telemetry_path() else subprocess.call(cmd))
+    if args.command == "job":
+        record = {"kind": "job", **context(), "event": args.event, "ts": time.time(), "beam": args.beam}
+        if args.event == "end":
+            record["status"] = args.status
+        write_record(record)
+    elif args.command == "submit":
+        # a job split into groups by resource_sizing.py is several array jobs, given (and depended on) as "id:id:..."
+        afterok = [j for ids in args.afterok for j in ids.split(":") if j]
+        aftercorr = [j for ids in args.aftercorr for j in ids.split(":") if j]
+        for job_id in args.job_id.split(":"):
+            write_record({"kind": "submit", "task": args.task, "job_id": job_id, "array": args.array,
+                          "afterok": afterok, "aftercorr": aftercorr, "ts": time.time()})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# Telemetry helpers for the run_*.sh wrappers (see telemetry.py); sourced, not run.
+# Records go to ${TELEMETRY}; with it empty every helper is a no-op apart from running the command.
+
+TELEMETRY=${TELEMETRY:-""}                                  # JSONL telemetry file of the run (pipeline_config.sh sets one per SBID)
+TELEMETRY_SCRIPT=${TELEMETRY_SCRIPT:-$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/telemetry.py}
+TELEMETRY_PYTHON=${TELEMETRY_PYTHON:-python3}               # telemetry.py only needs the standard library
+export TELEMETRY
+
+# telemetry_job STAGE [BEAM]: record this array task's start now and its end (with the exit status) when the script exits;
+# the python entry points it runs label their steps with STAGE
+telemetry_job() {
+  export TELEMETRY_STAGE="$1"
+  TELEMETRY_BEAM="${2:-}"
+  [[ -z "${TELEMETRY}" ]] && return 0
+  ${TELEMETRY_PYTHON} "${TELEMETRY_SCRIPT}" job --event start ${TELEMETRY_BEAM:+--beam "${TELEMETRY_BEAM}"} || true
+  trap 'telemetry_job_end $?' EXIT
+}
+
+telemetry_job_end() {
+  ${TELEMETRY_PYTHON} "${TELEMETRY_SCRIPT}" job --event end --status "$1" ${TELEMETRY_BEAM:+--beam "${TELEMETRY_BEAM}"} || true
+}
+
+# telemetry_run STEP MS COMMAND...: run COMMAND, recording its wall/CPU time and peak RSS as a step on MS
+telemetry_run() {
+  local step="$1" ms="$2"
+  shift 2
+  if [[ -z "${TELEMETRY}" ]]; then
+    "$@"
+    return
+  fi
+  ${TELEMETRY_PYTHON} "${TELEMETRY_SCRIPT}" run --step "${step}" ${ms:+--ms "${ms}"} -- "$@"
+}
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""Summarise a pipeline run from its telemetry file (see telemetry.py).
+
+The ``submit`` records rebuild the dependency chain of pipeline.sh /
+orchestrate.py (job ids with their ``afterok`` and ``aftercorr``
+dependencies), the ``job`` records place every array task in time and the
+``step`` records say where each task spent it. The report has:
+
+* the critical path: the chain of array tasks, each gated by the
+  dependency that finished last, that ends with the last task of the run.
+  Every link is split into the wait before it started (queue time once its
+  dependencies were done) and its run time, with its largest steps
+* per-stage job times: array tasks, median / max run time and median
+  queue wait of each submitted job
+* per-stage step throughput: wall time, MB/s read + written, rows/s, CPU
+  utilisation and peak RSS of every (stage, step)
+* the slowest beams: beam-level array tasks that took longest relative to
+  the median beam of the same job
+
+Only the standard library is used.
+"""
+import argparse
+import json
+import statistics
+import sys
+from collections import defaultdict
+
+
+def load_records(path):
+    """Records of a telemetry file; lines that are not JSON (e.g. cut short by a killed job) are skipped."""
+    records, bad = [], 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                bad += 1
+    if bad:
+        print(f"WARN: skipped {bad} unreadable lines of {path}", file=sys.stderr)
+    return records
+
+
+def duration(seconds):
+    """Seconds as a short human-readable duration, e.g. 2.5s, 45s, 12m05s or 3h20m."""
+    if seconds is None:
+        return "-"
+    if seconds < 10:
+        return f"{seconds:.1f}s"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def collect_jobs(records):
+    """Submitted jobs and the array tasks that ran.
+
+    Returns:
+        tuple: (jobs, units) with jobs mapping job id -> {"task", "submit_ts",
+        "afterok", "aftercorr"} and units mapping (job id, array index) ->
+        {"name", "stage", "beam", "host", "start", "end", "status"}. A task
+        that started more than once (requeued) keeps its last attempt.
+    """
+    jobs = {}
+    for rec in records:
+        if rec.get("kind") == "submit":
+            jobs[str(rec["job_id"])] = {"task": rec.get("task"), "submit_ts": rec.get("ts"),
+                                        "afterok": [str(j) for j in rec.get("afterok") or []],
+                                        "aftercorr": [str(j) for j in rec.get("aftercorr") or []]}
+    units = {}
+    for rec in sorted((r for r in records if r.get("kind") == "job" and r.get("job_id")), key=lambda r: r.get("ts") or 0):
+        key = (str(rec["job_id"]), str(rec.get("array_task_id") or "0"))
+        if rec.get("event") == "start":
+            units[key] = {"stage": rec.get("stage"), "beam": rec.get("beam"), "host": rec.get("host"),
+                          "start": rec.get("ts"), "end": None, "status": None}
+        elif key in units:
+            units[key].update(end=rec.get("ts"), status=rec.get("status"))
+    for (jid, _), unit in units.items():
+        unit["name"] = jobs.get(jid, {}).get("task") or unit["stage"] or f"job {jid}"
+    return jobs, units
+
+
+def steps_by_unit(records):
+    """(job id, array index) -> the step records of that array task."""
+    steps = defaultdict(list)
+    for rec in records:
+        if rec.get("kind") == "step" and rec.get("job_id"):
+            steps[(str(rec["job_id"]), str(rec.get("array_task_id") or "0"))].append(rec)
+    return steps
+
+
+def _predecessors(key, jobs, units_by_job, finished):
+    """Finished array tasks ``key`` waited for, and the jobs in between that left no job records.
+
+    A dependency without records (e.g. a wrapper that does not source
+    telemetry.sh) is looked through to its own dependencies.
+    """
+    jid, idx = key
+    preds, skipped, seen = [], [], set()
+
+    def expand(job_id, same_index):
+        job = jobs.get(job_id, {})
+        for dep, corr in [(d, same_index) for d in job.get("afterok", [])] + [(d, True) for d in job.get("aftercorr", [])]:
+            if dep in units_by_job:
+                if not corr:
+                    preds.extend(units_by_job[dep])
+                elif (dep, idx) in finished:
+                    preds.append((dep, idx))
+            elif dep in jobs and dep not in seen:
+                seen.add(dep)
+                skipped.append(jobs[dep]["task"] or dep)
+                expand(dep, corr)
+
+    expand(jid, False)
+    return preds, skipped
+
+
+def queue_waits(jobs, units):
+    """(job id, array index) -> (ready time, gating dependency, unrecorded jobs in between) of every finished array task.
+
+    A task is ready once it is submitted and its dependencies have ended;
+    start - ready is then its wait in the Slurm queue (plus the run time of
+    any unrecorded jobs in between).
+    """
+    finished = {k: u for k, u in units.items() if u["start"] is not None and u["end"] is not None}
+    units_by_job = defaultdict(list)
+    for key in finished:
+        units_by_job[key[0]].append(key)
+    ready = {}
+    for key, unit in finished.items():
+        preds, skipped = _predecessors(key, jobs, units_by_job, finished)
+        gate = max(preds, key=lambda k: finished[k]["end"]) if preds else None
+        times = [t for t in (jobs.get(key[0], {}).get("submit_ts"), finished[gate]["end"] if gate else None) if t is not None]
+        ready[key] = (max(times) if times else unit["start"], gate, skipped)
+    return ready
+
+
+def critical_path(jobs, units, ready):
+    """Links of the critical path, first to last: dicts with key, unit, wait_s, run_s and unrecorded (job names)."""
+    finished = {k: u for k, u in units.items() if k in ready}
+    if not finished:
+        return []
+    key, path = max(finished, key=lambda k: finished[k]["end"]), []
+    while key is not None:
+        unit = finished[key]
+        ready_ts, gate, skipped = ready[key]
+        path.append({"key": key, "unit": unit, "wait_s": max(unit["start"] - ready_ts, 0.0), "run_s": unit["end"] - unit["start"],
+                     "unrecorded": skipped})
+        key = gate
+    return path[::-1]
+
+
+def top_steps(steps, n=3):
+    """'name wall' of the n largest steps of an array task (summed over its MSs)."""
+    wall = defaultdict(float)
+    for rec in steps:
+        wall[rec.get("step")] += rec.get("wall_s") or 0.0
+    return ", ".join(f"{name} {duration(w)}" for name, w in sorted(wall.items(), key=lambda x: -x[1])[:n])
+
+
+def job_summary(units, ready):
+    """Per submitted job: array tasks, failures, median / max run time and median queue wait."""
+    by_name = defaultdict(list)
+    for key, unit in units.items():
+        by_name[unit["name"]].append((key, unit))
+    rows = []
+    for name, members in by_name.items():
+        runs = [u["end"] - u["start"] for _, u in members if u["end"] is not None]
+        waits = [max(u["start"] - ready[k][0], 0.0) for k, u in members if k in ready]
+        rows.append({"name": name, "tasks": len(members), "failed": sum(1 for _, u in members if u["status"] not in (0, None)),
+                     "unfinished": sum(1 for _, u in members if u["end"] is None),
+                     "first_start": min(u["start"] for _, u in members),
+                     "median_run_s": statistics.median(runs) if runs else None, "max_run_s": max(runs) if runs else None,
+                     "task_hours": sum(runs) / 3600, "median_wait_s": statistics.median(waits) if waits else None})
+    return sorted(rows, key=lambda r: r["first_start"])
+
+
+def step_summary(records):
+    """Per (stage, step): count, wall time, throughput, CPU utilisation and peak RSS."""
+    groups = defaultdict(list)
+    for rec in records:
+        if rec.get("kind") == "step":
+            groups[(rec.get("stage") or "-", rec.get("step"))].append(rec)
+    rows = []
+    for (stage, name), recs in groups.items():
+        wall = sum(r.get("wall_s") or 0.0 for r in recs)
+        nbytes = sum((r.get("bytes_read") or 0) + (r.get("bytes_written") or 0) for r in recs)
+        with_rows = [r for r in recs if r.get("rows")]
+        row_wall = sum(r.get("wall_s") or 0.0 for r in with_rows)
+        cpu = sum(r.get("cpu_s") or 0.0 for r in recs)
+        rows.append({"stage": stage, "step": name, "count": len(recs), "failed": sum(1 for r in recs if r.get("status") != "ok"),
+                     "wall_s": wall, "median_wall_s": statistics.median(r.get("wall_s") or 0.0 for r in recs),
+                     "mb_per_s": nbytes / wall / 1e6 if wall > 0 else None,
+                     "rows_per_s": sum(r["rows"] for r in with_rows) / row_wall if row_wall > 0 else None,
+                     "cpu_util": cpu / wall if wall > 0 else None,
+                     "peak_rss_mb": max((r.get("peak_rss_mb") or 0.0) for r in recs)})
+    return sorted(rows, key=lambda r: -r["wall_s"])
+
+
+def slowest_beams(units, steps, n):
+    """The n beam-level array tasks with the largest run time relative to the median beam of their job."""
+    by_name = defaultdict(list)
+    for key, unit in units.items():
+        if unit["beam"] is not None and unit["end"] is not None:
+            by_name[unit["name"]].append((key, unit, unit["end"] - unit["start"]))
+    rows = []
+    for name, members in by_name.items():
+        median = statistics.median(run for _, _, run in members)
+        for key, unit, run in members:
+            rows.append({"name": name, "beam": unit["beam"], "run_s": run, "median_run_s": median,
+                         "ratio": run / median if median > 0 else None, "host": unit["host"], "steps": top_steps(steps.get(key, []))})
+    rows.sort(key=lambda r: (-(r["ratio"] or 0), -r["run_s"]))
+    return rows[:n]
+
+
+def build_report(records, top=10):
+    """Everything the report prints, as a JSON-serialisable dict."""
+    jobs, units = collect_jobs(records)
+    steps = steps_by_unit(records)
+    ready = queue_waits(jobs, units)
+    path = critical_path(jobs, units, ready)
+    starts = [j["submit_ts"] for j in jobs.values() if j["submit_ts"] is not None] + [u["start"] for u in units.values()]
+    ends = [u["end"] for u in units.values() if u["end"] is not None]
+    return {
+        "makespan_s": max(ends) - min(starts) if starts and ends else None,
+        "jobs": len(jobs), "array_tasks": len(units),
+        "critical_path": [{"name": link["unit"]["name"], "job_id": link["key"][0], "array_task_id": link["key"][1],
+                           "beam": link["unit"]["beam"], "wait_s": link["wait_s"], "run_s": link["run_s"], "unrecorded": link["unrecorded"],
+                           "steps": top_steps(steps.get(link["key"], []))} for link in path],
+        "job_summary": job_summary(units, ready),
+        "step_summary": step_summary(records),
+        "slowest_beams": slowest_beams(units, steps, top),
+    }
+
+
+def print_report(report):
+    print(f"Run: {report['jobs']} submitted jobs, {report['array_tasks']} array tasks, "
+          f"first submit to last end {duration(report['makespan_s'])}")
+    if not report["jobs"]:
+        print("(no submit records: dependencies unknown, so queue waits count from each task's own start)")
+
+    path = report["critical_path"]
+    print("\nCritical path")
+    if path:
+        wait, run = sum(p["wait_s"] for p in path), sum(p["run_s"] for p in path)
+        print(f"  {len(path)} array tasks: {duration(run)} running, {duration(wait)} waiting in the queue")
+        for link in path:
+            task = f"{link['name']}[{link['array_task_id']}]"
+            print(f"  {task:32s} wait {duration(link['wait_s']):>7s}  run {duration(link['run_s']):>7s}  {link['steps']}"
+                  + (f"  (wait includes unrecorded {', '.join(link['unrecorded'])})" if link["unrecorded"] else ""))
+
+    print("\nJobs (in submission order)")
+    print(f"  {'job':28s} {'tasks':>5s} {'failed':>6s} {'median':>7s} {'max':>7s} {'task-h':>7s} {'queue':>7s}")
+    for row in report["job_summary"]:
+        failed = f"{row['failed']}" + (f"+{row['unfinished']}?" if row["unfinished"] else "")
+        print(f"  {row['name']:28s} {row['tasks']:5d} {failed:>6s} {duration(row['median_run_s']):>7s} "
+              f"{duration(row['max_run_s']):>7s} {row['task_hours']:7.2f} {duration(row['median_wait_s']):>7s}")
+
+    print("\nSteps (by total wall time)")
+    print(f"  {'stage':14s} {'step':20s} {'n':>5s} {'wall':>7s} {'median':>7s} {'MB/s':>8s} {'rows/s':>9s} {'cpu':>5s} {'peak MB':>8s}")
+    for row in report["step_summary"]:
+        mbs = f"{row['mb_per_s']:8.1f}" if row["mb_per_s"] is not None else f"{'-':>8s}"
+        rps = f"{row['rows_per_s']:9.0f}" if row["rows_per_s"] is not None else f"{'-':>9s}"
+        cpu = f"{row['cpu_util']:5.2f}" if row["cpu_util"] is not None else f"{'-':>5s}"
+        print(f"  {row['stage']:14s} {str(row['step']):20s} {row['count']:5d} {duration(row['wall_s']):>7s} "
+              f"{duration(row['median_wall_s']):>7s} {mbs} {rps} {cpu} {row['peak_rss_mb']:8.0f}"
+              + (f"  ({row['failed']} failed)" if row["failed"] else ""))
+
+    print("\nSlowest beams (run time vs the median beam of the same job)")
+    for row in report["slowest_beams"]:
+        print(f"  {row['name']:28s} beam {row['beam']:02d}  {duration(row['run_s']):>7s} "
+              f"(x{row['ratio']:.1f} of {duration(row['median_run_s'])}) on {row['host']}  {row['steps']}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Critical path, per-stage throughput and slowest beams of a pipeline run.")
+    p.add_argument("telemetry", help="Telemetry file of the run (JSONL; $TELEMETRY of the jobs).")
+    p.add_argument("--top", type=int, default=10, help="Number of slowest beams to list.")
+    p.add_argument("--json", default=None, help="Also write the report as JSON to this file.")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = build_report(load_records(args.telemetry), top=args.top)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
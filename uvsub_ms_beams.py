@@ -3,12 +3,14 @@ import argparse
 import glob
 import os
 import sys
-import casaconfig
-casaconfig.logfile = "/dev/null"
+from casa_worker import casa_available, casa_tasks
+from shard import add_shard_arguments, select_files
+from task_pool import run_tasks
+from telemetry import step
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run CASA uvsub on MS files for specified beams (SBID-aware).") 
-    parser.add_argument("--ms", required=True, help="Path to the measurement set.")
+    parser.add_argument("--ms", nargs="+", default=[], help="Path to the measurement set(s).")
     parser.add_argument("--index", required=True, type=int, help="selfcal index to use for book-keeping purposes")
     # parser.add_argument("--sbid", required=True, help="Scheduling Block ID, e.g., SB77974")
     # parser.add_argument("--data-root", default="data", help="Root directory containing data/<SBID>")
@@ -17,16 +19,32 @@ def parse_args():
     # parser.add_argument("--beams", default="all", help='Comma-separated list (e.g., "0,5,12") or "all" for 0..36')
     parser.add_argument("--out-prefix", default="uvsub", help="label for uvsub file")
     parser.add_argument("--dry-run", action="store_true", help="List planned operations without running uvsub")
+    parser.add_argument("--mode", choices=["casa", "stream", "inplace"], default="casa", help="casa: uvsub+split; stream: write DATA-MODEL_DATA straight to the .uvsub.ms; inplace: overwrite DATA of --ms itself")
+    parser.add_argument("--chunk-rows", type=int, default=20000, help="Rows per streamed block for --mode stream/inplace")
+    parser.add_argument("--layout", default="", help="Storage layout of the .uvsub.ms (not --mode inplace), e.g. rows or rows:cc16 (see ms_layout.py; needs python-casacore). Default: as written by the engine")
+    parser.add_argument("--stage-cache", action="store_true", help="Skip if the output was already produced from the same input and mode (see stage_cache.py)")
+    parser.add_argument("--share-parent", action="store_true", help="With --mode stream, hardlink everything but DATA from --ms instead of copying it (copy-on-write generation)")
+    parser.add_argument("--resume", action="store_true", help="With --mode stream, journal each written block and resume an interrupted .uvsub.ms instead of rewriting it (see ms_journal.py)")
+    parser.add_argument("--workers", type=int, default=1, help="Process this many MSs of the shard concurrently (worker processes)")
+    add_shard_arguments(parser)
     return parser.parse_args()
 
 def ensure_casatasks() -> bool:
     try:
-        from casatasks import applycal, uvsub, split  # noqa: F401
+        casa_available("applycal", "uvsub", "split")
         return True
     except Exception as e:
         print(f"ERROR: casatasks.applycal, uvsub, split not available: {e}", file=sys.stderr)
         return False
 
+def ensure_native_uvsub() -> bool:
+    try:
+        import native_uvsub  # noqa: F401
+        return True
+    except Exception as e:
+        print(f"ERROR: native uvsub not available (needs python-casacore): {e}", file=sys.stderr)
+        return False
+
 def find_ms_for_beam(data_root: str, sbid: str, pattern: str, beam: int) -> list:
     root = os.path.join(data_root, sbid)
     pat = os.path.join(root, pattern.format(beam=beam))
@@ -40,7 +58,7 @@ def find_caltable(data_root: str, sbid: str, cal_dir: str, beam: int) -> str:
     return matches[0]
 
 def run_applycal(msname: str, caltable: str):
-    from casatasks import applycal, split
+    applycal, split = casa_tasks("applycal", "split")
     print(f"Applying cal: {caltable} -> {msname}")
     # Interpolation list as per your example; adjust if you have multiple gaintables
     applycal(vis=msname, gaintable=[caltable], interp=['nearest', 'linear'])
@@ -48,24 +66,76 @@ def run_applycal(msname: str, caltable: str):
     split(vis=msname, outputvis=outputvis, datacolumn="corrected")
 
 def run_clearcal(msname: str):
-    from casatasks import clearcal
+    clearcal = casa_tasks("clearcal")
     print(f"Applying cal: {caltable} -> {msname}")
     # Interpolation list as per your example; adjust if you have multiple gaintables
     clearcal(vis=msname)
 
-def run_uvsub(msname: str, out_prefix: str = "uvsub") -> None:
-    from casatasks import uvsub, split
+def run_uvsub(msname: str, out_prefix: str = "uvsub", layout: str = "") -> None:
+    uvsub, split = casa_tasks("uvsub", "split")
     outputvis = msname.replace(".ms", f".{out_prefix}.ms")
     print(f"Running uvsub: {msname} -> {outputvis}")
-    uvsub(vis=msname)
-    split(vis=msname, outputvis=outputvis, datacolumn="corrected")
-    
+    with step("uvsub", ms=msname):
+        uvsub(vis=msname)
+    with step("split", ms=outputvis):
+        split(vis=msname, outputvis=outputvis, datacolumn="corrected")
+    if layout:
+        from ms_layout import parse_layout, relayout_ms
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, parse_layout(layout))
+
+def run_stream_uvsub(msname: str, out_prefix: str = "uvsub", chunk_rows: int = 20000, share_parent: bool = False, layout: str = "", resume: bool = False) -> str:
+    from ms_layout import parse_layout, relayout_ms, split_deferred
+    from native_uvsub import subtract_to_new_ms
+    outputvis = msname.replace(".ms", f".{out_prefix}.ms")
+    print(f"Running streaming uvsub: {msname} -> {outputvis}")
+    now, later = split_deferred(parse_layout(layout))
+    with step("subtract", ms=outputvis) as rec:
+        rec["rows"] = subtract_to_new_ms(msname, outputvis, chunk_rows=chunk_rows, share_parent=share_parent, layout=now,
+                                          resume=resume)
+    if later is not None:
+        with step("relayout", ms=outputvis):
+            relayout_ms(outputvis, later, chunk_rows=chunk_rows)
+    return outputvis
+
+def run_inplace_uvsub(msname: str, chunk_rows: int = 20000) -> str:
+    from native_uvsub import subtract_in_place
+    print(f"Running in-place uvsub (DATA will be overwritten): {msname}")
+    with step("subtract_in_place", ms=msname) as rec:
+        rec["rows"] = subtract_in_place(msname, chunk_rows=chunk_rows)
+    return msname
+
+def uvsub_one(ms: str, args) -> None:
+    """Subtract the model from one MS; the unit of work of a shard."""
+    out_prefix = args.out_prefix
+    stage = None
+    if args.stage_cache and not args.dry_run:
+        from stage_cache import Stage
+        outputvis = ms.replace(".ms", f".{out_prefix}.ms")
+        # casa uvsub writes CORRECTED_DATA into --ms; inplace overwrites its DATA
+        outputs = {"casa": [outputvis, ms], "stream": [outputvis], "inplace": [ms]}[args.mode]
+        stage = Stage(f"uvsub_{out_prefix}", [ms], outputs, {"mode": args.mode, "layout": args.layout})
+        if stage.complete():
+            print(f"{' and '.join(outputs)} up to date; skipping uvsub")
+            return
+        stage.begin()
+
+    if args.dry_run:
+        print(f"would run uvsub ({args.mode}) on {ms}")
+    elif args.mode == "stream":
+        run_stream_uvsub(ms, out_prefix=out_prefix, chunk_rows=args.chunk_rows, share_parent=args.share_parent,
+                         layout=args.layout, resume=args.resume)
+    elif args.mode == "inplace":
+        run_inplace_uvsub(ms, chunk_rows=args.chunk_rows)
+    else:
+        run_uvsub(ms, out_prefix=out_prefix, layout=args.layout)
+    if stage is not None:
+        stage.commit()
+
 def main():
     args = parse_args()
-    ms = args.ms
-    idx = args.index
-    out_prefix = args.out_prefix
-    
+    msnames = select_files(args.ms, args.file_list, args.shard)
+
     # if args.index == 1:
     #     old_ms = args.ms
     # elif args.index > 1:
@@ -75,19 +145,12 @@ def main():
     
     # new_ms = old_ms.replace(".calB0.ms", f".selfcal_{args.index}.ms")
     
-    if not args.dry_run and not ensure_casatasks():
+    ensure_engine = ensure_casatasks if args.mode == "casa" else ensure_native_uvsub
+    if not args.dry_run and not ensure_engine():
         sys.exit(1)
 
-    exit_code = 0
-
-    try:
-        if not args.dry_run:
-            run_uvsub(ms, out_prefix=out_prefix)
-    except Exception as e:
-        print(f"ERROR: Beam {beam:02d} failed: {e}", file=sys.stderr)
-        exit_code = 2
-
-    sys.exit(exit_code)
+    failures = run_tasks(uvsub_one, [(ms, (ms, args)) for ms in msnames], workers=args.workers)
+    sys.exit(2 if failures else 0)
 
 if __name__ == "__main__":
     main()